@@ -9,8 +9,12 @@ Features:
 - Invalidação inteligente por tags
 - TTL configurável por tipo de dado
 - Fallback para memória local
+- Near-cache: L1 em processo com objetos já desserializados, invalidado
+  entre réplicas via Redis pub/sub
 - Métricas de hit/miss
 - Cache warming
+- Single-flight: misses concorrentes da mesma key executam a função uma vez
+- Stale-while-revalidate e refresh antecipado probabilístico (XFetch)
 
 Uso:
     from api.middleware.cache import cache, invalidate_cache
@@ -39,6 +43,15 @@ import asyncio
 import hashlib
 import logging
 import pickle
+import copy
+import zlib
+import heapq
+import fnmatch
+import threading
+import uuid
+import math
+import random
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import (
     Optional, Dict, Any, List, Callable, TypeVar, 
@@ -46,7 +59,7 @@ from typing import (
 )
 from dataclasses import dataclass, field
 from functools import wraps
-from enum import Enum
+from enum import Enum, IntEnum
 import inspect
 
 # Redis
@@ -80,11 +93,27 @@ class CacheConfig:
     max_key_length: int = 200
     max_value_size_mb: int = 10
     enable_local_fallback: bool = True
-    local_max_items: int = 1000
+    local_max_items: int = field(default_factory=lambda: int(os.getenv('CACHE_LOCAL_MAX_ITEMS', '1000')))
+    local_max_bytes: int = field(default_factory=lambda: int(os.getenv('CACHE_LOCAL_MAX_BYTES', str(64 * 1024 * 1024))))
+    local_shards: int = field(default_factory=lambda: int(os.getenv('CACHE_LOCAL_SHARDS', '16')))
     enable_compression: bool = True
-    compression_threshold: int = 1024  # Compress if larger than 1KB
+    compression_threshold: int = field(default_factory=lambda: int(os.getenv('CACHE_COMPRESSION_THRESHOLD', '1024')))
+    codec: str = field(default_factory=lambda: os.getenv('CACHE_CODEC', 'auto'))  # auto, json, orjson, msgpack, pickle
+    compression: str = field(default_factory=lambda: os.getenv('CACHE_COMPRESSION', 'auto'))  # auto, zstd, zlib, none
+    zstd_level: int = field(default_factory=lambda: int(os.getenv('CACHE_ZSTD_LEVEL', '3')))
+    zstd_dict_path: str = field(default_factory=lambda: os.getenv('CACHE_ZSTD_DICT_PATH', ''))
+    legacy_format: bool = field(default_factory=lambda: os.getenv('CACHE_LEGACY_FORMAT', 'false').lower() == 'true')
     enable_metrics: bool = True
     warm_on_startup: bool = False
+    l1_ttl: int = field(default_factory=lambda: int(os.getenv('CACHE_L1_TTL', '60')))
+    enable_invalidation_pubsub: bool = field(
+        default_factory=lambda: os.getenv('CACHE_INVALIDATION_PUBSUB', 'true').lower() == 'true'
+    )
+    invalidation_channel: str = field(
+        default_factory=lambda: os.getenv('CACHE_INVALIDATION_CHANNEL', 'ssi:cache:invalidate')
+    )
+    default_stale_ttl: int = field(default_factory=lambda: int(os.getenv('CACHE_STALE_TTL', '0')))
+    early_refresh_beta: float = field(default_factory=lambda: float(os.getenv('CACHE_EARLY_REFRESH_BETA', '1.0')))
 
 
 # Global config
@@ -118,12 +147,261 @@ class CacheTTL(Enum):
 # SERIALIZATION
 # =============================================================================
 
+# Optional codecs
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+
+class CodecId(IntEnum):
+    """Value encodings (stored in the header, never renumber)."""
+    JSON = 1
+    ORJSON = 2
+    MSGPACK = 3
+    PICKLE = 4
+
+
+class CompressionId(IntEnum):
+    """Compression schemes (stored in the header, never renumber)."""
+    NONE = 0
+    ZLIB = 1
+    ZSTD = 2
+    ZSTD_DICT = 3
+
+
+# Header: magic, format version, codec id, compression id.
+# Legacy values start with an ASCII prefix (json:, zpickle:, ...) and can
+# never start with the magic byte.
+FORMAT_MAGIC = 0xC5
+FORMAT_VERSION = 1
+HEADER_SIZE = 4
+
+
+@dataclass
+class Codec:
+    """A value encoding: dumps raises TypeError/ValueError if it can't encode."""
+    codec_id: int
+    name: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+_CODECS: Dict[int, Codec] = {}
+_CODECS_BY_NAME: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """Register a codec so it can be selected by name and decoded by id."""
+    _CODECS[codec.codec_id] = codec
+    _CODECS_BY_NAME[codec.name] = codec
+
+
+register_codec(Codec(
+    CodecId.JSON, 'json',
+    lambda v: json.dumps(v, default=str).encode('utf-8'),
+    lambda b: json.loads(b.decode('utf-8')),
+))
+register_codec(Codec(CodecId.PICKLE, 'pickle', pickle.dumps, pickle.loads))
+
+if ORJSON_AVAILABLE:
+    register_codec(Codec(
+        CodecId.ORJSON, 'orjson',
+        lambda v: orjson.dumps(v, default=str, option=orjson.OPT_NON_STR_KEYS),
+        orjson.loads,
+    ))
+
+if MSGPACK_AVAILABLE:
+    register_codec(Codec(
+        CodecId.MSGPACK, 'msgpack',
+        lambda v: msgpack.packb(v, default=str, use_bin_type=True),
+        lambda b: msgpack.unpackb(b, raw=False, strict_map_key=False),
+    ))
+
+
+class _ZstdState:
+    """
+    Lazily built zstd (de)compressors, optionally with a shared dictionary.
+    
+    Instances are not thread-safe; the cache runs on a single event loop.
+    """
+    
+    def __init__(self):
+        self._compressor = None
+        self._decompressor = None
+        self._dict_compressor = None
+        self._dict_decompressor = None
+        self._dict: Optional["zstandard.ZstdCompressionDict"] = None
+        self._dict_loaded = False
+    
+    def load_dictionary(self, data: Optional[bytes]):
+        """Install (or clear) the shared dictionary."""
+        self._dict = zstandard.ZstdCompressionDict(data) if data else None
+        self._dict_compressor = None
+        self._dict_decompressor = None
+        self._dict_loaded = True
+    
+    @property
+    def dictionary(self):
+        if not self._dict_loaded:
+            data = None
+            if config.zstd_dict_path:
+                try:
+                    with open(config.zstd_dict_path, 'rb') as f:
+                        data = f.read()
+                except OSError as e:
+                    logger.error(f"Failed to load zstd dictionary: {e}")
+            self.load_dictionary(data)
+        return self._dict
+    
+    def compress(self, data: bytes, use_dict: bool) -> bytes:
+        if use_dict:
+            if self._dict_compressor is None:
+                self._dict_compressor = zstandard.ZstdCompressor(level=config.zstd_level, dict_data=self.dictionary)
+            return self._dict_compressor.compress(data)
+        if self._compressor is None:
+            self._compressor = zstandard.ZstdCompressor(level=config.zstd_level)
+        return self._compressor.compress(data)
+    
+    def decompress(self, data: bytes, use_dict: bool) -> bytes:
+        if use_dict:
+            if self.dictionary is None:
+                raise ValueError("zstd dictionary required but not configured")
+            if self._dict_decompressor is None:
+                self._dict_decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+            return self._dict_decompressor.decompress(data)
+        if self._decompressor is None:
+            self._decompressor = zstandard.ZstdDecompressor()
+        return self._decompressor.decompress(data)
+
+
+_zstd = _ZstdState()
+
+
 class CacheSerializer:
-    """Handles serialization/deserialization of cached values."""
+    """
+    Handles serialization/deserialization of cached values.
+    
+    Values are written as a 4-byte header (magic, format version, codec,
+    compression) followed by the payload. The codec comes from
+    config.codec ('auto' = orjson if installed, else json) with pickle as
+    fallback for values the codec can't encode. Payloads above
+    config.compression_threshold are compressed with config.compression;
+    'zstd' uses the shared dictionary from config.zstd_dict_path when set.
+    
+    Legacy prefixed values (json:, zpickle:, ...) are still readable, and
+    config.legacy_format keeps writing them during a rolling deploy.
+    """
+    
+    @staticmethod
+    def _select_codec() -> Codec:
+        name = config.codec
+        if name == 'auto':
+            name = 'orjson' if ORJSON_AVAILABLE else 'json'
+        codec = _CODECS_BY_NAME.get(name)
+        if codec is None:
+            logger.warning(f"Cache codec '{name}' unavailable, using json")
+            codec = _CODECS[CodecId.JSON]
+        return codec
+    
+    @staticmethod
+    def _select_compression() -> int:
+        name = config.compression
+        if name == 'auto':
+            name = 'zstd' if ZSTD_AVAILABLE else 'zlib'
+        if name == 'zstd' and ZSTD_AVAILABLE:
+            return CompressionId.ZSTD_DICT if _zstd.dictionary is not None else CompressionId.ZSTD
+        if name in ('zlib', 'zstd'):
+            return CompressionId.ZLIB
+        return CompressionId.NONE
     
     @staticmethod
     def serialize(value: Any, compress: bool = False) -> bytes:
         """Serialize value to bytes."""
+        if config.legacy_format:
+            return CacheSerializer._serialize_legacy(value, compress)
+        
+        codec = CacheSerializer._select_codec()
+        try:
+            data = codec.dumps(value)
+        except (TypeError, ValueError):
+            # Fall back to pickle for complex objects
+            codec = _CODECS[CodecId.PICKLE]
+            data = codec.dumps(value)
+        
+        compression = CompressionId.NONE
+        if compress and len(data) > config.compression_threshold:
+            compression = CacheSerializer._select_compression()
+            if compression == CompressionId.ZLIB:
+                data = zlib.compress(data)
+            elif compression in (CompressionId.ZSTD, CompressionId.ZSTD_DICT):
+                data = _zstd.compress(data, compression == CompressionId.ZSTD_DICT)
+        
+        return bytes((FORMAT_MAGIC, FORMAT_VERSION, codec.codec_id, compression)) + data
+    
+    @staticmethod
+    def deserialize(data: bytes) -> Any:
+        """Deserialize bytes to value."""
+        if data[:1] == bytes((FORMAT_MAGIC,)):
+            version, codec_id, compression = data[1], data[2], data[3]
+            if version != FORMAT_VERSION:
+                raise ValueError(f"Unsupported cache format version: {version}")
+            
+            payload = data[HEADER_SIZE:]
+            if compression == CompressionId.ZLIB:
+                payload = zlib.decompress(payload)
+            elif compression in (CompressionId.ZSTD, CompressionId.ZSTD_DICT):
+                if not ZSTD_AVAILABLE:
+                    raise ValueError("zstandard not installed")
+                payload = _zstd.decompress(payload, compression == CompressionId.ZSTD_DICT)
+            elif compression != CompressionId.NONE:
+                raise ValueError(f"Unknown cache compression: {compression}")
+            
+            codec = _CODECS.get(codec_id)
+            if codec is None:
+                raise ValueError(f"Cache codec {codec_id} not available")
+            return codec.loads(payload)
+        
+        return CacheSerializer._deserialize_legacy(data)
+    
+    @staticmethod
+    def train_zstd_dictionary(samples: List[Any], dict_size: int = 16 * 1024) -> bytes:
+        """
+        Train a zstd dictionary from sample values (e.g. recent dashboard
+        payloads). Save the result to config.zstd_dict_path on every replica.
+        """
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("zstandard not installed")
+        codec = CacheSerializer._select_codec()
+        encoded = [codec.dumps(sample) for sample in samples]
+        return zstandard.train_dictionary(dict_size, encoded).as_bytes()
+    
+    @staticmethod
+    def load_zstd_dictionary(data: Optional[bytes]):
+        """Install a zstd dictionary at runtime (None clears it)."""
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("zstandard not installed")
+        _zstd.load_dictionary(data)
+    
+    @staticmethod
+    def _serialize_legacy(value: Any, compress: bool = False) -> bytes:
+        """Pre-header format (json:/pickle: prefixes, optional zlib)."""
         try:
             # Try JSON first (more portable)
             data = json.dumps(value, default=str).encode('utf-8')
@@ -134,21 +412,17 @@ class CacheSerializer:
             prefix = b'pickle:'
         
         if compress and len(data) > config.compression_threshold:
-            import zlib
             data = zlib.compress(data)
             prefix = b'z' + prefix  # zjson: or zpickle:
         
         return prefix + data
     
     @staticmethod
-    def deserialize(data: bytes) -> Any:
-        """Deserialize bytes to value."""
+    def _deserialize_legacy(data: bytes) -> Any:
         if data.startswith(b'zjson:'):
-            import zlib
             data = zlib.decompress(data[6:])
             return json.loads(data.decode('utf-8'))
         elif data.startswith(b'zpickle:'):
-            import zlib
             data = zlib.decompress(data[8:])
             return pickle.loads(data)
         elif data.startswith(b'json:'):
@@ -237,6 +511,20 @@ class RedisBackend(CacheBackend):
             logger.error(f"Redis GET error: {e}")
             return None
     
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], int]:
+        """GET + TTL in a single round trip."""
+        if not self.is_connected:
+            return None, -1
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.ttl(key)
+                value, ttl = await pipe.execute()
+            return value, ttl
+        except Exception as e:
+            logger.error(f"Redis GET error: {e}")
+            return None, -1
+    
     async def set(self, key: str, value: bytes, ttl: int) -> bool:
         if not self.is_connected:
             return False
@@ -326,8 +614,12 @@ class RedisBackend(CacheBackend):
     
     async def invalidate_tag(self, tag: str) -> int:
         """Invalidate all keys with a tag."""
+        return len(await self.invalidate_tag_keys(tag))
+    
+    async def invalidate_tag_keys(self, tag: str) -> Set[str]:
+        """Invalidate all keys with a tag, returning the deleted keys."""
         if not self.is_connected:
-            return 0
+            return set()
         try:
             keys = await self.get_tag_keys(tag)
             if keys:
@@ -337,125 +629,465 @@ class RedisBackend(CacheBackend):
             tag_key = f"{config.key_prefix}tag:{tag}"
             await self._client.delete(tag_key)
             
-            return len(keys)
+            return keys
         except Exception as e:
             logger.error(f"Redis invalidate tag error: {e}")
-            return 0
+            return set()
+    
+    async def publish(self, channel: str, message: bytes) -> bool:
+        """Publish a message on a pub/sub channel."""
+        if not self.is_connected:
+            return False
+        try:
+            await self._client.publish(channel, message)
+            return True
+        except Exception as e:
+            logger.error(f"Redis PUBLISH error: {e}")
+            return False
+    
+    def subscribe(
+        self,
+        channel: str,
+        handler: Callable[[bytes], Awaitable[None]],
+        on_resubscribe: Callable[[], Awaitable[None]] = None
+    ) -> asyncio.Task:
+        """
+        Listen on a channel in a background task, reconnecting on errors.
+        
+        on_resubscribe runs after every reconnection, since messages published
+        while disconnected are lost.
+        """
+        return asyncio.create_task(self._listen(channel, handler, on_resubscribe))
+    
+    async def _listen(self, channel, handler, on_resubscribe):
+        first = True
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(channel)
+                try:
+                    if not first and on_resubscribe:
+                        await on_resubscribe()
+                    first = False
+                    
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message and message.get('type') == 'message':
+                            try:
+                                await handler(message['data'])
+                            except Exception as e:
+                                logger.error(f"Invalidation handler error: {e}")
+                finally:
+                    await pubsub.reset()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis pub/sub error on {channel}: {e}")
+                await asyncio.sleep(1.0)
+
+
+class _MemoryShard:
+    """
+    One stripe of the memory backend.
+    
+    LRU order is kept by an OrderedDict (O(1) touch/evict) and expirations
+    by a min-heap of (expiry, key). Heap entries are validated against the
+    stored expiry, so overwritten keys leave stale entries that are simply
+    skipped when popped.
+    """
+    
+    # Fixed per-entry overhead added to len(key) + len(value)
+    ENTRY_OVERHEAD = 64
+    # Max expired entries purged per write (keeps writes O(1) amortized)
+    PURGE_BATCH = 16
+    
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.data: "OrderedDict[str, Tuple[bytes, float, int]]" = OrderedDict()  # key -> (value, expiry, size)
+        self.expiry_heap: List[Tuple[float, str]] = []
+        self.bytes = 0
+    
+    def remove_locked(self, key: str) -> bool:
+        entry = self.data.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[2]
+        return True
+    
+    def purge_expired_locked(self, now: float, limit: Optional[int] = None) -> List[str]:
+        """Drop expired entries from the head of the heap."""
+        expired = []
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now and (limit is None or len(expired) < limit):
+            expiry, key = heapq.heappop(heap)
+            entry = self.data.get(key)
+            if entry is not None and entry[1] == expiry:
+                self.remove_locked(key)
+                expired.append(key)
+        
+        # Stale entries from overwrites: rebuild when the heap gets too large
+        if len(heap) > 2 * len(self.data) + 64:
+            self.expiry_heap = [(exp, k) for k, (_, exp, _) in self.data.items()]
+            heapq.heapify(self.expiry_heap)
+        return expired
+    
+    def evict_locked(self) -> List[str]:
+        """Evict least recently used entries until within capacity."""
+        evicted = []
+        while self.data and (len(self.data) > self.max_items or self.bytes > self.max_bytes):
+            key, (_, _, size) = self.data.popitem(last=False)
+            self.bytes -= size
+            evicted.append(key)
+        return evicted
 
 
 class MemoryBackend(CacheBackend):
-    """In-memory cache backend (fallback)."""
+    """
+    In-memory cache backend (L1 / fallback).
+    
+    Values are usually bytes; CacheManager also stores immutable objects
+    (and serialized payloads of mutable ones) through set_value/get_value.
+    
+    - O(1) LRU get/set per key
+    - TTL expiry via per-shard heap, purged incrementally on writes
+    - Capacity bounded by item count and by bytes
+    - Lock striping: keys are hashed to independent shards
     
-    def __init__(self, max_items: int = 1000):
+    Critical sections never await, so shard locks are plain threading locks
+    (also safe for callers using run_in_executor).
+    """
+    
+    def __init__(
+        self,
+        max_items: int = 1000,
+        max_bytes: int = None,
+        num_shards: int = None
+    ):
         self.max_items = max_items
-        self._cache: Dict[str, Tuple[bytes, float]] = {}  # key -> (value, expiry_time)
+        self.max_bytes = max_bytes or config.local_max_bytes
+        self.num_shards = max(1, min(num_shards or config.local_shards, max_items))
+        
+        per_shard_items = max(1, -(-max_items // self.num_shards))
+        per_shard_bytes = max(1, -(-self.max_bytes // self.num_shards))
+        self._shards = [
+            _MemoryShard(per_shard_items, per_shard_bytes)
+            for _ in range(self.num_shards)
+        ]
+        
         self._tags: Dict[str, Set[str]] = {}  # tag -> set of keys
-        self._lock = asyncio.Lock()
-    
-    async def _cleanup(self):
-        """Remove expired entries."""
-        now = time.time()
-        expired = [k for k, (_, exp) in self._cache.items() if exp < now]
-        for k in expired:
-            del self._cache[k]
+        self._key_tags: Dict[str, Set[str]] = {}  # key -> set of tags
+        self._tags_lock = threading.Lock()
         
-        # LRU eviction if too many items
-        if len(self._cache) > self.max_items:
-            # Remove oldest 10%
-            to_remove = len(self._cache) - int(self.max_items * 0.9)
-            for k in list(self._cache.keys())[:to_remove]:
-                del self._cache[k]
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+    
+    def _shard(self, key: str) -> _MemoryShard:
+        return self._shards[hash(key) % self.num_shards]
+    
+    def _forget_keys(self, keys: List[str]):
+        """Drop tag membership for keys that left the cache."""
+        if not keys:
+            return
+        with self._tags_lock:
+            for key in keys:
+                for tag in self._key_tags.pop(key, ()):
+                    members = self._tags.get(tag)
+                    if members is not None:
+                        members.discard(key)
+                        if not members:
+                            del self._tags[tag]
     
     async def get(self, key: str) -> Optional[bytes]:
-        async with self._lock:
-            await self._cleanup()
-            if key in self._cache:
-                value, expiry = self._cache[key]
-                if expiry > time.time():
-                    return value
-                else:
-                    del self._cache[key]
-            return None
+        return self.get_value(key)
+    
+    def get_value(self, key: str) -> Optional[Any]:
+        """Synchronous get; returns the stored object as-is."""
+        shard = self._shard(key)
+        expired = False
+        with shard.lock:
+            entry = shard.data.get(key)
+            if entry is not None:
+                if entry[1] > time.time():
+                    shard.data.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                shard.remove_locked(key)
+                expired = True
+            self._stats['misses'] += 1
+        
+        if expired:
+            self._stats['expirations'] += 1
+            self._forget_keys([key])
+        return None
     
     async def set(self, key: str, value: bytes, ttl: int) -> bool:
-        async with self._lock:
-            await self._cleanup()
-            self._cache[key] = (value, time.time() + ttl)
-            return True
+        return self.set_value(key, value, ttl, len(value))
     
-    async def delete(self, key: str) -> bool:
-        async with self._lock:
-            if key in self._cache:
-                del self._cache[key]
-                return True
+    def set_value(self, key: str, value: Any, ttl: int, size: int) -> bool:
+        """
+        Store any Python object, accounting `size` bytes for it.
+        
+        Used by CacheManager to keep deserialized objects in L1 (size is the
+        length of the serialized form).
+        """
+        shard = self._shard(key)
+        now = time.time()
+        expiry = now + ttl
+        size = len(key) + size + _MemoryShard.ENTRY_OVERHEAD
+        
+        if size > shard.max_bytes:
+            # Never keep serving the previous value for this key
+            with shard.lock:
+                removed = shard.remove_locked(key)
+            if removed:
+                self._forget_keys([key])
             return False
+        
+        with shard.lock:
+            expired = shard.purge_expired_locked(now, _MemoryShard.PURGE_BATCH)
+            shard.remove_locked(key)
+            shard.data[key] = (value, expiry, size)
+            shard.bytes += size
+            heapq.heappush(shard.expiry_heap, (expiry, key))
+            evicted = shard.evict_locked()
+        
+        self._stats['sets'] += 1
+        self._stats['expirations'] += len(expired)
+        self._stats['evictions'] += len(evicted)
+        self._forget_keys(expired + evicted)
+        return True
+    
+    async def delete(self, key: str) -> bool:
+        shard = self._shard(key)
+        with shard.lock:
+            removed = shard.remove_locked(key)
+        if removed:
+            self._forget_keys([key])
+        return removed
+    
+    async def clear(self) -> int:
+        """Drop every entry and tag."""
+        count = 0
+        for shard in self._shards:
+            with shard.lock:
+                count += len(shard.data)
+                shard.data.clear()
+                shard.expiry_heap.clear()
+                shard.bytes = 0
+        with self._tags_lock:
+            self._tags.clear()
+            self._key_tags.clear()
+        return count
     
     async def delete_pattern(self, pattern: str) -> int:
-        import fnmatch
-        async with self._lock:
-            pattern = pattern.replace('*', '.*')
-            keys = [k for k in self._cache.keys() if fnmatch.fnmatch(k, pattern)]
-            for k in keys:
-                del self._cache[k]
-            return len(keys)
+        keys = await self.keys(pattern)
+        removed = []
+        for key in keys:
+            shard = self._shard(key)
+            with shard.lock:
+                if shard.remove_locked(key):
+                    removed.append(key)
+        self._forget_keys(removed)
+        return len(removed)
     
     async def exists(self, key: str) -> bool:
-        return key in self._cache and self._cache[key][1] > time.time()
+        entry = self._shard(key).data.get(key)
+        return entry is not None and entry[1] > time.time()
     
     async def ttl(self, key: str) -> int:
-        if key in self._cache:
-            return int(self._cache[key][1] - time.time())
+        entry = self._shard(key).data.get(key)
+        if entry is not None:
+            return int(entry[1] - time.time())
         return -1
     
     async def keys(self, pattern: str) -> List[str]:
-        import fnmatch
-        pattern = pattern.replace('*', '.*')
-        return [k for k in self._cache.keys() if fnmatch.fnmatch(k, pattern)]
+        now = time.time()
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(
+                    k for k, (_, exp, _) in shard.data.items()
+                    if exp > now and fnmatch.fnmatchcase(k, pattern)
+                )
+        return result
     
     async def add_to_tag(self, tag: str, key: str, ttl: int) -> bool:
-        async with self._lock:
-            if tag not in self._tags:
-                self._tags[tag] = set()
-            self._tags[tag].add(key)
-            return True
+        with self._tags_lock:
+            self._tags.setdefault(tag, set()).add(key)
+            self._key_tags.setdefault(key, set()).add(tag)
+        return True
     
     async def get_tag_keys(self, tag: str) -> Set[str]:
-        return self._tags.get(tag, set())
+        with self._tags_lock:
+            return set(self._tags.get(tag, ()))
     
     async def invalidate_tag(self, tag: str) -> int:
-        async with self._lock:
-            keys = self._tags.get(tag, set())
-            for k in keys:
-                if k in self._cache:
-                    del self._cache[k]
-            if tag in self._tags:
-                del self._tags[tag]
-            return len(keys)
+        with self._tags_lock:
+            keys = self._tags.pop(tag, set())
+        
+        removed = []
+        for key in keys:
+            shard = self._shard(key)
+            with shard.lock:
+                if shard.remove_locked(key):
+                    removed.append(key)
+        self._forget_keys(list(keys))
+        return len(removed)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current occupancy."""
+        total = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'hit_rate': round(self._stats['hits'] / total, 4) if total > 0 else 0,
+            'items': sum(len(s.data) for s in self._shards),
+            'bytes': sum(s.bytes for s in self._shards),
+            'max_items': self.max_items,
+            'max_bytes': self.max_bytes,
+            'shards': self.num_shards,
+        }
 
 
 # =============================================================================
 # CACHE MANAGER
 # =============================================================================
 
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, datetime, timedelta)
+_FREEZE_MAX_DEPTH = 32
+_UNFROZEN = object()
+_NOT_STORED = object()
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("cached values are read-only; copy.deepcopy() them before modifying")
+
+
+class _FrozenDict(dict):
+    """Read-only dict shared by L1 readers; copy() and deepcopy give a plain dict."""
+    
+    __slots__ = ()
+    
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    
+    def copy(self) -> dict:
+        return dict(self)
+    
+    def __copy__(self) -> dict:
+        return dict(self)
+    
+    def __deepcopy__(self, memo) -> dict:
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+    
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class _FrozenList(list):
+    """Read-only list shared by L1 readers; copy() and deepcopy give a plain list."""
+    
+    __slots__ = ()
+    
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    
+    def copy(self) -> list:
+        return list(self)
+    
+    def __copy__(self) -> list:
+        return list(self)
+    
+    def __deepcopy__(self, memo) -> list:
+        return [copy.deepcopy(item, memo) for item in self]
+    
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def _freeze(value: Any, depth: int = 0) -> Any:
+    """
+    Read-only snapshot of value that L1 can hand to every caller.
+    
+    Immutable values are returned as-is; plain dicts, lists and tuples are
+    rebuilt with frozen contents. Returns _UNFROZEN for anything else
+    (sets, custom objects, too deep), which L1 keeps serialized instead.
+    """
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return value
+    if depth >= _FREEZE_MAX_DEPTH:
+        return _UNFROZEN
+    kind = type(value)
+    if kind is dict or kind is _FrozenDict:
+        frozen = _FrozenDict()
+        for key, item in value.items():
+            item = _freeze(item, depth + 1)
+            if item is _UNFROZEN or _freeze(key, depth + 1) is not key:
+                return _UNFROZEN
+            dict.__setitem__(frozen, key, item)
+        return frozen
+    if kind is list or kind is _FrozenList or kind is tuple or kind is frozenset:
+        items = [_freeze(item, depth + 1) for item in value]
+        if any(item is _UNFROZEN for item in items):
+            return _UNFROZEN
+        if kind is list or kind is _FrozenList:
+            return _FrozenList(items)
+        if all(item is original for item, original in zip(items, value)):
+            return value
+        return tuple(items) if kind is tuple else _UNFROZEN
+    return _UNFROZEN
+
+
+class _SerializedL1Entry:
+    """L1 entry holding the serialized form of a value that can't be frozen."""
+    
+    __slots__ = ('data',)
+    
+    def __init__(self, data: bytes):
+        self.data = data
+
+
 class CacheManager:
     """
     Central cache manager with multi-tier storage.
     
     Hierarchy:
-    1. L1: In-memory (fastest, limited size)
+    1. L1: In-memory near-cache of deserialized objects (fastest, limited size)
     2. L2: Redis (fast, shared across instances)
+    
+    L1 hits skip the Redis round trip and deserialization: immutable values
+    are kept as-is, and plain dicts/lists are kept as read-only snapshots
+    shared by every caller (mutating one raises TypeError; copy.deepcopy()
+    it first). Values that can't be frozen (sets, custom objects) stay
+    serialized in L1 and are decoded on every hit. Writes, deletes and
+    invalidations are broadcast on config.invalidation_channel so other
+    replicas drop their L1 copies.
     """
     
     def __init__(self):
         self.redis_backend: Optional[RedisBackend] = None
         self.memory_backend = MemoryBackend(config.local_max_items)
+        self.instance_id = uuid.uuid4().hex
         self._initialized = False
+        self._invalidation_task: Optional[asyncio.Task] = None
         self._stats = {
             'hits': 0,
             'misses': 0,
             'sets': 0,
             'deletes': 0,
             'errors': 0,
+            'l1_hits': 0,
+            'l2_hits': 0,
+            'remote_invalidations': 0,
+            'coalesced': 0,
+            'stale_served': 0,
+            'early_refreshes': 0,
         }
     
     async def initialize(self, redis_url: str = None) -> bool:
@@ -470,15 +1102,41 @@ class CacheManager:
         if not redis_connected and config.enable_local_fallback:
             logger.warning("Redis unavailable, using memory backend only")
         
+        if redis_connected and config.enable_invalidation_pubsub:
+            self._invalidation_task = self.redis_backend.subscribe(
+                config.invalidation_channel,
+                self._handle_invalidation,
+                on_resubscribe=self.memory_backend.clear
+            )
+        
         self._initialized = True
         return True
     
     async def close(self):
         """Close all connections."""
+        if self._invalidation_task:
+            self._invalidation_task.cancel()
+            try:
+                await self._invalidation_task
+            except asyncio.CancelledError:
+                pass
+            self._invalidation_task = None
         if self.redis_backend:
             await self.redis_backend.disconnect()
         self._initialized = False
     
+    def _set_l1(self, full_key: str, value: Any, data: bytes, ttl: int) -> Any:
+        """
+        Store in L1 as a frozen snapshot, or serialized if value can't be
+        frozen. Returns what L1 readers will get (snapshot or value).
+        """
+        frozen = _freeze(value)
+        if frozen is _UNFROZEN:
+            self.memory_backend.set_value(full_key, _SerializedL1Entry(data), ttl, len(data))
+            return value
+        self.memory_backend.set_value(full_key, frozen, ttl, len(data))
+        return frozen
+    
     def _make_key(self, key: str) -> str:
         """Create full cache key with prefix."""
         full_key = f"{config.key_prefix}{key}"
@@ -488,6 +1146,35 @@ class CacheManager:
             full_key = f"{config.key_prefix}h:{key_hash}"
         return full_key
     
+    # -------------------------------------------------------------------------
+    # Cross-instance invalidation
+    # -------------------------------------------------------------------------
+    
+    async def _publish_invalidation(self, **payload):
+        """Tell other replicas to drop L1 entries."""
+        if not (config.enable_invalidation_pubsub and self.redis_backend and self.redis_backend.is_connected):
+            return
+        message = json.dumps({'origin': self.instance_id, **payload}).encode('utf-8')
+        await self.redis_backend.publish(config.invalidation_channel, message)
+    
+    async def _handle_invalidation(self, data: bytes):
+        """Apply an invalidation published by another replica to L1."""
+        message = json.loads(data)
+        if message.get('origin') == self.instance_id:
+            return
+        
+        self._stats['remote_invalidations'] += 1
+        for key in message.get('keys', []):
+            await self.memory_backend.delete(key)
+        for tag in message.get('tags', []):
+            await self.memory_backend.invalidate_tag(tag)
+        if message.get('pattern'):
+            await self.memory_backend.delete_pattern(message['pattern'])
+    
+    # -------------------------------------------------------------------------
+    # Operations
+    # -------------------------------------------------------------------------
+    
     async def get(self, key: str) -> Tuple[Optional[Any], bool]:
         """
         Get value from cache.
@@ -498,31 +1185,48 @@ class CacheManager:
         full_key = self._make_key(key)
         
         # Try memory first (L1)
-        data = await self.memory_backend.get(full_key)
-        if data:
+        entry = self.memory_backend.get_value(full_key)
+        if isinstance(entry, _SerializedL1Entry):
+            try:
+                entry = CacheSerializer.deserialize(entry.data)
+            except Exception as e:
+                logger.warning(f"Cache deserialize error for {full_key}: {e}")
+                await self.memory_backend.delete(full_key)
+                entry = None
+        if entry is not None:
             self._stats['hits'] += 1
+            self._stats['l1_hits'] += 1
             if config.enable_metrics:
                 metrics.http_requests_total.labels(
                     method='GET', endpoint='cache', status='hit_l1'
                 ).inc()
-            return CacheSerializer.deserialize(data), True
+            return entry, True
         
         # Try Redis (L2)
         if self.redis_backend and self.redis_backend.is_connected:
-            data = await self.redis_backend.get(full_key)
+            data, ttl = await self.redis_backend.get_with_ttl(full_key)
+            if data:
+                try:
+                    value = CacheSerializer.deserialize(data)
+                except Exception as e:
+                    # Unreadable entry (unknown format/codec/dictionary): treat as a miss
+                    logger.warning(f"Cache deserialize error for {full_key}: {e}")
+                    self._stats['errors'] += 1
+                    data = None
+            
             if data:
                 self._stats['hits'] += 1
+                self._stats['l2_hits'] += 1
                 
                 # Promote to L1
-                ttl = await self.redis_backend.ttl(full_key)
                 if ttl > 0:
-                    await self.memory_backend.set(full_key, data, min(ttl, 60))
+                    value = self._set_l1(full_key, value, data, min(ttl, config.l1_ttl))
                 
                 if config.enable_metrics:
                     metrics.http_requests_total.labels(
                         method='GET', endpoint='cache', status='hit_l2'
                     ).inc()
-                return CacheSerializer.deserialize(data), True
+                return value, True
         
         self._stats['misses'] += 1
         if config.enable_metrics:
@@ -547,6 +1251,13 @@ class CacheManager:
             ttl: Time-to-live in seconds
             tags: Tags for invalidation
         """
+        return await self._store(key, value, ttl, tags) is not _NOT_STORED
+    
+    async def _store(self, key: str, value: Any, ttl: int = None, tags: List[str] = None) -> Any:
+        """
+        set() that returns what L1 readers will get for the key (the frozen
+        snapshot, or value itself if it can't be frozen), or _NOT_STORED.
+        """
         full_key = self._make_key(key)
         ttl = ttl or config.default_ttl
         
@@ -557,7 +1268,7 @@ class CacheManager:
             # Check size
             if len(data) > config.max_value_size_mb * 1024 * 1024:
                 logger.warning(f"Value too large to cache: {len(data)} bytes")
-                return False
+                return _NOT_STORED
             
             # Set in Redis (L2)
             if self.redis_backend and self.redis_backend.is_connected:
@@ -567,20 +1278,23 @@ class CacheManager:
                 if tags:
                     for tag in tags:
                         await self.redis_backend.add_to_tag(tag, full_key, ttl)
+                
+                # Other replicas may hold an older L1 copy
+                await self._publish_invalidation(keys=[full_key])
             
             # Set in memory (L1) with shorter TTL
-            await self.memory_backend.set(full_key, data, min(ttl, 60))
+            stored = self._set_l1(full_key, value, data, min(ttl, config.l1_ttl))
             if tags:
                 for tag in tags:
                     await self.memory_backend.add_to_tag(tag, full_key, ttl)
             
             self._stats['sets'] += 1
-            return True
+            return stored
             
         except Exception as e:
             logger.error(f"Cache set error: {e}")
             self._stats['errors'] += 1
-            return False
+            return _NOT_STORED
     
     async def delete(self, key: str) -> bool:
         """Delete a key from cache."""
@@ -589,6 +1303,7 @@ class CacheManager:
         await self.memory_backend.delete(full_key)
         if self.redis_backend and self.redis_backend.is_connected:
             await self.redis_backend.delete(full_key)
+            await self._publish_invalidation(keys=[full_key])
         
         self._stats['deletes'] += 1
         return True
@@ -596,11 +1311,25 @@ class CacheManager:
     async def invalidate_tags(self, tags: List[str]) -> int:
         """Invalidate all keys with given tags."""
         total = 0
+        redis_keys: Set[str] = set()
         
         for tag in tags:
             total += await self.memory_backend.invalidate_tag(tag)
             if self.redis_backend and self.redis_backend.is_connected:
-                total += await self.redis_backend.invalidate_tag(tag)
+                keys = await self.redis_backend.invalidate_tag_keys(tag)
+                redis_keys.update(keys)
+                total += len(keys)
+        
+        # Keys promoted from L2 carry no tags in L1, and our own broadcast is
+        # ignored here, so drop them locally too (after L2 is gone, so a
+        # concurrent get cannot promote them again)
+        for key in redis_keys:
+            await self.memory_backend.delete(key)
+        
+        # Replicas may have promoted these keys to L1 without their tags,
+        # so broadcast the concrete keys as well
+        if self.redis_backend and self.redis_backend.is_connected:
+            await self._publish_invalidation(keys=sorted(redis_keys), tags=list(tags))
         
         logger.info(f"Invalidated {total} keys for tags: {tags}")
         return total
@@ -613,6 +1342,9 @@ class CacheManager:
         total += await self.memory_backend.delete_pattern(full_pattern)
         if self.redis_backend and self.redis_backend.is_connected:
             total += await self.redis_backend.delete_pattern(full_pattern)
+            # Drop anything a concurrent get promoted from L2 meanwhile
+            await self.memory_backend.delete_pattern(full_pattern)
+            await self._publish_invalidation(pattern=full_pattern)
         
         return total
     
@@ -620,6 +1352,10 @@ class CacheManager:
         """Clear all cache entries."""
         return await self.invalidate_pattern("*")
     
+    def incr_stat(self, name: str, amount: int = 1):
+        """Increment a counter reported by get_stats()."""
+        self._stats[name] = self._stats.get(name, 0) + amount
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics."""
         total = self._stats['hits'] + self._stats['misses']
@@ -630,6 +1366,7 @@ class CacheManager:
             'hit_rate': round(hit_rate, 4),
             'total_requests': total,
             'redis_connected': self.redis_backend.is_connected if self.redis_backend else False,
+            'l1': self.memory_backend.get_stats(),
         }
 
 
@@ -661,30 +1398,94 @@ async def close_cache_manager():
 # DECORATOR
 # =============================================================================
 
+class SingleFlight:
+    """
+    Deduplicates concurrent calls per key.
+    
+    The first caller starts the work as a task; every concurrent caller for
+    the same key awaits that same task. The task is shielded, so a caller
+    being cancelled does not cancel the work for the others.
+    """
+    
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    def in_flight(self, key: str) -> bool:
+        return key in self._tasks
+    
+    def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Awaitable[T]:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        return asyncio.shield(task)
+    
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+_single_flight = SingleFlight()
+
+# Marker for entries written by the decorator (value + freshness metadata)
+_ENTRY_MARKER = '__ssi_cache_entry__'
+
+
+def _should_refresh_early(expires_at: float, delta: float, beta: float) -> bool:
+    """
+    XFetch (Vattani et al.): refresh with probability rising towards expiry,
+    scaled by how long the value took to compute (delta).
+    """
+    if beta <= 0 or delta <= 0:
+        return False
+    return time.time() - delta * beta * math.log(random.random() or 1e-12) >= expires_at
+
+
+def _log_refresh_error(cache_key: str, future: asyncio.Future):
+    """Done callback for background refreshes (retrieves the exception)."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Background cache refresh failed for {cache_key}: {error}")
+
+
 def cache(
     ttl: Union[int, CacheTTL] = None,
     tags: List[str] = None,
     key_builder: Callable[..., str] = None,
     condition: Callable[..., bool] = None,
     unless: Callable[[Any], bool] = None,
+    stale_ttl: int = None,
+    early_refresh_beta: float = None,
 ):
     """
     Cache decorator for async functions.
     
+    Concurrent misses for the same key run the function once (single-flight).
+    After `ttl` the value is served stale for up to `stale_ttl` seconds while
+    a background refresh runs; before expiry a refresh may also start early
+    (XFetch), so popular keys are usually recomputed before they expire.
+    
     Args:
         ttl: Time-to-live in seconds or CacheTTL enum
         tags: Tags for invalidation
         key_builder: Custom function to build cache key
         condition: Only cache if this returns True
         unless: Don't cache if this returns True for the result
+        stale_ttl: Seconds a value may be served stale while revalidating
+        early_refresh_beta: XFetch beta (0 disables early refresh)
     
     Usage:
-        @cache(ttl=CacheTTL.MEDIUM, tags=['dashboard'])
+        @cache(ttl=CacheTTL.MEDIUM, tags=['dashboard'], stale_ttl=60)
         async def get_dashboard_data(org_id: str):
             return await expensive_query()
     """
     _ttl = ttl.value if isinstance(ttl, CacheTTL) else (ttl or config.default_ttl)
     _tags = tags or []
+    _stale_ttl = config.default_stale_ttl if stale_ttl is None else stale_ttl
+    _beta = config.early_refresh_beta if early_refresh_beta is None else early_refresh_beta
     
     def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
         @wraps(func)
@@ -702,22 +1503,59 @@ def cache(
             # Get cache manager
             manager = await get_cache_manager()
             
+            async def compute() -> T:
+                started = time.time()
+                result = await func(*args, **kwargs)
+                
+                # Check unless condition
+                if unless and unless(result):
+                    return result
+                
+                # Cache result with freshness metadata
+                entry = {
+                    _ENTRY_MARKER: 1,
+                    'value': result,
+                    'expires_at': time.time() + _ttl,
+                    'delta': time.time() - started,
+                }
+                # Return the same read-only snapshot that hits will get; the
+                # result is also shared with every coalesced caller
+                stored = await manager._store(cache_key, entry, _ttl + _stale_ttl, _tags)
+                if stored is _NOT_STORED:
+                    frozen = _freeze(result)
+                    return result if frozen is _UNFROZEN else frozen
+                return stored['value']
+            
+            def refresh_in_background():
+                if _single_flight.in_flight(cache_key):
+                    return
+                _single_flight.do(cache_key, compute).add_done_callback(
+                    lambda f: _log_refresh_error(cache_key, f)
+                )
+            
             # Try cache
-            value, hit = await manager.get(cache_key)
+            cached, hit = await manager.get(cache_key)
             if hit:
+                if not (isinstance(cached, dict) and _ENTRY_MARKER in cached):
+                    return cached  # Entry written by cache_set / older format
+                
+                value = cached['value']
+                expires_at = cached['expires_at']
+                
+                if time.time() >= expires_at:
+                    # Stale: serve it and revalidate in the background
+                    manager.incr_stat('stale_served')
+                    refresh_in_background()
+                elif _should_refresh_early(expires_at, cached.get('delta', 0), _beta):
+                    if not _single_flight.in_flight(cache_key):
+                        manager.incr_stat('early_refreshes')
+                        refresh_in_background()
                 return value
             
-            # Execute function
-            result = await func(*args, **kwargs)
-            
-            # Check unless condition
-            if unless and unless(result):
-                return result
-            
-            # Cache result
-            await manager.set(cache_key, result, _ttl, _tags)
-            
-            return result
+            # Miss: only one concurrent caller executes the function
+            if _single_flight.in_flight(cache_key):
+                manager.incr_stat('coalesced')
+            return await _single_flight.do(cache_key, compute)
         
         # Add cache control methods to wrapper
         wrapper.invalidate = lambda: _invalidate_func(func)
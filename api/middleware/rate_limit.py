@@ -9,9 +9,10 @@ Features:
 - Tiered limits (anonymous, authenticated, premium)
 - Per-endpoint custom limits
 - Distributed rate limiting with Redis
-- Graceful fallback to local memory
+- Graceful fallback to local memory (same algorithms, sharded, timing-wheel expiry)
 - Standard headers (X-RateLimit-*)
 - Request cost weighting
+- Optional lease mode: per-replica token blocks to keep Redis off the hot path
 
 Usage:
     from api.middleware.rate_limit import RateLimitMiddleware, RateLimiter
@@ -32,8 +33,11 @@ Version: 2.0.0
 """
 
 import os
+import re
+import math
 import time
 import asyncio
+import threading
 import logging
 import hashlib
 from abc import ABC, abstractmethod
@@ -41,8 +45,8 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, Callable, List, Tuple, Union
 from dataclasses import dataclass, field
 from enum import Enum
-from functools import wraps
-from collections import defaultdict
+from functools import wraps, lru_cache
+from collections import OrderedDict
 
 from fastapi import Request, Response, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -109,6 +113,11 @@ class RateLimitConfig:
     # Token bucket specific
     refill_rate: float = 1.67  # Tokens per second (100/min)
     bucket_size: int = 100
+    
+    # Lease mode (Redis only): reserve blocks of tokens per identifier and
+    # decide locally until the block is used up or expires. 0 = disabled
+    lease_size: int = 0
+    lease_ttl_seconds: float = 1.0
 
 
 @dataclass
@@ -142,6 +151,169 @@ class RateLimitRule:
     cost: int = 1  # Request cost (some endpoints cost more)
 
 
+# =============================================================================
+# ROUTE RULE MATCHING
+# =============================================================================
+
+_REGEX_METACHARS = set(".^$*+?{}[]|()\\")
+
+
+def _parse_literal_rule(pattern: str) -> Optional[Tuple[str, bool]]:
+    """
+    Reduce a rule pattern to a literal path if it has no real regex in it.
+    
+    re.match() anchors at the start, so "^/api/x$" is an exact path and
+    "^/api/x", "^/api/x.*" and "^/api/x.*$" are all plain prefixes.
+    
+    Returns:
+        Tuple of (literal, is_exact), or None if the pattern needs the regex engine
+    """
+    body = pattern[1:] if pattern.startswith("^") else pattern
+    exact = False
+    
+    if body.endswith(".*$"):
+        body = body[:-3]
+    elif body.endswith(".*"):
+        body = body[:-2]
+    elif body.endswith("$") and not body.endswith("\\$"):
+        body = body[:-1]
+        exact = True
+    
+    literal = []
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == "\\":
+            if i + 1 >= len(body) or body[i + 1].isalnum() or body[i + 1] == "_":
+                return None  # \d, \w, \1, ... are not literals
+            literal.append(body[i + 1])
+            i += 2
+            continue
+        if char in _REGEX_METACHARS:
+            return None
+        literal.append(char)
+        i += 1
+    
+    return "".join(literal), exact
+
+
+class RouteRuleMatcher:
+    """
+    Rule patterns compiled once into a combined matcher.
+    
+    - Literal rules (exact paths and prefixes, which covers most endpoint
+      rules) live in a character trie, so lookup is O(path length).
+    - Remaining regex rules are joined per HTTP method into one alternation
+      regex; each alternative ends in an empty marker group so `lastgroup`
+      names the rule that matched.
+    - Decisions are memoized per (method, path) in a bounded LRU.
+    
+    Like a linear scan, the first matching rule in list order wins.
+    """
+    
+    # Trie terminal keys; never collide with single-character edges
+    _EXACT = "exact"
+    _PREFIX = "prefix"
+    
+    def __init__(self, rules: List[RateLimitRule], cache_size: int = 4096):
+        self.rules = list(rules)
+        self._trie: Dict[str, Any] = {}
+        self._regex_rules: Dict[int, "re.Pattern"] = {}
+        
+        for index, rule in enumerate(self.rules):
+            literal = _parse_literal_rule(rule.path_pattern)
+            if literal is not None:
+                self._insert(literal[0], literal[1], index)
+                continue
+            try:
+                self._regex_rules[index] = re.compile(rule.path_pattern)
+            except re.error as e:
+                logger.warning(f"Invalid rate limit rule pattern {rule.path_pattern!r}: {e}")
+        
+        # method -> combined regex, or list of (index, pattern) if it can't be combined
+        self._method_regexes: Dict[str, Any] = {}
+        self._match_cached = lru_cache(maxsize=cache_size)(self._match)
+    
+    def _insert(self, literal: str, exact: bool, index: int):
+        node = self._trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node.setdefault(self._EXACT if exact else self._PREFIX, []).append(index)
+    
+    def _regex_for_method(self, method: str) -> Any:
+        """Build (once) the alternation regex for regex rules allowing a method."""
+        if method in self._method_regexes:
+            return self._method_regexes[method]
+        
+        candidates = [
+            (index, compiled) for index, compiled in self._regex_rules.items()
+            if method in self.rules[index].methods
+        ]
+        combined: Any = None
+        if candidates:
+            try:
+                combined = re.compile("|".join(
+                    f"(?:{compiled.pattern})(?P<r{index}>)" for index, compiled in candidates
+                ))
+            except re.error:
+                # Duplicate group names, backreferences or inline flags don't
+                # survive being combined; match those rules one by one
+                combined = candidates
+        
+        self._method_regexes[method] = combined
+        return combined
+    
+    def _match_trie(self, path: str, method: str) -> Optional[int]:
+        best = None
+        node = self._trie
+        
+        for char in path:
+            for index in node.get(self._PREFIX, ()):
+                if method in self.rules[index].methods and (best is None or index < best):
+                    best = index
+            node = node.get(char)
+            if node is None:
+                return best
+        
+        for key in (self._PREFIX, self._EXACT):
+            for index in node.get(key, ()):
+                if method in self.rules[index].methods and (best is None or index < best):
+                    best = index
+        return best
+    
+    def _match_regex(self, path: str, method: str) -> Optional[int]:
+        combined = self._regex_for_method(method)
+        if combined is None:
+            return None
+        
+        if isinstance(combined, list):
+            for index, compiled in combined:
+                if compiled.match(path):
+                    return index
+            return None
+        
+        match = combined.match(path)
+        return int(match.lastgroup[1:]) if match else None
+    
+    def _match(self, method: str, path: str) -> Optional[RateLimitRule]:
+        candidates = [
+            index for index in (
+                self._match_trie(path, method),
+                self._match_regex(path, method),
+            )
+            if index is not None
+        ]
+        return self.rules[min(candidates)] if candidates else None
+    
+    def match(self, path: str, method: str) -> Optional[RateLimitRule]:
+        """Return the first rule matching path and method, if any."""
+        return self._match_cached(method, path)
+    
+    def cache_info(self):
+        """LRU statistics for the decision cache."""
+        return self._match_cached.cache_info()
+
+
 # =============================================================================
 # RATE LIMIT BACKENDS
 # =============================================================================
@@ -159,6 +331,38 @@ class RateLimitBackend(ABC):
         """
         pass
     
+    @abstractmethod
+    async def increment_sliding_window(
+        self,
+        key: str,
+        window: int,
+        limit: int,
+        cost: int = 1
+    ) -> Tuple[bool, int, int]:
+        """
+        Increment counter using sliding window algorithm.
+        
+        Returns:
+            Tuple of (allowed, count, reset_in_seconds)
+        """
+        pass
+    
+    @abstractmethod
+    async def check_token_bucket(
+        self,
+        key: str,
+        rate: float,
+        capacity: int,
+        cost: int = 1
+    ) -> Tuple[bool, int, int]:
+        """
+        Check token bucket rate limit.
+        
+        Returns:
+            Tuple of (allowed, remaining_tokens, wait_seconds)
+        """
+        pass
+    
     @abstractmethod
     async def get_count(self, key: str) -> int:
         """Get current count for a key."""
@@ -170,14 +374,56 @@ class RateLimitBackend(ABC):
         pass
 
 
+@dataclass
+class _Lease:
+    """Block of tokens reserved from Redis for one key on this replica."""
+    remaining: int
+    expires_at: float
+    reset_at: float
+    count: int  # Global count reported by Redis when the block was granted
+    exhausted: bool = False  # Redis had nothing left; deny locally until expiry
+
+
 class RedisBackend(RateLimitBackend):
-    """Redis-backed rate limit storage."""
+    """
+    Redis-backed rate limit storage.
+    
+    With lease_size > 0, sliding window and token bucket checks run in lease
+    mode: the replica reserves up to lease_size tokens per key in one script
+    call and answers from that local block until it is used up or expires.
+    Reserved tokens are counted in Redis as soon as they are granted, so the
+    global limit is never exceeded; the error is on the other side, at most
+    lease_size unused tokens per replica and key until the lease expires.
+    Sliding window leases never outlive the window they were taken from.
+    When Redis has nothing left, the denial is cached for up to lease_ttl too.
+    
+    Leases are kept per key *and* limit, so routes with different limits on
+    the same identifier never spend each other's blocks. At most MAX_LEASES
+    leases are kept (least recently used are evicted first; their unused
+    tokens stay counted in Redis until the window or bucket recovers).
+    """
     
-    def __init__(self, redis_client: "aioredis.Redis"):
+    MAX_LEASES = 10000
+    
+    def __init__(
+        self,
+        redis_client: "aioredis.Redis",
+        lease_size: int = 0,
+        lease_ttl: float = 1.0,
+    ):
         self.redis = redis_client
         self._scripts_loaded = False
         self._sliding_window_script = None
         self._token_bucket_script = None
+        self._sliding_window_lease_script = None
+        self._token_bucket_lease_script = None
+        
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        # (redis_key, window_or_rate, limit) -> lease, in LRU order
+        self._leases: "OrderedDict[Tuple[str, float, int], _Lease]" = OrderedDict()
+        self._lease_locks: Dict[Tuple[str, float, int], asyncio.Lock] = {}
+        self.lease_stats = {"local_hits": 0, "acquired": 0}
     
     async def _load_scripts(self):
         """Load Lua scripts for atomic operations."""
@@ -250,8 +496,67 @@ class RedisBackend(RateLimitBackend):
         return {1, math.floor(tokens), 0}
         """
         
+        # Lease variants: grant up to ARGV[4] units at once, fewer if that is
+        # all the window/bucket has left. Same keys as the scripts above so
+        # leasing and non-leasing replicas share counters.
+        sliding_window_lease_lua = """
+        local key = KEYS[1]
+        local now = tonumber(ARGV[1])
+        local window = tonumber(ARGV[2])
+        local limit = tonumber(ARGV[3])
+        local block = tonumber(ARGV[4])
+        
+        local current_window = math.floor(now / window) * window
+        local current_key = key .. ":" .. current_window
+        local previous_key = key .. ":" .. (current_window - window)
+        
+        local current_count = tonumber(redis.call('GET', current_key) or 0)
+        local previous_count = tonumber(redis.call('GET', previous_key) or 0)
+        
+        local elapsed = now - current_window
+        local weight = (window - elapsed) / window
+        local weighted_count = current_count + (previous_count * weight)
+        
+        local granted = math.min(block, math.floor(limit - weighted_count))
+        if granted < 1 then
+            return {0, math.ceil(weighted_count), window - elapsed}
+        end
+        
+        redis.call('INCRBY', current_key, granted)
+        redis.call('EXPIRE', current_key, window * 2)
+        
+        return {granted, math.ceil(weighted_count + granted), window - elapsed}
+        """
+        
+        token_bucket_lease_lua = """
+        local key = KEYS[1]
+        local now = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local capacity = tonumber(ARGV[3])
+        local block = tonumber(ARGV[4])
+        
+        local bucket = redis.call('HMGET', key, 'tokens', 'last_update')
+        local tokens = tonumber(bucket[1]) or capacity
+        local last_update = tonumber(bucket[2]) or now
+        
+        tokens = math.min(capacity, tokens + (now - last_update) * rate)
+        
+        local granted = math.min(block, math.floor(tokens))
+        if granted < 1 then
+            return {0, math.floor(tokens), math.ceil((1 - tokens) / rate)}
+        end
+        
+        tokens = tokens - granted
+        redis.call('HMSET', key, 'tokens', tokens, 'last_update', now)
+        redis.call('EXPIRE', key, 3600)
+        
+        return {granted, math.floor(tokens), 0}
+        """
+        
         self._sliding_window_script = self.redis.register_script(sliding_window_lua)
         self._token_bucket_script = self.redis.register_script(token_bucket_lua)
+        self._sliding_window_lease_script = self.redis.register_script(sliding_window_lease_lua)
+        self._token_bucket_lease_script = self.redis.register_script(token_bucket_lease_lua)
         self._scripts_loaded = True
     
     async def increment(self, key: str, window: int, limit: int) -> Tuple[int, int]:
@@ -283,6 +588,11 @@ class RedisBackend(RateLimitBackend):
         Returns:
             Tuple of (allowed, count, reset_in_seconds)
         """
+        if self.lease_size > 0:
+            return await self._check_leased(
+                f"ratelimit:sw:{key}", cost, window, limit, sliding=True
+            )
+        
         await self._load_scripts()
         
         result = await self._sliding_window_script(
@@ -305,6 +615,12 @@ class RedisBackend(RateLimitBackend):
         Returns:
             Tuple of (allowed, remaining_tokens, wait_seconds)
         """
+        if self.lease_size > 0:
+            allowed, count, wait = await self._check_leased(
+                f"ratelimit:tb:{key}", cost, rate, capacity, sliding=False
+            )
+            return allowed, max(0, capacity - count), wait
+        
         await self._load_scripts()
         
         result = await self._token_bucket_script(
@@ -314,6 +630,137 @@ class RedisBackend(RateLimitBackend):
         
         return bool(result[0]), result[1], result[2]
     
+    # -------------------------------------------------------------------------
+    # Lease mode
+    # -------------------------------------------------------------------------
+    
+    def _consume_lease(self, lease_key: Tuple[str, float, int], cost: int, now: float) -> Optional[Tuple[bool, int, int]]:
+        """Serve a decision from the local lease, or None if Redis is needed."""
+        lease = self._leases.get(lease_key)
+        if lease is None or lease.expires_at <= now:
+            return None
+        
+        self._leases.move_to_end(lease_key)
+        if lease.remaining < cost:
+            if not lease.exhausted:
+                return None
+            self.lease_stats["local_hits"] += 1
+            return False, lease.count, max(0, int(math.ceil(lease.reset_at - now)))
+        
+        lease.remaining -= cost
+        self.lease_stats["local_hits"] += 1
+        return True, lease.count - lease.remaining, max(0, int(lease.reset_at - now))
+    
+    async def _check_leased(
+        self,
+        redis_key: str,
+        cost: int,
+        window_or_rate: float,
+        limit: int,
+        sliding: bool,
+    ) -> Tuple[bool, int, int]:
+        """
+        Lease mode check.
+        
+        Returns:
+            Tuple of (allowed, count, reset_or_wait_seconds); for token bucket
+            `count` is tokens in use (capacity minus remaining)
+        """
+        now = time.time()
+        lease_key = (redis_key, window_or_rate, limit)
+        decision = self._consume_lease(lease_key, cost, now)
+        if decision is not None:
+            return decision
+        
+        # One refill per key at a time; concurrent callers wait and reuse it
+        lock = self._lease_locks.get(lease_key)
+        if lock is None:
+            if len(self._lease_locks) >= self.MAX_LEASES:
+                self._prune_lease_locks()
+            lock = self._lease_locks[lease_key] = asyncio.Lock()
+        
+        async with lock:
+            now = time.time()
+            decision = self._consume_lease(lease_key, cost, now)
+            if decision is not None:
+                return decision
+            
+            await self._load_scripts()
+            block = max(self.lease_size, cost)
+            script = self._sliding_window_lease_script if sliding else self._token_bucket_lease_script
+            granted, count, reset_in = await script(
+                keys=[redis_key],
+                args=[now, window_or_rate, limit, block]
+            )
+            granted, count, reset_in = int(granted), int(count), int(reset_in)
+            if not sliding:
+                # Script reports tokens left; normalize to tokens in use
+                count = limit - count
+            
+            # Redis truncates Lua numbers to integers, so the sliding window
+            # reset reads 0 during its last second; use the exact end instead
+            reset_at = now + reset_in
+            if sliding:
+                reset_at = math.floor(now / window_or_rate) * window_or_rate + window_or_rate
+            
+            expires_at = now + self.lease_ttl
+            if sliding or granted < 1:
+                # Sliding window: tokens were counted in the current window, so
+                # don't spend them in the next. Denials: don't outlive the wait.
+                expires_at = min(expires_at, reset_at)
+            
+            if granted < 1:
+                self._store_lease(lease_key, _Lease(
+                    remaining=0,
+                    expires_at=expires_at,
+                    reset_at=reset_at,
+                    count=count,
+                    exhausted=True,
+                ), now)
+                return False, count, reset_in
+            
+            self.lease_stats["acquired"] += 1
+            
+            # Leftovers of the previous lease are merged in rather than lost
+            previous = self._leases.get(lease_key)
+            leftover = previous.remaining if previous and previous.expires_at > now else 0
+            
+            lease = _Lease(
+                remaining=granted + leftover,
+                expires_at=expires_at,
+                reset_at=reset_at,
+                count=count,
+            )
+            self._store_lease(lease_key, lease, now)
+            
+            if lease.remaining < cost:
+                return False, count, reset_in
+            
+            lease.remaining -= cost
+            return True, count - lease.remaining, reset_in
+    
+    def _store_lease(self, lease_key: Tuple[str, float, int], lease: _Lease, now: float):
+        """Insert a lease as most recently used, keeping at most MAX_LEASES."""
+        self._leases[lease_key] = lease
+        self._leases.move_to_end(lease_key)
+        if len(self._leases) > self.MAX_LEASES:
+            self._prune_leases(now)
+            while len(self._leases) > self.MAX_LEASES:
+                self._leases.popitem(last=False)
+    
+    def _prune_leases(self, now: float):
+        """Drop expired leases (and their idle locks)."""
+        for lease_key in [k for k, lease in self._leases.items() if lease.expires_at <= now]:
+            del self._leases[lease_key]
+            lock = self._lease_locks.get(lease_key)
+            if lock is not None and not lock.locked():
+                del self._lease_locks[lease_key]
+    
+    def _prune_lease_locks(self):
+        """Drop idle locks; a lock is only needed while a refill is in flight."""
+        for lease_key in [k for k, lock in self._lease_locks.items() if not lock.locked()]:
+            del self._lease_locks[lease_key]
+    
     async def get_count(self, key: str) -> int:
         """Get current count for a key."""
         now = time.time()
@@ -329,6 +776,9 @@ class RedisBackend(RateLimitBackend):
         cursor = 0
         deleted = 0
         
+        for lease_key in [k for k in self._leases if key in k[0]]:
+            del self._leases[lease_key]
+        
         while True:
             cursor, keys = await self.redis.scan(cursor, match=pattern, count=100)
             if keys:
@@ -339,76 +789,282 @@ class RedisBackend(RateLimitBackend):
         return deleted > 0
 
 
-class MemoryBackend(RateLimitBackend):
-    """In-memory rate limit storage (for single-instance or fallback)."""
+class _RateState:
+    """Per-key state for every algorithm the memory backend supports."""
+    
+    __slots__ = (
+        'fixed_window', 'fixed_start', 'fixed_count',
+        'sw_start', 'sw_current', 'sw_previous',
+        'tat', 'expires_at',
+    )
     
     def __init__(self):
-        self._counters: Dict[str, Dict[str, Any]] = defaultdict(dict)
-        self._lock = asyncio.Lock()
+        self.fixed_window = 0
+        self.fixed_start = 0
+        self.fixed_count = 0
+        self.sw_start = 0
+        self.sw_current = 0
+        self.sw_previous = 0
+        self.tat = 0.0
+        self.expires_at = 0.0
+
+
+class _RateShard:
+    """
+    One shard of the memory backend: its own lock, state dict and timing wheel.
+    
+    The wheel has one slot per second. A key is (re)scheduled in the slot of
+    its expiry; when the wheel advances past a slot, only the keys in that
+    slot are checked. Keys whose expiry was pushed forward, or that lie more
+    than one revolution ahead, are simply rescheduled.
+    """
+    
+    def __init__(self, wheel_size: int):
+        self.lock = threading.Lock()
+        self.data: Dict[str, _RateState] = {}
+        self.wheel: List[set] = [set() for _ in range(wheel_size)]
+        self.wheel_size = wheel_size
+        self.current_tick = int(time.time())
+    
+    def schedule_locked(self, key: str, state: _RateState, expires_at: float):
+        """Extend expiry of a key and place it in the matching wheel slot."""
+        if expires_at <= state.expires_at:
+            return
+        state.expires_at = expires_at
+        tick = max(int(math.ceil(expires_at)), self.current_tick + 1)
+        self.wheel[tick % self.wheel_size].add(key)
+    
+    def advance_locked(self, now: float) -> int:
+        """Advance the wheel to now, dropping expired keys. Returns removed count."""
+        target = int(now)
+        if target <= self.current_tick:
+            return 0
+        
+        removed = 0
+        # A full revolution visits every slot; no need to spin further
+        steps = min(target - self.current_tick, self.wheel_size)
+        start = target - steps + 1
+        
+        for tick in range(start, target + 1):
+            slot = self.wheel[tick % self.wheel_size]
+            if not slot:
+                continue
+            
+            due = list(slot)
+            slot.clear()
+            for key in due:
+                state = self.data.get(key)
+                if state is None:
+                    continue
+                if state.expires_at <= now:
+                    del self.data[key]
+                    removed += 1
+                else:
+                    resched = max(int(math.ceil(state.expires_at)), target + 1)
+                    self.wheel[resched % self.wheel_size].add(key)
+        
+        self.current_tick = target
+        return removed
+    
+    def get_state_locked(self, key: str, now: float) -> _RateState:
+        """Get live state for a key, creating it if missing or expired."""
+        state = self.data.get(key)
+        if state is None or state.expires_at <= now:
+            state = _RateState()
+            self.data[key] = state
+        return state
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    In-memory rate limit storage (for single-instance or fallback).
+    
+    Supports the same algorithms as the Redis backend:
+    - Fixed window counters
+    - Sliding window counter (weighted previous + current window)
+    - Token bucket, implemented as GCRA (one timestamp per key)
+    
+    State is split across shards, each with its own lock, so concurrent
+    callers on different keys do not contend. Critical sections never await.
+    Expiry is handled by a per-shard timing wheel instead of full scans.
+    """
+    
+    DEFAULT_SHARDS = 64
+    WHEEL_SIZE = 3600
+    TICK_INTERVAL = 1.0
+    
+    def __init__(self, num_shards: int = None, wheel_size: int = None):
+        num_shards = num_shards or int(
+            os.getenv("RATE_LIMIT_MEMORY_SHARDS", self.DEFAULT_SHARDS)
+        )
+        self._shards = [
+            _RateShard(wheel_size or self.WHEEL_SIZE)
+            for _ in range(max(1, num_shards))
+        ]
         self._cleanup_task: Optional[asyncio.Task] = None
     
+    def _shard_for(self, key: str) -> _RateShard:
+        return self._shards[hash(key) % len(self._shards)]
+    
     async def start_cleanup(self):
-        """Start background cleanup task."""
+        """Start background task advancing the expiry wheels."""
         if self._cleanup_task is None:
             self._cleanup_task = asyncio.create_task(self._cleanup_loop())
     
+    async def stop_cleanup(self):
+        """Stop the background expiry task."""
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+    
     async def _cleanup_loop(self):
-        """Periodically clean up expired entries."""
+        """Advance the wheels once per tick (each tick touches only due slots)."""
         while True:
-            await asyncio.sleep(60)
+            await asyncio.sleep(self.TICK_INTERVAL)
             await self._cleanup()
     
     async def _cleanup(self):
         """Remove expired entries."""
         now = time.time()
-        async with self._lock:
-            expired_keys = []
-            for key, data in self._counters.items():
-                if data.get('expires_at', 0) < now:
-                    expired_keys.append(key)
-            
-            for key in expired_keys:
-                del self._counters[key]
-            
-            if expired_keys:
-                logger.debug(f"Cleaned up {len(expired_keys)} expired rate limit entries")
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                removed += shard.advance_locked(now)
+        
+        if removed:
+            logger.debug(f"Cleaned up {removed} expired rate limit entries")
+    
+    def __len__(self) -> int:
+        return sum(len(shard.data) for shard in self._shards)
     
     async def increment(self, key: str, window: int, limit: int) -> Tuple[int, int]:
         """Increment counter using fixed window."""
         now = time.time()
         window_start = int(now / window) * window
-        full_key = f"{key}:{window_start}"
-        
-        async with self._lock:
-            if full_key not in self._counters:
-                self._counters[full_key] = {
-                    'count': 0,
-                    'expires_at': window_start + window * 2
-                }
+        shard = self._shard_for(key)
+        
+        with shard.lock:
+            state = shard.get_state_locked(key, now)
+            if state.fixed_start != window_start or state.fixed_window != window:
+                state.fixed_window = window
+                state.fixed_start = window_start
+                state.fixed_count = 0
             
-            self._counters[full_key]['count'] += 1
-            current = self._counters[full_key]['count']
+            state.fixed_count += 1
+            current = state.fixed_count
+            shard.schedule_locked(key, state, window_start + window * 2)
         
         ttl = window - (now - window_start)
         return current, int(ttl)
     
+    async def increment_sliding_window(
+        self,
+        key: str,
+        window: int,
+        limit: int,
+        cost: int = 1
+    ) -> Tuple[bool, int, int]:
+        """
+        Increment counter using sliding window algorithm.
+        
+        Same approximation as the Redis script: the previous window's count
+        is weighted by how much of it still overlaps the sliding window.
+        
+        Returns:
+            Tuple of (allowed, count, reset_in_seconds)
+        """
+        now = time.time()
+        current_window = int(now / window) * window
+        elapsed = now - current_window
+        weight = (window - elapsed) / window
+        shard = self._shard_for(key)
+        
+        with shard.lock:
+            state = shard.get_state_locked(key, now)
+            if state.sw_start != current_window:
+                if state.sw_start == current_window - window:
+                    state.sw_previous = state.sw_current
+                else:
+                    state.sw_previous = 0
+                state.sw_current = 0
+                state.sw_start = current_window
+            
+            weighted_count = state.sw_current + state.sw_previous * weight
+            
+            if weighted_count + cost > limit:
+                return False, int(math.ceil(weighted_count)), int(window - elapsed)
+            
+            state.sw_current += cost
+            shard.schedule_locked(key, state, current_window + window * 2)
+        
+        return True, int(math.ceil(weighted_count + cost)), int(window - elapsed)
+    
+    async def check_token_bucket(
+        self,
+        key: str,
+        rate: float,
+        capacity: int,
+        cost: int = 1
+    ) -> Tuple[bool, int, int]:
+        """
+        Check token bucket rate limit (GCRA).
+        
+        Instead of storing tokens and a refill timestamp, GCRA keeps only the
+        theoretical arrival time (TAT) of the next request. A request is
+        allowed while TAT stays within `capacity` emission intervals of now,
+        which gives the same bursts as a bucket holding `capacity` tokens
+        refilled at `rate` per second.
+        
+        Returns:
+            Tuple of (allowed, remaining_tokens, wait_seconds)
+        """
+        now = time.time()
+        interval = 1.0 / rate
+        tolerance = capacity * interval
+        shard = self._shard_for(key)
+        
+        with shard.lock:
+            state = shard.get_state_locked(key, now)
+            tat = max(state.tat, now)
+            new_tat = tat + cost * interval
+            allow_at = new_tat - tolerance
+            
+            if now < allow_at:
+                remaining = int((tolerance - (tat - now)) / interval)
+                return False, max(0, remaining), int(math.ceil(allow_at - now))
+            
+            state.tat = new_tat
+            shard.schedule_locked(key, state, new_tat)
+        
+        remaining = int((tolerance - (new_tat - now)) / interval)
+        return True, max(0, remaining), 0
+    
     async def get_count(self, key: str) -> int:
         """Get current count for a key."""
         now = time.time()
         window_start = int(now / 60) * 60
-        full_key = f"{key}:{window_start}"
-        
-        async with self._lock:
-            data = self._counters.get(full_key, {})
-            return data.get('count', 0)
+        shard = self._shard_for(key)
+        
+        with shard.lock:
+            state = shard.data.get(key)
+            if state is None or state.expires_at <= now:
+                return 0
+            if state.fixed_start == window_start and state.fixed_window == 60:
+                return state.fixed_count
+            if state.sw_start == window_start:
+                return state.sw_current
+            return 0
     
     async def reset(self, key: str) -> bool:
         """Reset all counters for a key."""
-        async with self._lock:
-            keys_to_delete = [k for k in self._counters if key in k]
-            for k in keys_to_delete:
-                del self._counters[k]
-            return len(keys_to_delete) > 0
+        shard = self._shard_for(key)
+        with shard.lock:
+            # Stale wheel entries are ignored when their slot comes up
+            return shard.data.pop(key, None) is not None
 
 
 # =============================================================================
@@ -485,7 +1141,11 @@ class RateLimiter:
             return
         
         if self._redis_client:
-            self._backend = RedisBackend(self._redis_client)
+            self._backend = RedisBackend(
+                self._redis_client,
+                lease_size=self.config.lease_size,
+                lease_ttl=self.config.lease_ttl_seconds,
+            )
             logger.info("Rate limiter initialized with provided Redis client")
         elif self._redis_url and REDIS_AVAILABLE:
             try:
@@ -495,7 +1155,11 @@ class RateLimiter:
                     decode_responses=True
                 )
                 await self._redis_client.ping()
-                self._backend = RedisBackend(self._redis_client)
+                self._backend = RedisBackend(
+                    self._redis_client,
+                    lease_size=self.config.lease_size,
+                    lease_ttl=self.config.lease_ttl_seconds,
+                )
                 logger.info(f"Rate limiter connected to Redis: {self._redis_url}")
             except Exception as e:
                 logger.warning(f"Failed to connect to Redis: {e}. Using memory backend.")
@@ -510,6 +1174,16 @@ class RateLimiter:
         
         self._initialized = True
     
+    @property
+    def custom_rules(self) -> List[RateLimitRule]:
+        return self._custom_rules
+    
+    @custom_rules.setter
+    def custom_rules(self, rules: List[RateLimitRule]):
+        """Replace custom rules and recompile the path matcher."""
+        self._custom_rules = list(rules)
+        self._rule_matcher = RouteRuleMatcher(self._custom_rules)
+    
     def _get_key(self, identifier: str, scope: str = "default") -> str:
         """Generate a rate limit key."""
         return f"{self.key_prefix}:rl:{scope}:{identifier}"
@@ -572,12 +1246,10 @@ class RateLimiter:
         Returns:
             Tuple of (limit, cost)
         """
-        import re
-        
         # Check custom rules first
-        for rule in self.custom_rules:
-            if re.match(rule.path_pattern, path) and method in rule.methods:
-                return rule.requests_per_minute, rule.cost
+        rule = self._rule_matcher.match(path, method)
+        if rule is not None:
+            return rule.requests_per_minute, rule.cost
         
         # Return tier limit
         limit = self.tier_limits.get(tier, self.config.requests_per_minute)
@@ -635,30 +1307,18 @@ class RateLimiter:
                 remaining = max(0, effective_limit - current)
                 
             elif self.algorithm == RateLimitAlgorithm.SLIDING_WINDOW_COUNTER:
-                if isinstance(self._backend, RedisBackend):
-                    allowed, current, ttl = await self._backend.increment_sliding_window(
-                        key, window, effective_limit, cost
-                    )
-                    remaining = max(0, effective_limit - current)
-                else:
-                    # Fallback to fixed window for memory backend
-                    current, ttl = await self._backend.increment(key, window, effective_limit)
-                    allowed = current <= effective_limit
-                    remaining = max(0, effective_limit - current)
+                allowed, current, ttl = await self._backend.increment_sliding_window(
+                    key, window, effective_limit, cost
+                )
+                remaining = max(0, effective_limit - current)
                     
             elif self.algorithm == RateLimitAlgorithm.TOKEN_BUCKET:
-                if isinstance(self._backend, RedisBackend):
-                    rate = effective_limit / 60  # Tokens per second
-                    allowed, remaining, wait = await self._backend.check_token_bucket(
-                        key, rate, effective_limit, cost
-                    )
-                    current = effective_limit - remaining
-                    ttl = wait if not allowed else 0
-                else:
-                    # Fallback to fixed window
-                    current, ttl = await self._backend.increment(key, window, effective_limit)
-                    allowed = current <= effective_limit
-                    remaining = max(0, effective_limit - current)
+                rate = effective_limit / 60  # Tokens per second
+                allowed, remaining, wait = await self._backend.check_token_bucket(
+                    key, rate, effective_limit, cost
+                )
+                current = effective_limit - remaining
+                ttl = wait if not allowed else 0
             else:
                 # Default to fixed window
                 current, ttl = await self._backend.increment(key, window, effective_limit)
@@ -786,10 +1446,14 @@ class RateLimiter:
             **self._metrics,
             "algorithm": self.algorithm.value,
             "backend": "redis" if isinstance(self._backend, RedisBackend) else "memory",
+            **({"lease": dict(self._backend.lease_stats)}
+               if isinstance(self._backend, RedisBackend) and self._backend.lease_size > 0
+               else {}),
         }
     
     async def close(self):
         """Close connections."""
+        await self._memory_backend.stop_cleanup()
         if self._redis_client and hasattr(self._redis_client, 'close'):
             await self._redis_client.close()
 
@@ -1048,6 +1712,7 @@ __all__ = [
     "RateLimitConfig",
     "RateLimitResult",
     "RateLimitRule",
+    "RouteRuleMatcher",
     "RateLimitAlgorithm",
     "RateLimitTier",
     "RateLimitBackend",
@@ -14,13 +14,15 @@ Triangula resultados para visão unificada.
 
 import os
 import json
+import math
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 from dataclasses import dataclass, field
 from enum import Enum
 import numpy as np
 from collections import defaultdict
+from statistics import NormalDist
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('ssi_attribution_orchestrator')
@@ -141,172 +143,603 @@ class AttributionReport:
     generated_at: datetime = field(default_factory=datetime.now)
 
 
+# =============================================================================
+# COLUMNAR JOURNEYS
+# =============================================================================
+
+@dataclass
+class JourneyColumns:
+    """
+    Jornadas em formato colunar (um array por campo).
+    
+    Touch points ficam contíguos por conversão, na ordem original:
+    os da conversão i ocupam [offsets[i], offsets[i + 1]).
+    """
+    channels: List[Any]              # código -> canal
+    offsets: np.ndarray              # (n_conversions + 1,) int64
+    conversion_values: np.ndarray    # (n_conversions,) float64
+    touch_conversion: np.ndarray     # (n_touches,) int64, índice da conversão
+    touch_channel: np.ndarray        # (n_touches,) int64, código do canal
+    touch_age_seconds: np.ndarray    # (n_touches,) float64, conversão - touch
+    
+    @classmethod
+    def from_conversions(cls, conversions: List[Conversion]) -> 'JourneyColumns':
+        """Empacota objetos Conversion/TouchPoint uma única vez"""
+        channel_codes: Dict[Any, int] = {}
+        lengths = np.zeros(len(conversions), dtype=np.int64)
+        values = np.zeros(len(conversions), dtype=np.float64)
+        codes: List[int] = []
+        ages: List[float] = []
+        
+        for i, conv in enumerate(conversions):
+            lengths[i] = len(conv.touch_points)
+            values[i] = conv.value
+            for touch in conv.touch_points:
+                code = channel_codes.get(touch.channel)
+                if code is None:
+                    code = channel_codes[touch.channel] = len(channel_codes)
+                codes.append(code)
+                ages.append((conv.timestamp - touch.timestamp).total_seconds())
+        
+        return cls.from_arrays(
+            channels=list(channel_codes),
+            lengths=lengths,
+            conversion_values=values,
+            touch_channel=np.asarray(codes, dtype=np.int64),
+            touch_age_seconds=np.asarray(ages, dtype=np.float64)
+        )
+    
+    @classmethod
+    def from_arrays(
+        cls,
+        channels: List[Any],
+        lengths: np.ndarray,
+        conversion_values: np.ndarray,
+        touch_channel: np.ndarray,
+        touch_age_seconds: np.ndarray
+    ) -> 'JourneyColumns':
+        """Monta a partir de arrays já colunares (ex.: export do BigQuery)"""
+        lengths = np.asarray(lengths, dtype=np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        
+        return cls(
+            channels=list(channels),
+            offsets=offsets,
+            conversion_values=np.asarray(conversion_values, dtype=np.float64),
+            touch_conversion=np.repeat(np.arange(len(lengths), dtype=np.int64), lengths),
+            touch_channel=np.asarray(touch_channel, dtype=np.int64),
+            touch_age_seconds=np.asarray(touch_age_seconds, dtype=np.float64)
+        )
+    
+    @property
+    def n_conversions(self) -> int:
+        return len(self.conversion_values)
+    
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+    
+    @property
+    def touch_position(self) -> np.ndarray:
+        """Posição de cada touch dentro da sua jornada"""
+        return np.arange(len(self.touch_channel), dtype=np.int64) - self.offsets[self.touch_conversion]
+    
+    def channel_masks(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Bitmask de canais por conversão com touch points: (masks, valores)"""
+        lengths = self.lengths
+        nonempty = lengths > 0
+        if not nonempty.any():
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.float64)
+        
+        bits = np.left_shift(np.uint64(1), self.touch_channel.astype(np.uint64))
+        masks = np.bitwise_or.reduceat(bits, self.offsets[:-1][nonempty])
+        return masks, self.conversion_values[nonempty]
+    
+    def to_channel_dict(self, credit: np.ndarray, credited: np.ndarray) -> Dict[Any, float]:
+        """Converte vetores por código de canal em Dict[canal, valor]"""
+        return {
+            self.channels[code]: float(credit[code])
+            for code in np.flatnonzero(credited)
+        }
+
+
+# =============================================================================
+# SHAPLEY ENGINE
+# =============================================================================
+
+class ShapleyEngine:
+    """
+    Shapley values sobre coalizões codificadas como bitmasks.
+    
+    Valor da coalizão S: soma do valor das conversões cujo conjunto de canais
+    está contido em S. Os totais por coalizão exata são acumulados em um
+    vetor de 2^n posições e a soma sobre subconjuntos (zeta transform) é
+    feita bit a bit com operações NumPy.
+    
+    - Exato (n <= max_exact_channels): pesos |S|!(n-|S|-1)!/n! aplicados a
+      todas as contribuições marginais, O(n * 2^n).
+    - Monte Carlo (n maior): amostragem de permutações, com intervalo de
+      confiança normal por canal.
+    """
+    
+    # Linhas x coalizões avaliadas por bloco no Monte Carlo (limita memória)
+    MC_CHUNK_ELEMENTS = 4_000_000
+    
+    def __init__(
+        self,
+        max_exact_channels: int = 15,
+        n_permutations: int = 2000,
+        confidence: float = 0.95,
+        random_state: Optional[int] = None
+    ):
+        self.max_exact_channels = max_exact_channels
+        self.n_permutations = n_permutations
+        self.confidence = confidence
+        self.random_state = random_state
+    
+    @staticmethod
+    def coalition_totals(
+        masks: np.ndarray,
+        values: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Agrupa conversões por coalizão exata: (masks únicas, valor total)"""
+        unique_masks, inverse = np.unique(masks, return_inverse=True)
+        totals = np.bincount(inverse, weights=values, minlength=len(unique_masks))
+        return unique_masks, totals
+    
+    @staticmethod
+    def subset_sum(table: np.ndarray, n: int) -> np.ndarray:
+        """Zeta transform: v[S] = soma de table[T] para todo T contido em S"""
+        v = table.astype(np.float64, copy=True)
+        for bit in range(n):
+            view = v.reshape(-1, 2, 1 << bit)
+            view[:, 1, :] += view[:, 0, :]
+        return v
+    
+    def exact(self, unique_masks: np.ndarray, totals: np.ndarray, n: int) -> np.ndarray:
+        """Shapley exato para n canais"""
+        size = 1 << n
+        table = np.zeros(size, dtype=np.float64)
+        np.add.at(table, unique_masks.astype(np.int64), totals)
+        v = self.subset_sum(table, n)
+        
+        all_masks = np.arange(size, dtype=np.int64)
+        popcount = np.zeros(size, dtype=np.int64)
+        for bit in range(n):
+            popcount += (all_masks >> bit) & 1
+        
+        # w[k] = k! (n-k-1)! / n!
+        k = np.arange(n, dtype=np.float64)
+        log_w = (
+            np.array([math.lgamma(x + 1) for x in k])
+            + np.array([math.lgamma(n - x) for x in k])
+            - math.lgamma(n + 1)
+        )
+        weights = np.exp(log_w)
+        
+        phi = np.zeros(n, dtype=np.float64)
+        for bit in range(n):
+            v_view = v.reshape(-1, 2, 1 << bit)
+            sizes = popcount.reshape(-1, 2, 1 << bit)[:, 0, :]
+            marginal = v_view[:, 1, :] - v_view[:, 0, :]
+            phi[bit] = np.sum(weights[sizes] * marginal)
+        
+        return phi
+    
+    def _coalition_values(
+        self,
+        coalitions: np.ndarray,
+        unique_masks: np.ndarray,
+        totals: np.ndarray
+    ) -> np.ndarray:
+        """v(S) para coalizões arbitrárias, sem tabela 2^n"""
+        out = np.empty(len(coalitions), dtype=np.float64)
+        rows = max(1, self.MC_CHUNK_ELEMENTS // max(1, len(unique_masks)))
+        
+        for start in range(0, len(coalitions), rows):
+            chunk = coalitions[start:start + rows]
+            covered = (unique_masks[None, :] & ~chunk[:, None]) == 0
+            out[start:start + rows] = covered @ totals
+        
+        return out
+    
+    def monte_carlo(
+        self,
+        unique_masks: np.ndarray,
+        totals: np.ndarray,
+        n: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Shapley por amostragem de permutações: (estimativa, meia-largura do IC)"""
+        rng = np.random.default_rng(self.random_state)
+        m = self.n_permutations
+        unique_masks = unique_masks.astype(np.uint64)
+        
+        perms = np.argsort(rng.random((m, n)), axis=1)
+        bits = np.left_shift(np.uint64(1), perms.astype(np.uint64))
+        prefixes = np.bitwise_or.accumulate(bits, axis=1)
+        
+        values = self._coalition_values(prefixes.ravel(), unique_masks, totals).reshape(m, n)
+        previous = np.concatenate([np.zeros((m, 1)), values[:, :-1]], axis=1)
+        marginals = np.empty((m, n), dtype=np.float64)
+        np.put_along_axis(marginals, perms, values - previous, axis=1)
+        
+        phi = marginals.mean(axis=0)
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        half_width = z * marginals.std(axis=0, ddof=1) / np.sqrt(m) if m > 1 else np.zeros(n)
+        return phi, half_width
+    
+    def compute(
+        self,
+        masks: np.ndarray,
+        values: np.ndarray,
+        n: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Shapley por canal (bit) a partir da coalizão e valor de cada conversão.
+        
+        Returns:
+            (valores, meia-largura do IC); IC zero quando o cálculo é exato
+        """
+        if n == 0 or len(masks) == 0:
+            return np.zeros(n), np.zeros(n)
+        if n > 64:
+            raise ValueError(f"Shapley suporta até 64 canais (recebeu {n})")
+        
+        unique_masks, totals = self.coalition_totals(masks, values)
+        
+        if n <= self.max_exact_channels:
+            return self.exact(unique_masks, totals, n), np.zeros(n)
+        return self.monte_carlo(unique_masks, totals, n)
+
+
+# =============================================================================
+# MARKOV ATTRIBUTION
+# =============================================================================
+
+class MarkovAttributionModel:
+    """
+    Atribuição por cadeia de Markov (removal effect), de primeira ordem.
+    
+    Estados: START, um por canal, e os absorventes CONVERSION e NULL.
+    As transições são contadas de forma esparsa (pares origem/destino)
+    e podem ser atualizadas incrementalmente com update(); attribute()
+    só resolve o sistema absorvente, cujo tamanho depende do número de
+    canais e não do número de jornadas.
+    
+    Removal effect do canal c: 1 - P(conversão sem c) / P(conversão),
+    onde remover c redireciona para NULL todas as transições que entram em c.
+    """
+    
+    START = 0
+    
+    def __init__(self):
+        self.channels: List[Any] = []
+        self._channel_index: Dict[Any, int] = {}
+        
+        # Contagens esparsas: (origem, destino) entre estados transientes
+        self._transitions: Dict[Tuple[int, int], float] = defaultdict(float)
+        self._to_conversion: Dict[int, float] = defaultdict(float)
+        self._to_null: Dict[int, float] = defaultdict(float)
+        
+        self.total_value = 0.0
+        self.n_paths = 0
+    
+    def _state_codes(self, cols: JourneyColumns) -> np.ndarray:
+        """Mapeia códigos locais de JourneyColumns para estados do modelo"""
+        lookup = np.empty(len(cols.channels), dtype=np.int64)
+        for code, channel in enumerate(cols.channels):
+            index = self._channel_index.get(channel)
+            if index is None:
+                index = self._channel_index[channel] = len(self.channels)
+                self.channels.append(channel)
+            lookup[code] = index + 1  # estado 0 é START
+        return lookup[cols.touch_channel]
+    
+    @staticmethod
+    def _accumulate(target: Dict, keys: np.ndarray, to_key=int):
+        """Soma contagens de um lote em um acumulador esparso"""
+        if len(keys) == 0:
+            return
+        unique, counts = np.unique(keys, return_counts=True)
+        for key, count in zip(unique.tolist(), counts.tolist()):
+            target[to_key(key)] += count
+    
+    def update(
+        self,
+        conversions: Union[List[Conversion], JourneyColumns],
+        converted: bool = True
+    ) -> 'MarkovAttributionModel':
+        """
+        Adiciona jornadas às contagens.
+        
+        converted=False para jornadas que não converteram (terminam em NULL).
+        """
+        cols = MTACalculator._columns(conversions)
+        nonempty = cols.lengths > 0
+        if not nonempty.any():
+            return self
+        
+        states = self._state_codes(cols)
+        position = cols.touch_position
+        
+        previous = np.empty_like(states)
+        previous[1:] = states[:-1]
+        src = np.where(position == 0, self.START, previous)
+        
+        # Pares codificados em um único inteiro para contagem vetorizada
+        n_states = len(self.channels) + 1
+        self._accumulate(
+            self._transitions,
+            src * n_states + states,
+            to_key=lambda key: divmod(key, n_states)
+        )
+        
+        last_states = states[cols.offsets[1:][nonempty] - 1]
+        self._accumulate(self._to_conversion if converted else self._to_null, last_states)
+        
+        if converted:
+            self.total_value += float(cols.conversion_values[nonempty].sum())
+        self.n_paths += int(nonempty.sum())
+        return self
+    
+    def _system(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Matriz Q (transiente -> transiente) e vetor r (transiente -> conversão)"""
+        n_states = len(self.channels) + 1
+        counts = np.zeros((n_states, n_states), dtype=np.float64)
+        if self._transitions:
+            pairs = np.array(list(self._transitions.keys()), dtype=np.int64)
+            np.add.at(counts, (pairs[:, 0], pairs[:, 1]), list(self._transitions.values()))
+        
+        to_conversion = np.zeros(n_states, dtype=np.float64)
+        to_null = np.zeros(n_states, dtype=np.float64)
+        for state, count in self._to_conversion.items():
+            to_conversion[state] = count
+        for state, count in self._to_null.items():
+            to_null[state] = count
+        
+        totals = counts.sum(axis=1) + to_conversion + to_null
+        safe = np.where(totals > 0, totals, 1.0)
+        return counts / safe[:, None], to_conversion / safe
+    
+    @staticmethod
+    def _conversion_probability(q: np.ndarray, r: np.ndarray) -> np.ndarray:
+        """P(conversão | START) para um lote de sistemas (..., T, T)"""
+        identity = np.eye(q.shape[-1])
+        try:
+            x = np.linalg.solve(identity - q, r[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            x = np.stack([
+                np.linalg.lstsq(identity - qi, ri, rcond=None)[0]
+                for qi, ri in zip(q.reshape(-1, *q.shape[-2:]), r.reshape(-1, r.shape[-1]))
+            ]).reshape(r.shape)
+        return x[..., MarkovAttributionModel.START]
+    
+    def removal_effects(self) -> Dict[Any, float]:
+        """Removal effect por canal"""
+        n = len(self.channels)
+        if n == 0:
+            return {}
+        
+        q, r = self._system()
+        base = float(self._conversion_probability(q, r))
+        if base <= 0:
+            return {}
+        
+        # Um sistema por canal removido, resolvidos em lote
+        q_removed = np.repeat(q[None, :, :], n, axis=0)
+        r_removed = np.repeat(r[None, :], n, axis=0)
+        removed = np.arange(n) + 1
+        q_removed[np.arange(n), :, removed] = 0.0
+        q_removed[np.arange(n), removed, :] = 0.0
+        r_removed[np.arange(n), removed] = 0.0
+        
+        without = self._conversion_probability(q_removed, r_removed)
+        effects = np.clip(1.0 - without / base, 0.0, None)
+        return {channel: float(effects[i]) for i, channel in enumerate(self.channels)}
+    
+    def attribute(self) -> Dict[Any, float]:
+        """Valor convertido distribuído proporcionalmente aos removal effects"""
+        effects = self.removal_effects()
+        total_effect = sum(effects.values())
+        if total_effect <= 0:
+            return {}
+        return {
+            channel: self.total_value * effect / total_effect
+            for channel, effect in effects.items()
+        }
+
+
 # =============================================================================
 # MTA CALCULATOR
 # =============================================================================
 
 class MTACalculator:
-    """Calcula atribuição Multi-Touch"""
+    """
+    Calcula atribuição Multi-Touch.
+    
+    Todos os métodos aceitam List[Conversion] ou JourneyColumns; para rodar
+    vários modelos sobre os mesmos dados, empacote uma vez com
+    JourneyColumns.from_conversions (ou use calculate_rule_based).
+    """
+    
+    @staticmethod
+    def _columns(conversions: Union[List[Conversion], JourneyColumns]) -> JourneyColumns:
+        if isinstance(conversions, JourneyColumns):
+            return conversions
+        return JourneyColumns.from_conversions(conversions)
+    
+    @staticmethod
+    def _credit(
+        cols: JourneyColumns,
+        touches: Union[np.ndarray, slice],
+        weights: np.ndarray
+    ) -> Dict[Channel, float]:
+        """Soma créditos por canal (bincount) para os touches selecionados"""
+        n_channels = len(cols.channels)
+        codes = cols.touch_channel[touches]
+        credit = np.bincount(codes, weights=weights, minlength=n_channels)
+        credited = np.bincount(codes, minlength=n_channels) > 0
+        return cols.to_channel_dict(credit, credited)
     
     def calculate_last_click(
         self,
-        conversions: List[Conversion]
+        conversions: Union[List[Conversion], JourneyColumns]
     ) -> Dict[Channel, float]:
         """Last-click attribution"""
-        attribution = defaultdict(float)
-        
-        for conv in conversions:
-            if conv.touch_points:
-                last_touch = conv.touch_points[-1]
-                attribution[last_touch.channel] += conv.value
-        
-        return dict(attribution)
+        cols = self._columns(conversions)
+        nonempty = cols.lengths > 0
+        last = cols.offsets[1:][nonempty] - 1
+        return self._credit(cols, last, cols.conversion_values[nonempty])
     
     def calculate_first_click(
         self,
-        conversions: List[Conversion]
+        conversions: Union[List[Conversion], JourneyColumns]
     ) -> Dict[Channel, float]:
         """First-click attribution"""
-        attribution = defaultdict(float)
-        
-        for conv in conversions:
-            if conv.touch_points:
-                first_touch = conv.touch_points[0]
-                attribution[first_touch.channel] += conv.value
-        
-        return dict(attribution)
+        cols = self._columns(conversions)
+        nonempty = cols.lengths > 0
+        first = cols.offsets[:-1][nonempty]
+        return self._credit(cols, first, cols.conversion_values[nonempty])
     
     def calculate_linear(
         self,
-        conversions: List[Conversion]
+        conversions: Union[List[Conversion], JourneyColumns]
     ) -> Dict[Channel, float]:
         """Linear attribution"""
-        attribution = defaultdict(float)
-        
-        for conv in conversions:
-            n = len(conv.touch_points)
-            if n > 0:
-                credit = conv.value / n
-                for touch in conv.touch_points:
-                    attribution[touch.channel] += credit
-        
-        return dict(attribution)
+        cols = self._columns(conversions)
+        conv = cols.touch_conversion
+        weights = cols.conversion_values[conv] / cols.lengths[conv]
+        return self._credit(cols, slice(None), weights)
     
     def calculate_time_decay(
         self,
-        conversions: List[Conversion],
+        conversions: Union[List[Conversion], JourneyColumns],
         half_life_days: float = 7
     ) -> Dict[Channel, float]:
         """Time-decay attribution"""
-        attribution = defaultdict(float)
+        cols = self._columns(conversions)
+        conv = cols.touch_conversion
         
-        for conv in conversions:
-            if not conv.touch_points:
-                continue
-            
-            # Calculate weights based on time decay
-            weights = []
-            for touch in conv.touch_points:
-                days_before = (conv.timestamp - touch.timestamp).days
-                weight = np.exp(-days_before * np.log(2) / half_life_days)
-                weights.append(weight)
-            
-            total_weight = sum(weights)
-            
-            if total_weight > 0:
-                for touch, weight in zip(conv.touch_points, weights):
-                    credit = conv.value * weight / total_weight
-                    attribution[touch.channel] += credit
+        # Dias inteiros antes da conversão (floor, como timedelta.days)
+        days_before = np.floor(cols.touch_age_seconds / 86400.0)
+        weights = np.exp(-days_before * np.log(2) / half_life_days)
+        total_weight = np.bincount(conv, weights=weights, minlength=cols.n_conversions)
         
-        return dict(attribution)
+        valid = total_weight[conv] > 0
+        credit = np.zeros_like(weights)
+        credit[valid] = cols.conversion_values[conv[valid]] * weights[valid] / total_weight[conv[valid]]
+        return self._credit(cols, valid, credit[valid])
     
     def calculate_position_based(
         self,
-        conversions: List[Conversion],
+        conversions: Union[List[Conversion], JourneyColumns],
         first_weight: float = 0.4,
         last_weight: float = 0.4
     ) -> Dict[Channel, float]:
         """Position-based (U-shaped) attribution"""
-        attribution = defaultdict(float)
+        cols = self._columns(conversions)
+        conv = cols.touch_conversion
+        n = cols.lengths[conv]
+        position = cols.touch_position
         middle_weight = 1 - first_weight - last_weight
         
-        for conv in conversions:
-            n = len(conv.touch_points)
-            
-            if n == 0:
-                continue
-            elif n == 1:
-                attribution[conv.touch_points[0].channel] += conv.value
-            elif n == 2:
-                attribution[conv.touch_points[0].channel] += conv.value * 0.5
-                attribution[conv.touch_points[1].channel] += conv.value * 0.5
-            else:
-                # First touch
-                attribution[conv.touch_points[0].channel] += conv.value * first_weight
-                # Last touch
-                attribution[conv.touch_points[-1].channel] += conv.value * last_weight
-                # Middle touches
-                middle_credit = conv.value * middle_weight / (n - 2)
-                for touch in conv.touch_points[1:-1]:
-                    attribution[touch.channel] += middle_credit
+        share = np.where(
+            position == 0, first_weight,
+            np.where(position == n - 1, last_weight, middle_weight / np.maximum(n - 2, 1))
+        )
+        share = np.where(n == 1, 1.0, np.where(n == 2, 0.5, share))
+        return self._credit(cols, slice(None), cols.conversion_values[conv] * share)
+    
+    def calculate_markov(
+        self,
+        conversions: Union[List[Conversion], JourneyColumns],
+        non_converting: Optional[Union[List[Conversion], JourneyColumns]] = None
+    ) -> Dict[Channel, float]:
+        """Markov chain (removal effect) attribution"""
+        model = MarkovAttributionModel().update(conversions)
+        if non_converting is not None:
+            model.update(non_converting, converted=False)
+        return model.attribute()
+    
+    def calculate_rule_based(
+        self,
+        conversions: Union[List[Conversion], JourneyColumns],
+        half_life_days: float = 7,
+        first_weight: float = 0.4,
+        last_weight: float = 0.4
+    ) -> Dict[AttributionMethod, Dict[Channel, float]]:
+        """Todos os modelos heurísticos sobre um único empacotamento colunar"""
+        cols = self._columns(conversions)
         
-        return dict(attribution)
+        return {
+            AttributionMethod.LAST_CLICK: self.calculate_last_click(cols),
+            AttributionMethod.FIRST_CLICK: self.calculate_first_click(cols),
+            AttributionMethod.LINEAR: self.calculate_linear(cols),
+            AttributionMethod.TIME_DECAY: self.calculate_time_decay(cols, half_life_days),
+            AttributionMethod.POSITION_BASED: self.calculate_position_based(
+                cols, first_weight, last_weight
+            ),
+        }
     
     def calculate_shapley(
         self,
-        conversions: List[Conversion],
-        max_channels: int = 6
+        conversions: Union[List[Conversion], JourneyColumns],
+        max_channels: int = 15,
+        n_permutations: int = 2000,
+        random_state: Optional[int] = None
     ) -> Dict[Channel, float]:
-        """Simplified Shapley value attribution"""
-        attribution = defaultdict(float)
-        
-        # Get unique channels
-        all_channels = set()
-        for conv in conversions:
-            for touch in conv.touch_points:
-                all_channels.add(touch.channel)
-        
-        channels = list(all_channels)[:max_channels]
-        n = len(channels)
-        
-        if n == 0:
-            return {}
+        """
+        Shapley value attribution.
         
-        # Build coalition values (simplified)
-        coalition_values = defaultdict(float)
+        Exato até max_channels canais; acima disso, Monte Carlo com
+        n_permutations permutações (ver calculate_shapley_with_intervals).
+        """
+        values, _ = self.calculate_shapley_with_intervals(
+            conversions,
+            max_channels=max_channels,
+            n_permutations=n_permutations,
+            random_state=random_state
+        )
+        return values
+    
+    def calculate_shapley_with_intervals(
+        self,
+        conversions: Union[List[Conversion], JourneyColumns],
+        max_channels: int = 15,
+        n_permutations: int = 2000,
+        confidence: float = 0.95,
+        random_state: Optional[int] = None
+    ) -> Tuple[Dict[Channel, float], Dict[Channel, Tuple[float, float]]]:
+        """
+        Shapley value attribution com intervalos de confiança.
         
-        for conv in conversions:
-            conv_channels = set(t.channel for t in conv.touch_points)
-            conv_channels = conv_channels & set(channels)
-            
-            if conv_channels:
-                key = tuple(sorted(c.value for c in conv_channels))
-                coalition_values[key] += conv.value
+        Returns:
+            (valor por canal, (low, high) por canal); no cálculo exato low == high
+        """
+        cols = self._columns(conversions)
         
-        # Approximate Shapley values
-        for channel in channels:
-            marginal_contributions = []
-            
-            for key, value in coalition_values.items():
-                if channel.value in key:
-                    # Contribution = value with - value without
-                    without_key = tuple(c for c in key if c != channel.value)
-                    value_without = coalition_values.get(without_key, 0)
-                    marginal = value - value_without
-                    marginal_contributions.append(marginal)
-            
-            if marginal_contributions:
-                attribution[channel] = np.mean(marginal_contributions)
+        # Conversões sem touch point não entram em nenhuma coalizão
+        masks, values = cols.channel_masks()
         
-        # Normalize to total revenue
-        total_attr = sum(attribution.values())
-        total_revenue = sum(c.value for c in conversions)
+        n = len(cols.channels)
+        if n == 0 or len(masks) == 0:
+            return {}, {}
         
-        if total_attr > 0:
-            scale = total_revenue / total_attr
-            attribution = {k: v * scale for k, v in attribution.items()}
+        engine = ShapleyEngine(
+            max_exact_channels=max_channels,
+            n_permutations=n_permutations,
+            confidence=confidence,
+            random_state=random_state
+        )
+        phi, half_width = engine.compute(masks, values, n)
         
-        return dict(attribution)
+        attribution = {channel: float(phi[bit]) for bit, channel in enumerate(cols.channels)}
+        intervals = {
+            channel: (float(phi[bit] - half_width[bit]), float(phi[bit] + half_width[bit]))
+            for bit, channel in enumerate(cols.channels)
+        }
+        return attribution, intervals
 
 
 # =============================================================================
@@ -321,6 +754,9 @@ class AttributionOrchestrator:
     def __init__(self):
         self.mta_calculator = MTACalculator()
         
+        # Modelo Markov incremental (ver update_markov)
+        self.markov_model = MarkovAttributionModel()
+        
         # Weights for triangulation
         self.method_weights = {
             AttributionMethod.LAST_CLICK: 0.10,
@@ -338,27 +774,45 @@ class AttributionOrchestrator:
     ) -> Dict[AttributionMethod, Dict[Channel, float]]:
         """Calcula atribuição por todos os métodos MTA"""
         
-        results = {}
+        # Empacota as jornadas uma vez e reaproveita em todos os modelos
+        columns = JourneyColumns.from_conversions(conversions)
         
-        results[AttributionMethod.LAST_CLICK] = self.mta_calculator.calculate_last_click(conversions)
-        results[AttributionMethod.FIRST_CLICK] = self.mta_calculator.calculate_first_click(conversions)
-        results[AttributionMethod.LINEAR] = self.mta_calculator.calculate_linear(conversions)
-        results[AttributionMethod.TIME_DECAY] = self.mta_calculator.calculate_time_decay(conversions)
-        results[AttributionMethod.POSITION_BASED] = self.mta_calculator.calculate_position_based(conversions)
-        results[AttributionMethod.SHAPLEY] = self.mta_calculator.calculate_shapley(conversions)
+        results = self.mta_calculator.calculate_rule_based(columns)
+        results[AttributionMethod.SHAPLEY] = self.mta_calculator.calculate_shapley(columns)
+        results[AttributionMethod.MARKOV] = self.mta_calculator.calculate_markov(columns)
         
         return results
     
+    def update_markov(
+        self,
+        conversions: List[Conversion],
+        non_converting: Optional[List[Conversion]] = None
+    ) -> Dict[Channel, float]:
+        """
+        Adiciona novas jornadas ao modelo Markov incremental e retorna a
+        atribuição atualizada (sem reprocessar o histórico).
+        """
+        self.markov_model.update(conversions)
+        if non_converting:
+            self.markov_model.update(non_converting, converted=False)
+        return self.markov_model.attribute()
+    
     def triangulate(
         self,
         mta_results: Dict[AttributionMethod, Dict[Channel, float]],
         mmm_results: Optional[Dict[Channel, float]] = None,
-        incrementality_results: Optional[Dict[Channel, float]] = None
+        incrementality_results: Optional[Dict[Channel, float]] = None,
+        markov_results: Optional[Dict[Channel, float]] = None
     ) -> Dict[Channel, float]:
         """
         Triangula resultados de múltiplos métodos.
         Retorna atribuição unificada.
+        
+        markov_results (ex.: de update_markov) substitui o Markov de mta_results.
         """
+        if markov_results is not None:
+            mta_results = {**mta_results, AttributionMethod.MARKOV: markov_results}
+        
         all_channels = set()
         
         for method_results in mta_results.values():
@@ -426,6 +880,7 @@ class AttributionOrchestrator:
             attr.last_click_conversions = mta_results.get(AttributionMethod.LAST_CLICK, {}).get(channel, 0)
             attr.linear_conversions = mta_results.get(AttributionMethod.LINEAR, {}).get(channel, 0)
             attr.shapley_conversions = mta_results.get(AttributionMethod.SHAPLEY, {}).get(channel, 0)
+            attr.markov_conversions = mta_results.get(AttributionMethod.MARKOV, {}).get(channel, 0)
             
             if mmm_results:
                 attr.mmm_conversions = mmm_results.get(channel, 0)
@@ -637,6 +1092,9 @@ __all__ = [
     'Conversion',
     'ChannelAttribution',
     'AttributionReport',
+    'JourneyColumns',
+    'ShapleyEngine',
+    'MarkovAttributionModel',
     'MTACalculator',
     'AttributionOrchestrator',
     'BudgetOptimizer'
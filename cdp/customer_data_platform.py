@@ -24,7 +24,9 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Set, Callable, Union
 from dataclasses import dataclass, field, asdict
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import repeat
+from operator import attrgetter, is_not
 import numpy as np
 
 logging.basicConfig(level=logging.INFO)
@@ -160,12 +162,111 @@ class CustomerProfile:
 # SEGMENT DEFINITION
 # =============================================================================
 
+def _bulk_get(path: str, getter: Callable[[Any], Any], objs: List[Any]) -> List[Any]:
+    """Valores de um path para muitos objetos (attrgetter quando só há atributos)"""
+    try:
+        return list(map(attrgetter(path), objs))
+    except AttributeError:
+        return list(map(getter, objs))
+
+
+def _compile_getter(path: str) -> Callable[[Any], Any]:
+    """Compila path nested (e.g., 'metrics.total_revenue') em uma closure"""
+    parts = tuple(path.split('.'))
+    
+    def get_nested_value(obj):
+        current = obj
+        for part in parts:
+            if hasattr(current, part):
+                current = getattr(current, part)
+            elif isinstance(current, dict):
+                current = current.get(part)
+            else:
+                return None
+        return current
+    
+    return get_nested_value
+
+
+_SCALAR_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    'eq': lambda value, target: value == target,
+    'neq': lambda value, target: value != target,
+    'gt': lambda value, target: value > target,
+    'gte': lambda value, target: value >= target,
+    'lt': lambda value, target: value < target,
+    'lte': lambda value, target: value <= target,
+    'in': lambda value, target: value in target,
+    'contains': lambda value, target: target in value,
+}
+
+_NUMERIC_OPERATORS: Dict[str, Callable[[np.ndarray, Any], np.ndarray]] = {
+    'eq': np.equal,
+    'neq': np.not_equal,
+    'gt': np.greater,
+    'gte': np.greater_equal,
+    'lt': np.less,
+    'lte': np.less_equal,
+}
+
+
+_NUMBER_TYPES = frozenset({
+    int, float, bool,
+    np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64,
+    np.float16, np.float32, np.float64, np.bool_,
+})
+
+
+def _is_number(value: Any) -> bool:
+    return type(value) in _NUMBER_TYPES
+
+
 @dataclass
 class SegmentCondition:
     """Condição para segmentação"""
     field: str  # e.g., 'metrics.total_revenue'
     operator: str  # 'eq', 'gt', 'lt', 'gte', 'lte', 'in', 'contains'
     value: Any
+    
+    def compile(self) -> Callable[['CustomerProfile'], bool]:
+        """Compila a condição em um predicado (path e operador resolvidos uma vez)"""
+        getter = _compile_getter(self.field)
+        op = _SCALAR_OPERATORS.get(self.operator)
+        target = self.value
+        
+        if op is None:
+            return lambda profile: False
+        
+        def predicate(profile) -> bool:
+            value = getter(profile)
+            return value is not None and op(value, target)
+        
+        return predicate
+    
+    def evaluate_columns(self, store: 'ProfileColumnStore') -> np.ndarray:
+        """Avalia a condição para todas as linhas do store (máscara booleana)"""
+        present = store.present(self.field)
+        op = _SCALAR_OPERATORS.get(self.operator)
+        if op is None:
+            return np.zeros(len(store), dtype=bool)
+        
+        if self.operator in _NUMERIC_OPERATORS and _is_number(self.value):
+            numeric = store.numeric(self.field)
+            if store.all_numeric(self.field):
+                with np.errstate(invalid='ignore'):
+                    return present & _NUMERIC_OPERATORS[self.operator](numeric, self.value)
+        
+        if self.operator == 'in' and isinstance(self.value, (list, tuple, set, frozenset)) \
+                and all(_is_number(v) for v in self.value) and store.all_numeric(self.field):
+            return present & np.isin(store.numeric(self.field), list(self.value))
+        
+        # Strings, listas, dicts: elemento a elemento sobre a coluna de objetos
+        values = store.objects(self.field)
+        target = self.value
+        return np.fromiter(
+            (v is not None and op(v, target) for v in values),
+            dtype=bool,
+            count=len(values)
+        )
 
 
 @dataclass
@@ -190,62 +291,372 @@ class Segment:
     profile_count: int = 0
     last_computed: Optional[datetime] = None
     
-    def evaluate(self, profile: CustomerProfile) -> bool:
+    # Predicado compilado (ver compile())
+    _predicate: Optional[Callable[['CustomerProfile'], bool]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    
+    @property
+    def is_rule_based(self) -> bool:
+        """Static/lookalike têm membros explícitos, não regras"""
+        return self.segment_type in (SegmentType.DYNAMIC, SegmentType.PREDICTIVE)
+    
+    @property
+    def fields(self) -> Set[str]:
+        """Paths lidos pelas condições do segmento"""
+        paths = {c.field for c in self.conditions}
+        for or_group in self.or_conditions:
+            paths.update(c.field for c in or_group)
+        return paths
+    
+    def compile(self) -> Callable[['CustomerProfile'], bool]:
+        """
+        Compila as condições em um único predicado.
+        Chamado na primeira avaliação; chame de novo se alterar as condições.
+        """
+        and_predicates = [c.compile() for c in self.conditions]
+        or_groups = [[c.compile() for c in group] for group in self.or_conditions]
+        
+        def predicate(profile) -> bool:
+            for check in and_predicates:
+                if not check(profile):
+                    return False
+            if or_groups:
+                return any(all(check(profile) for check in group) for group in or_groups)
+            return True
+        
+        self._predicate = predicate
+        return predicate
+    
+    def evaluate(self, profile: 'CustomerProfile') -> bool:
         """Avalia se profile pertence ao segmento"""
+        predicate = self._predicate or self.compile()
+        return predicate(profile)
+    
+    def evaluate_columns(self, store: 'ProfileColumnStore') -> np.ndarray:
+        """Avalia o segmento para todos os profiles do store de uma vez"""
+        mask = np.ones(len(store), dtype=bool)
+        for cond in self.conditions:
+            mask &= cond.evaluate_columns(store)
         
-        def get_nested_value(obj, path: str):
-            """Obtém valor de path nested (e.g., 'metrics.total_revenue')"""
-            parts = path.split('.')
-            current = obj
-            
-            for part in parts:
-                if hasattr(current, part):
-                    current = getattr(current, part)
-                elif isinstance(current, dict):
-                    current = current.get(part)
-                else:
-                    return None
-            
-            return current
-        
-        def check_condition(cond: SegmentCondition) -> bool:
-            value = get_nested_value(profile, cond.field)
-            
-            if value is None:
-                return False
-            
-            if cond.operator == 'eq':
-                return value == cond.value
-            elif cond.operator == 'neq':
-                return value != cond.value
-            elif cond.operator == 'gt':
-                return value > cond.value
-            elif cond.operator == 'gte':
-                return value >= cond.value
-            elif cond.operator == 'lt':
-                return value < cond.value
-            elif cond.operator == 'lte':
-                return value <= cond.value
-            elif cond.operator == 'in':
-                return value in cond.value
-            elif cond.operator == 'contains':
-                return cond.value in value
-            
-            return False
-        
-        # Check AND conditions
-        if self.conditions:
-            if not all(check_condition(c) for c in self.conditions):
-                return False
-        
-        # Check OR groups
         if self.or_conditions:
+            any_group = np.zeros(len(store), dtype=bool)
             for or_group in self.or_conditions:
-                if all(check_condition(c) for c in or_group):
-                    return True
-            return False
+                group_mask = mask.copy()
+                for cond in or_group:
+                    group_mask &= cond.evaluate_columns(store)
+                any_group |= group_mask
+            mask = any_group
         
+        return mask & store.alive
+
+
+@dataclass
+class SegmentMembershipEvent:
+    """Entrada/saída de um profile em um segmento"""
+    segment_id: str
+    profile_id: str
+    event_type: str  # 'enter', 'exit'
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+def _path_prefixes(path: str) -> List[str]:
+    """'a.b.c' -> ['a', 'a.b', 'a.b.c']"""
+    parts = path.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+# =============================================================================
+# COLUMNAR PROFILE STORE
+# =============================================================================
+
+class ProfileColumnStore:
+    """
+    Atributos de profiles em colunas NumPy, uma linha por profile.
+    
+    Cada path registrado (e.g., 'metrics.total_revenue') tem uma coluna
+    float64 (NaN quando não numérico), uma coluna de objetos com o valor
+    original e uma máscara de presença. As linhas são mantidas em sincronia
+    pelo CDPEngine a cada alteração de profile.
+    
+    generation muda sempre que linhas existentes deixam de valer (load
+    renumera, remove descarta); estruturas indexadas por linha (e.g.
+    LookalikeIndex) comparam a generation para saber se estão obsoletas.
+    """
+    
+    def __init__(self, initial_capacity: int = 1024):
+        self.profile_ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.generation = 0
+        self._capacity = initial_capacity
+        self._alive = np.zeros(initial_capacity, dtype=bool)
+        self._getters: Dict[str, Callable[[Any], Any]] = {}
+        self._numeric: Dict[str, np.ndarray] = {}
+        self._objects: Dict[str, np.ndarray] = {}
+        self._present: Dict[str, np.ndarray] = {}
+        self._non_numeric: Dict[str, int] = {}  # linhas vivas com valor não numérico
+    
+    def __len__(self) -> int:
+        return len(self.profile_ids)
+    
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[:len(self)]
+    
+    @property
+    def paths(self) -> List[str]:
+        return list(self._getters)
+    
+    def _grow(self, needed: int):
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity * 2)
+        
+        def resized(arr: np.ndarray, fill) -> np.ndarray:
+            out = np.full(capacity, fill, dtype=arr.dtype)
+            out[:len(arr)] = arr
+            return out
+        
+        self._alive = resized(self._alive, False)
+        for path in self._getters:
+            self._numeric[path] = resized(self._numeric[path], np.nan)
+            self._objects[path] = resized(self._objects[path], None)
+            self._present[path] = resized(self._present[path], False)
+        self._capacity = capacity
+    
+    def register(self, path: str) -> bool:
+        """Adiciona coluna para um path. Retorna False se já existia."""
+        if path in self._getters:
+            return False
+        self._getters[path] = _compile_getter(path)
+        self._numeric[path] = np.full(self._capacity, np.nan)
+        self._objects[path] = np.full(self._capacity, None, dtype=object)
+        self._present[path] = np.zeros(self._capacity, dtype=bool)
+        self._non_numeric[path] = 0
         return True
+    
+    def load(self, profiles: List['CustomerProfile']):
+        """Reconstrói todas as linhas a partir dos objetos (uma passada por path)"""
+        n = len(profiles)
+        self.generation += 1
+        self.profile_ids = [p.profile_id for p in profiles]
+        self.rows = {pid: row for row, pid in enumerate(self.profile_ids)}
+        self._capacity = max(self._capacity, n)
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._alive[:n] = True
+        
+        for path, getter in self._getters.items():
+            values = _bulk_get(path, getter, profiles)
+            objects = np.full(self._capacity, None, dtype=object)
+            objects[:n] = values
+            live = objects[:n]
+            present = np.zeros(self._capacity, dtype=bool)
+            present[:n] = np.fromiter(map(is_not, values, repeat(None)), dtype=bool, count=n)
+            is_number = np.fromiter(
+                map(_NUMBER_TYPES.__contains__, map(type, values)), dtype=bool, count=n
+            )
+            numeric = np.full(self._capacity, np.nan)
+            numeric[:n][is_number] = live[is_number].astype(np.float64)
+            
+            self._objects[path] = objects
+            self._present[path] = present
+            self._numeric[path] = numeric
+            self._non_numeric[path] = int(np.count_nonzero(present[:n] & ~is_number))
+    
+    def refresh_columns(self, profiles: List['CustomerProfile'], paths: List[str]):
+        """Relê alguns paths para profiles que já têm linha (sem realocar linhas)"""
+        profiles = [p for p in profiles if p.profile_id in self.rows]
+        rows = np.fromiter((self.rows[p.profile_id] for p in profiles), dtype=np.int64, count=len(profiles))
+        
+        def non_numeric(values) -> int:
+            return sum(map(is_not, values, repeat(None))) - sum(
+                map(_NUMBER_TYPES.__contains__, map(type, values))
+            )
+        
+        for path in paths:
+            values = _bulk_get(path, self._getters[path], profiles)
+            objects = np.empty(len(values), dtype=object)
+            objects[:] = values
+            present = np.fromiter(map(is_not, values, repeat(None)), dtype=bool, count=len(values))
+            is_number = np.fromiter(
+                map(_NUMBER_TYPES.__contains__, map(type, values)), dtype=bool, count=len(values)
+            )
+            numeric = np.full(len(values), np.nan)
+            numeric[is_number] = objects[is_number].astype(np.float64)
+            
+            self._non_numeric[path] += (
+                int(np.count_nonzero(present & ~is_number)) - non_numeric(self._objects[path][rows].tolist())
+            )
+            self._objects[path][rows] = objects
+            self._present[path][rows] = present
+            self._numeric[path][rows] = numeric
+    
+    def row_for(self, profile_id: str) -> int:
+        """Linha do profile (alocada se ainda não existir)"""
+        row = self.rows.get(profile_id)
+        if row is None:
+            row = len(self.profile_ids)
+            self._grow(row + 1)
+            self.profile_ids.append(profile_id)
+            self.rows[profile_id] = row
+        return row
+    
+    def _set(self, path: str, row: int, value: Any):
+        previous = self._objects[path][row]
+        if previous is not None and not _is_number(previous):
+            self._non_numeric[path] -= 1
+        
+        self._objects[path][row] = value
+        self._present[path][row] = value is not None
+        if value is None:
+            self._numeric[path][row] = np.nan
+        elif _is_number(value):
+            self._numeric[path][row] = value
+        else:
+            self._numeric[path][row] = np.nan
+            self._non_numeric[path] += 1
+    
+    def write(self, profile: 'CustomerProfile', paths: Optional[List[str]] = None) -> int:
+        """Grava os valores do profile (todos os paths ou só os indicados)"""
+        row = self.row_for(profile.profile_id)
+        for path in (paths if paths is not None else self._getters):
+            self._set(path, row, self._getters[path](profile))
+        self._alive[row] = True
+        return row
+    
+    def remove(self, profile_id: str):
+        """Marca a linha do profile como removida"""
+        row = self.rows.pop(profile_id, None)
+        if row is None:
+            return
+        self.generation += 1
+        for path in self._getters:
+            self._set(path, row, None)
+        self._alive[row] = False
+        self.profile_ids[row] = None
+    
+    def numeric(self, path: str) -> np.ndarray:
+        return self._numeric[path][:len(self)]
+    
+    def objects(self, path: str) -> np.ndarray:
+        return self._objects[path][:len(self)]
+    
+    def present(self, path: str) -> np.ndarray:
+        return self._present[path][:len(self)]
+    
+    def all_numeric(self, path: str) -> bool:
+        """True se nenhuma linha tem valor não numérico no path"""
+        return self._non_numeric[path] == 0
+
+
+class SegmentBitsets:
+    """Membros de segmento como bitsets (np.packbits) indexados pelas linhas do store"""
+    
+    def __init__(self, store: ProfileColumnStore):
+        self.store = store
+        self._bits: Dict[str, np.ndarray] = {}
+    
+    def _bitset(self, segment_id: str) -> np.ndarray:
+        needed = (self.store._capacity + 7) // 8
+        bits = self._bits.get(segment_id)
+        if bits is None:
+            bits = self._bits[segment_id] = np.zeros(needed, dtype=np.uint8)
+        elif len(bits) < needed:
+            grown = np.zeros(needed, dtype=np.uint8)
+            grown[:len(bits)] = bits
+            bits = self._bits[segment_id] = grown
+        return bits
+    
+    def assign(self, segment_id: str, mask: np.ndarray):
+        """Substitui todos os membros a partir de uma máscara por linha"""
+        bits = np.zeros((self.store._capacity + 7) // 8, dtype=np.uint8)
+        packed = np.packbits(mask)
+        bits[:len(packed)] = packed
+        self._bits[segment_id] = bits
+    
+    def set(self, segment_id: str, row: int, member: bool):
+        bits = self._bitset(segment_id)
+        if member:
+            bits[row >> 3] |= np.uint8(0x80 >> (row & 7))
+        else:
+            bits[row >> 3] &= np.uint8(~(0x80 >> (row & 7)) & 0xFF)
+    
+    def mask(self, segment_id: str) -> np.ndarray:
+        bits = self._bits.get(segment_id)
+        if bits is None:
+            return np.zeros(len(self.store), dtype=bool)
+        return np.unpackbits(bits, count=len(self.store)).astype(bool)
+    
+    def members(self, segment_id: str) -> List[str]:
+        ids = self.store.profile_ids
+        return [ids[row] for row in np.flatnonzero(self.mask(segment_id)).tolist() if ids[row] is not None]
+    
+    def discard_row(self, row: int):
+        for segment_id in self._bits:
+            self.set(segment_id, row, False)
+    
+    def drop(self, segment_id: str):
+        self._bits.pop(segment_id, None)
+
+
+# =============================================================================
+# IDENTITY RESOLUTION
+# =============================================================================
+
+class IdentityIndex:
+    """
+    Índices invertidos de identidade (email, phone, device) -> profile_id,
+    com union-find para profiles que foram mergeados.
+    
+    Os índices guardam o profile_id do momento em que o identificador foi
+    visto; find() resolve para o profile sobrevivente após merges.
+    """
+    
+    KINDS = ('email', 'phone', 'device')
+    
+    def __init__(self):
+        self._indexes: Dict[str, Dict[str, str]] = {kind: {} for kind in self.KINDS}
+        self._parent: Dict[str, str] = {}
+    
+    def find(self, profile_id: str) -> str:
+        """Profile canônico (com path compression)"""
+        root = profile_id
+        while root in self._parent:
+            root = self._parent[root]
+        
+        while profile_id != root:
+            next_id = self._parent[profile_id]
+            self._parent[profile_id] = root
+            profile_id = next_id
+        
+        return root
+    
+    def union(self, survivor_id: str, merged_id: str):
+        """Aponta merged_id (e tudo que já apontava para ele) para survivor_id"""
+        survivor_id, merged_id = self.find(survivor_id), self.find(merged_id)
+        if survivor_id != merged_id:
+            self._parent[merged_id] = survivor_id
+    
+    def lookup(self, kind: str, value: Optional[str]) -> Optional[str]:
+        """Profile canônico que possui o identificador, se houver"""
+        if not value:
+            return None
+        profile_id = self._indexes[kind].get(value)
+        return self.find(profile_id) if profile_id is not None else None
+    
+    def add(self, kind: str, value: Optional[str], profile_id: str):
+        if value:
+            self._indexes[kind].setdefault(value, profile_id)
+    
+    def index_profile(self, profile: 'CustomerProfile'):
+        """Indexa todos os identificadores de um profile"""
+        identity = profile.identity
+        for value in identity.email_hashes:
+            self.add('email', value, profile.profile_id)
+        for value in identity.phone_hashes:
+            self.add('phone', value, profile.profile_id)
+        for value in identity.device_ids:
+            self.add('device', value, profile.profile_id)
 
 
 # =============================================================================
@@ -263,6 +674,19 @@ class CDPEngine:
         self.segments: Dict[str, Segment] = {}
         self.segment_members: Dict[str, Set[str]] = defaultdict(set)
         self.storage = storage
+        self.identity_index = IdentityIndex()
+        
+        # Colunas dos campos usados por segmentos + bitsets de membros
+        self.profile_store = ProfileColumnStore()
+        self.segment_bitsets = SegmentBitsets(self.profile_store)
+        
+        # Dependências: prefixo de path -> segmentos que leem o path
+        self._segments_by_prefix: Dict[str, Set[str]] = defaultdict(set)
+        self._segments_by_field: Dict[str, Set[str]] = defaultdict(set)
+        
+        # Stream de entradas/saídas de segmento
+        self.membership_events: deque = deque(maxlen=int(os.getenv('CDP_MEMBERSHIP_EVENTS_MAX', '100000')))
+        self._membership_listeners: List[Callable[[List[SegmentMembershipEvent]], None]] = []
         
         self._setup_default_segments()
     
@@ -327,6 +751,10 @@ class CDPEngine:
     # PROFILE MANAGEMENT
     # =========================================================================
     
+    def get_profile(self, profile_id: str) -> Optional[CustomerProfile]:
+        """Obtém profile por id (inclusive ids de profiles já mergeados)"""
+        return self.profiles.get(self.identity_index.find(profile_id))
+    
     def get_or_create_profile(
         self,
         ssi_id: str,
@@ -334,38 +762,169 @@ class CDPEngine:
         phone_hash: str = None
     ) -> CustomerProfile:
         """Obtém ou cria profile"""
+        index = self.identity_index
+        
+        # Profile by ssi_id (own id, or an ssi_id already linked as device)
+        by_id = self.get_profile(ssi_id)
+        if by_id is None:
+            linked = index.lookup('device', ssi_id)
+            by_id = self.profiles.get(linked) if linked else None
+        
+        matches = [by_id] if by_id is not None else []
+        for kind, value in (('email', email_hash), ('phone', phone_hash)):
+            profile_id = index.lookup(kind, value)
+            if profile_id is not None and profile_id in self.profiles:
+                matches.append(self.profiles[profile_id])
+        
+        if not matches:
+            # Create new profile
+            profile = CustomerProfile(
+                profile_id=ssi_id,
+                status=ProfileStatus.PROSPECT,
+                identity=CustomerIdentity(ssi_id=ssi_id),
+                attributes=CustomerAttributes(first_seen=datetime.now()),
+                metrics=CustomerMetrics()
+            )
+            
+            if email_hash:
+                profile.identity.email_hashes.append(email_hash)
+            if phone_hash:
+                profile.identity.phone_hashes.append(phone_hash)
+            
+            self.profiles[ssi_id] = profile
+            index.index_profile(profile)
+            
+            return profile
         
-        # Try to find by ssi_id
-        if ssi_id in self.profiles:
-            return self.profiles[ssi_id]
-        
-        # Try to find by email
-        if email_hash:
-            for profile in self.profiles.values():
-                if email_hash in profile.identity.email_hashes:
-                    # Merge ssi_id
-                    if ssi_id not in profile.identity.device_ids:
-                        profile.identity.device_ids.append(ssi_id)
-                    return profile
-        
-        # Create new profile
-        profile = CustomerProfile(
-            profile_id=ssi_id,
-            status=ProfileStatus.PROSPECT,
-            identity=CustomerIdentity(ssi_id=ssi_id),
-            attributes=CustomerAttributes(first_seen=datetime.now()),
-            metrics=CustomerMetrics()
-        )
+        # One event linking several profiles merges them
+        profile = matches[0]
+        for other in matches[1:]:
+            profile = self.merge_profiles(profile, other)
+        
+        # Link the identifiers seen in this event
+        self._link_identifier(profile, 'device', ssi_id)
+        self._link_identifier(profile, 'email', email_hash)
+        self._link_identifier(profile, 'phone', phone_hash)
         
-        if email_hash:
-            profile.identity.email_hashes.append(email_hash)
-        if phone_hash:
-            profile.identity.phone_hashes.append(phone_hash)
+        return profile
+    
+    def _link_identifier(
+        self,
+        profile: CustomerProfile,
+        kind: str,
+        value: Optional[str]
+    ) -> CustomerProfile:
+        """
+        Adiciona identificador ao profile e ao índice.
+        Se pertencer a outro profile, os dois são mergeados.
+        """
+        if not value:
+            return profile
         
-        self.profiles[ssi_id] = profile
+        owner_id = self.identity_index.lookup(kind, value)
+        if owner_id is not None and owner_id != profile.profile_id and owner_id in self.profiles:
+            profile = self.merge_profiles(profile, self.profiles[owner_id])
+        
+        identity = profile.identity
+        values = {
+            'email': identity.email_hashes,
+            'phone': identity.phone_hashes,
+            'device': identity.device_ids,
+        }[kind]
+        
+        # The profile's own ssi_id is not repeated as a device id
+        if value not in values and not (kind == 'device' and value == profile.profile_id):
+            values.append(value)
+        self.identity_index.add(kind, value, profile.profile_id)
         
         return profile
     
+    def merge_profiles(
+        self,
+        profile: CustomerProfile,
+        other: CustomerProfile
+    ) -> CustomerProfile:
+        """
+        Merge de dois profiles. Sobrevive o mais antigo; o outro é removido
+        e seu id passa a resolver para o sobrevivente (union-find).
+        """
+        if profile.profile_id == other.profile_id:
+            return profile
+        
+        survivor, merged = (profile, other) if profile.created_at <= other.created_at else (other, profile)
+        
+        # Identity
+        ident, other_ident = survivor.identity, merged.identity
+        for values, other_values in (
+            (ident.email_hashes, other_ident.email_hashes),
+            (ident.phone_hashes, other_ident.phone_hashes),
+            (ident.device_ids, [merged.profile_id] + other_ident.device_ids),
+            (ident.browser_ids, other_ident.browser_ids),
+        ):
+            for value in other_values:
+                if value not in values:
+                    values.append(value)
+        for attr in ('ramp_id', 'fingerprint_id', 'meta_external_id', 'google_client_id'):
+            if getattr(ident, attr) is None:
+                setattr(ident, attr, getattr(other_ident, attr))
+        
+        # Attributes
+        attrs, other_attrs = survivor.attributes, merged.attributes
+        for attr in ('country', 'region', 'city', 'language', 'primary_device',
+                     'acquisition_source', 'acquisition_medium', 'acquisition_campaign'):
+            if getattr(attrs, attr) is None:
+                setattr(attrs, attr, getattr(other_attrs, attr))
+        for device in other_attrs.devices_used:
+            if device not in attrs.devices_used:
+                attrs.devices_used.append(device)
+        seen = [d for d in (attrs.first_seen, other_attrs.first_seen) if d]
+        attrs.first_seen = min(seen) if seen else None
+        seen = [d for d in (attrs.last_seen, other_attrs.last_seen) if d]
+        attrs.last_seen = max(seen) if seen else None
+        attrs.total_sessions += other_attrs.total_sessions
+        attrs.total_pageviews += other_attrs.total_pageviews
+        
+        # Metrics
+        metrics, other_metrics = survivor.metrics, merged.metrics
+        metrics.total_orders += other_metrics.total_orders
+        metrics.total_revenue += other_metrics.total_revenue
+        if metrics.total_orders:
+            metrics.avg_order_value = metrics.total_revenue / metrics.total_orders
+        orders = [d for d in (metrics.last_order_date, other_metrics.last_order_date) if d]
+        metrics.last_order_date = max(orders) if orders else None
+        metrics.recency_days = min(metrics.recency_days, other_metrics.recency_days)
+        
+        for tag in merged.tags:
+            if tag not in survivor.tags:
+                survivor.tags.append(tag)
+        for key, value in merged.custom_properties.items():
+            survivor.custom_properties.setdefault(key, value)
+        
+        if metrics.total_orders > 0:
+            survivor.status = ProfileStatus.ACTIVE
+            self._calculate_rfm(survivor)
+        survivor.updated_at = datetime.now()
+        
+        # Re-point ids and indexes
+        del self.profiles[merged.profile_id]
+        merged_row = self.profile_store.rows.get(merged.profile_id)
+        if merged_row is not None:
+            self.segment_bitsets.discard_row(merged_row)
+            self.profile_store.remove(merged.profile_id)
+        self.identity_index.union(survivor.profile_id, merged.profile_id)
+        self.identity_index.index_profile(survivor)
+        exits = []
+        for segment_id, members in self.segment_members.items():
+            if merged.profile_id in members:
+                members.discard(merged.profile_id)
+                exits.append(SegmentMembershipEvent(segment_id, merged.profile_id, 'exit'))
+        self._emit_membership(exits)
+        self._evaluate_segments_for_profile(survivor)
+        
+        logger.info(f"Merged profile {merged.profile_id} into {survivor.profile_id}")
+        
+        return survivor
+    
     def update_profile(
         self,
         profile_id: str,
@@ -373,33 +932,42 @@ class CDPEngine:
     ) -> CustomerProfile:
         """Atualiza profile com novos dados"""
         
-        profile = self.profiles.get(profile_id)
+        profile = self.get_profile(profile_id)
         if not profile:
             raise ValueError(f"Profile {profile_id} not found")
         
-        # Update identity
+        # Fields touched by this update (drives incremental segment evaluation)
+        changed = {
+            'attributes.last_seen', 'attributes.total_sessions',
+            'metrics.recency_days', 'status', 'updated_at',
+        }
+        
+        # Update identity (merges if the identifier belongs to another profile)
         if 'email_hash' in updates:
-            if updates['email_hash'] not in profile.identity.email_hashes:
-                profile.identity.email_hashes.append(updates['email_hash'])
+            profile = self._link_identifier(profile, 'email', updates['email_hash'])
+            changed.add('identity.email_hashes')
         
         if 'phone_hash' in updates:
-            if updates['phone_hash'] not in profile.identity.phone_hashes:
-                profile.identity.phone_hashes.append(updates['phone_hash'])
+            profile = self._link_identifier(profile, 'phone', updates['phone_hash'])
+            changed.add('identity.phone_hashes')
         
         if 'device_id' in updates:
-            if updates['device_id'] not in profile.identity.device_ids:
-                profile.identity.device_ids.append(updates['device_id'])
+            profile = self._link_identifier(profile, 'device', updates['device_id'])
+            changed.add('identity.device_ids')
         
         # Update attributes
         attrs = profile.attributes
         if 'country' in updates:
             attrs.country = updates['country']
+            changed.add('attributes.country')
         if 'city' in updates:
             attrs.city = updates['city']
+            changed.add('attributes.city')
         if 'device_type' in updates:
             attrs.primary_device = updates['device_type']
             if updates['device_type'] not in attrs.devices_used:
                 attrs.devices_used.append(updates['device_type'])
+            changed.update(('attributes.primary_device', 'attributes.devices_used'))
         
         attrs.last_seen = datetime.now()
         attrs.total_sessions += 1
@@ -409,9 +977,11 @@ class CDPEngine:
         if 'trust_score' in updates:
             # Exponential moving average
             metrics.trust_score = metrics.trust_score * 0.9 + updates['trust_score'] * 0.1
+            changed.add('metrics.trust_score')
         
         if 'scroll_depth' in updates:
             attrs.avg_scroll_depth = attrs.avg_scroll_depth * 0.9 + updates['scroll_depth'] * 0.1
+            changed.add('attributes.avg_scroll_depth')
         
         # Update recency
         if attrs.last_seen:
@@ -425,8 +995,8 @@ class CDPEngine:
         
         profile.updated_at = datetime.now()
         
-        # Re-evaluate segments
-        self._evaluate_segments_for_profile(profile)
+        # Re-evaluate segments that read the changed fields
+        self._evaluate_segments_for_profile(profile, changed)
         
         return profile
     
@@ -438,7 +1008,7 @@ class CDPEngine:
     ) -> CustomerProfile:
         """Registra uma compra"""
         
-        profile = self.profiles.get(profile_id)
+        profile = self.get_profile(profile_id)
         if not profile:
             raise ValueError(f"Profile {profile_id} not found")
         
@@ -455,8 +1025,12 @@ class CDPEngine:
         # Re-calculate RFM
         self._calculate_rfm(profile)
         
-        # Re-evaluate segments
-        self._evaluate_segments_for_profile(profile)
+        # Re-evaluate segments that read the changed fields
+        self._evaluate_segments_for_profile(profile, {
+            'metrics.total_orders', 'metrics.total_revenue', 'metrics.avg_order_value',
+            'metrics.last_order_date', 'metrics.recency_days', 'metrics.frequency_score',
+            'metrics.monetary_score', 'metrics.rfm_segment', 'status', 'updated_at',
+        })
         
         return profile
     
@@ -525,39 +1099,222 @@ class CDPEngine:
     
     def create_segment(self, segment: Segment):
         """Cria ou atualiza segmento"""
+        if segment.id in self.segments:
+            self._unregister_dependencies(self.segments[segment.id])
+        
+        segment.compile()
         self.segments[segment.id] = segment
         self.segment_members[segment.id] = set()
+        self.segment_bitsets.drop(segment.id)
+        
+        for path in segment.fields:
+            self._segments_by_field[path].add(segment.id)
+            for prefix in _path_prefixes(path):
+                self._segments_by_prefix[prefix].add(segment.id)
+        
+        self.register_profile_fields(segment.fields)
+    
+    def register_profile_fields(self, paths):
+        """
+        Garante colunas no profile store para os paths (segmentos, features
+        de lookalike). Colunas novas são preenchidas a partir dos profiles
+        existentes e depois mantidas por update_profile/record_purchase.
+        """
+        new_paths = [path for path in sorted(paths) if self.profile_store.register(path)]
+        if new_paths:
+            self.profile_store.refresh_columns(
+                [self.profiles[pid] for pid in self.profile_store.rows if pid in self.profiles],
+                new_paths
+            )
+    
+    def sync_profile_store(self, paths: Optional[List[str]] = None):
+        """
+        Inclui no store profiles ainda sem linha; com paths, relê essas
+        colunas para todos (profiles alterados fora do engine).
+        """
+        store = self.profile_store
+        for profile in self.profiles.values():
+            if profile.profile_id not in store.rows:
+                store.write(profile)
+        if paths:
+            store.refresh_columns(list(self.profiles.values()), list(paths))
+    
+    def _unregister_dependencies(self, segment: Segment):
+        for index in (self._segments_by_field, self._segments_by_prefix):
+            for segment_ids in index.values():
+                segment_ids.discard(segment.id)
+    
+    def segments_reading(self, changed_fields: Set[str]) -> Set[str]:
+        """
+        Segmentos cujas condições leem algum dos campos alterados.
+        'metrics' alterado afeta 'metrics.x'; 'metrics.x' alterado afeta
+        segmentos que leem 'metrics' inteiro.
+        """
+        affected: Set[str] = set()
+        for changed in changed_fields:
+            affected |= self._segments_by_prefix.get(changed, set())
+            for prefix in _path_prefixes(changed)[:-1]:
+                affected |= self._segments_by_field.get(prefix, set())
+        return affected
     
-    def _evaluate_segments_for_profile(self, profile: CustomerProfile):
-        """Avalia todos os segmentos para um profile"""
-        profile.segments = []
+    # =========================================================================
+    # MEMBERSHIP EVENTS
+    # =========================================================================
+    
+    def subscribe_membership(self, callback: Callable[[List[SegmentMembershipEvent]], None]):
+        """Registra callback chamado com cada lote de entradas/saídas de segmento"""
+        self._membership_listeners.append(callback)
+    
+    def drain_membership_events(self, max_events: int = None) -> List[SegmentMembershipEvent]:
+        """Consome eventos pendentes do stream (ex.: audience sync)"""
+        count = len(self.membership_events) if max_events is None else min(max_events, len(self.membership_events))
+        return [self.membership_events.popleft() for _ in range(count)]
+    
+    def _emit_membership(self, events: List[SegmentMembershipEvent]):
+        if not events:
+            return
+        self.membership_events.extend(events)
+        for callback in self._membership_listeners:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.error(f"Membership listener failed: {e}")
+    
+    def _emit_membership_diff(self, segment_id: str, before: Set[str], after: Set[str]):
+        now = datetime.now()
+        self._emit_membership(
+            [SegmentMembershipEvent(segment_id, pid, 'enter', now) for pid in after - before]
+            + [SegmentMembershipEvent(segment_id, pid, 'exit', now) for pid in before - after]
+        )
+    
+    def set_segment_members(self, segment_id: str, profile_ids: List[str]):
+        """Define membros explícitos (segmentos static/lookalike)"""
+        for pid in self.segment_members.get(segment_id, set()):
+            profile = self.profiles.get(pid)
+            if profile is not None and segment_id in profile.segments:
+                profile.segments.remove(segment_id)
+        
+        members = {pid for pid in profile_ids if pid in self.profiles}
+        previous = self.segment_members.get(segment_id, set())
+        self.segment_members[segment_id] = members
+        self._emit_membership_diff(segment_id, previous, members)
+        
+        rows = []
+        for pid in members:
+            row = self.profile_store.rows.get(pid)
+            rows.append(row if row is not None else self.profile_store.write(self.profiles[pid]))
+            if segment_id not in self.profiles[pid].segments:
+                self.profiles[pid].segments.append(segment_id)
+        
+        mask = np.zeros(len(self.profile_store), dtype=bool)
+        mask[rows] = True
+        self.segment_bitsets.assign(segment_id, mask)
+    
+    def _evaluate_segments_for_profile(
+        self,
+        profile: CustomerProfile,
+        changed_fields: Optional[Set[str]] = None
+    ):
+        """
+        Avalia segmentos para um profile.
+        
+        Com changed_fields, só são reavaliados os segmentos que leem algum
+        dos campos alterados; sem ele (ou profile ainda fora do store),
+        todos os segmentos rule-based são avaliados.
+        """
+        store = self.profile_store
         
-        for segment_id, segment in self.segments.items():
-            if segment.evaluate(profile):
-                profile.segments.append(segment_id)
+        if changed_fields is None or profile.profile_id not in store.rows:
+            row = store.write(profile)
+            segment_ids = [sid for sid, segment in self.segments.items() if segment.is_rule_based]
+        else:
+            affected = self.segments_reading(changed_fields)
+            paths = [
+                path for path in store.paths
+                if any(
+                    path == changed or path.startswith(changed + '.') or changed.startswith(path + '.')
+                    for changed in changed_fields
+                )
+            ]
+            row = store.write(profile, paths)
+            segment_ids = [sid for sid in affected if self.segments[sid].is_rule_based]
+        
+        if not segment_ids:
+            return
+        
+        now = datetime.now()
+        current = set(profile.segments)
+        events = []
+        for segment_id in segment_ids:
+            member = self.segments[segment_id].evaluate(profile)
+            was_member = segment_id in current
+            if member and not was_member:
+                current.add(segment_id)
                 self.segment_members[segment_id].add(profile.profile_id)
-            else:
+                events.append(SegmentMembershipEvent(segment_id, profile.profile_id, 'enter', now))
+            elif was_member and not member:
+                current.discard(segment_id)
                 self.segment_members[segment_id].discard(profile.profile_id)
-    
-    def compute_all_segments(self):
-        """Recomputa todos os segmentos para todos os profiles"""
-        logger.info("Computing all segments...")
+                events.append(SegmentMembershipEvent(segment_id, profile.profile_id, 'exit', now))
+            self.segment_bitsets.set(segment_id, row, member)
         
-        for segment_id in self.segments:
-            self.segment_members[segment_id] = set()
+        # Drops stale ids (deleted segments) and keeps definition order
+        profile.segments = [segment_id for segment_id in self.segments if segment_id in current]
+        self._emit_membership(events)
+    
+    def compute_all_segments(self, refresh: bool = True):
+        """
+        Recomputa todos os segmentos para todos os profiles.
         
-        for profile in self.profiles.values():
-            self._evaluate_segments_for_profile(profile)
+        Avaliação colunar: cada condição vira uma operação NumPy sobre a
+        coluna do campo, e o resultado de cada segmento é um bitset.
+        refresh=True relê os campos dos objetos (necessário se profiles foram
+        alterados fora do engine); com refresh=False usa as colunas mantidas
+        incrementalmente por update_profile/record_purchase.
+        """
+        logger.info("Computing all segments...")
+        store = self.profile_store
         
-        for segment_id, segment in self.segments.items():
+        if refresh:
+            store.load(list(self.profiles.values()))
+        else:
+            self.sync_profile_store()
+        
+        ids = np.array(store.profile_ids, dtype=object)
+        segment_ids = list(self.segments)
+        membership = np.zeros((len(store), len(segment_ids)), dtype=bool)
+        
+        for col, (segment_id, segment) in enumerate(self.segments.items()):
+            if segment.is_rule_based:
+                mask = segment.evaluate_columns(store)
+                self.segment_bitsets.assign(segment_id, mask)
+                previous = self.segment_members[segment_id]
+                self.segment_members[segment_id] = set(ids[mask].tolist())
+                self._emit_membership_diff(segment_id, previous, self.segment_members[segment_id])
+            else:
+                # Explicit members; rows may have moved after a refresh
+                self.set_segment_members(segment_id, list(self.segment_members[segment_id]))
+                mask = self.segment_bitsets.mask(segment_id)
+            
+            membership[:, col] = mask
             segment.profile_count = len(self.segment_members[segment_id])
             segment.last_computed = datetime.now()
         
+        # profile.segments from the membership matrix, one split per profile
+        alive_rows = np.flatnonzero(store.alive)
+        rows, cols = np.nonzero(membership[alive_rows])
+        names = np.array(segment_ids, dtype=object)[cols].tolist()
+        ends = np.cumsum(np.bincount(rows, minlength=len(alive_rows))).tolist()
+        start = 0
+        for pid, end in zip(ids[alive_rows].tolist(), ends):
+            self.profiles[pid].segments = names[start:end]
+            start = end
+        
         logger.info(f"Computed {len(self.segments)} segments for {len(self.profiles)} profiles")
     
     def get_segment_profiles(self, segment_id: str) -> List[CustomerProfile]:
         """Obtém profiles de um segmento"""
-        profile_ids = self.segment_members.get(segment_id, set())
+        profile_ids = self.segment_bitsets.members(segment_id)
         return [self.profiles[pid] for pid in profile_ids if pid in self.profiles]
     
     # =========================================================================
@@ -660,14 +1417,137 @@ class CDPEngine:
 # LOOKALIKE MODELING
 # =============================================================================
 
+def _kmeans(
+    vectors: np.ndarray,
+    k: int,
+    n_iter: int = 25,
+    random_state: Optional[int] = None
+) -> np.ndarray:
+    """K-means (Lloyd, init k-means++) sobre as linhas; retorna os centroides"""
+    rng = np.random.default_rng(random_state)
+    n = len(vectors)
+    k = max(1, min(k, n))
+    if k == 1:
+        return vectors.mean(axis=0, keepdims=True)
+    
+    sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+    centroids = np.empty((k, vectors.shape[1]), dtype=vectors.dtype)
+    centroids[0] = vectors[rng.integers(n)]
+    closest = np.full(n, np.inf)
+    for i in range(1, k):
+        diff = vectors - centroids[i - 1]
+        closest = np.minimum(closest, np.einsum('ij,ij->i', diff, diff))
+        total = closest.sum()
+        centroids[i] = vectors[rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)]
+    
+    labels = None
+    for _ in range(n_iter):
+        distances = sq_norms[:, None] - 2 * vectors @ centroids.T + np.einsum('ij,ij->i', centroids, centroids)
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    
+    return centroids
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Normaliza linhas (L2); vetores nulos continuam nulos (similaridade 0)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class LookalikeIndex:
+    """
+    Índice IVF (inverted file) para busca aproximada por similaridade.
+    
+    Os vetores normalizados são agrupados em n_lists clusters (k-means sobre
+    uma amostra); a busca só compara os candidatos dos n_probe clusters mais
+    próximos de cada query. O índice guarda apenas o cluster de cada linha:
+    os vetores são lidos da matriz atual na busca, e linhas novas são
+    atribuídas na hora. Reconstruir periodicamente se a distribuição mudar.
+    
+    generation é a do ProfileColumnStore no build; o LookalikeModeler
+    retreina o índice quando o store renumera ou remove linhas.
+    """
+    
+    def __init__(self, n_lists: int = 256, n_probe: int = 8, train_size: int = 100000,
+                 random_state: Optional[int] = None):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_size = train_size
+        self.random_state = random_state
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.generation: Optional[int] = None
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+    
+    def _assign(self, normalized: np.ndarray, chunk: int = 1 << 16) -> np.ndarray:
+        labels = np.empty(len(normalized), dtype=np.int32)
+        for start in range(0, len(normalized), chunk):
+            block = normalized[start:start + chunk]
+            labels[start:start + chunk] = (block @ self.centroids.T).argmax(axis=1)
+        return labels
+    
+    def build(self, normalized: np.ndarray):
+        """Treina o quantizador e atribui todas as linhas"""
+        rng = np.random.default_rng(self.random_state)
+        sample = normalized
+        if len(normalized) > self.train_size:
+            sample = normalized[rng.choice(len(normalized), self.train_size, replace=False)]
+        self.centroids = _normalize_rows(_kmeans(sample, self.n_lists, random_state=self.random_state))
+        self.assignments = self._assign(normalized)
+    
+    def update(self, normalized: np.ndarray):
+        """Atribui linhas adicionadas desde o build (só as novas, em ordem de linha)"""
+        if len(normalized):
+            self.assignments = np.concatenate([self.assignments, self._assign(normalized)])
+    
+    def candidate_mask(self, queries: np.ndarray) -> np.ndarray:
+        """Linhas nos n_probe clusters mais próximos de qualquer query"""
+        scores = _normalize_rows(queries) @ self.centroids.T
+        n_probe = min(self.n_probe, len(self.centroids))
+        probed = np.unique(np.argpartition(-scores, n_probe - 1, axis=1)[:, :n_probe])
+        selected = np.zeros(len(self.centroids), dtype=bool)
+        selected[probed] = True
+        return selected[self.assignments]
+
+
 class LookalikeModeler:
     """
     Cria audiences similares a um seed segment.
     Usa feature similarity para encontrar prospects parecidos com best customers.
+    
+    As features vêm das colunas do profile store do CDP (mantidas a cada
+    update_profile/record_purchase), então a matriz de features é montada
+    com operações vetoriais e a similaridade é um produto de matrizes.
     """
     
-    def __init__(self, cdp: CDPEngine):
+    FEATURE_PATHS = (
+        'metrics.trust_score',
+        'metrics.recency_days',
+        'metrics.total_orders',
+        'metrics.total_revenue',
+        'metrics.purchase_probability',
+        'attributes.avg_scroll_depth',
+        'attributes.primary_device',
+    )
+    
+    # Pools acima disso usam o índice IVF por padrão
+    ANN_MIN_POOL = 1_000_000
+    
+    def __init__(self, cdp: CDPEngine, index: Optional[LookalikeIndex] = None):
         self.cdp = cdp
+        self.index = index
+        self.cdp.register_profile_fields(self.FEATURE_PATHS)
     
     def _profile_to_vector(self, profile: CustomerProfile) -> np.ndarray:
         """Converte profile para vetor de features"""
@@ -684,12 +1564,46 @@ class LookalikeModeler:
             1 if attrs.primary_device == 'mobile' else 0
         ])
     
+    def feature_matrix(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Matriz (linhas do store x features), mesmas features de _profile_to_vector"""
+        store = self.cdp.profile_store
+        if rows is None:
+            rows = np.arange(len(store))
+        
+        def column(path: str) -> np.ndarray:
+            return np.nan_to_num(store.numeric(path)[rows], nan=0.0)
+        
+        matrix = np.empty((len(rows), len(self.FEATURE_PATHS)), dtype=np.float32)
+        matrix[:, 0] = column('metrics.trust_score')
+        matrix[:, 1] = np.minimum(1, column('metrics.recency_days') / 90)
+        matrix[:, 2] = np.minimum(1, column('metrics.total_orders') / 10)
+        matrix[:, 3] = np.minimum(1, column('metrics.total_revenue') / 1000)
+        matrix[:, 4] = column('metrics.purchase_probability')
+        matrix[:, 5] = column('attributes.avg_scroll_depth') / 100
+        matrix[:, 6] = store.objects('attributes.primary_device')[rows] == 'mobile'
+        return matrix
+    
+    def _train_index(self, index: LookalikeIndex):
+        """Treina o índice sobre as linhas atuais do store"""
+        index.build(_normalize_rows(self.feature_matrix()))
+        index.generation = self.cdp.profile_store.generation
+    
+    def build_index(self, n_lists: int = 256, n_probe: int = 8, refresh: bool = False) -> LookalikeIndex:
+        """Constrói o índice IVF sobre todos os profiles"""
+        self.cdp.sync_profile_store(self.FEATURE_PATHS if refresh else None)
+        self.index = LookalikeIndex(n_lists=n_lists, n_probe=n_probe)
+        self._train_index(self.index)
+        return self.index
+    
     def find_lookalikes(
         self,
         seed_segment_id: str,
         target_segment_id: str = None,
         top_n: int = 1000,
-        similarity_threshold: float = 0.7
+        similarity_threshold: float = 0.7,
+        n_centroids: int = 1,
+        use_index: Optional[bool] = None,
+        refresh: bool = False
     ) -> List[str]:
         """
         Encontra profiles similares ao seed segment.
@@ -698,53 +1612,61 @@ class LookalikeModeler:
         target_segment_id: Pool para buscar (opcional)
         top_n: Número máximo de lookalikes
         similarity_threshold: Similaridade mínima
+        n_centroids: Centroides do seed (k-means); a similaridade de um
+            candidato é a maior entre os centroides
+        use_index: Busca aproximada pelo índice IVF (None = automático
+            para pools grandes)
+        refresh: Relê as features dos objetos (profiles alterados fora do engine)
         """
-        # Get seed profiles
-        seed_profiles = self.cdp.get_segment_profiles(seed_segment_id)
+        cdp = self.cdp
+        store = cdp.profile_store
+        cdp.sync_profile_store(self.FEATURE_PATHS if refresh else None)
         
-        if not seed_profiles:
+        seed_mask = cdp.segment_bitsets.mask(seed_segment_id) & store.alive
+        if not seed_mask.any():
             return []
         
-        # Compute seed centroid
-        seed_vectors = np.array([
-            self._profile_to_vector(p) for p in seed_profiles
-        ])
-        centroid = np.mean(seed_vectors, axis=0)
+        # Seed centroids
+        seed_vectors = self.feature_matrix(np.flatnonzero(seed_mask)).astype(np.float64)
+        # Fixed seed: the same seed segment always yields the same audience
+        centroids = _normalize_rows(_kmeans(seed_vectors, n_centroids, random_state=0)).astype(np.float32)
         
-        # Get candidate pool
+        # Candidate pool
         if target_segment_id:
-            candidates = self.cdp.get_segment_profiles(target_segment_id)
+            pool = cdp.segment_bitsets.mask(target_segment_id) & store.alive
         else:
             # All non-seed profiles
-            seed_ids = set(p.profile_id for p in seed_profiles)
-            candidates = [
-                p for p in self.cdp.profiles.values()
-                if p.profile_id not in seed_ids
-            ]
-        
-        # Calculate similarity scores
-        similarities = []
+            pool = store.alive & ~seed_mask
+        
+        if use_index is None:
+            use_index = self.index is not None or np.count_nonzero(pool) >= self.ANN_MIN_POOL
+        if use_index:
+            if self.index is None:
+                self.index = LookalikeIndex()
+            if not self.index.is_trained or self.index.generation != store.generation:
+                # Linhas renumeradas/removidas desde o build (e.g. compute_all_segments)
+                self._train_index(self.index)
+            self.index.update(_normalize_rows(self.feature_matrix(
+                np.arange(len(self.index.assignments), len(store))
+            )))
+            pool &= self.index.candidate_mask(centroids)
+        
+        candidates = np.flatnonzero(pool)
+        if len(candidates) == 0:
+            return []
         
-        for profile in candidates:
-            vec = self._profile_to_vector(profile)
-            
-            # Cosine similarity
-            norm_centroid = np.linalg.norm(centroid)
-            norm_vec = np.linalg.norm(vec)
-            
-            if norm_centroid > 0 and norm_vec > 0:
-                similarity = np.dot(centroid, vec) / (norm_centroid * norm_vec)
-            else:
-                similarity = 0
-            
-            if similarity >= similarity_threshold:
-                similarities.append((profile.profile_id, similarity))
+        # Cosine similarity for the whole pool (max over centroids)
+        similarity = (_normalize_rows(self.feature_matrix(candidates)) @ centroids.T).max(axis=1)
         
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        keep = np.flatnonzero(similarity >= similarity_threshold)
+        if len(keep) > top_n:
+            # Partial selection, keeping every candidate tied with the cutoff
+            cutoff = np.partition(similarity[keep], len(keep) - top_n)[len(keep) - top_n]
+            keep = keep[similarity[keep] >= cutoff]
+        order = keep[np.argsort(-similarity[keep], kind='stable')][:top_n]
         
-        # Return top N
-        lookalike_ids = [pid for pid, _ in similarities[:top_n]]
+        ids = store.profile_ids
+        lookalike_ids = [ids[row] for row in candidates[order].tolist()]
         
         logger.info(f"Found {len(lookalike_ids)} lookalike profiles (threshold: {similarity_threshold})")
         
@@ -754,11 +1676,12 @@ class LookalikeModeler:
         self,
         seed_segment_id: str,
         lookalike_segment_id: str,
-        top_n: int = 1000
+        top_n: int = 1000,
+        n_centroids: int = 1
     ) -> Segment:
         """Cria segmento de lookalikes"""
         
-        lookalike_ids = self.find_lookalikes(seed_segment_id, top_n=top_n)
+        lookalike_ids = self.find_lookalikes(seed_segment_id, top_n=top_n, n_centroids=n_centroids)
         
         # Create static segment
         segment = Segment(
@@ -769,13 +1692,7 @@ class LookalikeModeler:
         )
         
         self.cdp.segments[lookalike_segment_id] = segment
-        self.cdp.segment_members[lookalike_segment_id] = set(lookalike_ids)
-        
-        # Update profiles
-        for pid in lookalike_ids:
-            if pid in self.cdp.profiles:
-                if lookalike_segment_id not in self.cdp.profiles[pid].segments:
-                    self.cdp.profiles[pid].segments.append(lookalike_segment_id)
+        self.cdp.set_segment_members(lookalike_segment_id, lookalike_ids)
         
         segment.profile_count = len(lookalike_ids)
         segment.last_computed = datetime.now()
@@ -796,6 +1713,11 @@ __all__ = [
     'CustomerProfile',
     'Segment',
     'SegmentCondition',
+    'ProfileColumnStore',
+    'SegmentBitsets',
+    'IdentityIndex',
+    'SegmentMembershipEvent',
+    'LookalikeIndex',
     'CDPEngine',
     'LookalikeModeler'
 ]
@@ -30,6 +30,39 @@ Configuração (env vars):
     - BATCH_SIZE: Tamanho do batch (default: 100)
     - BATCH_TIMEOUT_MS: Timeout do batch em ms (default: 1000)
     - ENABLE_METRICS: Habilitar métricas Prometheus (default: true)
+    - BACKGROUND_FLUSH: Flush em thread de background (default: true, exceto
+      em Cloud Functions, onde a CPU é limitada após a resposta)
+    - MAX_QUEUE_SIZE: Máximo de rows na fila em memória (default: 10000)
+    - FLUSH_WORKERS: Flushes concorrentes para o BigQuery (default: 4)
+    - SPILL_DIR: Diretório dos segmentos de spill (default: /tmp/pubsub_consumer_spill)
+    - SPILL_MAX_BYTES: Tamanho máximo em disco do spill (default: 256MB)
+    - SPILL_REPLAY_INTERVAL_S: Intervalo de replay do spill em segundos (default: 30)
+    - ADAPTIVE_BATCHING: Ajustar batch size/timeout pela latência (default: true)
+    - MIN_BATCH_SIZE / MAX_BATCH_SIZE: Limites do batch adaptativo (default: 10 / 500)
+    - MAX_REQUEST_BYTES: Bytes máximos por insert request (default: 9000000)
+    - TARGET_INSERT_LATENCY_MS: p95 alvo de insert (default: 1000)
+    - MIN_BATCH_TIMEOUT_MS: Timeout mínimo do batch adaptativo (default: 50)
+
+Batching adaptativo:
+    Cada row tem seu tamanho serializado contabilizado; um batch nunca passa
+    de MAX_REQUEST_BYTES (o limite do streaming insert é 10MB por request).
+    O batch size cresce enquanto o p95 dos inserts está abaixo do alvo e
+    cai pela metade quando passa; o timeout acompanha o p95.
+
+Backpressure:
+    Quando a fila em memória está cheia, os endpoints HTTP respondem 429 e
+    handle_pubsub_message levanta QueueFullError; em ambos os casos o Pub/Sub
+    faz NACK/redelivery com backoff. Com flush em background, batches que
+    falham no insert são gravados em segmentos no disco local e
+    reprocessados pelo flusher e no restart.
+
+Flush em background:
+    Só é seguro em deploys long-running (Cloud Run com CPU sempre alocada,
+    container, servidor Flask): a mensagem é confirmada com a row apenas na
+    fila em memória. Em Cloud Functions (FUNCTION_TARGET definido) o default
+    é o modo síncrono: cada mensagem (ou request de /batch) é inserida antes
+    de responder, sem fila nem spill, e uma falha de insert vira NACK. Nesse
+    modo não há batching entre mensagens.
 """
 
 import os
@@ -37,12 +70,15 @@ import json
 import base64
 import logging
 import time
+import uuid
+import atexit
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass, field
 from collections import deque
 import threading
 import functools
+from concurrent.futures import ThreadPoolExecutor
 
 # Google Cloud
 from google.cloud import bigquery
@@ -64,6 +100,11 @@ logger = logging.getLogger('pubsub_consumer')
 # CONFIGURATION
 # =============================================================================
 
+def _default_background_flush() -> str:
+    """Cloud Functions (FUNCTION_TARGET) limita a CPU após a resposta."""
+    return 'false' if os.getenv('FUNCTION_TARGET') else 'true'
+
+
 @dataclass
 class ConsumerConfig:
     """Configuração do consumer."""
@@ -74,6 +115,18 @@ class ConsumerConfig:
     batch_timeout_ms: int = field(default_factory=lambda: int(os.getenv('BATCH_TIMEOUT_MS', '1000')))
     enable_metrics: bool = field(default_factory=lambda: os.getenv('ENABLE_METRICS', 'true').lower() == 'true')
     pushgateway_url: str = field(default_factory=lambda: os.getenv('PUSHGATEWAY_URL', ''))
+    background_flush: bool = field(default_factory=lambda: os.getenv('BACKGROUND_FLUSH', _default_background_flush()).lower() == 'true')
+    max_queue_size: int = field(default_factory=lambda: int(os.getenv('MAX_QUEUE_SIZE', '10000')))
+    flush_workers: int = field(default_factory=lambda: int(os.getenv('FLUSH_WORKERS', '4')))
+    spill_dir: str = field(default_factory=lambda: os.getenv('SPILL_DIR', '/tmp/pubsub_consumer_spill'))
+    spill_max_bytes: int = field(default_factory=lambda: int(os.getenv('SPILL_MAX_BYTES', str(256 * 1024 * 1024))))
+    spill_replay_interval_s: float = field(default_factory=lambda: float(os.getenv('SPILL_REPLAY_INTERVAL_S', '30')))
+    adaptive_batching: bool = field(default_factory=lambda: os.getenv('ADAPTIVE_BATCHING', 'true').lower() == 'true')
+    min_batch_size: int = field(default_factory=lambda: int(os.getenv('MIN_BATCH_SIZE', '10')))
+    max_batch_size: int = field(default_factory=lambda: int(os.getenv('MAX_BATCH_SIZE', '500')))
+    max_request_bytes: int = field(default_factory=lambda: int(os.getenv('MAX_REQUEST_BYTES', '9000000')))
+    target_insert_latency_ms: float = field(default_factory=lambda: float(os.getenv('TARGET_INSERT_LATENCY_MS', '1000')))
+    min_batch_timeout_ms: int = field(default_factory=lambda: int(os.getenv('MIN_BATCH_TIMEOUT_MS', '50')))
 
 
 # Global config
@@ -91,12 +144,19 @@ class ConsumerMetrics:
         self.events_received = 0
         self.events_inserted = 0
         self.events_failed = 0
+        self.events_rejected = 0
+        self.events_spilled = 0
+        self.events_replayed = 0
         self.batches_processed = 0
         self.total_lag_ms = 0
         self.avg_lag_ms = 0.0
         self.avg_batch_size = 0.0
+        self.bytes_inserted = 0
+        self.insert_durations_ms: deque = deque(maxlen=200)
         self.last_process_time: Optional[str] = None
         self.errors: List[str] = []
+        self.queue_depth = 0
+        self._lock = threading.Lock()
         
         # Prometheus metrics (se disponível)
         if PROMETHEUS_AVAILABLE and config.enable_metrics:
@@ -120,6 +180,24 @@ class ConsumerMetrics:
                 registry=self.registry
             )
             
+            self.prom_events_rejected = Counter(
+                'pubsub_consumer_events_rejected_total',
+                'Total events rejected with backpressure (queue full)',
+                registry=self.registry
+            )
+            
+            self.prom_events_spilled = Counter(
+                'pubsub_consumer_events_spilled_total',
+                'Total events written to the local spill',
+                registry=self.registry
+            )
+            
+            self.prom_queue_depth = Gauge(
+                'pubsub_consumer_queue_depth',
+                'Rows waiting in the in-memory queue',
+                registry=self.registry
+            )
+            
             self.prom_lag_seconds = Histogram(
                 'pubsub_consumer_lag_seconds',
                 'Lag between event reception and BigQuery insert',
@@ -134,6 +212,13 @@ class ConsumerMetrics:
                 registry=self.registry
             )
             
+            self.prom_batch_bytes = Histogram(
+                'pubsub_consumer_batch_bytes',
+                'Serialized size of batches inserted into BigQuery',
+                buckets=(1e3, 1e4, 1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7),
+                registry=self.registry
+            )
+            
             self.prom_insert_duration = Histogram(
                 'pubsub_consumer_insert_duration_seconds',
                 'Duration of BigQuery insert operations',
@@ -147,31 +232,70 @@ class ConsumerMetrics:
         if PROMETHEUS_AVAILABLE and config.enable_metrics:
             self.prom_events_received.inc()
     
-    def record_batch_inserted(self, batch_size: int, lag_ms: float, duration_s: float):
-        """Registra batch inserido com sucesso."""
-        self.events_inserted += batch_size
-        self.batches_processed += 1
-        self.total_lag_ms += lag_ms
-        self.avg_lag_ms = self.total_lag_ms / self.events_inserted if self.events_inserted > 0 else 0
-        self.avg_batch_size = self.events_inserted / self.batches_processed if self.batches_processed > 0 else 0
-        self.last_process_time = datetime.now(timezone.utc).isoformat()
+    def record_batch_inserted(self, batch_size: int, lag_ms: float, duration_s: float, batch_bytes: int = 0):
+        """Registra batch inserido com sucesso (lag_ms = lag médio por row)."""
+        with self._lock:
+            self.events_inserted += batch_size
+            self.batches_processed += 1
+            self.bytes_inserted += batch_bytes
+            self.insert_durations_ms.append(duration_s * 1000.0)
+            self.total_lag_ms += lag_ms * batch_size
+            self.avg_lag_ms = self.total_lag_ms / self.events_inserted if self.events_inserted > 0 else 0
+            self.avg_batch_size = self.events_inserted / self.batches_processed if self.batches_processed > 0 else 0
+            self.last_process_time = datetime.now(timezone.utc).isoformat()
         
         if PROMETHEUS_AVAILABLE and config.enable_metrics:
             self.prom_events_inserted.inc(batch_size)
             self.prom_lag_seconds.observe(lag_ms / 1000.0)
             self.prom_batch_size.observe(batch_size)
             self.prom_insert_duration.observe(duration_s)
+            if batch_bytes:
+                self.prom_batch_bytes.observe(batch_bytes)
+    
+    def insert_duration_p95_ms(self) -> Optional[float]:
+        """p95 da duração dos inserts recentes (janela de 200 batches)."""
+        with self._lock:
+            samples = sorted(self.insert_durations_ms)
+        if not samples:
+            return None
+        return samples[int(0.95 * (len(samples) - 1))]
     
     def record_failure(self, count: int, error: str):
         """Registra falha de inserção."""
-        self.events_failed += count
-        self.errors.append(f"{datetime.now().isoformat()}: {error}")
-        if len(self.errors) > 100:
-            self.errors = self.errors[-100:]  # Keep last 100 errors
+        with self._lock:
+            self.events_failed += count
+            self.errors.append(f"{datetime.now().isoformat()}: {error}")
+            if len(self.errors) > 100:
+                self.errors = self.errors[-100:]  # Keep last 100 errors
         
         if PROMETHEUS_AVAILABLE and config.enable_metrics:
             self.prom_events_failed.inc(count)
     
+    def record_rejected(self, count: int):
+        """Registra eventos rejeitados por backpressure (fila cheia)."""
+        with self._lock:
+            self.events_rejected += count
+        if PROMETHEUS_AVAILABLE and config.enable_metrics:
+            self.prom_events_rejected.inc(count)
+    
+    def record_spilled(self, count: int):
+        """Registra eventos gravados no spill em disco."""
+        with self._lock:
+            self.events_spilled += count
+        if PROMETHEUS_AVAILABLE and config.enable_metrics:
+            self.prom_events_spilled.inc(count)
+    
+    def record_replayed(self, count: int):
+        """Registra eventos reprocessados a partir do spill."""
+        with self._lock:
+            self.events_replayed += count
+    
+    def set_queue_depth(self, depth: int):
+        """Atualiza a profundidade atual da fila."""
+        self.queue_depth = depth
+        if PROMETHEUS_AVAILABLE and config.enable_metrics:
+            self.prom_queue_depth.set(depth)
+    
     def push_to_gateway(self):
         """Envia métricas para Prometheus Pushgateway."""
         if PROMETHEUS_AVAILABLE and config.enable_metrics and config.pushgateway_url:
@@ -190,9 +314,15 @@ class ConsumerMetrics:
             'events_received': self.events_received,
             'events_inserted': self.events_inserted,
             'events_failed': self.events_failed,
+            'events_rejected': self.events_rejected,
+            'events_spilled': self.events_spilled,
+            'events_replayed': self.events_replayed,
+            'queue_depth': self.queue_depth,
             'batches_processed': self.batches_processed,
             'avg_lag_ms': round(self.avg_lag_ms, 2),
             'avg_batch_size': round(self.avg_batch_size, 2),
+            'bytes_inserted': self.bytes_inserted,
+            'insert_p95_ms': round(self.insert_duration_p95_ms() or 0.0, 2),
             'last_process_time': self.last_process_time,
             'recent_errors': self.errors[-5:] if self.errors else [],
         }
@@ -206,13 +336,179 @@ metrics = ConsumerMetrics()
 # BIGQUERY CLIENT
 # =============================================================================
 
+class QueueFullError(Exception):
+    """Fila em memória cheia: o caller deve responder 429 (NACK)."""
+    pass
+
+
+class InsertError(Exception):
+    """Insert síncrono falhou por erro de transporte/API: o caller deve fazer NACK."""
+    pass
+
+
+class SpillStore:
+    """
+    Write-ahead de batches que falharam no insert.
+    
+    Cada batch vira um segmento JSONL no disco local, gravado em arquivo
+    temporário + fsync + rename (atômico). Segmentos são reprocessados em
+    ordem de criação e removidos somente após insert bem-sucedido.
+    """
+    
+    SUFFIX = '.jsonl'
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+    
+    def size_bytes(self) -> int:
+        """Tamanho total dos segmentos em disco."""
+        total = 0
+        for path in self.segments():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+    
+    def segments(self) -> List[str]:
+        """Lista segmentos pendentes, do mais antigo para o mais novo."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [
+            os.path.join(self.directory, name)
+            for name in sorted(names)
+            if name.endswith(self.SUFFIX)
+        ]
+    
+    def write(self, rows: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Grava um batch como novo segmento.
+        
+        Returns:
+            Path do segmento, ou None se o limite de disco foi atingido
+        """
+        payload = ''.join(json.dumps(row, default=str) + '\n' for row in rows).encode('utf-8')
+        
+        with self._lock:
+            if self.size_bytes() + len(payload) > self.max_bytes:
+                logger.error(f"Spill full ({self.max_bytes} bytes), dropping {len(rows)} rows")
+                return None
+            
+            name = f"segment-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+            tmp_path = os.path.join(self.directory, name + '.tmp')
+            final_path = os.path.join(self.directory, name + self.SUFFIX)
+            
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, final_path)
+        
+        return final_path
+    
+    def read(self, path: str) -> List[Dict[str, Any]]:
+        """Lê as rows de um segmento (linhas corrompidas são ignoradas)."""
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt line in {path}")
+        return rows
+    
+    def remove(self, path: str):
+        """Remove um segmento já reprocessado."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Overhead aproximado por row no request (insertId + envelope JSON)
+ROW_OVERHEAD_BYTES = 100
+
+
+def estimate_row_bytes(row: Dict[str, Any]) -> int:
+    """Tamanho serializado da row no request de streaming insert."""
+    return len(json.dumps(row, separators=(',', ':'), default=str).encode('utf-8')) + ROW_OVERHEAD_BYTES
+
+
+class AdaptiveBatchPolicy:
+    """
+    Ajusta batch size e timeout a partir do p95 dos inserts (AIMD).
+    
+    - p95 abaixo de metade do alvo: batch size cresce 25%
+    - p95 acima do alvo: batch size cai pela metade
+    - timeout = p95 limitado a [min_batch_timeout_ms, batch_timeout_ms]:
+      com BigQuery rápido batches parciais saem cedo; com BigQuery lento
+      espera-se mais para acumular rows.
+    """
+    
+    ADJUST_EVERY = 20  # batches entre ajustes
+    
+    def __init__(self):
+        self.batch_size = max(1, min(config.batch_size, config.max_batch_size))
+        self.batch_timeout_ms = config.batch_timeout_ms
+        self.max_request_bytes = config.max_request_bytes
+        self._batches_since_adjust = 0
+        self._lock = threading.Lock()
+    
+    def on_batch_inserted(self):
+        """Chamado após cada insert; reajusta a cada ADJUST_EVERY batches."""
+        if not config.adaptive_batching:
+            return
+        with self._lock:
+            self._batches_since_adjust += 1
+            if self._batches_since_adjust < self.ADJUST_EVERY:
+                return
+            self._batches_since_adjust = 0
+        
+        p95 = metrics.insert_duration_p95_ms()
+        if p95 is None:
+            return
+        self.adjust(p95)
+    
+    def adjust(self, p95_ms: float):
+        """Aplica um passo de ajuste para o p95 observado."""
+        target = config.target_insert_latency_ms
+        with self._lock:
+            if p95_ms > target:
+                self.batch_size = max(config.min_batch_size, self.batch_size // 2)
+            elif p95_ms < target / 2:
+                self.batch_size = min(config.max_batch_size, max(self.batch_size + 1, int(self.batch_size * 1.25)))
+            
+            self.batch_timeout_ms = int(min(
+                config.batch_timeout_ms,
+                max(config.min_batch_timeout_ms, p95_ms)
+            ))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'batch_size': self.batch_size,
+            'batch_timeout_ms': self.batch_timeout_ms,
+            'max_request_bytes': self.max_request_bytes,
+        }
+
+
 class BigQueryBatchInserter:
     """
     Insere eventos no BigQuery em batches.
     
     Features:
-    - Batch buffering (agrupa eventos)
-    - Streaming insert com retry
+    - Batch buffering (agrupa eventos) em fila limitada
+    - Batches limitados por rows e bytes, com tamanho adaptativo
+    - Backpressure (QueueFullError) quando a fila está cheia
+    - Flush em background com inserts concorrentes
+    - Spill em disco de batches que falharam, com replay no restart
     - Error handling por row
     """
     
@@ -225,41 +521,197 @@ class BigQueryBatchInserter:
         
         # Batch buffer
         self.buffer: List[Dict[str, Any]] = []
+        self.buffer_sizes: List[int] = []
+        self.buffer_bytes = 0
         self.buffer_lock = threading.Lock()
+        self.buffer_ready = threading.Condition(self.buffer_lock)
         self.last_flush_time = time.time()
+        self.policy = AdaptiveBatchPolicy()
+        
+        # Spill em disco para batches que falharam
+        self.spill = SpillStore(config.spill_dir, config.spill_max_bytes)
+        self._replay_lock = threading.Lock()
+        self._last_replay_time = 0.0
+        
+        # Background flusher
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = threading.BoundedSemaphore(max(1, config.flush_workers))
+        self._flusher: Optional[threading.Thread] = None
+        self._running = False
+    
+    # -------------------------------------------------------------------------
+    # Buffer
+    # -------------------------------------------------------------------------
     
     def add_to_buffer(self, row: Dict[str, Any]) -> bool:
-        """Adiciona row ao buffer. Retorna True se flush necessário."""
+        """
+        Adiciona row ao buffer. Retorna True se flush necessário.
+        
+        Raises:
+            QueueFullError: se a fila atingiu config.max_queue_size
+        """
+        return self.add_many_to_buffer([row])
+    
+    def add_many_to_buffer(self, rows: List[Dict[str, Any]]) -> bool:
+        """
+        Adiciona várias rows de forma atômica (todas ou nenhuma).
+        
+        Um batch maior que a fila inteira é aceito se a fila estiver vazia,
+        senão seria rejeitado para sempre.
+        
+        Raises:
+            QueueFullError: se as rows não cabem na fila
+        """
+        sizes = [estimate_row_bytes(row) for row in rows]
+        
         with self.buffer_lock:
-            self.buffer.append(row)
-            return len(self.buffer) >= config.batch_size
+            if self.buffer and len(self.buffer) + len(rows) > config.max_queue_size:
+                raise QueueFullError(
+                    f"Queue full ({len(self.buffer)}/{config.max_queue_size} rows)"
+                )
+            self.buffer.extend(rows)
+            self.buffer_sizes.extend(sizes)
+            self.buffer_bytes += sum(sizes)
+            depth = len(self.buffer)
+            full = self._batch_full_locked()
+            if full:
+                self.buffer_ready.notify()
+        
+        metrics.set_queue_depth(depth)
+        return full
     
     def should_flush(self) -> bool:
         """Verifica se deve fazer flush (timeout ou size)."""
         with self.buffer_lock:
-            if len(self.buffer) == 0:
-                return False
-            if len(self.buffer) >= config.batch_size:
-                return True
-            elapsed_ms = (time.time() - self.last_flush_time) * 1000
-            return elapsed_ms >= config.batch_timeout_ms
+            return self._should_flush_locked()
+    
+    def _batch_full_locked(self) -> bool:
+        return len(self.buffer) >= self.policy.batch_size or \
+            self.buffer_bytes >= self.policy.max_request_bytes
+    
+    def _should_flush_locked(self) -> bool:
+        if len(self.buffer) == 0:
+            return False
+        if self._batch_full_locked():
+            return True
+        elapsed_ms = (time.time() - self.last_flush_time) * 1000
+        return elapsed_ms >= self.policy.batch_timeout_ms
+    
+    def _batch_extent(self, sizes: List[int]) -> Tuple[int, int]:
+        """(rows, bytes) do próximo batch: até policy.batch_size rows sem passar de max_request_bytes."""
+        max_rows = self.policy.batch_size
+        max_bytes = self.policy.max_request_bytes
+        
+        count = 0
+        batch_bytes = 0
+        for size in sizes:
+            if count >= max_rows:
+                break
+            # Uma row maior que o limite sai sozinha
+            if count > 0 and batch_bytes + size > max_bytes:
+                break
+            batch_bytes += size
+            count += 1
+        return count, batch_bytes
+    
+    def _take_batch_locked(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Retira o próximo batch da fila."""
+        count, batch_bytes = self._batch_extent(self.buffer_sizes)
+        rows = self.buffer[:count]
+        del self.buffer[:count]
+        del self.buffer_sizes[:count]
+        self.buffer_bytes -= batch_bytes
+        self.last_flush_time = time.time()
+        return rows, batch_bytes
+    
+    # -------------------------------------------------------------------------
+    # Insert
+    # -------------------------------------------------------------------------
     
     def flush(self) -> Dict[str, Any]:
         """
-        Faz flush do buffer para BigQuery.
+        Faz flush do buffer para BigQuery (síncrono, em batches da policy).
+        Métricas e policy são atualizadas por batch inserido (record_result),
+        com a duração e os bytes de cada request.
         
         Returns:
-            Dict com resultados: {success, inserted, failed, errors, duration_ms}
+            Dict com resultados: {success, inserted, failed, spilled, errors, duration_ms}
         """
-        with self.buffer_lock:
-            if not self.buffer:
-                return {'success': True, 'inserted': 0, 'failed': 0, 'errors': [], 'duration_ms': 0}
+        totals = {'success': True, 'inserted': 0, 'failed': 0, 'spilled': 0, 'errors': [], 'duration_ms': 0}
+        lag_total_ms = 0.0
+        
+        while True:
+            with self.buffer_lock:
+                if not self.buffer:
+                    break
+                rows_to_insert, batch_bytes = self._take_batch_locked()
+                depth = len(self.buffer)
+            metrics.set_queue_depth(depth)
             
-            rows_to_insert = self.buffer.copy()
-            self.buffer = []
-            self.last_flush_time = time.time()
+            result = self.insert_batch(rows_to_insert, batch_bytes=batch_bytes)
+            self.record_result(result)
+            totals['success'] = totals['success'] and result['success']
+            totals['inserted'] += result['inserted']
+            totals['failed'] += result['failed']
+            totals['spilled'] += result['spilled']
+            totals['errors'].extend(result['errors'])
+            totals['duration_ms'] += result['duration_ms']
+            lag_total_ms += result['avg_lag_ms'] * result['inserted']
+        
+        totals['errors'] = totals['errors'][:5]
+        totals['avg_lag_ms'] = lag_total_ms / totals['inserted'] if totals['inserted'] else 0.0
+        return totals
+    
+    def insert_now(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Insere rows imediatamente, sem passar pela fila (modo síncrono).
+        
+        Não usa o spill: numa falha de transporte/API o resultado vem com
+        retryable=True e o caller deve fazer NACK para o Pub/Sub reentregar
+        (o spill local não sobrevive à reciclagem da instância). Para no
+        primeiro batch com falha retryable.
+        
+        Returns:
+            Dict com resultados: {success, inserted, failed, errors, duration_ms, retryable}
+        """
+        totals = {'success': True, 'inserted': 0, 'failed': 0, 'errors': [], 'duration_ms': 0, 'retryable': False}
+        sizes = [estimate_row_bytes(row) for row in rows]
+        
+        while rows:
+            count, batch_bytes = self._batch_extent(sizes)
+            result = self.insert_batch(rows[:count], spill_on_error=False, batch_bytes=batch_bytes)
+            self.record_result(result)
+            totals['success'] = totals['success'] and result['success']
+            totals['inserted'] += result['inserted']
+            totals['failed'] += result['failed']
+            totals['errors'].extend(result['errors'])
+            totals['duration_ms'] += result['duration_ms']
+            if result['retryable']:
+                totals['retryable'] = True
+                break
+            rows, sizes = rows[count:], sizes[count:]
+        
+        totals['errors'] = totals['errors'][:5]
+        return totals
+    
+    def insert_batch(
+        self,
+        rows_to_insert: List[Dict[str, Any]],
+        spill_on_error: bool = True,
+        batch_bytes: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Insere um batch no BigQuery.
         
+        Erros por row (schema, valores inválidos) não são recuperáveis e contam
+        como falha. Erros de transporte/API gravam o batch inteiro no spill
+        para replay posterior.
+        """
         start_time = time.time()
+        if batch_bytes is None:
+            batch_bytes = sum(estimate_row_bytes(row) for row in rows_to_insert)
+        lag_values = [row.get('pubsub_lag_ms', 0) or 0 for row in rows_to_insert]
+        avg_lag_ms = sum(lag_values) / len(lag_values) if lag_values else 0.0
         
         try:
             # Streaming insert
@@ -283,8 +735,12 @@ class BigQueryBatchInserter:
                     'success': False,
                     'inserted': inserted,
                     'failed': len(failed_indices),
+                    'spilled': 0,
                     'errors': error_messages,
-                    'duration_ms': duration_ms
+                    'duration_ms': duration_ms,
+                    'avg_lag_ms': avg_lag_ms,
+                    'batch_bytes': batch_bytes,
+                    'retryable': False,
                 }
             else:
                 logger.info(f"Inserted {len(rows_to_insert)} rows in {duration_ms:.0f}ms")
@@ -292,8 +748,12 @@ class BigQueryBatchInserter:
                     'success': True,
                     'inserted': len(rows_to_insert),
                     'failed': 0,
+                    'spilled': 0,
                     'errors': [],
-                    'duration_ms': duration_ms
+                    'duration_ms': duration_ms,
+                    'avg_lag_ms': avg_lag_ms,
+                    'batch_bytes': batch_bytes,
+                    'retryable': False,
                 }
                 
         except Exception as e:
@@ -301,31 +761,188 @@ class BigQueryBatchInserter:
             error_msg = str(e)
             logger.error(f"BigQuery insert failed: {error_msg}")
             
-            # Re-add to buffer for retry (optional)
-            # with self.buffer_lock:
-            #     self.buffer = rows_to_insert + self.buffer
+            # Grava no spill para replay (em vez de descartar o batch)
+            spilled = 0
+            if spill_on_error:
+                try:
+                    if self.spill.write(rows_to_insert):
+                        spilled = len(rows_to_insert)
+                except OSError as spill_error:
+                    logger.error(f"Failed to spill batch: {spill_error}")
             
             return {
                 'success': False,
                 'inserted': 0,
-                'failed': len(rows_to_insert),
+                'failed': len(rows_to_insert) - spilled,
+                'spilled': spilled,
                 'errors': [error_msg],
-                'duration_ms': duration_ms
+                'duration_ms': duration_ms,
+                'avg_lag_ms': avg_lag_ms,
+                'batch_bytes': batch_bytes,
+                'retryable': True,
             }
+    
+    def replay_spilled(self) -> Dict[str, int]:
+        """
+        Reprocessa segmentos do spill em ordem.
+        
+        Para no primeiro segmento com erro de transporte (o BigQuery
+        provavelmente ainda está indisponível); o segmento permanece no disco.
+        Erros por row não são recuperáveis e o segmento é descartado.
+        """
+        replayed = 0
+        segments_done = 0
+        
+        if not self._replay_lock.acquire(blocking=False):
+            return {'replayed': 0, 'segments': 0}
+        
+        try:
+            self._last_replay_time = time.time()
+            for path in self.spill.segments():
+                rows = self.spill.read(path)
+                if rows:
+                    result = self.insert_batch(rows, spill_on_error=False)
+                    if result['retryable']:
+                        logger.warning(f"Replay of {path} failed, will retry later")
+                        break
+                    self.record_result(result)
+                    metrics.record_replayed(result['inserted'])
+                self.spill.remove(path)
+                segments_done += 1
+                replayed += len(rows)
+        finally:
+            self._replay_lock.release()
+        
+        if segments_done:
+            logger.info(f"Replayed {replayed} rows from {segments_done} spill segments")
+        return {'replayed': replayed, 'segments': segments_done}
+    
+    def record_result(self, result: Dict[str, Any]):
+        """Atualiza métricas a partir do resultado de um insert."""
+        if result['inserted'] > 0:
+            metrics.record_batch_inserted(
+                result['inserted'],
+                result.get('avg_lag_ms', 0.0),
+                result['duration_ms'] / 1000.0,
+                result.get('batch_bytes', 0)
+            )
+            self.policy.on_batch_inserted()
+        if result.get('spilled', 0) > 0:
+            metrics.record_spilled(result['spilled'])
+        if result['failed'] > 0:
+            metrics.record_failure(result['failed'], '; '.join(result['errors'][:3]))
+    
+    # -------------------------------------------------------------------------
+    # Background flusher
+    # -------------------------------------------------------------------------
+    
+    def start(self):
+        """Inicia o flusher em background e agenda o replay do spill."""
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, config.flush_workers),
+            thread_name_prefix='bq-flush'
+        )
+        self._flusher = threading.Thread(target=self._flush_loop, name='bq-flusher', daemon=True)
+        self._flusher.start()
+        
+        # Replay de segmentos deixados por uma instância anterior
+        self._executor.submit(self.replay_spilled)
+    
+    def stop(self, timeout: float = 10.0):
+        """Para o flusher, drena a fila e grava no spill o que não for inserido."""
+        if not self._running:
+            return
+        with self.buffer_lock:
+            self._running = False
+            self.buffer_ready.notify_all()
+        if self._flusher:
+            self._flusher.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        # Com os workers encerrados _in_flight está livre: o flusher vê
+        # _running False (ou devolve o batch à fila) e sai
+        if self._flusher:
+            self._flusher.join(timeout)
+            if not self._flusher.is_alive():
+                self._flusher = None
+        self._executor = None
+        
+        self.flush()
+    
+    def _flush_loop(self):
+        while True:
+            with self.buffer_lock:
+                while self._running and not self._should_flush_locked():
+                    self.buffer_ready.wait(max(self.policy.batch_timeout_ms, 1) / 1000.0)
+                if not self._running:
+                    return
+            
+            # Limita inserts concorrentes: se todos os workers estão ocupados,
+            # a fila enche e os endpoints passam a responder 429.
+            self._in_flight.acquire()
+            with self.buffer_lock:
+                # stop() pode ter rodado enquanto esperava um worker livre
+                if not self._running:
+                    self._in_flight.release()
+                    return
+                if not self.buffer:
+                    self._in_flight.release()
+                    continue
+                rows_to_insert, batch_bytes = self._take_batch_locked()
+                depth = len(self.buffer)
+            metrics.set_queue_depth(depth)
+            
+            executor = self._executor
+            try:
+                executor.submit(self._flush_worker, rows_to_insert, batch_bytes)
+            except (AttributeError, RuntimeError):
+                # Executor encerrado durante shutdown: devolve à fila para o
+                # flush() final de stop()
+                self._in_flight.release()
+                sizes = [estimate_row_bytes(row) for row in rows_to_insert]
+                with self.buffer_lock:
+                    self.buffer[:0] = rows_to_insert
+                    self.buffer_sizes[:0] = sizes
+                    self.buffer_bytes += batch_bytes
+                return
+    
+    def _flush_worker(self, rows_to_insert: List[Dict[str, Any]], batch_bytes: int):
+        try:
+            result = self.insert_batch(rows_to_insert, batch_bytes=batch_bytes)
+            self.record_result(result)
+            
+            if result['success'] and self.spill.segments() and \
+                    time.time() - self._last_replay_time >= config.spill_replay_interval_s:
+                self.replay_spilled()
+        except Exception as e:
+            logger.exception(f"Background flush failed: {e}")
+        finally:
+            self._in_flight.release()
+            metrics.push_to_gateway()
 
 
 # Global inserter (lazy init)
 _inserter: Optional[BigQueryBatchInserter] = None
+_inserter_lock = threading.Lock()
 
 def get_inserter() -> BigQueryBatchInserter:
     """Get or create BigQuery inserter."""
     global _inserter
     if _inserter is None:
-        _inserter = BigQueryBatchInserter(
-            config.gcp_project_id,
-            config.bq_dataset,
-            config.bq_table
-        )
+        with _inserter_lock:
+            if _inserter is None:
+                inserter = BigQueryBatchInserter(
+                    config.gcp_project_id,
+                    config.bq_dataset,
+                    config.bq_table
+                )
+                if config.background_flush:
+                    inserter.start()
+                    atexit.register(inserter.stop)
+                _inserter = inserter
     return _inserter
 
 
@@ -408,8 +1025,18 @@ def handle_pubsub_message(cloud_event):
     Esta função é chamada para CADA mensagem (não batch).
     Para batch processing, use Pub/Sub push subscription.
     
+    O valor de retorno é ignorado pelo framework: só uma exceção faz NACK
+    (redelivery), e só as condições transitórias abaixo a propagam; outros
+    erros são logados e a mensagem é confirmada. Sem flush em background (default em Cloud Functions), a
+    row é inserida antes do ACK, uma mensagem por insert: não há batching
+    entre mensagens nesse modo.
+    
     Args:
         cloud_event: CloudEvent com dados do Pub/Sub
+    
+    Raises:
+        QueueFullError: fila cheia (backpressure)
+        InsertError: insert síncrono falhou (a mensagem é reentregue)
     """
     try:
         # Extract message data
@@ -429,32 +1056,31 @@ def handle_pubsub_message(cloud_event):
         # Record metric
         metrics.record_event_received()
         
-        # Process and add to buffer
         row = process_message(message)
         inserter = get_inserter()
-        should_flush = inserter.add_to_buffer(row)
         
-        # Flush if needed
-        if should_flush or inserter.should_flush():
-            result = inserter.flush()
-            
-            if result['inserted'] > 0:
-                avg_lag = row.get('pubsub_lag_ms', 0)
-                metrics.record_batch_inserted(
-                    result['inserted'],
-                    avg_lag,
-                    result['duration_ms'] / 1000.0
-                )
-            
-            if result['failed'] > 0:
-                metrics.record_failure(result['failed'], '; '.join(result['errors'][:3]))
-            
-            # Push metrics
+        # Sem flusher em background, nada fica só em memória após o ACK
+        if not config.background_flush:
+            result = inserter.insert_now([row])
             metrics.push_to_gateway()
+            if result['retryable']:
+                raise InsertError('; '.join(result['errors']))
+            return 'OK', 200
+        
+        try:
+            inserter.add_to_buffer(row)
+        except QueueFullError as e:
+            # Backpressure: a exceção faz NACK e o Pub/Sub reentrega com backoff
+            logger.warning(str(e))
+            metrics.record_rejected(1)
+            raise
         
         return 'OK', 200
         
+    except (QueueFullError, InsertError):
+        raise
     except Exception as e:
+        # Erro da própria mensagem: reentregar só repetiria a falha, então ACK
         logger.exception(f"Error processing message: {e}")
         metrics.record_failure(1, str(e))
         return f'Error: {e}', 500
@@ -468,6 +1094,9 @@ def handle_batch_request(request):
     Recebe um array de mensagens e processa em batch.
     Útil para Pub/Sub push subscriptions com batching.
     
+    Sem flush em background, as rows são inseridas antes da resposta e uma
+    falha de transporte responde 503 (NACK) em vez de usar o spill.
+    
     Request body:
     {
         "messages": [
@@ -484,8 +1113,7 @@ def handle_batch_request(request):
             return {'status': 'ok', 'processed': 0}, 200
         
         inserter = get_inserter()
-        processed = 0
-        total_lag_ms = 0
+        rows = []
         
         for msg in messages:
             data = msg.get('data', '')
@@ -497,34 +1125,38 @@ def handle_batch_request(request):
                 continue
             
             metrics.record_event_received()
-            row = process_message(message)
-            inserter.add_to_buffer(row)
-            processed += 1
-            total_lag_ms += row.get('pubsub_lag_ms', 0)
+            rows.append(process_message(message))
         
-        # Flush all
-        result = inserter.flush()
+        processed = len(rows)
         
-        if result['inserted'] > 0:
-            avg_lag = total_lag_ms / processed if processed > 0 else 0
-            metrics.record_batch_inserted(
-                result['inserted'],
-                avg_lag,
-                result['duration_ms'] / 1000.0
-            )
-        
-        if result['failed'] > 0:
-            metrics.record_failure(result['failed'], '; '.join(result['errors'][:3]))
+        if not config.background_flush:
+            result = inserter.insert_now(rows)
+            metrics.push_to_gateway()
+            body = {
+                'status': 'ok',
+                'processed': processed,
+                'inserted': result['inserted'],
+                'failed': result['failed'],
+                'duration_ms': result['duration_ms'],
+            }
+            if result['retryable']:
+                # Non-2xx = NACK: o batch é reentregue (event_id deduplica)
+                body.update(status='insert_failed', error='; '.join(result['errors']))
+                return body, 503
+            return body, 200
         
-        # Push metrics
-        metrics.push_to_gateway()
+        # Enfileira o batch inteiro ou nada (evita ack parcial)
+        try:
+            inserter.add_many_to_buffer(rows)
+        except QueueFullError as e:
+            logger.warning(str(e))
+            metrics.record_rejected(processed)
+            return {'status': 'queue_full', 'error': str(e)}, 429
         
         return {
             'status': 'ok',
             'processed': processed,
-            'inserted': result['inserted'],
-            'failed': result['failed'],
-            'duration_ms': result['duration_ms'],
+            'queued': processed,
         }, 200
         
     except Exception as e:
@@ -543,7 +1175,12 @@ def health_check(request):
             'dataset': config.bq_dataset,
             'table': config.bq_table,
             'batch_size': config.batch_size,
+            'background_flush': config.background_flush,
+            'max_queue_size': config.max_queue_size,
+            'flush_workers': config.flush_workers,
+            'batching': _inserter.policy.to_dict() if _inserter else None,
         },
+        'spill_segments': len(_inserter.spill.segments()) if _inserter else 0,
         'metrics': metrics.to_dict(),
     }, 200
 
@@ -589,16 +1226,19 @@ def create_flask_app():
         row = process_message(parsed)
         
         inserter = get_inserter()
-        inserter.add_to_buffer(row)
-        
-        if inserter.should_flush():
-            result = inserter.flush()
-            if result['inserted'] > 0:
-                metrics.record_batch_inserted(
-                    result['inserted'],
-                    row.get('pubsub_lag_ms', 0),
-                    result['duration_ms'] / 1000.0
-                )
+        if not config.background_flush:
+            result = inserter.insert_now([row])
+            if result['retryable']:
+                # Non-2xx = NACK: Pub/Sub reentrega com backoff
+                return jsonify({'status': 'insert_failed'}), 503
+            return jsonify({'status': 'ok'}), 200
+        
+        try:
+            inserter.add_to_buffer(row)
+        except QueueFullError:
+            # Non-2xx = NACK: Pub/Sub reentrega com backoff
+            metrics.record_rejected(1)
+            return jsonify({'status': 'queue_full'}), 429
         
         return jsonify({'status': 'ok'}), 200
     
@@ -622,6 +1262,7 @@ def create_flask_app():
         """Force flush buffer."""
         inserter = get_inserter()
         result = inserter.flush()
+        result['replay'] = inserter.replay_spilled()
         return jsonify(result)
     
     return app
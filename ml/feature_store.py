@@ -26,15 +26,30 @@ Arquitetura:
 
 import os
 import json
+import zlib
+import base64
+import struct
+import asyncio
 import hashlib
+import heapq
+import inspect
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Callable, Union
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Callable, Set, Tuple, Union
 from dataclasses import dataclass, field, asdict
 from enum import Enum
+from collections import OrderedDict, defaultdict
 import numpy as np
 from abc import ABC, abstractmethod
 
+# Google Cloud
+try:
+    from google.cloud import bigquery
+    BIGQUERY_AVAILABLE = True
+except ImportError:
+    bigquery = None
+    BIGQUERY_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('ssi_feature_store')
 
@@ -210,15 +225,18 @@ class FeatureRegistry:
         self.features: Dict[str, FeatureDefinition] = {}
         self.views: Dict[str, FeatureView] = {}
         self.transforms: Dict[str, FeatureTransform] = {}
+        self._codecs: Dict[str, 'FeatureVectorCodec'] = {}
     
     def register_feature(self, feature: FeatureDefinition):
         """Registra uma feature"""
         self.features[feature.name] = feature
+        self._codecs.clear()
         logger.info(f"Registered feature: {feature.name}")
     
     def register_view(self, view: FeatureView):
         """Registra uma feature view"""
         self.views[view.name] = view
+        self._codecs.pop(view.name, None)
         logger.info(f"Registered view: {view.name}")
     
     def register_transform(self, name: str, transform: FeatureTransform):
@@ -231,6 +249,16 @@ class FeatureRegistry:
     def get_view(self, name: str) -> Optional[FeatureView]:
         return self.views.get(name)
     
+    def get_codec(self, view_name: str) -> 'FeatureVectorCodec':
+        """Codec binário da view (cacheado até a view ou uma feature mudar)"""
+        codec = self._codecs.get(view_name)
+        if codec is None:
+            view = self.views.get(view_name)
+            if view is None:
+                raise KeyError(f"Unknown feature view: {view_name}")
+            codec = self._codecs[view_name] = FeatureVectorCodec(view, self)
+        return codec
+    
     def list_features(self, tags: List[str] = None) -> List[str]:
         """Lista features, opcionalmente filtradas por tags"""
         if tags is None:
@@ -256,36 +284,378 @@ class FeatureRegistry:
         }
 
 
+# =============================================================================
+# BINARY FEATURE VECTORS
+# =============================================================================
+
+class FeatureVectorCodec:
+    """
+    Encoding binário de vetores de uma FeatureView.
+    
+    Layout: header (magic, versão do formato, fingerprint do schema,
+    timestamp epoch) seguido de um float64 little-endian por feature, na
+    ordem da view. Feature ausente vira default_value ou NaN. A leitura é
+    um np.frombuffer direto para o vetor na ordem do modelo.
+    
+    O fingerprint cobre nome da view, nomes, tipos e versões das features:
+    payloads gravados com outra definição são rejeitados na leitura.
+    """
+    
+    MAGIC = b'SF'
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct('<2sBId')
+    SUPPORTED_TYPES = (FeatureType.INT, FeatureType.FLOAT, FeatureType.BOOL)
+    
+    def __init__(self, view: FeatureView, registry: FeatureRegistry):
+        definitions = []
+        for name in view.features:
+            definition = registry.get_feature(name)
+            if definition is None:
+                raise ValueError(f"Feature {name} of view {view.name} is not registered")
+            if definition.dtype not in self.SUPPORTED_TYPES:
+                raise ValueError(
+                    f"Feature {name} ({definition.dtype.value}) has no fixed-width binary encoding"
+                )
+            definitions.append(definition)
+        
+        self.view_name = view.name
+        self.feature_names = list(view.features)
+        self.dtypes = [d.dtype for d in definitions]
+        self.defaults = [np.nan if d.default_value is None else float(d.default_value) for d in definitions]
+        self.fingerprint = zlib.crc32(json.dumps(
+            [view.name, [[d.name, d.dtype.value, d.version] for d in definitions]]
+        ).encode())
+        self.size = self.HEADER.size + 8 * len(definitions)
+    
+    def encode(self, features: Dict[str, Any], timestamp: datetime = None) -> bytes:
+        """Empacota as features da view (extras são ignorados)"""
+        values = np.array(
+            [features.get(name) for name in self.feature_names], dtype=object
+        )
+        missing = np.equal(values, None)
+        values[missing] = np.asarray(self.defaults, dtype=object)[missing]
+        values = values.astype('<f8')
+        header = self.HEADER.pack(
+            self.MAGIC, self.FORMAT_VERSION, self.fingerprint,
+            (timestamp or datetime.now()).timestamp()
+        )
+        return header + values.tobytes()
+    
+    def decode_array(self, payload: bytes):
+        """(vetor float64 na ordem da view, timestamp epoch)"""
+        if len(payload) != self.size:
+            raise ValueError(f"Payload size {len(payload)} does not match view {self.view_name}")
+        magic, version, fingerprint, timestamp = self.HEADER.unpack_from(payload)
+        if magic != self.MAGIC or version != self.FORMAT_VERSION or fingerprint != self.fingerprint:
+            raise ValueError(f"Payload was encoded with another schema of view {self.view_name}")
+        return np.frombuffer(payload, dtype='<f8', offset=self.HEADER.size), timestamp
+    
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        """Dict tipado (INT -> int, BOOL -> bool, NaN -> None)"""
+        values, _ = self.decode_array(payload)
+        result = {}
+        for name, dtype, value in zip(self.feature_names, self.dtypes, values.tolist()):
+            if value != value:
+                result[name] = None
+            elif dtype == FeatureType.INT:
+                result[name] = int(value)
+            elif dtype == FeatureType.BOOL:
+                result[name] = bool(value)
+            else:
+                result[name] = value
+        return result
+
+
 # =============================================================================
 # ONLINE FEATURE STORE (Cloudflare KV)
 # =============================================================================
 
+class _CacheEntry:
+    """Vetor em cache; features=None é um negativo (entity sem features)"""
+    __slots__ = ('features', 'timestamp', 'expires', 'size')
+    
+    def __init__(self, features: Optional[Dict[str, Any]], timestamp: float, expires: float, size: int):
+        self.features = features
+        self.timestamp = timestamp
+        self.expires = expires
+        self.size = size
+
+
+class LocalFeatureCache:
+    """
+    Cache local limitado (LRU + TTL) para vetores de features.
+    
+    Limites por número de entries e por bytes (tamanho do JSON serializado
+    + overhead fixo). Expirações ficam num min-heap de (expires, key);
+    entries sobrescritas deixam itens obsoletos no heap, que são ignorados.
+    """
+    
+    # Overhead fixo por entry somado a len(key) + len(serialized)
+    ENTRY_OVERHEAD = 64
+    # Máximo de expirados removidos por escrita (mantém put O(1) amortizado)
+    PURGE_BATCH = 16
+    
+    def __init__(self, max_entries: int = 100_000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._expiry_heap: List[tuple] = []
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+    
+    def get(self, key: str, now: Optional[float] = None) -> Optional[_CacheEntry]:
+        """Entry válida (marcada como usada recentemente) ou None"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= (now if now is not None else datetime.now().timestamp()):
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return entry
+    
+    def put(
+        self,
+        key: str,
+        features: Optional[Dict[str, Any]],
+        timestamp: float,
+        ttl_seconds: float,
+        serialized_size: Optional[int] = None
+    ):
+        """Grava entry; serialized_size evita re-serializar quando já conhecido"""
+        now = datetime.now().timestamp()
+        if serialized_size is None:
+            serialized_size = len(json.dumps(features)) if features is not None else 0
+        
+        self._remove(key)
+        entry = _CacheEntry(features, timestamp, now + ttl_seconds, len(key) + serialized_size + self.ENTRY_OVERHEAD)
+        self._data[key] = entry
+        self.bytes += entry.size
+        heapq.heappush(self._expiry_heap, (entry.expires, key))
+        
+        self._purge_expired(now, self.PURGE_BATCH)
+        self._evict()
+    
+    def invalidate(self, key: str):
+        self._remove(key)
+    
+    def clear(self):
+        self._data.clear()
+        self._expiry_heap.clear()
+        self.bytes = 0
+    
+    def purge_expired(self) -> int:
+        """Remove todos os expirados; retorna quantos"""
+        return self._purge_expired(datetime.now().timestamp())
+    
+    def _remove(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+    
+    def _purge_expired(self, now: float, limit: Optional[int] = None) -> int:
+        purged = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now and (limit is None or purged < limit):
+            expires, key = heapq.heappop(heap)
+            entry = self._data.get(key)
+            if entry is not None and entry.expires == expires:
+                self._remove(key)
+                purged += 1
+        self.expirations += purged
+        
+        # Itens obsoletos de sobrescritas: reconstrói quando o heap cresce demais
+        if len(heap) > 2 * len(self._data) + 64:
+            self._expiry_heap = [(entry.expires, key) for key, entry in self._data.items()]
+            heapq.heapify(self._expiry_heap)
+        return purged
+    
+    def _evict(self):
+        while self._data and (len(self._data) > self.max_entries or self.bytes > self.max_bytes):
+            _, entry = self._data.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._data),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
 class OnlineFeatureStore:
     """
     Store online para serving de features em low-latency.
     Usa Cloudflare KV ou similar.
     """
     
+    # Chaves por MGET; lotes maiores vão em um único pipeline
+    MGET_CHUNK_SIZE = 500
+    
     def __init__(
         self,
         kv_namespace = None,  # Cloudflare KV namespace
         redis_client = None,  # Ou Redis
-        prefix: str = "features"
+        prefix: str = "features",
+        local_cache_ttl: int = 60,  # TTL local para vetores lidos do KV/Redis
+        local_cache_max_entries: int = None,
+        local_cache_max_bytes: int = None,
+        negative_cache_ttl: int = 30,  # Entities sem features (0 desativa)
+        registry: FeatureRegistry = None  # Schemas para vetores binários por view
     ):
         self.kv = kv_namespace
         self.redis = redis_client
         self.prefix = prefix
-        self._local_cache: Dict[str, Any] = {}
+        self.registry = registry
+        # None até a primeira chamada dizer se o cliente Redis é assíncrono
+        self._redis_async: Optional[bool] = None
+        self.local_cache_ttl = local_cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self._local_cache = LocalFeatureCache(
+            max_entries=local_cache_max_entries or int(os.getenv('FEATURE_CACHE_MAX_ENTRIES', '100000')),
+            max_bytes=local_cache_max_bytes or int(os.getenv('FEATURE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        )
+        # Hit rate por feature view (ou entity_type quando não informada)
+        self._view_stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {'hits': 0, 'negative_hits': 0, 'misses': 0}
+        )
     
     def _make_key(self, entity_type: str, entity_id: str) -> str:
         """Cria chave para storage"""
         return f"{self.prefix}:{entity_type}:{entity_id}"
     
+    def _make_view_key(self, view: FeatureView, entity_id: str) -> str:
+        """Chave do vetor binário de uma view"""
+        return f"{self.prefix}:{view.entity}:{entity_id}:view:{view.name}"
+    
+    def _view_codec(self, view_name: str):
+        if self.registry is None:
+            raise ValueError("OnlineFeatureStore needs a FeatureRegistry for view vectors")
+        return self.registry.get_view(view_name), self.registry.get_codec(view_name)
+    
+    @staticmethod
+    def _select(features: Dict[str, Any], feature_names: Optional[List[str]]) -> Dict[str, Any]:
+        if not feature_names:
+            return features
+        return {k: v for k, v in features.items() if k in feature_names}
+    
+    def _lookup_local(
+        self,
+        key: str,
+        entity_id: str,
+        feature_names: Optional[List[str]],
+        stats: Dict[str, int],
+        now: float
+    ):
+        """(encontrado no cache, vetor); vetor None em hit negativo"""
+        entry = self._local_cache.get(key, now)
+        if entry is None:
+            stats['misses'] += 1
+            return False, None
+        if entry.features is None:
+            stats['negative_hits'] += 1
+            return True, None
+        stats['hits'] += 1
+        return True, FeatureVector(
+            entity_id=entity_id,
+            features=self._select(entry.features, feature_names),
+            timestamp=datetime.fromtimestamp(entry.timestamp)
+        )
+    
+    def _store_fetched(
+        self,
+        key: str,
+        entity_id: str,
+        data,
+        feature_names: Optional[List[str]]
+    ) -> Optional[FeatureVector]:
+        """Decodifica o valor do KV/Redis e grava no local cache (ou negativo)"""
+        if not data:
+            if self.negative_cache_ttl > 0:
+                self._local_cache.put(key, None, 0.0, self.negative_cache_ttl)
+            return None
+        
+        parsed = json.loads(data)
+        timestamp = datetime.fromisoformat(parsed['timestamp'])
+        self._local_cache.put(
+            key, parsed['features'], timestamp.timestamp(), self.local_cache_ttl,
+            serialized_size=len(data)
+        )
+        return FeatureVector(
+            entity_id=entity_id,
+            features=self._select(parsed['features'], feature_names),
+            timestamp=timestamp
+        )
+    
+    async def _kv_get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """Leitura em lote do KV (bulk get quando o binding suporta)"""
+        if not self.kv or not keys:
+            return [None] * len(keys)
+        
+        if hasattr(self.kv, 'get_many'):
+            found = await self.kv.get_many(keys)
+            if isinstance(found, dict):
+                return [found.get(key) for key in keys]
+            return list(found)
+        
+        return list(await asyncio.gather(*(self.kv.get(key) for key in keys)))
+    
+    async def _redis_call(self, call: Callable[[], Any]) -> Any:
+        """
+        Executa call() contra self.redis.
+        
+        Os comandos do redis.asyncio são funções comuns que retornam um
+        awaitable (iscoroutinefunction é False), então o modo é detectado pelo
+        retorno: cliente síncrono roda fora do event loop, assíncrono é
+        aguardado no próprio loop.
+        """
+        if self._redis_async:
+            result = call()
+        else:
+            result = await asyncio.to_thread(call)
+        
+        self._redis_async = inspect.isawaitable(result)
+        if self._redis_async:
+            return await result
+        return result
+    
+    async def _redis_get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """MGET em chunks, num único pipeline"""
+        if not self.redis or not keys:
+            return [None] * len(keys)
+        
+        chunks = [keys[i:i + self.MGET_CHUNK_SIZE] for i in range(0, len(keys), self.MGET_CHUNK_SIZE)]
+        
+        if len(chunks) == 1:
+            return list(await self._redis_call(lambda: self.redis.mget(chunks[0])))
+        
+        def fetch():
+            pipe = self.redis.pipeline(transaction=False)
+            for chunk in chunks:
+                pipe.mget(chunk)
+            return pipe.execute()
+        
+        replies = await self._redis_call(fetch)
+        return [value for reply in replies for value in reply]
+    
     async def get_features(
         self,
         entity_type: str,
         entity_id: str,
-        feature_names: List[str] = None
+        feature_names: List[str] = None,
+        view_name: str = None
     ) -> Optional[FeatureVector]:
         """
         Busca features para um entity.
@@ -293,47 +663,23 @@ class OnlineFeatureStore:
         key = self._make_key(entity_type, entity_id)
         
         # Tentar local cache primeiro
-        if key in self._local_cache:
-            cached = self._local_cache[key]
-            if cached['expires'] > datetime.now().timestamp():
-                features = cached['features']
-                if feature_names:
-                    features = {k: v for k, v in features.items() if k in feature_names}
-                return FeatureVector(
-                    entity_id=entity_id,
-                    features=features,
-                    timestamp=datetime.fromtimestamp(cached['timestamp'])
-                )
+        found, vector = self._lookup_local(
+            key, entity_id, feature_names,
+            self._view_stats[view_name or entity_type], datetime.now().timestamp()
+        )
+        if found:
+            return vector
         
         # Buscar do KV
+        data = None
         if self.kv:
             data = await self.kv.get(key)
-            if data:
-                parsed = json.loads(data)
-                features = parsed['features']
-                if feature_names:
-                    features = {k: v for k, v in features.items() if k in feature_names}
-                return FeatureVector(
-                    entity_id=entity_id,
-                    features=features,
-                    timestamp=datetime.fromisoformat(parsed['timestamp'])
-                )
         
         # Buscar do Redis
-        if self.redis:
-            data = self.redis.get(key)
-            if data:
-                parsed = json.loads(data)
-                features = parsed['features']
-                if feature_names:
-                    features = {k: v for k, v in features.items() if k in feature_names}
-                return FeatureVector(
-                    entity_id=entity_id,
-                    features=features,
-                    timestamp=datetime.fromisoformat(parsed['timestamp'])
-                )
+        if not data and self.redis:
+            data = await self._redis_call(lambda: self.redis.get(key))
         
-        return None
+        return self._store_fetched(key, entity_id, data, feature_names)
     
     async def set_features(
         self,
@@ -346,21 +692,21 @@ class OnlineFeatureStore:
         Armazena features para um entity.
         """
         key = self._make_key(entity_type, entity_id)
+        now = datetime.now()
         
         data = {
             'features': features,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
             'entity_id': entity_id
         }
         
         serialized = json.dumps(data)
         
-        # Local cache
-        self._local_cache[key] = {
-            'features': features,
-            'timestamp': datetime.now().timestamp(),
-            'expires': datetime.now().timestamp() + ttl_seconds
-        }
+        # Local cache (substitui um eventual negativo)
+        self._local_cache.put(
+            key, features, now.timestamp(), ttl_seconds,
+            serialized_size=len(serialized)
+        )
         
         # KV
         if self.kv:
@@ -368,41 +714,305 @@ class OnlineFeatureStore:
         
         # Redis
         if self.redis:
-            self.redis.setex(key, ttl_seconds, serialized)
+            await self._redis_call(lambda: self.redis.setex(key, ttl_seconds, serialized))
+    
+    async def set_batch(
+        self,
+        entity_type: str,
+        vectors: Dict[str, Dict[str, Any]],
+        ttl_seconds: int = 3600,
+        view_name: str = None
+    ):
+        """
+        Armazena features de vários entities (ex.: push da materialização).
+        
+        Redis recebe um pipeline de SETEX por chunk e o KV puts concorrentes.
+        Com view_name grava os vetores binários da view. O local cache não é
+        populado (evita expulsar o working set), só invalidado.
+        """
+        if not vectors:
+            return
+        
+        now = datetime.now()
+        if view_name:
+            view, codec = self._view_codec(view_name)
+            items = [
+                (self._make_view_key(view, entity_id), codec.encode(features, now))
+                for entity_id, features in vectors.items()
+            ]
+            kv_items = [(key, base64.b64encode(payload).decode('ascii')) for key, payload in items]
+        else:
+            timestamp = now.isoformat()
+            items = [
+                (self._make_key(entity_type, entity_id), json.dumps({
+                    'features': features,
+                    'timestamp': timestamp,
+                    'entity_id': entity_id
+                }))
+                for entity_id, features in vectors.items()
+            ]
+            kv_items = items
+        
+        for key, _ in items:
+            self._local_cache.invalidate(key)
+        
+        async def put_kv():
+            if self.kv:
+                await asyncio.gather(*(
+                    self.kv.put(key, value, expirationTtl=ttl_seconds) for key, value in kv_items
+                ))
+        
+        async def put_redis():
+            if not self.redis:
+                return
+            for i in range(0, len(items), self.MGET_CHUNK_SIZE):
+                chunk = items[i:i + self.MGET_CHUNK_SIZE]
+                
+                def write():
+                    pipe = self.redis.pipeline(transaction=False)
+                    for key, value in chunk:
+                        pipe.setex(key, ttl_seconds, value)
+                    return pipe.execute()
+                
+                await self._redis_call(write)
+        
+        await asyncio.gather(put_kv(), put_redis())
     
     async def get_batch(
         self,
         entity_type: str,
         entity_ids: List[str],
-        feature_names: List[str] = None
+        feature_names: List[str] = None,
+        view_name: str = None
     ) -> Dict[str, FeatureVector]:
         """
         Busca features para múltiplos entities.
+        
+        Local cache primeiro; os misses vão em lote para KV e Redis ao mesmo
+        tempo (KV tem precedência, como em get_features) e os encontrados
+        entram no local cache.
         """
         results = {}
+        now = datetime.now().timestamp()
+        stats = self._view_stats[view_name or entity_type]
+        wanted = set(feature_names) if feature_names else None
         
-        for entity_id in entity_ids:
-            vector = await self.get_features(entity_type, entity_id, feature_names)
-            if vector:
+        missing = []
+        for entity_id in dict.fromkeys(entity_ids):
+            key = self._make_key(entity_type, entity_id)
+            found, vector = self._lookup_local(key, entity_id, wanted, stats, now)
+            if vector is not None:
                 results[entity_id] = vector
+            elif not found:
+                missing.append((entity_id, key))
         
-        return results
+        if missing:
+            keys = [key for _, key in missing]
+            kv_values, redis_values = await asyncio.gather(
+                self._kv_get_many(keys),
+                self._redis_get_many(keys)
+            )
+            
+            for (entity_id, key), kv_data, redis_data in zip(missing, kv_values, redis_values):
+                vector = self._store_fetched(key, entity_id, kv_data or redis_data, wanted)
+                if vector is not None:
+                    results[entity_id] = vector
+        
+        return {entity_id: results[entity_id] for entity_id in entity_ids if entity_id in results}
+    
+    async def set_view_features(
+        self,
+        view_name: str,
+        entity_id: str,
+        features: Dict[str, Any],
+        ttl_seconds: int = None
+    ):
+        """
+        Armazena o vetor binário de uma view (TTL padrão: online_ttl da view).
+        No KV o payload vai em base64, no Redis como bytes.
+        """
+        view, codec = self._view_codec(view_name)
+        key = self._make_view_key(view, entity_id)
+        ttl_seconds = ttl_seconds or int(view.online_ttl.total_seconds())
+        now = datetime.now()
+        payload = codec.encode(features, now)
+        
+        self._local_cache.put(
+            key, codec.decode_array(payload)[0], now.timestamp(), ttl_seconds,
+            serialized_size=len(payload)
+        )
+        
+        if self.kv:
+            await self.kv.put(key, base64.b64encode(payload).decode('ascii'), expirationTtl=ttl_seconds)
+        
+        if self.redis:
+            await self._redis_call(lambda: self.redis.setex(key, ttl_seconds, payload))
+    
+    async def get_view_vectors(
+        self,
+        view_name: str,
+        entity_ids: List[str]
+    ):
+        """
+        Vetores de uma view para vários entities, prontos para o modelo.
+        
+        Retorna (ids encontrados, matriz float64 len(ids) x n_features na
+        ordem da view). Mesmo caminho de get_batch: local cache, depois KV e
+        Redis em lote e concorrentes; payloads de outro schema contam como miss.
+        """
+        view, codec = self._view_codec(view_name)
+        now = datetime.now().timestamp()
+        stats = self._view_stats[view_name]
+        vectors: Dict[str, np.ndarray] = {}
+        
+        missing = []
+        for entity_id in dict.fromkeys(entity_ids):
+            key = self._make_view_key(view, entity_id)
+            entry = self._local_cache.get(key, now)
+            if entry is None:
+                stats['misses'] += 1
+                missing.append((entity_id, key))
+            elif entry.features is None:
+                stats['negative_hits'] += 1
+            else:
+                stats['hits'] += 1
+                vectors[entity_id] = entry.features
+        
+        if missing:
+            keys = [key for _, key in missing]
+            kv_values, redis_values = await asyncio.gather(
+                self._kv_get_many(keys),
+                self._redis_get_many(keys)
+            )
+            
+            for (entity_id, key), kv_data, redis_data in zip(missing, kv_values, redis_values):
+                payload = base64.b64decode(kv_data) if kv_data else redis_data
+                vector = None
+                if payload:
+                    try:
+                        vector, timestamp = codec.decode_array(payload)
+                    except ValueError as e:
+                        logger.warning(f"Discarding feature vector {key}: {e}")
+                
+                if vector is None:
+                    if self.negative_cache_ttl > 0:
+                        self._local_cache.put(key, None, 0.0, self.negative_cache_ttl)
+                    continue
+                
+                self._local_cache.put(key, vector, timestamp, self.local_cache_ttl, serialized_size=len(payload))
+                vectors[entity_id] = vector
+        
+        found = [entity_id for entity_id in dict.fromkeys(entity_ids) if entity_id in vectors]
+        matrix = np.empty((len(found), len(codec.feature_names)), dtype=np.float64)
+        for row, entity_id in enumerate(found):
+            matrix[row] = vectors[entity_id]
+        
+        return found, matrix
+    
+    def invalidate(self, entity_type: str, entity_id: str, view_name: str = None):
+        """
+        Remove entity do local cache (ex.: após update em outro worker).
+        Sem view_name remove o JSON e os vetores binários de todas as views
+        do entity_type; com view_name só o vetor daquela view.
+        """
+        if view_name is None:
+            self._local_cache.invalidate(self._make_key(entity_type, entity_id))
+            views = self.registry.views.values() if self.registry is not None else []
+        else:
+            view, _ = self._view_codec(view_name)
+            views = [view]
+        
+        for view in views:
+            if view.entity == entity_type:
+                self._local_cache.invalidate(self._make_view_key(view, entity_id))
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Ocupação do local cache e hit rate por feature view"""
+        views = {}
+        for name, counts in self._view_stats.items():
+            total = counts['hits'] + counts['negative_hits'] + counts['misses']
+            views[name] = {
+                **counts,
+                'hit_rate': round((counts['hits'] + counts['negative_hits']) / total, 4) if total else 0
+            }
+        return {
+            'local_cache': self._local_cache.get_stats(),
+            'views': views
+        }
 
 
 # =============================================================================
 # OFFLINE FEATURE STORE (BigQuery)
 # =============================================================================
 
+def _window_seconds(window: str) -> int:
+    """'30m', '24h', '7d', '2w' -> segundos"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    window = window.strip().lower()
+    if not window or window[-1] not in units or not window[:-1].isdigit():
+        raise ValueError(f"Invalid window size: {window}")
+    return int(window[:-1]) * units[window[-1]]
+
+
 class OfflineFeatureStore:
     """
     Store offline para training e batch processing.
     Usa BigQuery.
+    
+    Materialização incremental: cada view tem um watermark (último
+    feature_timestamp materializado); uma execução só lê as partições de
+    eventos desde o watermark (mais a maior janela das features janeladas)
+    e grava um snapshot apenas para entities com eventos novos ou com
+    eventos saindo de alguma janela.
+    
+    Várias views podem gravar na mesma tabela {entity}_features; cada
+    snapshot leva o view_name de quem o gravou, e leituras (snapshot
+    anterior, point-in-time join, push_to_online) só usam os da view.
+    Snapshots gravados antes da coluna view_name existir são ignorados, e
+    a primeira materialização de uma view com watermark antigo refaz o
+    histórico completo.
     """
     
-    def __init__(self, bq_client, project_id: str, dataset_id: str = 'feature_store'):
+    # Agregações lifetime que podem ser combinadas com o snapshot anterior
+    MERGEABLE_AGGREGATIONS = {
+        AggregationType.SUM, AggregationType.COUNT, AggregationType.MIN,
+        AggregationType.MAX, AggregationType.LAST, AggregationType.FIRST
+    }
+    
+    def __init__(
+        self,
+        bq_client,
+        project_id: str,
+        dataset_id: str = 'feature_store',
+        events_table: str = None,
+        timestamp_column: str = 'event_timestamp'
+    ):
         self.bq = bq_client
         self.project_id = project_id
         self.dataset_id = dataset_id
+        self.events_table = events_table or f"{project_id}.ssi_shadow.events"
+        self.timestamp_column = timestamp_column
+        self._watermark_table_ready = False
+        self._view_column_ready: Set[str] = set()
+    
+    def _features_table(self, entity_type: str) -> str:
+        return f"{self.project_id}.{self.dataset_id}.{entity_type}_features"
+    
+    @property
+    def _watermark_table(self) -> str:
+        return f"{self.project_id}.{self.dataset_id}._materialization_watermarks"
+    
+    def _run(self, query: str, params: List[tuple] = None):
+        """Executa query com parâmetros (name, type, value) e espera o job"""
+        if not BIGQUERY_AVAILABLE:
+            raise ImportError("google-cloud-bigquery is required for the offline feature store")
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter(name, type_, value) if isinstance(value, list)
+            else bigquery.ScalarQueryParameter(name, type_, value)
+            for name, type_, value in params or []
+        ])
+        job = self.bq.query(query, job_config=job_config)
+        return job, job.result()
     
     def get_training_data(
         self,
@@ -413,7 +1023,8 @@ class OfflineFeatureStore:
         end_time: datetime
     ) -> List[Dict]:
         """
-        Busca dados de training com point-in-time correctness.
+        Busca snapshots de features de entities num intervalo.
+        Para joins com labels use get_historical_features.
         """
         features_str = ', '.join(feature_names)
         entity_ids_str = ', '.join([f"'{id}'" for id in entity_ids])
@@ -435,49 +1046,367 @@ class OfflineFeatureStore:
         
         return results
     
+    def get_historical_features(
+        self,
+        view: FeatureView,
+        labels: Union[str, List[Dict[str, Any]]],
+        max_age: timedelta = None,
+        registry: FeatureRegistry = None
+    ) -> List[Dict]:
+        """
+        Point-in-time join de labels com snapshots de features.
+        
+        Cada label recebe o snapshot mais recente da view com
+        feature_timestamp <= label_timestamp, sem vazar valores do futuro.
+        Features janeladas de um snapshot mais velho que max_age (padrão:
+        offline_ttl da view) viram NULL. Features lifetime (sem
+        window_size no registry) ignoram max_age: só são materializadas
+        quando o entity tem eventos, então o último snapshot continua
+        valendo para entities inativos há mais tempo. Sem registry, todas
+        as features são tratadas como janeladas.
+        
+        labels: tabela BigQuery com colunas entity_id e label_timestamp, ou
+            lista de dicts com 'entity_id' e 'timestamp' (demais chaves são
+            preservadas no resultado)
+        """
+        max_age = max_age or view.offline_ttl
+        lifetime = set()
+        if registry is not None:
+            definitions = [registry.get_feature(name) for name in view.features]
+            lifetime = {feature.name for feature in definitions if feature and not feature.window_size}
+        
+        fresh = "f.feature_timestamp > TIMESTAMP_SUB(l.label_timestamp, INTERVAL @max_age_seconds SECOND)"
+        features_sql = ', '.join(
+            f"f.{name}" if name in lifetime or not lifetime else f"IF({fresh}, f.{name}, NULL) AS {name}"
+            for name in view.features
+        )
+        # Sem features lifetime, max_age limita o join (e as partições lidas)
+        age_filter = "" if lifetime else f"\n         AND {fresh}"
+        params = [
+            ("max_age_seconds", "INT64", int(max_age.total_seconds())),
+            ("view_name", "STRING", view.name),
+        ]
+        
+        if isinstance(labels, str):
+            label_source = f"SELECT l.*, TO_JSON_STRING(l) AS label_row FROM `{labels}` l"
+        else:
+            label_source = """
+            SELECT entity_id, label_timestamp, label_row
+            FROM UNNEST(@label_entity_ids) AS entity_id WITH OFFSET label_row
+            JOIN UNNEST(@label_timestamps) AS label_timestamp WITH OFFSET ts_row
+            ON label_row = ts_row
+            """
+            params += [
+                ("label_entity_ids", "STRING", [label['entity_id'] for label in labels]),
+                ("label_timestamps", "TIMESTAMP", [label['timestamp'] for label in labels]),
+            ]
+        
+        query = f"""
+        WITH labels AS ({label_source})
+        SELECT
+            l.*,
+            f.feature_timestamp,
+            {features_sql}
+        FROM labels l
+        LEFT JOIN `{self._features_table(view.entity)}` f
+          ON f.entity_id = l.entity_id
+         AND f.view_name = @view_name
+         AND f.feature_timestamp <= l.label_timestamp{age_filter}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY l.label_row ORDER BY f.feature_timestamp DESC) = 1
+        """
+        
+        _, rows = self._run(query, params)
+        results = [dict(row) for row in rows]
+        
+        if isinstance(labels, str):
+            for row in results:
+                row.pop('label_row', None)
+            return results
+        
+        # Restore label order and extra label fields
+        joined = [None] * len(labels)
+        for row in results:
+            position = row.pop('label_row')
+            joined[position] = {**labels[position], **row}
+        return joined
+    
+    # =========================================================================
+    # MATERIALIZATION
+    # =========================================================================
+    
+    def _ensure_watermark_table(self):
+        if self._watermark_table_ready:
+            return
+        self._run(f"""
+        CREATE TABLE IF NOT EXISTS `{self._watermark_table}` (
+            view_name STRING NOT NULL,
+            watermark TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL,
+            view_scoped BOOL
+        );
+        ALTER TABLE `{self._watermark_table}` ADD COLUMN IF NOT EXISTS view_scoped BOOL;
+        """)
+        self._watermark_table_ready = True
+    
+    def _ensure_view_column(self, entity_type: str):
+        """Adiciona view_name a tabelas de features criadas antes dela"""
+        table = self._features_table(entity_type)
+        if table in self._view_column_ready:
+            return
+        self._run(f"ALTER TABLE IF EXISTS `{table}` ADD COLUMN IF NOT EXISTS view_name STRING")
+        self._view_column_ready.add(table)
+    
+    def _watermark_state(self, view_name: str) -> Tuple[Optional[datetime], bool]:
+        """(watermark, view_scoped): view_scoped=False se os snapshots não têm view_name"""
+        self._ensure_watermark_table()
+        _, rows = self._run(
+            f"SELECT watermark, view_scoped FROM `{self._watermark_table}` WHERE view_name = @view_name",
+            [("view_name", "STRING", view_name)]
+        )
+        for row in rows:
+            watermark = row['watermark']
+            # BigQuery returns aware UTC datetimes; naive values are sent as UTC
+            if watermark.tzinfo is not None:
+                watermark = watermark.astimezone(timezone.utc).replace(tzinfo=None)
+            return watermark, bool(row['view_scoped'])
+        return None, True
+    
+    def get_watermark(self, view_name: str) -> Optional[datetime]:
+        """Último feature_timestamp materializado para a view"""
+        return self._watermark_state(view_name)[0]
+    
+    def _aggregate_sql(self, feature: FeatureDefinition, condition: str) -> str:
+        """Agregação da feature sobre os eventos que satisfazem condition"""
+        ts = f"e.{self.timestamp_column}"
+        aggregation = feature.aggregation or AggregationType.LAST
+        if feature.source_column:
+            column = f"e.{feature.source_column}"
+        else:
+            # COUNT sem coluna conta eventos
+            column = "1" if aggregation == AggregationType.COUNT else f"e.{feature.name}"
+        value = f"IF({condition}, {column}, NULL)"
+        
+        if aggregation == AggregationType.COUNT_DISTINCT:
+            return f"COUNT(DISTINCT {value})"
+        if aggregation == AggregationType.LAST:
+            return f"ARRAY_AGG({value} IGNORE NULLS ORDER BY {ts} DESC LIMIT 1)[SAFE_OFFSET(0)]"
+        if aggregation == AggregationType.FIRST:
+            return f"ARRAY_AGG({value} IGNORE NULLS ORDER BY {ts} ASC LIMIT 1)[SAFE_OFFSET(0)]"
+        return f"{aggregation.value.upper()}({value})"
+    
+    @staticmethod
+    def _merge_sql(name: str, aggregation: Optional[AggregationType]) -> str:
+        """Combina o snapshot anterior (p) com o delta desde o watermark (c)"""
+        previous, delta = f"p.{name}", f"c.{name}"
+        if aggregation in (AggregationType.SUM, AggregationType.COUNT):
+            return f"COALESCE({previous}, 0) + COALESCE({delta}, 0)"
+        if aggregation == AggregationType.MIN:
+            return f"LEAST(COALESCE({previous}, {delta}), COALESCE({delta}, {previous}))"
+        if aggregation == AggregationType.MAX:
+            return f"GREATEST(COALESCE({previous}, {delta}), COALESCE({delta}, {previous}))"
+        if aggregation == AggregationType.FIRST:
+            return f"COALESCE({previous}, {delta})"
+        return f"COALESCE({delta}, {previous})"  # LAST / sem agregação
+    
     def materialize_features(
         self,
         view: FeatureView,
         registry: FeatureRegistry,
-        target_date: datetime = None
-    ):
+        target_date: datetime = None,
+        incremental: bool = True
+    ) -> Dict[str, Any]:
         """
         Materializa features de uma view para a tabela offline.
+        
+        Com incremental=True (e um watermark existente) só entities com
+        eventos em [watermark, target_date) recebem snapshot novo, além dos
+        que têm eventos saindo de alguma janela ([watermark - janela,
+        target_date - janela)), para que features janeladas decaiam:
+        - features janeladas são recalculadas sobre a janela;
+        - agregações lifetime combináveis (SUM, COUNT, MIN, MAX, FIRST, LAST)
+          combinam o snapshot anterior com o delta;
+        - AVG/COUNT_DISTINCT/STDDEV sem janela exigem histórico completo
+          dos entities tocados (sem limite inferior de partição).
+        INSERT e avanço do watermark rodam na mesma transação.
         """
         if target_date is None:
             target_date = datetime.now()
         
-        # Construir query de materialização
-        feature_selects = []
+        watermark, view_scoped = self._watermark_state(view.name) if incremental else (None, True)
+        if watermark is not None and watermark >= target_date:
+            logger.info(f"View {view.name} already materialized up to {watermark}")
+            return {'view': view.name, 'watermark': watermark, 'target': target_date, 'skipped': True}
+        if watermark is not None and not view_scoped:
+            # Snapshots anteriores não têm view_name: não dá para achar os desta view
+            logger.warning(f"View {view.name}: snapshots predate view_name, rebuilding from full history")
+            watermark = None
+        self._ensure_view_column(view.entity)
         
-        for feature_name in view.features:
-            feature = registry.get_feature(feature_name)
-            if not feature:
-                continue
-            
-            if feature.aggregation:
-                agg_fn = feature.aggregation.value.upper()
-                col = feature.source_column
-                feature_selects.append(f"{agg_fn}({col}) as {feature_name}")
+        features = [registry.get_feature(name) for name in view.features]
+        features = [feature for feature in features if feature]
+        
+        # Earliest event each feature needs to read
+        ts = f"e.{self.timestamp_column}"
+        selects, merged = [], []
+        scan_start = watermark
+        needs_full_history = watermark is None
+        uses_previous = False
+        windows = set()
+        
+        for feature in features:
+            if feature.window_size:
+                seconds = _window_seconds(feature.window_size)
+                windows.add(seconds)
+                condition = f"{ts} >= TIMESTAMP_SUB(@target, INTERVAL {seconds} SECOND)"
+                window_start = target_date - timedelta(seconds=seconds)
+                if scan_start is not None:
+                    scan_start = min(scan_start, window_start)
+                merged.append(f"c.{feature.name} AS {feature.name}")
+            elif watermark is not None and (feature.aggregation or AggregationType.LAST) in self.MERGEABLE_AGGREGATIONS:
+                condition = f"{ts} >= @watermark"
+                uses_previous = True
+                merged.append(f"{self._merge_sql(feature.name, feature.aggregation)} AS {feature.name}")
             else:
-                feature_selects.append(f"{feature.source_column} as {feature_name}")
+                condition = f"{ts} IS NOT NULL"
+                needs_full_history = True
+                merged.append(f"c.{feature.name} AS {feature.name}")
+            selects.append(f"{self._aggregate_sql(feature, condition)} AS {feature.name}")
+        
+        if needs_full_history:
+            scan_start = None
+            if watermark is not None:
+                logger.warning(f"View {view.name}: lifetime non-mergeable features force a full history scan")
         
-        features_sql = ', '.join(feature_selects)
+        entity_column = f"{view.entity}_id"
+        features_table = self._features_table(view.entity)
+        scan_filter = f"AND e.{self.timestamp_column} >= @scan_start" if scan_start is not None else ""
+        previous_cte = f""",
+        previous AS (
+            SELECT f.*
+            FROM `{features_table}` f
+            JOIN touched t USING (entity_id)
+            WHERE f.view_name = @view_name
+              AND f.feature_timestamp < @target
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY f.entity_id ORDER BY f.feature_timestamp DESC) = 1
+        )""" if uses_previous else ""
+        previous_join = "LEFT JOIN previous p USING (entity_id)" if uses_previous else ""
+        # Entities sem eventos novos mas com eventos saindo da janela também mudam
+        window_exits = "".join(
+            f"\n                   OR ({self.timestamp_column} >= TIMESTAMP_SUB(@watermark, INTERVAL {seconds} SECOND)"
+            f" AND {self.timestamp_column} < TIMESTAMP_SUB(@target, INTERVAL {seconds} SECOND))"
+            for seconds in sorted(windows)
+        )
         
         query = f"""
-        INSERT INTO `{self.project_id}.{self.dataset_id}.{view.entity}_features`
+        BEGIN TRANSACTION;
+        
+        INSERT INTO `{features_table}` (entity_id, view_name, feature_timestamp, {', '.join(f.name for f in features)})
+        WITH touched AS (
+            SELECT DISTINCT {entity_column} AS entity_id
+            FROM `{self.events_table}`
+            WHERE {self.timestamp_column} < @target
+              AND {entity_column} IS NOT NULL
+              AND (@watermark IS NULL OR {self.timestamp_column} >= @watermark{window_exits})
+        ),
+        current_values AS (
+            SELECT
+                t.entity_id,
+                {', '.join(selects)}
+            FROM touched t
+            LEFT JOIN `{self.events_table}` e
+              ON e.{entity_column} = t.entity_id
+             AND {ts} < @target {scan_filter}
+            GROUP BY t.entity_id
+        ){previous_cte}
         SELECT
-            {view.entity}_id as entity_id,
-            TIMESTAMP('{target_date.isoformat()}') as feature_timestamp,
-            {features_sql}
-        FROM `{self.project_id}.ssi_shadow.events`
-        GROUP BY {view.entity}_id
+            c.entity_id,
+            @view_name AS view_name,
+            @target AS feature_timestamp,
+            {', '.join(merged)}
+        FROM current_values c
+        {previous_join};
+        
+        MERGE `{self._watermark_table}` w
+        USING (SELECT @view_name AS view_name, @target AS watermark) s
+        ON w.view_name = s.view_name
+        WHEN MATCHED THEN
+            UPDATE SET watermark = s.watermark, updated_at = CURRENT_TIMESTAMP(), view_scoped = TRUE
+        WHEN NOT MATCHED THEN
+            INSERT (view_name, watermark, updated_at, view_scoped)
+            VALUES (s.view_name, s.watermark, CURRENT_TIMESTAMP(), TRUE);
+        
+        COMMIT TRANSACTION;
+        """
+        
+        job, _ = self._run(query, [
+            ("target", "TIMESTAMP", target_date),
+            ("watermark", "TIMESTAMP", watermark),
+            ("scan_start", "TIMESTAMP", scan_start),
+            ("view_name", "STRING", view.name),
+        ])
+        
+        stats = {
+            'view': view.name,
+            'watermark': watermark,
+            'target': target_date,
+            'incremental': not needs_full_history,
+            'bytes_processed': getattr(job, 'total_bytes_processed', None),
+            'skipped': False
+        }
+        logger.info(f"Materialized features for view: {view.name} ({stats})")
+        return stats
+    
+    async def push_to_online(
+        self,
+        view: FeatureView,
+        online_store: OnlineFeatureStore,
+        feature_timestamp: datetime = None,
+        chunk_size: int = 1000,
+        ttl_seconds: int = None
+    ) -> int:
+        """
+        Envia o snapshot materializado (padrão: o do watermark) para o
+        online store em lotes. Usa vetores binários quando o online store
+        tem um codec para a view; senão o formato JSON por entity.
         """
+        feature_timestamp = feature_timestamp or self.get_watermark(view.name)
+        if feature_timestamp is None:
+            return 0
+        
+        ttl_seconds = ttl_seconds or int(view.online_ttl.total_seconds())
+        view_name = None
+        if online_store.registry is not None:
+            try:
+                online_store.registry.get_codec(view.name)
+                view_name = view.name
+            except (KeyError, ValueError):
+                view_name = None
+        
+        _, rows = self._run(f"""
+        SELECT entity_id, {', '.join(view.features)}
+        FROM `{self._features_table(view.entity)}`
+        WHERE view_name = @view_name
+          AND feature_timestamp = @feature_timestamp
+        """, [
+            ("view_name", "STRING", view.name),
+            ("feature_timestamp", "TIMESTAMP", feature_timestamp),
+        ])
         
-        job = self.bq.query(query)
-        job.result()
+        pushed = 0
+        batch: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            record = dict(row)
+            batch[record.pop('entity_id')] = record
+            if len(batch) >= chunk_size:
+                await online_store.set_batch(view.entity, batch, ttl_seconds, view_name=view_name)
+                pushed += len(batch)
+                batch = {}
+        if batch:
+            await online_store.set_batch(view.entity, batch, ttl_seconds, view_name=view_name)
+            pushed += len(batch)
         
-        logger.info(f"Materialized features for view: {view.name}")
+        logger.info(f"Pushed {pushed} {view.name} vectors to the online store")
+        return pushed
 
 
 # =============================================================================
@@ -716,6 +1645,8 @@ __all__ = [
     'FeatureView',
     'FeatureVector',
     'FeatureRegistry',
+    'FeatureVectorCodec',
+    'LocalFeatureCache',
     'OnlineFeatureStore',
     'OfflineFeatureStore',
     'FeatureComputeEngine',
@@ -20,12 +20,15 @@ import os
 import json
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple, Set
+from typing import Dict, Any, List, Optional, Tuple, Set, Sequence
 from dataclasses import dataclass, field
 from enum import Enum
 from collections import defaultdict
 import hashlib
 import math
+import time
+import bisect
+import multiprocessing
 
 import numpy as np
 from scipy import stats
@@ -92,32 +95,247 @@ class DeviceFingerprint:
     fonts: List[str] = None
 
 
-@dataclass
 class UserBehaviorProfile:
-    """Perfil comportamental do usuário"""
-    user_id: str
+    """
+    Perfil comportamental do usuário.
+    
+    Horas/dias de acesso ficam em ring buffers de tamanho fixo (bytearray)
+    com soma e soma dos quadrados mantidas a cada escrita, então média e
+    desvio padrão das últimas HISTORY_SIZE horas são O(1) e exatos (valores
+    inteiros). Devices e localizações são listas curtas com limite fixo.
+    """
+    
+    HISTORY_SIZE = 100
+    MAX_DEVICES = 10
+    MAX_LOCATIONS = 5
+    
+    __slots__ = (
+        'user_id',
+        # Temporal patterns
+        '_hours', '_days', '_history_len', '_history_pos', '_hour_sum', '_hour_sq_sum',
+        'avg_session_duration', 'avg_events_per_session',
+        # Interaction patterns
+        'avg_scroll_depth', 'avg_time_on_page', 'click_pattern_variance',
+        # Device patterns
+        'known_devices', 'typical_locations',
+        # History
+        'total_sessions', 'total_purchases', 'total_value', 'first_seen', 'last_seen',
+    )
+    
+    def __init__(
+        self,
+        user_id: str,
+        typical_hours: List[int] = None,
+        typical_days: List[int] = None,
+        avg_session_duration: float = 0,
+        avg_events_per_session: float = 0,
+        avg_scroll_depth: float = 0,
+        avg_time_on_page: float = 0,
+        click_pattern_variance: float = 0,
+        known_devices: List[str] = None,
+        typical_locations: List[str] = None,
+        total_sessions: int = 0,
+        total_purchases: int = 0,
+        total_value: float = 0,
+        first_seen: datetime = None,
+        last_seen: datetime = None
+    ):
+        self.user_id = user_id
+        self._hours = bytearray(self.HISTORY_SIZE)
+        self._days = bytearray(self.HISTORY_SIZE)
+        self._history_len = 0
+        self._history_pos = 0
+        self._hour_sum = 0
+        self._hour_sq_sum = 0
+        self.avg_session_duration = avg_session_duration
+        self.avg_events_per_session = avg_events_per_session
+        self.avg_scroll_depth = avg_scroll_depth
+        self.avg_time_on_page = avg_time_on_page
+        self.click_pattern_variance = click_pattern_variance
+        self.known_devices = list(known_devices or [])[-self.MAX_DEVICES:]
+        self.typical_locations = list(typical_locations or [])[-self.MAX_LOCATIONS:]
+        self.total_sessions = total_sessions
+        self.total_purchases = total_purchases
+        self.total_value = total_value
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        
+        hours = list(typical_hours or [])[-self.HISTORY_SIZE:]
+        days = list(typical_days or [])[-self.HISTORY_SIZE:]
+        for index in range(max(len(hours), len(days))):
+            self.record_time(
+                hours[index] if index < len(hours) else 0,
+                days[index] if index < len(days) else 0
+            )
+    
+    def record_time(self, hour: int, day: int):
+        """Registra hora (0-23) e dia da semana (0-6) de um acesso"""
+        pos = self._history_pos
+        if self._history_len == self.HISTORY_SIZE:
+            old = self._hours[pos]
+            self._hour_sum -= old
+            self._hour_sq_sum -= old * old
+        else:
+            self._history_len += 1
+        
+        self._hours[pos] = hour
+        self._days[pos] = day
+        self._hour_sum += hour
+        self._hour_sq_sum += hour * hour
+        self._history_pos = (pos + 1) % self.HISTORY_SIZE
+    
+    def _chronological(self, buffer: bytearray) -> List[int]:
+        if self._history_len < self.HISTORY_SIZE:
+            return list(buffer[:self._history_len])
+        return list(buffer[self._history_pos:] + buffer[:self._history_pos])
+    
+    @property
+    def typical_hours(self) -> List[int]:
+        """Horas típicas de acesso (mais antigas primeiro)"""
+        return self._chronological(self._hours)
+    
+    @property
+    def typical_days(self) -> List[int]:
+        """Dias típicos (mais antigos primeiro)"""
+        return self._chronological(self._days)
     
-    # Temporal patterns
-    typical_hours: List[int] = None  # Horas típicas de acesso
-    typical_days: List[int] = None  # Dias típicos
-    avg_session_duration: float = 0
-    avg_events_per_session: float = 0
+    @property
+    def history_size(self) -> int:
+        return self._history_len
     
-    # Interaction patterns
-    avg_scroll_depth: float = 0
-    avg_time_on_page: float = 0
-    click_pattern_variance: float = 0
+    def hour_stats(self) -> Tuple[float, float]:
+        """(média, desvio padrão populacional) das horas registradas"""
+        n = self._history_len
+        if n == 0:
+            return 0.0, 0.0
+        # n^2 * var = n * sum(x^2) - sum(x)^2, exato em inteiros
+        return self._hour_sum / n, math.sqrt(n * self._hour_sq_sum - self._hour_sum ** 2) / n
     
-    # Device patterns
-    known_devices: List[str] = None
-    typical_locations: List[str] = None
+    def add_device(self, device_id: str):
+        if device_id not in self.known_devices:
+            self.known_devices.append(device_id)
+            if len(self.known_devices) > self.MAX_DEVICES:
+                del self.known_devices[0]
     
-    # History
-    total_sessions: int = 0
-    total_purchases: int = 0
-    total_value: float = 0
-    first_seen: datetime = None
-    last_seen: datetime = None
+    def add_location(self, location: str):
+        if location not in self.typical_locations:
+            self.typical_locations.append(location)
+            if len(self.typical_locations) > self.MAX_LOCATIONS:
+                del self.typical_locations[0]
+
+
+def _to_float(value) -> float:
+    """Valor numérico ou NaN (None/inválido)"""
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class FraudEventBatch:
+    """
+    Lote colunar de eventos para scoring vetorizado.
+    
+    Aceita lista de dicts, DataFrame (pandas), Table (pyarrow), NumPy
+    record/structured array ou dict de colunas. Valores ausentes (None/NaN)
+    assumem o mesmo default que event.get(name, default) usaria.
+    """
+    
+    def __init__(self, columns: Dict[str, Any], size: int = None):
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, values in columns.items():
+            array = np.asarray(values)
+            if array.dtype.kind == 'M':
+                array = np.array(array.astype('datetime64[us]').tolist(), dtype=object)
+            self.columns[name] = array
+        if size is None:
+            size = len(next(iter(self.columns.values()))) if self.columns else 0
+        self.size = size
+        self._lists: Dict[str, list] = {}
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> 'FraudEventBatch':
+        names = dict.fromkeys(name for record in records for name in record)
+        columns = {}
+        for name in names:
+            column = np.empty(len(records), dtype=object)
+            column[:] = [record.get(name) for record in records]
+            columns[name] = column
+        return cls(columns, size=len(records))
+    
+    @classmethod
+    def from_any(cls, events) -> 'FraudEventBatch':
+        """Converte lista de dicts, DataFrame, Arrow Table ou record array"""
+        if isinstance(events, cls):
+            return events
+        if isinstance(events, np.ndarray) and events.dtype.names:
+            return cls({name: events[name] for name in events.dtype.names}, size=len(events))
+        if hasattr(events, 'column_names') and hasattr(events, 'column'):  # pyarrow.Table
+            return cls(
+                {name: events.column(name).to_numpy(zero_copy_only=False) for name in events.column_names},
+                size=events.num_rows
+            )
+        if hasattr(events, 'columns') and hasattr(events, 'to_numpy'):  # pandas.DataFrame
+            return cls({name: events[name].to_numpy() for name in events.columns}, size=len(events))
+        if isinstance(events, dict):
+            return cls(events)
+        return cls.from_records(list(events))
+    
+    def values(self, name: str) -> list:
+        """Coluna como lista Python (None para ausentes)"""
+        cached = self._lists.get(name)
+        if cached is None:
+            column = self.columns.get(name)
+            if column is None:
+                cached = [None] * self.size
+            else:
+                cached = [
+                    None if (value is None or (isinstance(value, float) and value != value)) else value
+                    for value in column.tolist()
+                ]
+            self._lists[name] = cached
+        return cached
+    
+    def numeric(self, name: str, default: float = 0) -> np.ndarray:
+        column = self.columns.get(name)
+        if column is None:
+            return np.full(self.size, float(default))
+        if column.dtype.kind in 'biuf':
+            out = column.astype(np.float64)
+        else:
+            out = np.fromiter(map(_to_float, column.tolist()), dtype=np.float64, count=self.size)
+        out[np.isnan(out)] = default
+        return out
+    
+    def flag(self, name: str) -> np.ndarray:
+        """Truthiness por linha (ausente = False)"""
+        column = self.columns.get(name)
+        if column is None:
+            return np.zeros(self.size, dtype=bool)
+        if column.dtype.kind in 'biuf':
+            return np.nan_to_num(column.astype(np.float64)) != 0
+        return np.fromiter(map(bool, self.values(name)), dtype=bool, count=self.size)
+    
+    def strings(self, name: str) -> np.ndarray:
+        """Coluna como array de str ('' para ausentes)"""
+        return np.array([value if isinstance(value, str) else '' for value in self.values(name)], dtype=str)
+    
+    def take(self, indices) -> 'FraudEventBatch':
+        """Sub-lote com as linhas indicadas (na ordem dada)"""
+        indices = np.asarray(indices, dtype=np.intp)
+        return FraudEventBatch({name: column[indices] for name, column in self.columns.items()}, size=len(indices))
+    
+    def row(self, index: int) -> Dict[str, Any]:
+        """Evento como dict (chaves ausentes omitidas), para caminhos escalares"""
+        event = {}
+        for name in self.columns:
+            value = self.values(name)[index]
+            if value is not None:
+                event[name] = value
+        return event
 
 
 # =============================================================================
@@ -141,6 +359,7 @@ class FraudRuleEngine:
             'name': 'high_click_velocity',
             'category': FraudType.CLICK_FRAUD,
             'condition': lambda e: e.get('clicks_last_minute', 0) > 10,
+            'vector_condition': lambda b: b.numeric('clicks_last_minute', 0) > 10,
             'score': 0.8,
             'weight': 0.9,
             'description': 'Mais de 10 cliques por minuto'
@@ -150,6 +369,7 @@ class FraudRuleEngine:
             'name': 'datacenter_ip',
             'category': FraudType.BOT_TRAFFIC,
             'condition': lambda e: e.get('is_datacenter', False),
+            'vector_condition': lambda b: b.flag('is_datacenter'),
             'score': 0.7,
             'weight': 0.8,
             'description': 'IP de datacenter detectado'
@@ -159,6 +379,7 @@ class FraudRuleEngine:
             'name': 'missing_fingerprint',
             'category': FraudType.BOT_TRAFFIC,
             'condition': lambda e: not e.get('canvas_hash') and not e.get('webgl_hash'),
+            'vector_condition': lambda b: ~b.flag('canvas_hash') & ~b.flag('webgl_hash'),
             'score': 0.6,
             'weight': 0.7,
             'description': 'Fingerprint não disponível'
@@ -168,6 +389,7 @@ class FraudRuleEngine:
             'name': 'instant_conversion',
             'category': FraudType.CONVERSION_FRAUD,
             'condition': lambda e: e.get('time_to_conversion', 999) < 5,
+            'vector_condition': lambda b: b.numeric('time_to_conversion', 999) < 5,
             'score': 0.9,
             'weight': 0.95,
             'description': 'Conversão em menos de 5 segundos'
@@ -177,6 +399,7 @@ class FraudRuleEngine:
             'name': 'no_scroll',
             'category': FraudType.BOT_TRAFFIC,
             'condition': lambda e: e.get('scroll_depth', 0) == 0 and e.get('time_on_page', 0) > 10,
+            'vector_condition': lambda b: (b.numeric('scroll_depth', 0) == 0) & (b.numeric('time_on_page', 0) > 10),
             'score': 0.5,
             'weight': 0.6,
             'description': 'Tempo na página sem scroll'
@@ -186,6 +409,7 @@ class FraudRuleEngine:
             'name': 'vpn_detected',
             'category': FraudType.BOT_TRAFFIC,
             'condition': lambda e: e.get('is_vpn', False),
+            'vector_condition': lambda b: b.flag('is_vpn'),
             'score': 0.3,
             'weight': 0.4,
             'description': 'VPN detectado'
@@ -195,6 +419,7 @@ class FraudRuleEngine:
             'name': 'tor_detected',
             'category': FraudType.BOT_TRAFFIC,
             'condition': lambda e: e.get('is_tor', False),
+            'vector_condition': lambda b: b.flag('is_tor'),
             'score': 0.8,
             'weight': 0.9,
             'description': 'Tor exit node detectado'
@@ -204,6 +429,7 @@ class FraudRuleEngine:
             'name': 'headless_browser',
             'category': FraudType.BOT_TRAFFIC,
             'condition': lambda e: 'HeadlessChrome' in e.get('user_agent', ''),
+            'vector_condition': lambda b: np.char.find(b.strings('user_agent'), 'HeadlessChrome') >= 0,
             'score': 0.95,
             'weight': 1.0,
             'description': 'Navegador headless detectado'
@@ -213,6 +439,7 @@ class FraudRuleEngine:
             'name': 'suspicious_referrer',
             'category': FraudType.ATTRIBUTION_FRAUD,
             'condition': lambda e: self._is_suspicious_referrer(e.get('referrer', '')),
+            'vector_condition': lambda b: self._is_suspicious_referrer_batch(b.strings('referrer')),
             'score': 0.6,
             'weight': 0.7,
             'description': 'Referrer suspeito'
@@ -222,6 +449,7 @@ class FraudRuleEngine:
             'name': 'click_injection',
             'category': FraudType.ATTRIBUTION_FRAUD,
             'condition': lambda e: e.get('click_to_install_time', 999) < 2,
+            'vector_condition': lambda b: b.numeric('click_to_install_time', 999) < 2,
             'score': 0.85,
             'weight': 0.9,
             'description': 'Possível click injection'
@@ -236,8 +464,20 @@ class FraudRuleEngine:
         referrer_lower = referrer.lower()
         return any(p in referrer_lower for p in suspicious_patterns)
     
+    def _is_suspicious_referrer_batch(self, referrers: np.ndarray) -> np.ndarray:
+        """Versão vetorizada de _is_suspicious_referrer"""
+        lowered = np.char.lower(referrers)
+        mask = np.zeros(len(referrers), dtype=bool)
+        for pattern in ('click.', 'track.', 'redirect.', 'offer.', 'promo.', 'deal.'):
+            mask |= np.char.find(lowered, pattern) >= 0
+        return mask
+    
     def add_rule(self, rule: Dict):
-        """Adiciona uma regra"""
+        """
+        Adiciona uma regra.
+        'vector_condition' (opcional) recebe um FraudEventBatch e retorna
+        máscara booleana; sem ela, evaluate_batch aplica 'condition' por linha.
+        """
         self.rules.append(rule)
     
     def evaluate(self, event_data: Dict[str, Any]) -> List[FraudSignal]:
@@ -258,6 +498,38 @@ class FraudRuleEngine:
                 logger.warning(f"Rule {rule['name']} failed: {e}")
         
         return signals
+    
+    def evaluate_batch(self, batch: FraudEventBatch) -> np.ndarray:
+        """Máscara (eventos x regras), na ordem de self.rules"""
+        mask = np.zeros((len(batch), len(self.rules)), dtype=bool)
+        
+        for col, rule in enumerate(self.rules):
+            vector_condition = rule.get('vector_condition')
+            try:
+                if vector_condition is not None:
+                    mask[:, col] = vector_condition(batch)
+                    continue
+            except Exception as e:
+                logger.warning(f"Vector rule {rule['name']} failed, evaluating per event: {e}")
+            
+            for row in range(len(batch)):
+                try:
+                    mask[row, col] = bool(rule['condition'](batch.row(row)))
+                except Exception as e:
+                    logger.warning(f"Rule {rule['name']} failed: {e}")
+        
+        return mask
+    
+    def signal_for(self, col: int) -> FraudSignal:
+        """FraudSignal da regra na coluna col de evaluate_batch"""
+        rule = self.rules[col]
+        return FraudSignal(
+            name=rule['name'],
+            value=rule['score'],
+            weight=rule['weight'],
+            category=rule['category'],
+            description=rule['description']
+        )
 
 
 # =============================================================================
@@ -373,6 +645,39 @@ class MLFraudDetector:
         score = min(1.0, max(0.0, score))
         
         return score, contributions
+    
+    def _zscore_anomaly_batch(self, values: np.ndarray, feature: str) -> np.ndarray:
+        mean = self.feature_means.get(feature, 0)
+        std = self.feature_stds.get(feature, 1)
+        if std == 0:
+            return np.zeros(len(values))
+        return np.minimum(1.0, np.abs((values - mean) / std) / 3)
+    
+    def extract_features_batch(self, batch: FraudEventBatch) -> Dict[str, np.ndarray]:
+        """extract_features para um lote: uma coluna por feature"""
+        return {
+            'scroll_depth_anomaly': self._zscore_anomaly_batch(batch.numeric('scroll_depth', 0), 'scroll_depth'),
+            'time_anomaly': self._zscore_anomaly_batch(batch.numeric('time_on_page', 0), 'time_on_page'),
+            'interaction_anomaly': self._zscore_anomaly_batch(batch.numeric('interactions', 0), 'interactions'),
+            'trust_score': 1 - batch.numeric('trust_score', 0.5),
+            'biometric_score': 1 - batch.numeric('biometric_score', 0.5),
+            'velocity_anomaly': np.minimum(1.0, batch.numeric('events_per_minute', 0) / 20),
+        }
+    
+    def predict_batch(self, batch: FraudEventBatch) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        predict para um lote.
+        Returns: (scores, contribuições por feature)
+        """
+        features = self.extract_features_batch(batch)
+        
+        score = np.zeros(len(batch))
+        contributions = {}
+        for feature, values in features.items():
+            contributions[feature] = values * self.model_weights.get(feature, 0.1)
+            score += contributions[feature]
+        
+        return np.clip(score, 0.0, 1.0), contributions
 
 
 # =============================================================================
@@ -394,36 +699,19 @@ class BehavioralAnalyzer:
     ) -> UserBehaviorProfile:
         """Atualiza perfil do usuário com novo evento"""
         
-        if user_id not in self.user_profiles:
-            self.user_profiles[user_id] = UserBehaviorProfile(
+        profile = self.user_profiles.get(user_id)
+        if profile is None:
+            profile = self.user_profiles[user_id] = UserBehaviorProfile(
                 user_id=user_id,
-                typical_hours=[],
-                typical_days=[],
-                known_devices=[],
-                typical_locations=[],
                 first_seen=datetime.now()
             )
         
-        profile = self.user_profiles[user_id]
-        
         # Atualizar padrões temporais
         event_time = event_data.get('timestamp', datetime.now())
         if isinstance(event_time, (int, float)):
             event_time = datetime.fromtimestamp(event_time / 1000)
         
-        hour = event_time.hour
-        if profile.typical_hours:
-            profile.typical_hours.append(hour)
-            profile.typical_hours = profile.typical_hours[-100:]  # Keep last 100
-        else:
-            profile.typical_hours = [hour]
-        
-        day = event_time.weekday()
-        if profile.typical_days:
-            profile.typical_days.append(day)
-            profile.typical_days = profile.typical_days[-100:]
-        else:
-            profile.typical_days = [day]
+        profile.record_time(event_time.hour, event_time.weekday())
         
         # Atualizar métricas
         profile.avg_scroll_depth = (
@@ -438,17 +726,13 @@ class BehavioralAnalyzer:
         
         # Atualizar devices
         device_id = event_data.get('device_id') or event_data.get('canvas_hash')
-        if device_id and profile.known_devices is not None:
-            if device_id not in profile.known_devices:
-                profile.known_devices.append(device_id)
-                profile.known_devices = profile.known_devices[-10:]
+        if device_id:
+            profile.add_device(device_id)
         
         # Atualizar locations
         location = event_data.get('city') or event_data.get('country')
-        if location and profile.typical_locations is not None:
-            if location not in profile.typical_locations:
-                profile.typical_locations.append(location)
-                profile.typical_locations = profile.typical_locations[-5:]
+        if location:
+            profile.add_location(location)
         
         profile.last_seen = datetime.now()
         profile.total_sessions += 1
@@ -479,9 +763,9 @@ class BehavioralAnalyzer:
         
         # 1. Anomalia temporal
         hour = event_time.hour
-        if profile.typical_hours:
-            hour_mean = np.mean(profile.typical_hours)
-            hour_std = np.std(profile.typical_hours) or 3
+        if profile.history_size:
+            hour_mean, hour_std = profile.hour_stats()
+            hour_std = hour_std or 3
             
             if abs(hour - hour_mean) > 2 * hour_std:
                 signals.append(FraudSignal(
@@ -532,6 +816,277 @@ class BehavioralAnalyzer:
         return signals
 
 
+# =============================================================================
+# CARDINALITY SKETCHES
+# =============================================================================
+
+def _hash64(value: str) -> int:
+    """Hash estável de 64 bits (igual entre processos e restarts)"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    Sketch de cardinalidade com 2^precision registros de 1 byte.
+    Erro padrão ~1.04/sqrt(2^precision) (3.2% com precision=10).
+    """
+    
+    def __init__(self, precision: int = 10, registers: np.ndarray = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+    
+    def add_hash(self, hashed: int):
+        index = hashed >> (64 - self.precision)
+        remainder = (hashed << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - remainder.bit_length() + 1 if remainder else 64 - self.precision + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def add(self, value: str):
+        self.add_hash(_hash64(value))
+    
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+    
+    def count(self) -> float:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting para cardinalidades pequenas
+            return m * math.log(m / zeros)
+        return float(estimate)
+
+
+class WindowedCardinality:
+    """
+    Cardinalidade de membros distintos por chave numa janela deslizante.
+    
+    A janela é dividida em buckets de tempo; cada bucket de uma chave guarda
+    os hashes exatos (até sparse_limit) e depois vira um HyperLogLog. Contar
+    "últimas N horas" une os buckets do período. Memória por chave é limitada
+    a n_buckets * 2^precision bytes, e buckets fora da janela são descartados.
+    Timestamps no futuro (clock skew) contam no bucket atual do relógio.
+    
+    add() registra os buckets alterados e as chaves novas desde o último
+    drain_changes(), para sincronizar só o delta entre shards.
+    """
+    
+    def __init__(
+        self,
+        bucket_seconds: int = 3600,
+        n_buckets: int = 24,
+        precision: int = 10,
+        sparse_limit: int = 32
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.n_buckets = n_buckets
+        self.precision = precision
+        self.sparse_limit = sparse_limit
+        # key -> bucket id -> set de hashes (sparse) ou registros HLL (dense)
+        self._buckets: Dict[str, Dict[int, Any]] = {}
+        self._expired_before = 0
+        # Desde o último drain_changes(): chave -> buckets alterados, chaves novas
+        self._changed: Dict[str, Set[int]] = {}
+        self._new_keys: Set[str] = set()
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+    
+    def _bucket_id(self, timestamp: Optional[float]) -> int:
+        return int((timestamp if timestamp is not None else time.time()) // self.bucket_seconds)
+    
+    def add(self, key: str, member: str, timestamp: float = None):
+        # Clamp to wall clock so a future timestamp cannot expire the window
+        bucket_id = min(self._bucket_id(timestamp), self._bucket_id(None))
+        self.expire(bucket_id)
+        if bucket_id < self._expired_before:
+            return  # Older than the window
+        
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = {}
+            self._new_keys.add(key)
+        self._changed.setdefault(key, set()).add(bucket_id)
+        bucket = buckets.get(bucket_id)
+        hashed = _hash64(member)
+        
+        if bucket is None:
+            buckets[bucket_id] = {hashed}
+        elif isinstance(bucket, set):
+            bucket.add(hashed)
+            if len(bucket) > self.sparse_limit:
+                sketch = HyperLogLog(self.precision)
+                for value in bucket:
+                    sketch.add_hash(value)
+                buckets[bucket_id] = sketch.registers
+        else:
+            HyperLogLog(self.precision, bucket).add_hash(hashed)
+    
+    def expire(self, current_bucket: int = None):
+        """Descarta buckets fora da janela (varredura completa uma vez por bucket)"""
+        if current_bucket is None:
+            current_bucket = self._bucket_id(None)
+        oldest = current_bucket - self.n_buckets + 1
+        if oldest <= self._expired_before:
+            return
+        self._expired_before = oldest
+        
+        for key in list(self._buckets):
+            buckets = self._buckets[key]
+            for bucket_id in [b for b in buckets if b < oldest]:
+                del buckets[bucket_id]
+            if not buckets:
+                del self._buckets[key]
+    
+    def count(self, key: str, window_seconds: float = None, now: float = None) -> float:
+        """Membros distintos da chave nos últimos window_seconds (padrão: janela toda)"""
+        buckets = self._buckets.get(key)
+        if not buckets:
+            return 0
+        
+        current = self._bucket_id(now)
+        span = self.n_buckets if window_seconds is None else max(1, math.ceil(window_seconds / self.bucket_seconds))
+        selected = [bucket for bucket_id, bucket in buckets.items() if current - span < bucket_id <= current]
+        
+        if all(isinstance(bucket, set) for bucket in selected):
+            return len(set().union(*selected))
+        
+        sketch = HyperLogLog(self.precision)
+        for bucket in selected:
+            if isinstance(bucket, set):
+                for value in bucket:
+                    sketch.add_hash(value)
+            else:
+                np.maximum(sketch.registers, bucket, out=sketch.registers)
+        return sketch.count()
+    
+    def drain_changes(self) -> Tuple[Dict[str, Set[int]], Set[str]]:
+        """Buckets alterados e chaves novas desde a última chamada (e zera os dois)"""
+        changed, new_keys = self._changed, self._new_keys
+        self._changed, self._new_keys = {}, set()
+        return changed, new_keys
+    
+    def merge(self, other: 'WindowedCardinality', known_only: bool = False):
+        """
+        Une outro sketch com a mesma configuração (ex.: de outro shard).
+        known_only: ignora chaves que este sketch não tem
+        """
+        for key, other_buckets in other._buckets.items():
+            if known_only and key not in self._buckets:
+                continue
+            buckets = self._buckets.setdefault(key, {})
+            for bucket_id, other_bucket in other_buckets.items():
+                bucket = buckets.get(bucket_id)
+                if bucket is None:
+                    buckets[bucket_id] = set(other_bucket) if isinstance(other_bucket, set) else other_bucket.copy()
+                    continue
+                if isinstance(bucket, set) and isinstance(other_bucket, set):
+                    bucket |= other_bucket
+                    if len(bucket) <= self.sparse_limit:
+                        continue
+                sketch = HyperLogLog(self.precision)
+                for part in (bucket, other_bucket):
+                    if isinstance(part, set):
+                        for value in part:
+                            sketch.add_hash(value)
+                    else:
+                        np.maximum(sketch.registers, part, out=sketch.registers)
+                buckets[bucket_id] = sketch.registers
+        self._expired_before = max(self._expired_before, other._expired_before)
+    
+    def memory_usage(self) -> Dict[str, int]:
+        sparse = dense = hashes = 0
+        for buckets in self._buckets.values():
+            for bucket in buckets.values():
+                if isinstance(bucket, set):
+                    sparse += 1
+                    hashes += len(bucket)
+                else:
+                    dense += 1
+        return {
+            'keys': len(self._buckets),
+            'sparse_buckets': sparse,
+            'dense_buckets': dense,
+            'approx_bytes': hashes * 8 + dense * (1 << self.precision)
+        }
+    
+    def to_arrays(
+        self,
+        prefix: str,
+        only_keys: Set[str] = None,
+        only_buckets: Dict[str, Set[int]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Estado como arrays NumPy (para np.savez, sem pickle).
+        only_keys filtra chaves; only_buckets, pares chave -> buckets
+        """
+        if only_buckets is not None:
+            items = (
+                (key, {b: self._buckets[key][b] for b in bucket_ids if b in self._buckets.get(key, ())})
+                for key, bucket_ids in only_buckets.items()
+            )
+        elif only_keys is not None:
+            items = ((key, self._buckets[key]) for key in only_keys if key in self._buckets)
+        else:
+            items = self._buckets.items()
+        
+        keys, entry_keys, bucket_ids, kinds = [], [], [], []
+        sparse_offsets, sparse_values, dense = [0], [], []
+        for key, buckets in items:
+            if not buckets:
+                continue
+            key_index = len(keys)
+            keys.append(key)
+            for bucket_id, bucket in buckets.items():
+                entry_keys.append(key_index)
+                bucket_ids.append(bucket_id)
+                if isinstance(bucket, set):
+                    kinds.append(0)
+                    sparse_values.extend(bucket)
+                else:
+                    kinds.append(1)
+                    dense.append(bucket)
+                sparse_offsets.append(len(sparse_values))
+        
+        return {
+            f'{prefix}keys': np.array(keys, dtype=str),
+            f'{prefix}entry_keys': np.array(entry_keys, dtype=np.int64),
+            f'{prefix}bucket_ids': np.array(bucket_ids, dtype=np.int64),
+            f'{prefix}kinds': np.array(kinds, dtype=np.uint8),
+            f'{prefix}sparse_offsets': np.array(sparse_offsets, dtype=np.int64),
+            f'{prefix}sparse_values': np.array(sparse_values, dtype=np.uint64),
+            f'{prefix}dense': (
+                np.stack(dense) if dense else np.zeros((0, 1 << self.precision), dtype=np.uint8)
+            ),
+            f'{prefix}expired_before': np.array([self._expired_before], dtype=np.int64),
+        }
+    
+    def load_arrays(self, arrays, prefix: str):
+        keys = arrays[f'{prefix}keys'].tolist()
+        offsets = arrays[f'{prefix}sparse_offsets'].tolist()
+        sparse_values = arrays[f'{prefix}sparse_values'].tolist()
+        dense = arrays[f'{prefix}dense']
+        
+        self._buckets = {}
+        dense_row = 0
+        entries = zip(
+            arrays[f'{prefix}entry_keys'].tolist(),
+            arrays[f'{prefix}bucket_ids'].tolist(),
+            arrays[f'{prefix}kinds'].tolist()
+        )
+        for entry, (key_index, bucket_id, kind) in enumerate(entries):
+            buckets = self._buckets.setdefault(keys[key_index], {})
+            if kind == 0:
+                buckets[bucket_id] = set(sparse_values[offsets[entry]:offsets[entry + 1]])
+            else:
+                buckets[bucket_id] = dense[dense_row].copy()
+                dense_row += 1
+        self._expired_before = int(arrays[f'{prefix}expired_before'][0])
+
+
 # =============================================================================
 # NETWORK ANALYZER
 # =============================================================================
@@ -539,62 +1094,105 @@ class BehavioralAnalyzer:
 class NetworkAnalyzer:
     """
     Analisa rede de devices/IPs para detectar fraude coordenada.
+    
+    Usuários por device/IP e devices por usuário são contados com sketches
+    janelados (memória limitada por chave, buckets antigos expiram). O
+    estado pode ser salvo/restaurado em disco com snapshot()/restore().
+    Com snapshot_path, o estado é restaurado na construção; um snapshot
+    incompatível é ignorado (com warning), mas restore() chamado
+    diretamente falha com ValueError.
     """
     
-    def __init__(self):
-        self.device_graph: Dict[str, Set[str]] = defaultdict(set)  # device -> users
-        self.ip_graph: Dict[str, Set[str]] = defaultdict(set)  # ip -> users
-        self.user_devices: Dict[str, Set[str]] = defaultdict(set)  # user -> devices
+    SNAPSHOT_VERSION = 2
+    GRAPHS = ('device_users', 'ip_users', 'user_devices')
+    
+    def __init__(
+        self,
+        window_hours: float = 24,
+        bucket_minutes: int = 60,
+        precision: int = 10,
+        snapshot_path: str = None
+    ):
+        self.window_hours = window_hours
+        bucket_seconds = bucket_minutes * 60
+        n_buckets = max(1, math.ceil(window_hours * 3600 / bucket_seconds))
+        
+        def sketch() -> WindowedCardinality:
+            return WindowedCardinality(bucket_seconds, n_buckets, precision)
+        
+        self.device_users = sketch()  # device -> users
+        self.ip_users = sketch()  # ip -> users
+        self.user_devices = sketch()  # user -> devices
+        
+        self.snapshot_path = snapshot_path
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                self.restore(self.snapshot_path)
+            except ValueError as e:
+                # Snapshot de outra versão/configuração: começa vazio
+                logger.warning(f"Ignoring network snapshot {self.snapshot_path}: {e}")
     
     def add_connection(
         self,
         user_id: str,
         device_id: str = None,
-        ip: str = None
+        ip: str = None,
+        timestamp: float = None
     ):
-        """Adiciona conexão ao grafo"""
+        """Adiciona conexão ao grafo (timestamp em segundos; padrão: agora)"""
         if device_id:
-            self.device_graph[device_id].add(user_id)
-            self.user_devices[user_id].add(device_id)
+            self.device_users.add(device_id, user_id, timestamp)
+            self.user_devices.add(user_id, device_id, timestamp)
         
         if ip:
-            self.ip_graph[ip].add(user_id)
+            self.ip_users.add(ip, user_id, timestamp)
+    
+    def users_per_device(self, device_id: str, hours: float = None) -> int:
+        return round(self.device_users.count(device_id, hours * 3600 if hours else None))
+    
+    def users_per_ip(self, ip: str, hours: float = None) -> int:
+        """Usuários distintos no IP nas últimas N horas (padrão: janela toda)"""
+        return round(self.ip_users.count(ip, hours * 3600 if hours else None))
+    
+    def devices_per_user(self, user_id: str, hours: float = None) -> int:
+        return round(self.user_devices.count(user_id, hours * 3600 if hours else None))
     
     def analyze_network(
         self,
         user_id: str,
         device_id: str = None,
-        ip: str = None
+        ip: str = None,
+        hours: float = None
     ) -> List[FraudSignal]:
         """Analisa rede para sinais de fraude"""
         signals = []
         
         # 1. Device compartilhado
         if device_id:
-            users_on_device = self.device_graph.get(device_id, set())
-            if len(users_on_device) > 5:
+            users_on_device = self.users_per_device(device_id, hours)
+            if users_on_device > 5:
                 signals.append(FraudSignal(
                     name='shared_device',
-                    value=min(1.0, len(users_on_device) / 20),
+                    value=min(1.0, users_on_device / 20),
                     weight=0.7,
                     category=FraudType.CLICK_FRAUD,
-                    description=f'Device usado por {len(users_on_device)} usuários'
+                    description=f'Device usado por {users_on_device} usuários'
                 ))
         
         # 2. IP com muitos usuários
         if ip:
-            users_on_ip = self.ip_graph.get(ip, set())
-            if len(users_on_ip) > 10:
+            users_on_ip = self.users_per_ip(ip, hours)
+            if users_on_ip > 10:
                 signals.append(FraudSignal(
                     name='high_ip_usage',
-                    value=min(1.0, len(users_on_ip) / 50),
+                    value=min(1.0, users_on_ip / 50),
                     weight=0.6,
                     category=FraudType.CLICK_FRAUD,
-                    description=f'IP usado por {len(users_on_ip)} usuários'
+                    description=f'IP usado por {users_on_ip} usuários'
                 ))
         
         # 3. Usuário com muitos devices
-        user_device_count = len(self.user_devices.get(user_id, set()))
+        user_device_count = self.devices_per_user(user_id, hours)
         if user_device_count > 5:
             signals.append(FraudSignal(
                 name='many_devices',
@@ -605,23 +1203,214 @@ class NetworkAnalyzer:
             ))
         
         return signals
+    
+    def merge(self, other: 'NetworkAnalyzer'):
+        """Une o estado de outro analyzer com a mesma configuração"""
+        for name in self.GRAPHS:
+            getattr(self, name).merge(getattr(other, name))
+    
+    def _config(self) -> np.ndarray:
+        """(precision, bucket_seconds, n_buckets) dos sketches"""
+        graph = self.device_users
+        return np.array([graph.precision, graph.bucket_seconds, graph.n_buckets], dtype=np.int64)
+    
+    def _check_state(self, arrays):
+        """Rejeita estado de outra versão ou configuração de sketch"""
+        version = int(arrays['version'][0])
+        if version != self.SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported network snapshot version: {version}")
+        config = arrays['config'].tolist()
+        if config != self._config().tolist():
+            raise ValueError(
+                f"Network snapshot config (precision, bucket_seconds, n_buckets) {config} "
+                f"does not match {self._config().tolist()}"
+            )
+    
+    def export_state(
+        self,
+        graphs: Sequence[str] = None,
+        only_keys: Dict[str, Set[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Estado como arrays NumPy (formato de snapshot, sem pickle).
+        only_keys: por grafo, exporta só essas chaves
+        """
+        arrays = {'version': np.array([self.SNAPSHOT_VERSION]), 'config': self._config()}
+        for name in graphs or self.GRAPHS:
+            keys = only_keys.get(name) if only_keys is not None else None
+            arrays.update(getattr(self, name).to_arrays(f'{name}__', keys))
+        return arrays
+    
+    def export_changes(self, graphs: Sequence[str] = None) -> Tuple[Dict[str, np.ndarray], Dict[str, Set[str]]]:
+        """
+        Só os buckets alterados desde a última chamada, e as chaves novas
+        por grafo (cujo estado anterior em outros shards ainda falta aqui)
+        """
+        arrays = {'version': np.array([self.SNAPSHOT_VERSION]), 'config': self._config()}
+        new_keys = {}
+        for name in graphs or self.GRAPHS:
+            graph = getattr(self, name)
+            changed, new_keys[name] = graph.drain_changes()
+            arrays.update(graph.to_arrays(f'{name}__', only_buckets=changed))
+        return arrays, new_keys
+    
+    def merge_state(self, arrays, known_only: bool = False):
+        """
+        Une estado exportado por export_state (ex.: de outro shard/nó).
+        known_only: só chaves que este analyzer já tem
+        """
+        self._check_state(arrays)
+        for name in self.GRAPHS:
+            if f'{name}__keys' in arrays:
+                graph = getattr(self, name)
+                other = WindowedCardinality(graph.bucket_seconds, graph.n_buckets, graph.precision, graph.sparse_limit)
+                other.load_arrays(arrays, f'{name}__')
+                graph.merge(other, known_only)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: getattr(self, name).memory_usage() for name in self.GRAPHS}
+    
+    def snapshot(self, path: str = None) -> str:
+        """Salva o estado em disco (escrita atômica, formato .npz sem pickle)"""
+        path = path or self.snapshot_path
+        if not path:
+            raise ValueError("No snapshot path configured")
+        
+        arrays = self.export_state()
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as fh:
+            np.savez_compressed(fh, **arrays)
+        os.replace(tmp_path, path)
+        return path
+    
+    def restore(self, path: str = None):
+        """Carrega estado salvo por snapshot() (mesma versão e configuração)"""
+        path = path or self.snapshot_path
+        with np.load(path, allow_pickle=False) as arrays:
+            self._check_state(arrays)
+            for name in self.GRAPHS:
+                getattr(self, name).load_arrays(arrays, f'{name}__')
+        logger.info(f"Restored network state from {path}: {self.get_stats()}")
 
 
 # =============================================================================
 # UNIFIED FRAUD DETECTOR
 # =============================================================================
 
+@dataclass
+class FraudBatchResult:
+    """Scores de um lote, em arrays alinhados com os eventos"""
+    scores: np.ndarray
+    risk_levels: np.ndarray  # RiskLevel por evento (dtype object)
+    actions: np.ndarray  # 'allow', 'review', 'block'
+    ml_scores: np.ndarray
+    confidences: np.ndarray
+    rule_mask: np.ndarray  # eventos x regras
+    ml_mask: np.ndarray  # eventos com sinal ml_fraud_score
+    ml_contributions: Dict[str, np.ndarray]
+    # Behavioral + network, por evento (na ordem de analyze)
+    extra_signals: List[List[FraudSignal]]
+    rule_signals: List[FraudSignal]  # um por coluna de rule_mask
+    
+    def __len__(self) -> int:
+        return len(self.scores)
+    
+    def signals(self, index: int) -> List[FraudSignal]:
+        """Sinais do evento, montados sob demanda"""
+        signals = [self.rule_signals[col] for col in np.flatnonzero(self.rule_mask[index])]
+        if self.ml_mask[index]:
+            ml_score = float(self.ml_scores[index])
+            signals.append(FraudSignal(
+                name='ml_fraud_score',
+                value=ml_score,
+                weight=FraudDetector.ML_SIGNAL_WEIGHT,
+                category=FraudType.BOT_TRAFFIC,
+                description=f'ML score: {ml_score:.2f}',
+                metadata={'contributions': {k: float(v[index]) for k, v in self.ml_contributions.items()}}
+            ))
+        return signals + self.extra_signals[index]
+    
+    def fraud_score(self, index: int) -> FraudScore:
+        """FraudScore completo de um evento (mesmo formato de analyze)"""
+        signals = self.signals(index)
+        fraud_types = {s.category for s in signals if s.name != 'ml_fraud_score'}
+        top_signals = sorted(signals, key=lambda s: s.value * s.weight, reverse=True)[:3]
+        explanation_parts = [f"{s.name}: {s.description}" for s in top_signals]
+        
+        return FraudScore(
+            score=float(self.scores[index]),
+            risk_level=self.risk_levels[index],
+            fraud_types=list(fraud_types),
+            signals=signals,
+            action=self.actions[index],
+            confidence=float(self.confidences[index]),
+            explanation="; ".join(explanation_parts) if explanation_parts else "Nenhum sinal de fraude detectado",
+            metadata={
+                'ml_score': float(self.ml_scores[index]),
+                'rule_signals': int(self.rule_mask[index].sum()),
+                'total_signals': len(signals)
+            }
+        )
+    
+    def to_fraud_scores(self) -> List[FraudScore]:
+        return [self.fraud_score(i) for i in range(len(self))]
+    
+    @classmethod
+    def gather(cls, parts: List[Tuple[np.ndarray, 'FraudBatchResult']], size: int) -> 'FraudBatchResult':
+        """Remonta resultados parciais (índices no lote original, resultado) em um só"""
+        first = parts[0][1]
+        
+        def scatter(attr: str, dtype=None) -> np.ndarray:
+            template = getattr(first, attr)
+            out = np.empty((size,) + template.shape[1:], dtype=dtype or template.dtype)
+            for indices, part in parts:
+                out[indices] = getattr(part, attr)
+            return out
+        
+        ml_contributions = {}
+        for name, values in first.ml_contributions.items():
+            column = np.empty(size, dtype=values.dtype)
+            for indices, part in parts:
+                column[indices] = part.ml_contributions[name]
+            ml_contributions[name] = column
+        
+        extra_signals: List[List[FraudSignal]] = [None] * size
+        for indices, part in parts:
+            for index, signals in zip(indices.tolist(), part.extra_signals):
+                extra_signals[index] = signals
+        
+        return cls(
+            scores=scatter('scores'),
+            risk_levels=scatter('risk_levels', object),
+            actions=scatter('actions', object),
+            ml_scores=scatter('ml_scores'),
+            confidences=scatter('confidences'),
+            rule_mask=scatter('rule_mask'),
+            ml_mask=scatter('ml_mask'),
+            ml_contributions=ml_contributions,
+            extra_signals=extra_signals,
+            rule_signals=first.rule_signals
+        )
+
+
 class FraudDetector:
     """
     Detector unificado de fraude.
     Combina rule engine, ML e behavioral analysis.
     """
     
+    # ML score vira sinal acima do threshold, com este peso
+    ML_SIGNAL_THRESHOLD = 0.3
+    ML_SIGNAL_WEIGHT = 0.8
+    
     def __init__(self):
         self.rule_engine = FraudRuleEngine()
         self.ml_detector = MLFraudDetector()
         self.behavioral_analyzer = BehavioralAnalyzer()
-        self.network_analyzer = NetworkAnalyzer()
+        self.network_analyzer = NetworkAnalyzer(snapshot_path=os.getenv('FRAUD_NETWORK_SNAPSHOT_PATH'))
         
         # Thresholds
         self.thresholds = {
@@ -684,11 +1473,11 @@ class FraudDetector:
         
         # 2. ML-based score
         ml_score, ml_contributions = self.ml_detector.predict(event_data)
-        if ml_score > 0.3:
+        if ml_score > self.ML_SIGNAL_THRESHOLD:
             all_signals.append(FraudSignal(
                 name='ml_fraud_score',
                 value=ml_score,
-                weight=0.8,
+                weight=self.ML_SIGNAL_WEIGHT,
                 category=FraudType.BOT_TRAFFIC,
                 description=f'ML score: {ml_score:.2f}',
                 metadata={'contributions': ml_contributions}
@@ -737,6 +1526,409 @@ class FraudDetector:
                 'total_signals': len(all_signals)
             }
         )
+    
+    def analyze_batch(
+        self,
+        events,
+        user_ids: Optional[Sequence[Optional[str]]] = None
+    ) -> FraudBatchResult:
+        """
+        Analisa um lote de eventos (lista de dicts, DataFrame, Arrow Table ou
+        record array). Regras e ML são avaliados como operações vetoriais;
+        behavioral e network (com estado) seguem a ordem dos eventos.
+        Equivalente a chamar analyze evento a evento.
+        
+        user_ids: um por evento; padrão é a coluna 'user_id' do lote
+        """
+        batch = FraudEventBatch.from_any(events)
+        n = len(batch)
+        if user_ids is None:
+            user_ids = batch.values('user_id')
+        
+        # 1. Rules as masks (accumulated in rule order, like _combine_signals)
+        rule_mask = self.rule_engine.evaluate_batch(batch)
+        rule_signals = [self.rule_engine.signal_for(col) for col in range(len(self.rule_engine.rules))]
+        weighted_sum = np.zeros(n)
+        total_weight = np.zeros(n)
+        signal_count = rule_mask.sum(axis=1)
+        for col, signal in enumerate(rule_signals):
+            hit = rule_mask[:, col]
+            weighted_sum += np.where(hit, signal.value * signal.weight, 0.0)
+            total_weight += np.where(hit, signal.weight, 0.0)
+        
+        # 2. ML
+        ml_scores, ml_contributions = self.ml_detector.predict_batch(batch)
+        ml_hit = ml_scores > self.ML_SIGNAL_THRESHOLD
+        weighted_sum += np.where(ml_hit, ml_scores * self.ML_SIGNAL_WEIGHT, 0.0)
+        total_weight += np.where(ml_hit, self.ML_SIGNAL_WEIGHT, 0.0)
+        signal_count += ml_hit
+        
+        extra_signals: List[List[FraudSignal]] = [[] for _ in range(n)]
+        
+        # 3-4. Stateful analyzers, in event order
+        device_ids = batch.values('device_id')
+        canvas_hashes = batch.values('canvas_hash')
+        ips = batch.values('ip')
+        for row, user_id in enumerate(user_ids):
+            if not user_id:
+                continue
+            event_data = batch.row(row)
+            self.behavioral_analyzer.update_profile(user_id, event_data)
+            signals = self.behavioral_analyzer.analyze_anomaly(user_id, event_data)
+            
+            device_id = device_ids[row] or canvas_hashes[row]
+            self.network_analyzer.add_connection(user_id, device_id, ips[row])
+            signals += self.network_analyzer.analyze_network(user_id, device_id, ips[row])
+            
+            for signal in signals:
+                weighted_sum[row] += signal.value * signal.weight
+                total_weight[row] += signal.weight
+            signal_count[row] += len(signals)
+            extra_signals[row].extend(signals)
+        
+        scores = np.divide(weighted_sum, total_weight, out=np.zeros(n), where=total_weight > 0)
+        
+        levels = np.array([RiskLevel.LOW, RiskLevel.MEDIUM, RiskLevel.HIGH, RiskLevel.CRITICAL], dtype=object)
+        level_index = np.searchsorted(
+            [self.thresholds[RiskLevel.MEDIUM], self.thresholds[RiskLevel.HIGH], self.thresholds[RiskLevel.CRITICAL]],
+            scores, side='right'
+        )
+        risk_levels = levels[level_index]
+        actions = np.array([self._get_action(level) for level in levels], dtype=object)[level_index]
+        
+        return FraudBatchResult(
+            scores=scores,
+            risk_levels=risk_levels,
+            actions=actions,
+            ml_scores=ml_scores,
+            confidences=np.minimum(0.95, 0.5 + signal_count * 0.05),
+            rule_mask=rule_mask,
+            ml_mask=ml_hit,
+            ml_contributions=ml_contributions,
+            extra_signals=extra_signals,
+            rule_signals=rule_signals
+        )
+
+
+# =============================================================================
+# SHARDED SCORING
+# =============================================================================
+
+class ConsistentHashRing:
+    """
+    Hash ring com nós virtuais: cada chave (user_id/IP) pertence a um nó, e
+    adicionar/remover um nó só move ~1/N das chaves. Serve tanto para
+    escolher o processo local quanto o nó do cluster que recebe o evento.
+    """
+    
+    def __init__(self, nodes: Sequence[str] = (), replicas: int = 64):
+        self.replicas = replicas
+        self._hashes: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+    
+    def __len__(self) -> int:
+        return len(self._owners) // self.replicas
+    
+    @property
+    def nodes(self) -> List[str]:
+        return list(dict.fromkeys(self._owners))
+    
+    def add_node(self, node: str):
+        for replica in range(self.replicas):
+            point = _hash64(f'{node}#{replica}')
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._owners.insert(index, node)
+    
+    def remove_node(self, node: str):
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._hashes = [self._hashes[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+    
+    def get_node(self, key: str) -> str:
+        if not self._owners:
+            raise ValueError("Hash ring has no nodes")
+        index = bisect.bisect(self._hashes, _hash64(key)) % len(self._hashes)
+        return self._owners[index]
+    
+    def assign(self, keys: Sequence[str]) -> List[str]:
+        """Nó de cada chave (busca vetorizada no ring)"""
+        if not self._owners:
+            raise ValueError("Hash ring has no nodes")
+        points = np.fromiter((_hash64(key) for key in keys), dtype=np.uint64, count=len(keys))
+        indices = np.searchsorted(np.array(self._hashes, dtype=np.uint64), points, side='right')
+        indices %= len(self._hashes)
+        return [self._owners[i] for i in indices.tolist()]
+
+
+class _FraudShard:
+    """Estado shared-nothing de um shard: um FraudDetector completo"""
+    
+    def __init__(self):
+        self.detector = FraudDetector()
+    
+    def handle(self, command: str, payload: Any = None) -> Any:
+        if command == 'analyze':
+            batch, user_ids = payload
+            return self.detector.analyze_batch(batch, user_ids)
+        if command == 'export_network':
+            graphs, only_keys = payload
+            return self.detector.network_analyzer.export_state(graphs, only_keys)
+        if command == 'export_network_changes':
+            return self.detector.network_analyzer.export_changes(payload)
+        if command == 'merge_network':
+            arrays, known_only = payload
+            self.detector.network_analyzer.merge_state(arrays, known_only)
+            return None
+        if command == 'stats':
+            return {
+                'profiles': len(self.detector.behavioral_analyzer.user_profiles),
+                'network': self.detector.network_analyzer.get_stats()
+            }
+        raise ValueError(f"Unknown shard command: {command}")
+
+
+def _fraud_shard_worker(conn):
+    """Loop do processo worker: recebe (comando, payload), responde (ok, resultado)"""
+    shard = _FraudShard()
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            break
+        if command == 'stop':
+            break
+        try:
+            conn.send((True, shard.handle(command, payload)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class _LocalShardHandle:
+    """Shard no próprio processo (processes=False), mesma interface do worker"""
+    
+    def __init__(self):
+        self.shard = _FraudShard()
+        self._reply = (True, None)
+    
+    def send(self, command: str, payload: Any = None):
+        # Erros chegam no recv, como no worker
+        try:
+            self._reply = (True, self.shard.handle(command, payload))
+        except Exception as e:
+            self._reply = (False, e)
+    
+    def recv(self) -> Any:
+        (ok, result), self._reply = self._reply, (True, None)
+        if not ok:
+            raise result
+        return result
+    
+    def close(self):
+        pass
+
+
+class _ProcessShardHandle:
+    """Shard em processo worker, falando por Pipe"""
+    
+    def __init__(self, context, name: str):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_fraud_shard_worker, args=(child_conn,), name=name, daemon=True)
+        self.process.start()
+        child_conn.close()
+    
+    def send(self, command: str, payload: Any = None):
+        self.conn.send((command, payload))
+    
+    def recv(self) -> Any:
+        ok, result = self.conn.recv()
+        if not ok:
+            raise RuntimeError(f"Fraud shard {self.process.name} failed: {result}")
+        return result
+    
+    def close(self):
+        try:
+            self.conn.send(('stop', None))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardedFraudDetector:
+    """
+    Scoring de fraude particionado em shards (um processo por core).
+    
+    Eventos são roteados por user_id (ou IP, sem usuário) num hash ring
+    consistente, então perfis comportamentais e devices por usuário ficam
+    inteiros em um único shard. Contagens por device/IP cruzam shards: a
+    cada sync_every lotes, cada shard envia só os buckets alterados desde
+    o último sync (mais o estado completo, vindo de todos os shards, das
+    chaves que algum shard viu pela primeira vez), e cada shard une esse
+    delta só nas chaves que já viu (união de sketches é idempotente).
+    Custo do sync e memória de um shard crescem com o delta e com as suas
+    chaves, não com o estado global. Entre syncs, sinais
+    shared_device/high_ip_usage veem só o estado local + último sync.
+    
+    Para vários nós, use ConsistentHashRing com os nomes dos nós na frente
+    deste detector e troque estado com export_network()/merge_network().
+    """
+    
+    # Grafos com chaves que não pertencem a um único usuário
+    SHARED_GRAPHS = ('device_users', 'ip_users')
+    
+    def __init__(
+        self,
+        n_shards: int = None,
+        processes: bool = True,
+        sync_every: int = None,
+        replicas: int = 64,
+        mp_context: str = None
+    ):
+        if n_shards is None:
+            n_shards = int(os.getenv('FRAUD_SHARDS', os.cpu_count() or 1))
+        if sync_every is None:
+            sync_every = int(os.getenv('FRAUD_SHARD_SYNC_EVERY', '10'))
+        self.n_shards = max(1, n_shards)
+        self.sync_every = sync_every
+        self.shard_names = [f'fraud-shard-{i}' for i in range(self.n_shards)]
+        self.ring = ConsistentHashRing(self.shard_names, replicas)
+        self._shard_index = {name: i for i, name in enumerate(self.shard_names)}
+        self._batches_since_sync = 0
+        
+        if processes:
+            context = multiprocessing.get_context(mp_context)
+            self._shards = [_ProcessShardHandle(context, name) for name in self.shard_names]
+        else:
+            self._shards = [_LocalShardHandle() for _ in self.shard_names]
+    
+    def __enter__(self) -> 'ShardedFraudDetector':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def route(self, user_id: str = None, ip: str = None) -> int:
+        """Índice do shard dono do evento"""
+        return self._shard_index[self.ring.get_node(user_id or ip or '')]
+    
+    def _dispatch(self, command: str, payloads: Dict[int, Any]) -> List[Any]:
+        """
+        Envia para todos antes de esperar (shards processam em paralelo) e lê
+        a resposta de cada shard despachado antes de propagar o primeiro erro,
+        para não deixar respostas pendentes nos pipes.
+        """
+        sent, error = [], None
+        for shard_index, payload in payloads.items():
+            try:
+                self._shards[shard_index].send(command, payload)
+            except Exception as e:
+                error = e
+                break
+            sent.append(shard_index)
+        
+        results = []
+        for shard_index in sent:
+            try:
+                results.append(self._shards[shard_index].recv())
+            except Exception as e:
+                results.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+    
+    def _broadcast(self, command: str, payloads: List[Any]) -> List[Any]:
+        return self._dispatch(command, dict(enumerate(payloads)))
+    
+    def analyze_batch(
+        self,
+        events,
+        user_ids: Optional[Sequence[Optional[str]]] = None
+    ) -> FraudBatchResult:
+        """
+        Analisa um lote distribuindo eventos pelos shards; resultado na
+        ordem original. Eventos de um mesmo usuário mantêm a ordem relativa.
+        """
+        batch = FraudEventBatch.from_any(events)
+        if user_ids is None:
+            user_ids = batch.values('user_id')
+        user_ids = list(user_ids)
+        ips = batch.values('ip')
+        
+        owners = self.ring.assign([
+            user_id or ip or '' for user_id, ip in zip(user_ids, ips)
+        ])
+        rows_by_shard: Dict[int, List[int]] = defaultdict(list)
+        for row, owner in enumerate(owners):
+            rows_by_shard[self._shard_index[owner]].append(row)
+        if not rows_by_shard:
+            rows_by_shard[0] = []
+        
+        indices = {shard_index: np.array(rows, dtype=np.intp) for shard_index, rows in rows_by_shard.items()}
+        results = self._dispatch('analyze', {
+            shard_index: (batch.take(indices[shard_index]), [user_ids[row] for row in rows])
+            for shard_index, rows in rows_by_shard.items()
+        })
+        result = FraudBatchResult.gather(list(zip(indices.values(), results)), len(batch))
+        
+        self._batches_since_sync += 1
+        if self.sync_every and self._batches_since_sync >= self.sync_every:
+            self.sync_network()
+        return result
+    
+    def analyze(self, event_data: Dict[str, Any], user_id: str = None) -> FraudScore:
+        """Analisa um único evento no shard dono do usuário"""
+        return self.analyze_batch([event_data], [user_id]).fraud_score(0)
+    
+    def _merged_network(self, states: Sequence[Dict[str, np.ndarray]]) -> NetworkAnalyzer:
+        """União de estados exportados pelos shards (sem restaurar snapshot)"""
+        merged = NetworkAnalyzer(snapshot_path=None)
+        for arrays in states:
+            merged.merge_state(arrays)
+        return merged
+    
+    def export_network(self) -> Dict[str, np.ndarray]:
+        """Estado de rede compartilhado (device/IP) unido de todos os shards"""
+        states = self._broadcast('export_network', [(self.SHARED_GRAPHS, None)] * self.n_shards)
+        return self._merged_network(states).export_state(self.SHARED_GRAPHS)
+    
+    def merge_network(self, arrays: Dict[str, np.ndarray]):
+        """Une estado de rede externo (ex.: de outro nó) em todos os shards"""
+        self._broadcast('merge_network', [(arrays, False)] * self.n_shards)
+    
+    def sync_network(self):
+        """Propaga contagens por device/IP alteradas desde o último sync (só chaves que cada shard já viu)"""
+        changes = self._broadcast('export_network_changes', [self.SHARED_GRAPHS] * self.n_shards)
+        states = [arrays for arrays, _ in changes]
+        
+        # Chave nova num shard: os buckets antigos dela nos outros não mudaram
+        new_keys = {
+            name: set().union(*(keys[name] for _, keys in changes)) for name in self.SHARED_GRAPHS
+        }
+        if any(new_keys.values()):
+            states += self._broadcast('export_network', [(self.SHARED_GRAPHS, new_keys)] * self.n_shards)
+        
+        delta = self._merged_network(states).export_state(self.SHARED_GRAPHS)
+        self._broadcast('merge_network', [(delta, True)] * self.n_shards)
+        self._batches_since_sync = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'n_shards': self.n_shards,
+            'batches_since_sync': self._batches_since_sync,
+            'shards': dict(zip(self.shard_names, self._broadcast('stats', [None] * self.n_shards)))
+        }
+    
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        self._shards = []
 
 
 # =============================================================================
@@ -748,9 +1940,15 @@ __all__ = [
     'RiskLevel',
     'FraudSignal',
     'FraudScore',
+    'FraudEventBatch',
+    'FraudBatchResult',
     'FraudDetector',
+    'ShardedFraudDetector',
+    'ConsistentHashRing',
     'FraudRuleEngine',
     'MLFraudDetector',
     'BehavioralAnalyzer',
+    'HyperLogLog',
+    'WindowedCardinality',
     'NetworkAnalyzer'
 ]
@@ -20,10 +20,11 @@ Técnicas:
 
 import os
 import json
-import hashlib
 import hmac
 import secrets
 import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple, Set
 from dataclasses import dataclass, field
@@ -128,17 +129,13 @@ class SecureHasher:
     Usa HMAC com salt compartilhado entre partes.
     """
     
+    DIGEST_SIZE = 32  # HMAC-SHA256
+    
     def __init__(self, shared_secret: str):
         self.secret = shared_secret.encode()
     
-    def hash_identifier(self, identifier: str, salt: str = "") -> str:
-        """Hash de identificador com HMAC"""
-        message = f"{identifier.lower().strip()}{salt}".encode()
-        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
-    
-    def hash_email(self, email: str) -> str:
-        """Hash de email normalizado"""
-        # Normalizar email
+    @staticmethod
+    def normalize_email(email: str) -> str:
         email = email.lower().strip()
         local, domain = email.split('@')
         
@@ -148,11 +145,10 @@ class SecureHasher:
             if '+' in local:
                 local = local.split('+')[0]
         
-        normalized = f"{local}@{domain}"
-        return self.hash_identifier(normalized)
+        return f"{local}@{domain}"
     
-    def hash_phone(self, phone: str, country_code: str = "55") -> str:
-        """Hash de telefone normalizado"""
+    @staticmethod
+    def normalize_phone(phone: str, country_code: str = "55") -> str:
         # Apenas dígitos
         digits = ''.join(filter(str.isdigit, phone))
         
@@ -160,7 +156,179 @@ class SecureHasher:
         if not digits.startswith(country_code):
             digits = country_code + digits
         
-        return self.hash_identifier(digits)
+        return digits
+    
+    def digest_identifier(self, identifier: str, salt: str = "") -> bytes:
+        """HMAC bruto (32 bytes) do identificador"""
+        message = f"{identifier.lower().strip()}{salt}".encode()
+        return hmac.digest(self.secret, message, 'sha256')
+    
+    def hash_identifier(self, identifier: str, salt: str = "") -> str:
+        """Hash de identificador com HMAC"""
+        return self.digest_identifier(identifier, salt).hex()
+    
+    def hash_email(self, email: str) -> str:
+        """Hash de email normalizado"""
+        return self.hash_identifier(self.normalize_email(email))
+    
+    def hash_phone(self, phone: str, country_code: str = "55") -> str:
+        """Hash de telefone normalizado"""
+        return self.hash_identifier(self.normalize_phone(phone, country_code))
+    
+    def digest_many(self, values: List[str], key_field: str = 'identifier') -> bytes:
+        """
+        Digests concatenados (32 bytes cada, na ordem de values), com a
+        normalização de email/phone conforme key_field
+        """
+        if key_field == 'email':
+            normalize = self.normalize_email
+        elif key_field == 'phone':
+            normalize = self.normalize_phone
+        else:
+            normalize = str
+        
+        secret = self.secret
+        digest = hmac.digest
+        return b''.join([
+            digest(secret, normalize(value).lower().strip().encode(), 'sha256')
+            for value in values
+        ])
+
+
+def _digest_chunk(shared_secret: bytes, key_field: str, values: List[str]) -> bytes:
+    """Worker de ProcessPoolExecutor para SecureHasher.digest_many"""
+    hasher = SecureHasher('')
+    hasher.secret = shared_secret
+    return hasher.digest_many(values, key_field)
+
+
+# =============================================================================
+# COLUMNAR PARTY STORE
+# =============================================================================
+
+def _column_array(values: List[Any]) -> np.ndarray:
+    """Numéricos/bool viram float64 (NaN = ausente); demais, object (None = ausente)"""
+    if all(value is None or isinstance(value, (int, float, np.number)) for value in values):
+        return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _missing_column(like: np.ndarray, size: int) -> np.ndarray:
+    if like.dtype == object:
+        return np.full(size, None, dtype=object)
+    return np.full(size, np.nan)
+
+
+def _as_object(column: np.ndarray) -> np.ndarray:
+    if column.dtype == object:
+        return column
+    out = column.astype(object)
+    out[np.isnan(column)] = None
+    return out
+
+
+def _truthy(column: Optional[np.ndarray], size: int) -> np.ndarray:
+    """Máscara de valores verdadeiros (ausente = False)"""
+    if column is None:
+        return np.zeros(size, dtype=bool)
+    if column.dtype == object:
+        return np.fromiter(map(bool, column.tolist()), dtype=bool, count=len(column))
+    return np.nan_to_num(column) != 0
+
+
+def _sorted_lookup(haystack: np.ndarray, needles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Para arrays ordenados e únicos: (máscara de needles presentes em
+    haystack, posição de cada needle em haystack)
+    """
+    if len(haystack) == 0:
+        return np.zeros(len(needles), dtype=bool), np.zeros(len(needles), dtype=np.intp)
+    positions = np.searchsorted(haystack, needles)
+    np.minimum(positions, len(haystack) - 1, out=positions)
+    return haystack[positions] == needles, positions
+
+
+class PartyColumnStore:
+    """
+    Dados hasheados de uma parte em formato colunar.
+    
+    hashes: digests HMAC de 32 bytes (dtype S32), ordenados e únicos.
+    columns: um array por campo, alinhado com hashes (float64 para campos
+    numéricos/bool, object para os demais). Overlaps entre partes são
+    buscas em arrays ordenados e agregações são gathers vetoriais.
+    """
+    
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=f'S{SecureHasher.DIGEST_SIZE}')
+        self.columns: Dict[str, np.ndarray] = {}
+    
+    def __len__(self) -> int:
+        return len(self.hashes)
+    
+    def _position(self, hashed_key: str) -> Optional[int]:
+        needle = np.array([bytes.fromhex(hashed_key)], dtype=self.hashes.dtype)
+        found, positions = _sorted_lookup(self.hashes, needle)
+        return int(positions[0]) if found[0] else None
+    
+    def __contains__(self, hashed_key: str) -> bool:
+        return self._position(hashed_key) is not None
+    
+    def get(self, hashed_key: str, default: Any = None) -> Optional[Dict[str, Any]]:
+        """Registro como dict (campos ausentes omitidos), pelo hash hex"""
+        position = self._position(hashed_key)
+        if position is None:
+            return default
+        record = {}
+        for name, column in self.columns.items():
+            value = column[position]
+            if value is None or (isinstance(value, float) and value != value):
+                continue
+            record[name] = value.item() if isinstance(value, np.generic) else value
+        record['_hash'] = hashed_key
+        return record
+    
+    def column(self, name: str) -> Optional[np.ndarray]:
+        return self.columns.get(name)
+    
+    def upsert(self, digests: np.ndarray, columns: Dict[str, np.ndarray]):
+        """
+        Adiciona registros (digests não ordenados). Hash repetido substitui
+        o registro inteiro; no mesmo lote, vale a última ocorrência.
+        Só o lote é ordenado; ele entra no store por merge (searchsorted +
+        insert), então cada ingestão custa O(lote log lote + store).
+        """
+        # Stable sort + last occurrence of each hash in the batch
+        order = np.argsort(digests, kind='stable')
+        sorted_digests = digests[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[:-1] = sorted_digests[1:] != sorted_digests[:-1]
+        order = order[keep]
+        batch_hashes = sorted_digests[keep].astype(self.hashes.dtype)
+        
+        found, positions = _sorted_lookup(self.hashes, batch_hashes)
+        replaced = positions[found]
+        insert_at = np.searchsorted(self.hashes, batch_hashes[~found])
+        # Replaced rows shift by the inserts placed before them
+        replaced_after = replaced + np.searchsorted(insert_at, replaced, side='right')
+        
+        n_old = len(self.hashes)
+        merged = {}
+        for name in dict.fromkeys([*self.columns, *columns]):
+            old = self.columns.get(name)
+            new = columns.get(name)
+            if old is None:
+                old = _missing_column(new, n_old)
+            new = _missing_column(old, len(order)) if new is None else new[order]
+            if old.dtype != new.dtype:
+                old, new = _as_object(old), _as_object(new)
+            column = np.insert(old, insert_at, new[~found])
+            column[replaced_after] = new[found]
+            merged[name] = column
+        
+        self.hashes = np.insert(self.hashes, insert_at, batch_hashes[~found])
+        self.columns = merged
 
 
 # =============================================================================
@@ -242,20 +410,47 @@ class CleanRoomEngine:
     Engine principal do Data Clean Room.
     """
     
-    def __init__(self, shared_secret: str):
+    # Campos com PII nunca armazenados
+    PII_FIELDS = ('email', 'phone', 'name', 'address')
+    
+    # Hashing em processos separados a partir deste volume
+    HASH_PARALLEL_MIN = 100_000
+    HASH_CHUNK_SIZE = 50_000
+    
+    def __init__(self, shared_secret: str, hash_workers: int = None):
         self.hasher = SecureHasher(shared_secret)
         self.dp = DifferentialPrivacy()
+        self.hash_workers = hash_workers or int(os.getenv('CLEAN_ROOM_HASH_WORKERS', os.cpu_count() or 1))
         
         self.parties: Dict[str, DataParty] = {}
-        self.data_stores: Dict[str, Dict[str, Dict]] = {}  # party_id -> hash -> data
+        self.data_stores: Dict[str, PartyColumnStore] = {}  # party_id -> hashes + columns
         self.queries: Dict[str, CleanRoomQuery] = {}
     
     def register_party(self, party: DataParty):
         """Registra uma parte no clean room"""
         self.parties[party.id] = party
-        self.data_stores[party.id] = {}
+        self.data_stores[party.id] = PartyColumnStore()
         logger.info(f"Registered party: {party.name}")
     
+    def _digest_keys(self, keys: List[str], key_field: str) -> np.ndarray:
+        """Digests HMAC (S32) das chaves, em paralelo para volumes grandes"""
+        if len(keys) >= self.HASH_PARALLEL_MIN and self.hash_workers > 1:
+            chunks = [
+                keys[start:start + self.HASH_CHUNK_SIZE]
+                for start in range(0, len(keys), self.HASH_CHUNK_SIZE)
+            ]
+            with ProcessPoolExecutor(max_workers=self.hash_workers) as executor:
+                parts = list(executor.map(
+                    _digest_chunk,
+                    [self.hasher.secret] * len(chunks),
+                    [key_field] * len(chunks),
+                    chunks
+                ))
+            raw = b''.join(parts)
+        else:
+            raw = self.hasher.digest_many(keys, key_field)
+        return np.frombuffer(raw, dtype=f'S{SecureHasher.DIGEST_SIZE}')
+    
     def ingest_data(
         self,
         party_id: str,
@@ -272,32 +467,28 @@ class CleanRoomEngine:
         party = self.parties[party_id]
         store = self.data_stores[party_id]
         
-        for record in records:
-            key_value = record.get(key_field)
-            if not key_value:
-                continue
-            
-            # Hash the key
-            if key_field == 'email':
-                hashed_key = self.hasher.hash_email(key_value)
-            elif key_field == 'phone':
-                hashed_key = self.hasher.hash_phone(key_value)
-            else:
-                hashed_key = self.hasher.hash_identifier(key_value)
-            
-            # Store without PII
-            safe_record = {
-                k: v for k, v in record.items()
-                if k not in ['email', 'phone', 'name', 'address']
-            }
-            safe_record['_hash'] = hashed_key
-            
-            store[hashed_key] = safe_record
-            party.hashed_records += 1
+        kept = [record for record in records if record.get(key_field)]
+        keys = [record[key_field] for record in kept]
+        digests = self._digest_keys(keys, key_field)
+        
+        # Store without PII
+        names = dict.fromkeys(
+            name for record in kept for name in record if name not in self.PII_FIELDS
+        )
+        columns = {
+            name: _column_array([record.get(name) for record in kept])
+            for name in names
+        }
         
+        store.upsert(digests, columns)
+        party.hashed_records += len(kept)
         party.total_records = len(store)
         logger.info(f"Ingested {len(records)} records for party {party_id}")
     
+    def _store(self, party_id: str) -> PartyColumnStore:
+        store = self.data_stores.get(party_id)
+        return store if store is not None else PartyColumnStore()
+    
     def execute_overlap_query(
         self,
         query: CleanRoomQuery
@@ -309,30 +500,29 @@ class CleanRoomEngine:
         start_time = datetime.now()
         
         # Get data stores
-        initiator_store = self.data_stores.get(query.initiator, {})
+        initiator_store = self._store(query.initiator)
         
-        if not initiator_store:
+        if not len(initiator_store):
             return CleanRoomResult(
                 query_id=query.id,
                 success=False
             )
         
-        # Find overlapping hashes
-        initiator_hashes = set(initiator_store.keys())
+        # Find overlapping hashes (sorted-array lookups)
+        initiator_hashes = initiator_store.hashes
         
         overlap_counts = {}
-        total_overlap = set()
+        total_overlap = np.zeros(len(initiator_hashes), dtype=bool)
         
         for participant_id in query.participants:
-            participant_store = self.data_stores.get(participant_id, {})
-            participant_hashes = set(participant_store.keys())
-            
-            overlap = initiator_hashes & participant_hashes
-            overlap_counts[participant_id] = len(overlap)
+            overlap, _ = _sorted_lookup(self._store(participant_id).hashes, initiator_hashes)
+            overlap_counts[participant_id] = int(overlap.sum())
             total_overlap |= overlap
         
+        total_matched = int(total_overlap.sum())
+        
         # Privacy: Apply minimum aggregation
-        if len(total_overlap) < query.min_aggregation_size:
+        if total_matched < query.min_aggregation_size:
             return CleanRoomResult(
                 query_id=query.id,
                 success=True,
@@ -346,14 +536,14 @@ class CleanRoomEngine:
         if query.privacy_level in [PrivacyLevel.HIGH, PrivacyLevel.MAXIMUM]:
             self.dp.epsilon = query.noise_epsilon
             
-            noisy_overlap = self.dp.privatize_count(len(total_overlap))
+            noisy_overlap = self.dp.privatize_count(total_matched)
             noisy_counts = {
                 pid: self.dp.privatize_count(count)
                 for pid, count in overlap_counts.items()
             }
             noise_added = True
         else:
-            noisy_overlap = len(total_overlap)
+            noisy_overlap = total_matched
             noisy_counts = overlap_counts
             noise_added = False
         
@@ -388,16 +578,21 @@ class CleanRoomEngine:
         start_time = datetime.now()
         
         # Find overlap first
-        initiator_store = self.data_stores.get(query.initiator, {})
-        initiator_hashes = set(initiator_store.keys())
+        initiator_store = self._store(query.initiator)
+        initiator_hashes = initiator_store.hashes
         
-        overlap_hashes = initiator_hashes.copy()
+        overlap_mask = np.ones(len(initiator_hashes), dtype=bool)
+        participant_positions = []
         
         for participant_id in query.participants:
-            participant_store = self.data_stores.get(participant_id, {})
-            overlap_hashes &= set(participant_store.keys())
+            participant_store = self._store(participant_id)
+            found, positions = _sorted_lookup(participant_store.hashes, initiator_hashes)
+            overlap_mask &= found
+            participant_positions.append((participant_store, positions))
+        
+        n_overlap = int(overlap_mask.sum())
         
-        if len(overlap_hashes) < query.min_aggregation_size:
+        if n_overlap < query.min_aggregation_size:
             return CleanRoomResult(
                 query_id=query.id,
                 success=True,
@@ -405,30 +600,33 @@ class CleanRoomEngine:
                 aggregates={'suppressed': True}
             )
         
+        # Rows of each party's store for the overlapping hashes
+        gathers = [(initiator_store, np.flatnonzero(overlap_mask))] + [
+            (store, positions[overlap_mask]) for store, positions in participant_positions
+        ]
+        
         # Calculate aggregates
         aggregates = {}
         
         for metric in query.metrics:
             if metric == 'count':
-                value = len(overlap_hashes)
+                value = n_overlap
             elif metric == 'revenue':
                 # Sum revenue from overlapping records
-                total = 0
-                for h in overlap_hashes:
-                    for party_id in [query.initiator] + query.participants:
-                        record = self.data_stores[party_id].get(h, {})
-                        total += record.get('revenue', 0)
+                total = 0.0
+                for store, rows in gathers:
+                    column = store.column('revenue')
+                    if column is not None:
+                        total += float(np.nansum(column[rows].astype(np.float64)))
                 value = total
             elif metric == 'conversions':
-                # Count conversions
-                count = 0
-                for h in overlap_hashes:
-                    for party_id in [query.initiator] + query.participants:
-                        record = self.data_stores[party_id].get(h, {})
-                        if record.get('converted'):
-                            count += 1
-                            break
-                value = count
+                # Count conversions (any party)
+                converted = np.zeros(n_overlap, dtype=bool)
+                for store, rows in gathers:
+                    column = store.column('converted')
+                    if column is not None:
+                        converted |= _truthy(column[rows], n_overlap)
+                value = int(converted.sum())
             else:
                 value = 0
             
@@ -448,8 +646,8 @@ class CleanRoomEngine:
         return CleanRoomResult(
             query_id=query.id,
             success=True,
-            total_matched=len(overlap_hashes),
-            match_rate=len(overlap_hashes) / max(1, len(initiator_hashes)),
+            total_matched=n_overlap,
+            match_rate=n_overlap / max(1, len(initiator_hashes)),
             aggregates=aggregates,
             privacy_level=query.privacy_level,
             noise_added=query.privacy_level in [PrivacyLevel.HIGH, PrivacyLevel.MAXIMUM],
@@ -467,14 +665,16 @@ class CleanRoomEngine:
         start_time = datetime.now()
         
         # Find converters in initiator
-        initiator_store = self.data_stores.get(query.initiator, {})
+        initiator_store = self._store(query.initiator)
+        n = len(initiator_store)
         
-        converters = {
-            h: r for h, r in initiator_store.items()
-            if r.get('converted') or r.get('purchased')
-        }
+        converter_mask = (
+            _truthy(initiator_store.column('converted'), n) |
+            _truthy(initiator_store.column('purchased'), n)
+        )
+        converter_hashes = initiator_store.hashes[converter_mask]
         
-        if len(converters) < query.min_aggregation_size:
+        if len(converter_hashes) < query.min_aggregation_size:
             return CleanRoomResult(
                 query_id=query.id,
                 success=True,
@@ -484,16 +684,24 @@ class CleanRoomEngine:
         # Check which converters were exposed by participants
         attribution = defaultdict(lambda: {'exposed': 0, 'converted': 0})
         
-        for h, converter in converters.items():
-            for participant_id in query.participants:
-                participant_store = self.data_stores.get(participant_id, {})
-                
-                if h in participant_store:
-                    exposure = participant_store[h]
-                    channel = exposure.get('channel', participant_id)
-                    
-                    attribution[channel]['exposed'] += 1
-                    attribution[channel]['converted'] += 1
+        for participant_id in query.participants:
+            participant_store = self._store(participant_id)
+            found, positions = _sorted_lookup(participant_store.hashes, converter_hashes)
+            if not found.any():
+                continue
+            
+            channel_column = participant_store.column('channel')
+            if channel_column is None:
+                channels = Counter({participant_id: int(found.sum())})
+            else:
+                channels = Counter(
+                    participant_id if channel is None or channel != channel else channel
+                    for channel in channel_column[positions[found]].tolist()
+                )
+            
+            for channel, exposed in channels.items():
+                attribution[channel]['exposed'] += exposed
+                attribution[channel]['converted'] += exposed
         
         # Privacy
         if query.privacy_level in [PrivacyLevel.HIGH, PrivacyLevel.MAXIMUM]:
@@ -510,10 +718,10 @@ class CleanRoomEngine:
         return CleanRoomResult(
             query_id=query.id,
             success=True,
-            total_matched=len(converters),
+            total_matched=len(converter_hashes),
             aggregates={
                 'attribution_by_channel': dict(attribution),
-                'total_converters': len(converters)
+                'total_converters': len(converter_hashes)
             },
             privacy_level=query.privacy_level,
             execution_time_ms=execution_time
@@ -643,5 +851,6 @@ __all__ = [
     'CleanRoomEngine',
     'CleanRoomAPI',
     'SecureHasher',
+    'PartyColumnStore',
     'DifferentialPrivacy'
 ]
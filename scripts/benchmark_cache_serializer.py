@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+S.S.I. SHADOW - Cache Serializer Benchmark
+Compares stored bytes and encode/decode time of CacheSerializer
+configurations on payloads shaped like DashboardDataService.get_overview
+and get_platforms.
+
+Run: python scripts/benchmark_cache_serializer.py [--iterations 2000]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _load_module(name: str, relative_path: str):
+    """Load a module by path (api.middleware's __init__ pulls in the auth stack)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+cache_module = _load_module("ssi_cache_middleware", "api/middleware/cache.py")
+CacheSerializer = cache_module.CacheSerializer
+config = cache_module.config
+
+PLATFORMS = ["meta", "tiktok", "google", "microsoft", "snapchat", "pinterest", "linkedin", "twitter", "bigquery"]
+
+
+def make_metric(current, previous):
+    change = ((current - previous) / previous * 100) if previous else 0
+    trend = "up" if change > 1 else ("down" if change < -1 else "stable")
+    return {
+        "current": round(current, 2),
+        "previous": round(previous, 2),
+        "change_percent": round(change, 2),
+        "trend": trend
+    }
+
+
+def overview_payload(rng: random.Random) -> dict:
+    """Same shape as DashboardDataService.get_overview."""
+    return {
+        "events_today": make_metric(rng.randint(1000, 900000), rng.randint(1000, 900000)),
+        "unique_users": make_metric(rng.randint(100, 90000), rng.randint(100, 90000)),
+        "revenue": make_metric(rng.uniform(100, 1e6), rng.uniform(100, 1e6)),
+        "conversion_rate": make_metric(rng.random() / 10, rng.random() / 10),
+        "avg_order_value": make_metric(rng.uniform(20, 400), rng.uniform(20, 400)),
+        "blocked_rate": make_metric(rng.random() / 20, rng.random() / 20),
+        "avg_trust_score": round(rng.random(), 4),
+        "last_updated": datetime.utcnow().isoformat(),
+        "period": "today",
+        "data_source": "bigquery"
+    }
+
+
+def platforms_payload(rng: random.Random) -> dict:
+    """Same shape as DashboardDataService.get_platforms."""
+    platforms = []
+    for name in PLATFORMS:
+        sent = rng.randint(0, 500000)
+        failed = rng.randint(0, sent // 50 + 1)
+        rate = (sent - failed) / sent if sent else 0
+        platforms.append({
+            "platform": name,
+            "status": "healthy" if rate >= 0.99 else ("degraded" if rate >= 0.95 else "down"),
+            "events_sent": sent,
+            "events_failed": failed,
+            "success_rate": round(rate, 4),
+            "avg_latency_ms": round(rng.uniform(20, 400), 2),
+            "p99_latency_ms": round(rng.uniform(200, 2000), 2),
+            "errors_last_hour": rng.randint(0, 50),
+            "last_error": rng.choice([None, "Rate limit exceeded", "Invalid access token", "Timeout"]),
+            "last_success": (datetime.utcnow() - timedelta(seconds=rng.randint(0, 3600))).isoformat()
+        })
+    return {
+        "platforms": platforms,
+        "overall_status": "healthy",
+        "total_events_sent": sum(p["events_sent"] for p in platforms),
+        "overall_success_rate": round(rng.random(), 4),
+        "last_updated": datetime.utcnow().isoformat(),
+        "data_source": "bigquery"
+    }
+
+
+def configurations():
+    """(label, settings) pairs; skips codecs that aren't installed."""
+    configs = [("legacy json+zlib", {"legacy_format": True})]
+    codecs = ["json"]
+    if cache_module.ORJSON_AVAILABLE:
+        codecs.append("orjson")
+    if cache_module.MSGPACK_AVAILABLE:
+        codecs.append("msgpack")
+    compressions = ["none", "zlib"]
+    if cache_module.ZSTD_AVAILABLE:
+        compressions += ["zstd", "zstd+dict"]
+    for codec in codecs:
+        for compression in compressions:
+            configs.append((f"{codec}+{compression}", {"codec": codec, "compression": compression}))
+    return configs
+
+
+def apply(settings: dict, dictionaries: dict):
+    config.legacy_format = settings.get("legacy_format", False)
+    config.codec = settings.get("codec", "json")
+    compression = settings.get("compression", "zlib")
+    config.compression = "zstd" if compression.startswith("zstd") else compression
+    if cache_module.ZSTD_AVAILABLE:
+        CacheSerializer.load_zstd_dictionary(dictionaries.get(config.codec) if compression == "zstd+dict" else None)
+
+
+def bench(payloads, iterations: int):
+    start = time.perf_counter()
+    for i in range(iterations):
+        CacheSerializer.serialize(payloads[i % len(payloads)], compress=True)
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+    blobs = [CacheSerializer.serialize(p, compress=True) for p in payloads]
+    start = time.perf_counter()
+    for i in range(iterations):
+        CacheSerializer.deserialize(blobs[i % len(blobs)])
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+    avg_bytes = sum(len(b) for b in blobs) / len(blobs)
+    return avg_bytes, encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    # Dashboard payloads are small; compress everything to compare schemes
+    config.compression_threshold = 0
+
+    # One dictionary per codec, trained on that codec's encoding
+    dictionaries = {}
+    if cache_module.ZSTD_AVAILABLE:
+        training = [overview_payload(rng) for _ in range(500)] + [platforms_payload(rng) for _ in range(500)]
+        for _, settings in configurations():
+            codec = settings.get("codec")
+            if codec and codec not in dictionaries:
+                config.codec = codec
+                dictionaries[codec] = CacheSerializer.train_zstd_dictionary(training, dict_size=8 * 1024)
+
+    for name, factory in (("get_overview", overview_payload), ("get_platforms", platforms_payload)):
+        payloads = [factory(rng) for _ in range(args.samples)]
+        print(f"\n{name} ({args.samples} payloads, {args.iterations} iterations)")
+        print(f"{'configuration':<22}{'bytes':>10}{'encode us':>12}{'decode us':>12}")
+        for label, settings in configurations():
+            apply(settings, dictionaries)
+            avg_bytes, encode_us, decode_us = bench(payloads, args.iterations)
+            print(f"{label:<22}{avg_bytes:>10.0f}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+S.S.I. SHADOW - Attribution Tests
+Tests for the Shapley engine, the columnar MTA models and Markov attribution.
+"""
+
+import pytest
+import itertools
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from attribution.attribution_orchestrator import (
+    AttributionMethod,
+    AttributionOrchestrator,
+    Channel,
+    Conversion,
+    JourneyColumns,
+    MarkovAttributionModel,
+    MTACalculator,
+    ShapleyEngine,
+    TouchPoint,
+)
+
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+def make_conversion(channels, value=100.0, days_apart=1, conversion_id="c"):
+    """Conversion whose touch points are spaced days_apart, oldest first."""
+    touches = [
+        TouchPoint(channel=channel, timestamp=NOW - timedelta(days=days_apart * (len(channels) - i)))
+        for i, channel in enumerate(channels)
+    ]
+    return Conversion(
+        conversion_id=conversion_id, user_id="u", timestamp=NOW,
+        value=value, touch_points=touches
+    )
+
+
+def brute_force_shapley(masks, values, n):
+    """Average marginal contribution over every permutation of n players."""
+    def v(coalition):
+        return sum(value for mask, value in zip(masks, values) if mask & ~coalition == 0)
+
+    phi = np.zeros(n)
+    perms = list(itertools.permutations(range(n)))
+    for perm in perms:
+        coalition = 0
+        for player in perm:
+            phi[player] += v(coalition | (1 << player)) - v(coalition)
+            coalition |= 1 << player
+    return phi / len(perms)
+
+
+# =============================================================================
+# SHAPLEY
+# =============================================================================
+
+class TestShapleyEngine:
+
+    MASKS = np.array([0b001, 0b011, 0b110, 0b111, 0b010, 0b011], dtype=np.uint64)
+    VALUES = np.array([10.0, 50.0, 30.0, 80.0, 5.0, 25.0])
+
+    def test_exact_matches_permutation_definition(self):
+        phi, half_width = ShapleyEngine().compute(self.MASKS, self.VALUES, 3)
+
+        np.testing.assert_allclose(phi, brute_force_shapley(self.MASKS.tolist(), self.VALUES, 3))
+        assert np.all(half_width == 0)
+
+    def test_efficiency(self):
+        phi, _ = ShapleyEngine().compute(self.MASKS, self.VALUES, 3)
+        assert phi.sum() == pytest.approx(self.VALUES.sum())
+
+    def test_subset_sum(self):
+        table = np.arange(8, dtype=np.float64)
+        v = ShapleyEngine.subset_sum(table, 3)
+        for s in range(8):
+            assert v[s] == sum(table[t] for t in range(8) if t & ~s == 0)
+
+    def test_monte_carlo_close_to_exact(self):
+        rng = np.random.default_rng(0)
+        n = 6
+        masks = rng.integers(1, 1 << n, size=200).astype(np.uint64)
+        values = rng.uniform(1, 100, size=200)
+
+        exact, _ = ShapleyEngine().compute(masks, values, n)
+        estimate, half_width = ShapleyEngine(
+            max_exact_channels=2, n_permutations=4000, random_state=1
+        ).compute(masks, values, n)
+
+        assert estimate.sum() == pytest.approx(values.sum())
+        assert np.all(half_width > 0)
+        assert np.all(np.abs(estimate - exact) <= 2 * half_width)
+
+    def test_too_many_channels(self):
+        with pytest.raises(ValueError):
+            ShapleyEngine().compute(np.array([1], dtype=np.uint64), np.array([1.0]), 65)
+
+    def test_calculator_symmetric_channels(self):
+        conversions = [
+            make_conversion([Channel.META_PAID, Channel.GOOGLE_PAID], conversion_id="a"),
+            make_conversion([Channel.GOOGLE_PAID, Channel.META_PAID], conversion_id="b"),
+            Conversion(conversion_id="empty", user_id="u", timestamp=NOW, value=999.0),
+        ]
+        values, intervals = MTACalculator().calculate_shapley_with_intervals(conversions)
+
+        assert values == pytest.approx({Channel.META_PAID: 100.0, Channel.GOOGLE_PAID: 100.0})
+        low, high = intervals[Channel.META_PAID]
+        assert low == high == values[Channel.META_PAID]
+        assert MTACalculator().calculate_shapley([]) == {}
+
+
+# =============================================================================
+# COLUMNAR RULE-BASED MODELS
+# =============================================================================
+
+def reference_rule_based(conversions, half_life_days=7, first_weight=0.4, last_weight=0.4):
+    """Per-object loops the columnar models replace."""
+    results = {name: {} for name in ("last", "first", "linear", "decay", "position")}
+
+    def add(name, channel, credit):
+        results[name][channel] = results[name].get(channel, 0.0) + credit
+
+    for conv in conversions:
+        touches = conv.touch_points
+        n = len(touches)
+        if n == 0:
+            continue
+        add("last", touches[-1].channel, conv.value)
+        add("first", touches[0].channel, conv.value)
+        for touch in touches:
+            add("linear", touch.channel, conv.value / n)
+
+        weights = [
+            math.exp(-(conv.timestamp - touch.timestamp).days * math.log(2) / half_life_days)
+            for touch in touches
+        ]
+        for touch, weight in zip(touches, weights):
+            add("decay", touch.channel, conv.value * weight / sum(weights))
+
+        if n <= 2:
+            for touch in touches:
+                add("position", touch.channel, conv.value / n)
+        else:
+            add("position", touches[0].channel, conv.value * first_weight)
+            add("position", touches[-1].channel, conv.value * last_weight)
+            for touch in touches[1:-1]:
+                add("position", touch.channel, conv.value * (1 - first_weight - last_weight) / (n - 2))
+
+    return results
+
+
+def random_conversions(seed, count=300):
+    rng = np.random.default_rng(seed)
+    channels = list(Channel)
+    conversions = []
+    for i in range(count):
+        length = int(rng.integers(0, 7))
+        touches = [
+            TouchPoint(
+                channel=channels[int(rng.integers(len(channels)))],
+                timestamp=NOW - timedelta(hours=float(rng.uniform(0, 24 * 30)))
+            )
+            for _ in range(length)
+        ]
+        touches.sort(key=lambda touch: touch.timestamp)
+        conversions.append(Conversion(
+            conversion_id=str(i), user_id=str(i), timestamp=NOW,
+            value=float(rng.uniform(1, 500)), touch_points=touches
+        ))
+    return conversions
+
+
+class TestColumnarMTA:
+
+    def test_rule_based_matches_reference(self):
+        conversions = random_conversions(seed=3)
+        expected = reference_rule_based(conversions)
+        results = MTACalculator().calculate_rule_based(conversions)
+
+        pairs = {
+            AttributionMethod.LAST_CLICK: "last",
+            AttributionMethod.FIRST_CLICK: "first",
+            AttributionMethod.LINEAR: "linear",
+            AttributionMethod.TIME_DECAY: "decay",
+            AttributionMethod.POSITION_BASED: "position",
+        }
+        for method, name in pairs.items():
+            assert results[method] == pytest.approx(expected[name]), method
+
+    def test_list_and_columns_agree(self):
+        conversions = random_conversions(seed=4, count=50)
+        cols = JourneyColumns.from_conversions(conversions)
+        calculator = MTACalculator()
+
+        assert calculator.calculate_linear(cols) == calculator.calculate_linear(conversions)
+        assert calculator.calculate_time_decay(cols, 3) == calculator.calculate_time_decay(conversions, 3)
+
+    def test_from_arrays_layout(self):
+        cols = JourneyColumns.from_arrays(
+            channels=["a", "b"],
+            lengths=[2, 0, 1],
+            conversion_values=[10.0, 5.0, 4.0],
+            touch_channel=[0, 1, 1],
+            touch_age_seconds=[3600.0, 0.0, 0.0],
+        )
+
+        assert cols.offsets.tolist() == [0, 2, 2, 3]
+        assert cols.touch_conversion.tolist() == [0, 0, 2]
+        assert cols.touch_position.tolist() == [0, 1, 0]
+        masks, values = cols.channel_masks()
+        assert masks.tolist() == [0b11, 0b10]
+        assert values.tolist() == [10.0, 4.0]
+        assert MTACalculator().calculate_last_click(cols) == {"b": 14.0}
+
+    def test_empty_input(self):
+        calculator = MTACalculator()
+        assert all(result == {} for result in calculator.calculate_rule_based([]).values())
+        assert calculator.calculate_linear([Conversion("c", "u", NOW, value=1.0)]) == {}
+
+
+# =============================================================================
+# MARKOV
+# =============================================================================
+
+class TestMarkovAttribution:
+
+    def journeys(self):
+        converting = [
+            make_conversion([Channel.META_PAID, Channel.EMAIL], conversion_id="a"),
+            make_conversion([Channel.EMAIL], conversion_id="b"),
+        ]
+        non_converting = [make_conversion([Channel.META_PAID], value=0.0, conversion_id="n")]
+        return converting, non_converting
+
+    def test_removal_effects_by_hand(self):
+        # P(conv) = 2/3 * 1/2 + 1/3 = 2/3; without META 1/3, without EMAIL 0
+        converting, non_converting = self.journeys()
+        model = MarkovAttributionModel().update(converting).update(non_converting, converted=False)
+
+        effects = model.removal_effects()
+        assert effects[Channel.META_PAID] == pytest.approx(0.5)
+        assert effects[Channel.EMAIL] == pytest.approx(1.0)
+
+        credit = model.attribute()
+        assert credit[Channel.META_PAID] == pytest.approx(200.0 / 3)
+        assert credit[Channel.EMAIL] == pytest.approx(400.0 / 3)
+
+    def test_incremental_updates_match_single_batch(self):
+        conversions = random_conversions(seed=5, count=200)
+        batch = MarkovAttributionModel().update(conversions)
+
+        incremental = MarkovAttributionModel()
+        for start in range(0, len(conversions), 37):
+            incremental.update(conversions[start:start + 37])
+
+        assert incremental.n_paths == batch.n_paths
+        assert incremental.attribute() == pytest.approx(batch.attribute())
+
+    def test_credit_sums_to_converted_value(self):
+        conversions = random_conversions(seed=6, count=200)
+        credit = MTACalculator().calculate_markov(conversions)
+        converted = sum(conv.value for conv in conversions if conv.touch_points)
+        assert sum(credit.values()) == pytest.approx(converted)
+
+    def test_empty_model(self):
+        assert MarkovAttributionModel().attribute() == {}
+        assert MTACalculator().calculate_markov([]) == {}
+
+    def test_orchestrator_update_markov(self):
+        converting, non_converting = self.journeys()
+        orchestrator = AttributionOrchestrator()
+
+        orchestrator.update_markov(converting[:1])
+        credit = orchestrator.update_markov(converting[1:], non_converting)
+
+        assert orchestrator.markov_model.n_paths == 3
+        assert credit[Channel.EMAIL] == pytest.approx(400.0 / 3)
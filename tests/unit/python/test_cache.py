@@ -0,0 +1,469 @@
+"""
+S.S.I. SHADOW - Cache Middleware Tests
+Tests for the sharded L1 memory backend, the two-tier CacheManager, the
+@cache decorator and the versioned serializer.
+"""
+
+import pytest
+import asyncio
+import copy
+import importlib.util
+import json
+import pickle
+import time
+
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, ROOT)
+
+
+def _load_module(name: str, relative_path: str):
+    """Load a module by path (api.middleware's __init__ pulls in the auth stack)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+cache_module = _load_module("ssi_cache_middleware", "api/middleware/cache.py")
+MemoryBackend = cache_module.MemoryBackend
+CacheManager = cache_module.CacheManager
+CacheSerializer = cache_module.CacheSerializer
+
+
+class FakeRedisBackend:
+    """In-process stand-in for RedisBackend (values, TTLs, tags, publishes)."""
+
+    is_connected = True
+
+    def __init__(self):
+        self.data = {}
+        self.tags = {}
+        self.published = []
+
+    async def get_with_ttl(self, key):
+        if key not in self.data:
+            return None, -2
+        return self.data[key], 300
+
+    async def set(self, key, value, ttl):
+        self.data[key] = value
+        return True
+
+    async def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+    async def delete_pattern(self, pattern):
+        return 0
+
+    async def add_to_tag(self, tag, key, ttl):
+        self.tags.setdefault(tag, set()).add(key)
+        return True
+
+    async def invalidate_tag_keys(self, tag):
+        keys = self.tags.pop(tag, set())
+        for key in keys:
+            self.data.pop(key, None)
+        return keys
+
+    async def publish(self, channel, message):
+        self.published.append(message)
+        return True
+
+
+@pytest.fixture
+def redis_backend():
+    return FakeRedisBackend()
+
+
+@pytest.fixture
+def manager(redis_backend):
+    manager = CacheManager()
+    manager.redis_backend = redis_backend
+    manager._initialized = True
+    return manager
+
+
+# =============================================================================
+# MEMORY BACKEND (L1)
+# =============================================================================
+
+class TestMemoryBackend:
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction_by_items(self):
+        backend = MemoryBackend(max_items=2, num_shards=1)
+        await backend.set("a", b"1", 60)
+        await backend.set("b", b"2", 60)
+        assert await backend.get("a") == b"1"  # a becomes most recent
+
+        await backend.set("c", b"3", 60)
+
+        assert await backend.get("b") is None
+        assert await backend.get("a") == b"1"
+        assert backend.get_stats()["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_eviction_by_bytes(self):
+        backend = MemoryBackend(max_items=100, max_bytes=400, num_shards=1)
+        for i in range(5):
+            await backend.set(f"k{i}", b"x" * 100, 60)
+
+        stats = backend.get_stats()
+        assert stats["bytes"] <= 400
+        assert await backend.get("k4") == b"x" * 100
+        assert await backend.get("k0") is None
+
+    @pytest.mark.asyncio
+    async def test_expired_entries_are_misses(self):
+        backend = MemoryBackend(max_items=10, num_shards=1)
+        await backend.set("k", b"v", 0)
+        time.sleep(0.01)
+
+        assert await backend.get("k") is None
+        assert backend.get_stats()["expirations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_oversized_set_drops_previous_value(self):
+        backend = MemoryBackend(max_items=10, max_bytes=1024, num_shards=1)
+        await backend.set("k", b"old", 60)
+        await backend.add_to_tag("t", "k", 60)
+
+        assert await backend.set("k", b"x" * 4096, 60) is False
+        assert await backend.get("k") is None
+        assert await backend.get_tag_keys("t") == set()
+
+    @pytest.mark.asyncio
+    async def test_tags_follow_evictions(self):
+        backend = MemoryBackend(max_items=1, num_shards=1)
+        await backend.set("a", b"1", 60)
+        await backend.add_to_tag("t", "a", 60)
+        await backend.set("b", b"2", 60)
+
+        assert await backend.get_tag_keys("t") == set()
+
+    @pytest.mark.asyncio
+    async def test_invalidate_tag_and_pattern(self):
+        backend = MemoryBackend(max_items=100, num_shards=4)
+        for key in ("user:1", "user:2", "org:1"):
+            await backend.set(key, b"v", 60)
+        await backend.add_to_tag("users", "user:1", 60)
+
+        assert await backend.invalidate_tag("users") == 1
+        assert await backend.delete_pattern("user:*") == 1
+        assert await backend.keys("*") == ["org:1"]
+
+    def test_keys_spread_across_shards(self):
+        backend = MemoryBackend(max_items=1000, num_shards=8)
+        for i in range(200):
+            backend.set_value(f"k{i}", b"v", 60, 1)
+
+        assert sum(1 for shard in backend._shards if shard.data) > 1
+        assert backend.get_stats()["items"] == 200
+
+
+# =============================================================================
+# CACHE MANAGER (L1 + L2)
+# =============================================================================
+
+class TestCacheManagerL1:
+
+    @pytest.mark.asyncio
+    async def test_l1_hits_share_a_read_only_snapshot(self, manager):
+        await manager.set("k", {"items": [1, 2]}, ttl=60)
+
+        first, hit = await manager.get("k")
+        assert hit
+        with pytest.raises(TypeError):
+            first["items"].append(3)
+        with pytest.raises(TypeError):
+            first["new"] = 1
+
+        second, _ = await manager.get("k")
+        assert second is first
+        assert second == {"items": [1, 2]}
+        assert manager.get_stats()["l1_hits"] == 2
+
+    @pytest.mark.asyncio
+    async def test_snapshot_copies_are_mutable(self, manager):
+        await manager.set("k", {"items": [1, 2]}, ttl=60)
+        cached, _ = await manager.get("k")
+
+        editable = copy.deepcopy(cached)
+        editable["items"].append(3)
+        shallow = cached.copy()
+        shallow["new"] = 1
+
+        assert type(editable) is dict and type(editable["items"]) is list
+        assert pickle.loads(pickle.dumps(cached)) == {"items": [1, 2]}
+        assert CacheSerializer.deserialize(CacheSerializer.serialize(cached)) == {"items": [1, 2]}
+        assert (await manager.get("k"))[0] == {"items": [1, 2]}
+
+    @pytest.mark.asyncio
+    async def test_unfreezable_values_stay_serialized(self, manager):
+        await manager.set("k", {"ids": {1, 2}}, ttl=60)
+
+        first, _ = await manager.get("k")
+        second, _ = await manager.get("k")
+
+        assert first == second
+        assert first is not second
+
+    @pytest.mark.asyncio
+    async def test_caller_mutation_after_set_does_not_leak(self, manager):
+        value = {"a": 1}
+        await manager.set("k", value, ttl=60)
+        value["a"] = 2
+
+        cached, _ = await manager.get("k")
+        assert cached == {"a": 1}
+
+    @pytest.mark.asyncio
+    async def test_immutable_values_skip_deserialization(self, manager):
+        value = ("x", 1, frozenset({2}))
+        await manager.set("k", value, ttl=60)
+
+        cached, _ = await manager.get("k")
+        assert cached is value
+
+    @pytest.mark.asyncio
+    async def test_l2_hit_is_promoted_to_l1(self, manager, redis_backend):
+        full_key = manager._make_key("k")
+        redis_backend.data[full_key] = CacheSerializer.serialize({"v": 1})
+
+        assert await manager.get("k") == ({"v": 1}, True)
+        redis_backend.data.clear()
+        assert await manager.get("k") == ({"v": 1}, True)
+
+        stats = manager.get_stats()
+        assert (stats["l2_hits"], stats["l1_hits"]) == (1, 1)
+
+
+class TestCrossReplicaInvalidation:
+
+    @pytest.mark.asyncio
+    async def test_remote_invalidation_drops_l1(self, manager, redis_backend):
+        other = CacheManager()
+        other.redis_backend = redis_backend
+
+        await manager.set("k", "v1", ttl=60)
+        await other.set("k", "v2", ttl=60)
+        await manager._handle_invalidation(redis_backend.published[-1])
+
+        assert await manager.get("k") == ("v2", True)
+        assert manager.get_stats()["remote_invalidations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_own_messages_are_ignored(self, manager, redis_backend):
+        await manager.set("k", "v", ttl=60)
+        await manager._handle_invalidation(redis_backend.published[-1])
+
+        assert manager.get_stats()["remote_invalidations"] == 0
+        assert manager.memory_backend.get_value(manager._make_key("k")) == "v"
+
+    @pytest.mark.asyncio
+    async def test_tag_invalidation_broadcasts_keys(self, manager, redis_backend):
+        await manager.set("k", "v", ttl=60, tags=["dash"])
+        await manager.invalidate_tags(["dash"])
+
+        message = json.loads(redis_backend.published[-1])
+        assert message["keys"] == [manager._make_key("k")]
+        assert message["tags"] == ["dash"]
+        assert await manager.get("k") == (None, False)
+
+    @pytest.mark.asyncio
+    async def test_tag_invalidation_drops_promoted_l1_locally(self, manager, redis_backend):
+        full_key = manager._make_key("k")
+        redis_backend.data[full_key] = CacheSerializer.serialize("v")
+        redis_backend.tags["dash"] = {full_key}
+        assert await manager.get("k") == ("v", True)
+
+        await manager.invalidate_tags(["dash"])
+
+        assert manager.memory_backend.get_value(full_key) is None
+        assert await manager.get("k") == (None, False)
+
+    @pytest.mark.asyncio
+    async def test_pattern_invalidation_drops_l1(self, manager, redis_backend):
+        await manager.set("user:1", "v", ttl=60)
+        await manager.set("other", "w", ttl=60)
+        redis_backend.data.clear()
+
+        await manager.invalidate_pattern("user:*")
+
+        assert await manager.get("user:1") == (None, False)
+        assert await manager.get("other") == ("w", True)
+
+
+# =============================================================================
+# @cache DECORATOR
+# =============================================================================
+
+@pytest.fixture
+def global_manager(manager, monkeypatch):
+    monkeypatch.setattr(cache_module, "_cache_manager", manager)
+    return manager
+
+
+class TestCacheDecorator:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_run_once(self, global_manager):
+        calls = []
+
+        @cache_module.cache(ttl=60, early_refresh_beta=0)
+        async def load(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return {"key": key}
+
+        results = await asyncio.gather(*(load("a") for _ in range(10)))
+
+        assert calls == ["a"]
+        assert all(result == {"key": "a"} for result in results)
+        assert global_manager.get_stats()["coalesced"] == 9
+        assert await load("a") == {"key": "a"}
+        assert calls == ["a"]
+
+    @pytest.mark.asyncio
+    async def test_miss_and_hit_return_the_same_read_only_snapshot(self, global_manager):
+        @cache_module.cache(ttl=60, early_refresh_beta=0)
+        async def load():
+            await asyncio.sleep(0.01)
+            return {"items": [1, 2]}
+
+        first, coalesced = await asyncio.gather(load(), load())
+        hit = await load()
+
+        assert first is coalesced is hit
+        for result in (first, hit):
+            with pytest.raises(TypeError):
+                result["items"].append(3)
+            with pytest.raises(TypeError):
+                result["extra"] = True
+        assert copy.deepcopy(first) == {"items": [1, 2]}
+
+    @pytest.mark.asyncio
+    async def test_stale_value_served_while_revalidating(self, global_manager):
+        calls = []
+
+        @cache_module.cache(ttl=60, stale_ttl=60, early_refresh_beta=0)
+        async def load():
+            calls.append(1)
+            return "fresh"
+
+        await global_manager.set(load.cache_key(), {
+            cache_module._ENTRY_MARKER: 1,
+            "value": "stale",
+            "expires_at": time.time() - 1,
+            "delta": 0.01,
+        }, 120)
+
+        assert await load() == "stale"
+        await asyncio.sleep(0.01)  # background refresh
+
+        assert calls == [1]
+        assert await load() == "fresh"
+        assert global_manager.get_stats()["stale_served"] == 1
+
+    @pytest.mark.asyncio
+    async def test_unless_skips_caching(self, global_manager):
+        calls = []
+
+        @cache_module.cache(ttl=60, unless=lambda result: result is None)
+        async def load():
+            calls.append(1)
+            return None
+
+        await load()
+        await load()
+        assert len(calls) == 2
+
+    def test_xfetch_probability(self, monkeypatch):
+        monkeypatch.setattr(cache_module.random, "random", lambda: 0.5)
+        now = time.time()
+        assert not cache_module._should_refresh_early(now + 60, 0.5, 0)
+        assert not cache_module._should_refresh_early(now + 3600, 0.001, 1.0)
+        # Recompute cost far above the remaining TTL: always refresh early
+        assert cache_module._should_refresh_early(now + 1, 10.0, 1.0)
+
+
+# =============================================================================
+# SERIALIZATION
+# =============================================================================
+
+class TestCacheSerializer:
+
+    def test_header_and_round_trip(self):
+        data = CacheSerializer.serialize({"a": [1, 2, 3]})
+
+        assert data[0] == cache_module.FORMAT_MAGIC
+        assert data[1] == cache_module.FORMAT_VERSION
+        assert CacheSerializer.deserialize(data) == {"a": [1, 2, 3]}
+
+    def test_pickle_fallback_for_unsupported_values(self, monkeypatch):
+        monkeypatch.setattr(cache_module.config, "codec", "json")
+        value = {(1, 2): "tuple keys are not JSON"}
+
+        data = CacheSerializer.serialize(value)
+
+        assert data[2] == cache_module.CodecId.PICKLE
+        assert CacheSerializer.deserialize(data) == value
+
+    @pytest.mark.parametrize("compression", ["zlib", "zstd", "none"])
+    def test_compression_round_trip(self, monkeypatch, compression):
+        if compression == "zstd" and not cache_module.ZSTD_AVAILABLE:
+            pytest.skip("zstandard not installed")
+        monkeypatch.setattr(cache_module.config, "compression", compression)
+        value = {"rows": ["campaign-%d" % i for i in range(500)]}
+
+        data = CacheSerializer.serialize(value, compress=True)
+
+        assert CacheSerializer.deserialize(data) == value
+        if compression != "none":
+            assert data[3] != cache_module.CompressionId.NONE
+
+    def test_zstd_dictionary(self, monkeypatch):
+        if not cache_module.ZSTD_AVAILABLE:
+            pytest.skip("zstandard not installed")
+        monkeypatch.setattr(cache_module.config, "compression", "zstd")
+        monkeypatch.setattr(cache_module.config, "compression_threshold", 16)
+        samples = [{"org": i, "campaign": "summer-%d" % i, "spend": i * 1.5, "status": "active"} for i in range(2000)]
+        dictionary = CacheSerializer.train_zstd_dictionary(samples, dict_size=4096)
+
+        CacheSerializer.load_zstd_dictionary(dictionary)
+        try:
+            data = CacheSerializer.serialize(samples[7], compress=True)
+            assert data[3] == cache_module.CompressionId.ZSTD_DICT
+            assert CacheSerializer.deserialize(data) == samples[7]
+
+            CacheSerializer.load_zstd_dictionary(None)
+            with pytest.raises(ValueError):
+                CacheSerializer.deserialize(data)
+        finally:
+            CacheSerializer.load_zstd_dictionary(None)
+
+    def test_legacy_values_still_readable(self, monkeypatch):
+        monkeypatch.setattr(cache_module.config, "legacy_format", True)
+        legacy = CacheSerializer.serialize({"a": 1}, compress=True)
+        monkeypatch.setattr(cache_module.config, "legacy_format", False)
+
+        assert legacy.startswith(b"json:")
+        assert CacheSerializer.deserialize(legacy) == {"a": 1}
+        assert CacheSerializer.deserialize(b'{"plain": true}') == {"plain": True}
+
+    def test_unknown_version_rejected(self):
+        data = bytearray(CacheSerializer.serialize("v"))
+        data[1] = cache_module.FORMAT_VERSION + 1
+
+        with pytest.raises(ValueError):
+            CacheSerializer.deserialize(bytes(data))
+
+    @pytest.mark.asyncio
+    async def test_unreadable_l2_entry_is_a_miss(self, manager, redis_backend):
+        redis_backend.data[manager._make_key("k")] = bytes((cache_module.FORMAT_MAGIC, 99, 1, 0))
+
+        assert await manager.get("k") == (None, False)
+        assert manager.get_stats()["errors"] == 1
@@ -0,0 +1,383 @@
+"""
+S.S.I. SHADOW - CDP Tests
+Tests for identity resolution, compiled/columnar segments, incremental
+membership and lookalike search.
+"""
+
+import pytest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from cdp.customer_data_platform import (
+    CDPEngine,
+    IdentityIndex,
+    LookalikeModeler,
+    Segment,
+    SegmentCondition,
+)
+
+
+@pytest.fixture
+def cdp():
+    return CDPEngine()
+
+
+# =============================================================================
+# IDENTITY RESOLUTION
+# =============================================================================
+
+class TestIdentityIndex:
+
+    def test_find_follows_merge_chain(self):
+        index = IdentityIndex()
+        index.union("b", "c")
+        index.union("a", "b")
+
+        assert index.find("c") == "a"
+        # Path compression points c straight at the root
+        assert index._parent["c"] == "a"
+
+    def test_lookup_resolves_to_survivor(self):
+        index = IdentityIndex()
+        index.add("email", "e1", "b")
+        index.union("a", "b")
+
+        assert index.lookup("email", "e1") == "a"
+        assert index.lookup("email", None) is None
+        assert index.lookup("phone", "unknown") is None
+
+
+class TestIdentityResolution:
+
+    def test_same_email_returns_existing_profile(self, cdp):
+        profile = cdp.get_or_create_profile("ssi_1", email_hash="e1")
+        again = cdp.get_or_create_profile("ssi_2", email_hash="e1")
+
+        assert again is profile
+        assert profile.identity.device_ids == ["ssi_2"]
+        # The linked ssi_id finds the profile on its own
+        assert cdp.get_or_create_profile("ssi_2") is profile
+        assert len(cdp.profiles) == 1
+
+    def test_event_linking_two_profiles_merges_them(self, cdp):
+        older = cdp.get_or_create_profile("ssi_1", email_hash="e1")
+        newer = cdp.get_or_create_profile("ssi_2", phone_hash="p1")
+        older.created_at = datetime.now() - timedelta(days=1)
+        cdp.record_purchase("ssi_1", 100.0)
+        cdp.record_purchase("ssi_2", 50.0)
+
+        merged = cdp.get_or_create_profile("ssi_3", email_hash="e1", phone_hash="p1")
+
+        assert merged is older and newer is not older
+        assert set(cdp.profiles) == {"ssi_1"}
+        assert newer not in cdp.profiles.values()
+        assert cdp.get_profile("ssi_2") is older
+        assert merged.metrics.total_orders == 2
+        assert merged.metrics.total_revenue == 150.0
+        assert merged.identity.phone_hashes == ["p1"]
+        assert {"ssi_2", "ssi_3"} <= set(merged.identity.device_ids)
+        assert cdp.identity_index.lookup("phone", "p1") == "ssi_1"
+
+    def test_update_with_foreign_identifier_merges(self, cdp):
+        first = cdp.get_or_create_profile("ssi_1", email_hash="e1")
+        cdp.get_or_create_profile("ssi_2", email_hash="e2")
+
+        profile = cdp.update_profile("ssi_2", {"email_hash": "e1"})
+
+        assert profile is first
+        assert set(profile.identity.email_hashes) == {"e1", "e2"}
+        assert len(cdp.profiles) == 1
+
+    def test_merge_removes_merged_profile_from_segments(self, cdp):
+        cdp.get_or_create_profile("ssi_1", email_hash="e1")
+        other = cdp.get_or_create_profile("ssi_2", phone_hash="p1")
+        cdp.record_purchase("ssi_2", 10.0)
+        assert "ssi_2" in cdp.segment_members["recent_buyers"]
+        cdp.drain_membership_events()
+
+        cdp.merge_profiles(cdp.profiles["ssi_1"], other)
+
+        assert "ssi_2" not in cdp.segment_members["recent_buyers"]
+        assert "ssi_1" in cdp.segment_members["recent_buyers"]
+        events = {(e.profile_id, e.event_type) for e in cdp.drain_membership_events()
+                  if e.segment_id == "recent_buyers"}
+        assert events == {("ssi_2", "exit"), ("ssi_1", "enter")}
+
+
+# =============================================================================
+# SEGMENTS
+# =============================================================================
+
+def populate(cdp, count=200, seed=0):
+    rng = np.random.default_rng(seed)
+    countries = ["BR", "US", "PT", None]
+    for i in range(count):
+        profile = cdp.get_or_create_profile(f"ssi_{i}")
+        profile.metrics.total_revenue = float(rng.uniform(0, 2000))
+        profile.metrics.total_orders = int(rng.integers(0, 6))
+        profile.metrics.trust_score = float(rng.uniform(0, 1))
+        profile.metrics.purchase_probability = float(rng.uniform(0, 1))
+        profile.metrics.recency_days = int(rng.integers(0, 120))
+        profile.attributes.country = countries[int(rng.integers(len(countries)))]
+        profile.attributes.primary_device = "mobile" if rng.random() < 0.5 else "desktop"
+        profile.tags = ["vip"] if rng.random() < 0.2 else []
+        profile.custom_properties = {"plan": "pro"} if rng.random() < 0.3 else {}
+
+
+CUSTOM_SEGMENTS = [
+    Segment(id="br_big", name="BR big spenders", conditions=[
+        SegmentCondition("attributes.country", "eq", "BR"),
+        SegmentCondition("metrics.total_revenue", "gt", 1000),
+    ]),
+    Segment(id="latam_or_vip", name="LatAm or VIP", or_conditions=[
+        [SegmentCondition("attributes.country", "in", ["BR", "PT"])],
+        [SegmentCondition("tags", "contains", "vip"), SegmentCondition("metrics.trust_score", "gte", 0.5)],
+    ]),
+    Segment(id="orders_in", name="1 or 3 orders", conditions=[
+        SegmentCondition("metrics.total_orders", "in", [1, 3]),
+    ]),
+    Segment(id="pro_plan", name="Pro plan", conditions=[
+        SegmentCondition("custom_properties.plan", "eq", "pro"),
+        SegmentCondition("attributes.primary_device", "neq", "desktop"),
+    ]),
+    Segment(id="bad_op", name="Unknown operator", conditions=[
+        SegmentCondition("metrics.total_orders", "between", (1, 2)),
+    ]),
+]
+
+
+class TestSegmentEvaluation:
+
+    def test_columnar_matches_compiled_predicate(self, cdp):
+        for segment in CUSTOM_SEGMENTS:
+            cdp.create_segment(segment)
+        populate(cdp)
+        cdp.compute_all_segments()
+
+        for segment_id, segment in cdp.segments.items():
+            expected = {pid for pid, p in cdp.profiles.items() if segment.evaluate(p)}
+            assert cdp.segment_members[segment_id] == expected, segment_id
+            assert set(cdp.segment_bitsets.members(segment_id)) == expected
+            assert segment.profile_count == len(expected)
+
+        for profile in cdp.profiles.values():
+            expected = [sid for sid, s in cdp.segments.items() if s.evaluate(profile)]
+            assert profile.segments == expected
+
+    def test_mixed_types_fall_back_to_objects(self, cdp):
+        cdp.create_segment(Segment(id="twenty", name="Twenty", conditions=[
+            SegmentCondition("custom_properties.score", "eq", 20),
+        ]))
+        for i, score in enumerate([5, 20, "20", None, 20.0]):
+            profile = cdp.get_or_create_profile(f"ssi_{i}")
+            if score is not None:
+                profile.custom_properties["score"] = score
+        cdp.compute_all_segments()
+
+        assert not cdp.profile_store.all_numeric("custom_properties.score")
+        assert cdp.segment_members["twenty"] == {"ssi_1", "ssi_4"}
+
+    def test_compile_resolves_nested_paths(self):
+        condition = SegmentCondition("custom_properties.plan", "eq", "pro")
+        predicate = condition.compile()
+        profile = CDPEngine().get_or_create_profile("ssi_1")
+
+        assert not predicate(profile)
+        profile.custom_properties["plan"] = "pro"
+        assert predicate(profile)
+
+    def test_incremental_columns_match_refresh(self, cdp):
+        populate(cdp, count=50)
+        cdp.compute_all_segments()
+        for i in range(0, 50, 3):
+            cdp.record_purchase(f"ssi_{i}", 600.0)
+        incremental = {sid: set(m) for sid, m in cdp.segment_members.items()}
+
+        cdp.compute_all_segments(refresh=False)
+        assert cdp.segment_members == incremental
+        cdp.compute_all_segments(refresh=True)
+        assert cdp.segment_members == incremental
+
+
+# =============================================================================
+# INCREMENTAL MEMBERSHIP
+# =============================================================================
+
+class TestIncrementalMembership:
+
+    def test_segments_reading_uses_path_prefixes(self, cdp):
+        assert cdp.segments_reading({"metrics.trust_score"}) == {"low_quality"}
+        assert "high_value" in cdp.segments_reading({"metrics"})
+        assert cdp.segments_reading({"attributes.city"}) == set()
+
+        cdp.create_segment(Segment(id="by_metrics", name="Whole metrics", conditions=[
+            SegmentCondition("metrics", "neq", None),
+        ]))
+        assert "by_metrics" in cdp.segments_reading({"metrics.total_orders"})
+
+    def test_purchase_emits_enter_events(self, cdp):
+        received = []
+        cdp.subscribe_membership(received.append)
+        cdp.get_or_create_profile("ssi_1")
+        cdp.drain_membership_events()
+        received.clear()
+
+        cdp.record_purchase("ssi_1", 300.0)
+        cdp.record_purchase("ssi_1", 300.0)
+
+        events = [(e.segment_id, e.event_type) for e in cdp.drain_membership_events()]
+        assert events == [("recent_buyers", "enter"), ("high_value", "enter")]
+        assert [[(e.segment_id, e.event_type) for e in batch] for batch in received] == [
+            [("recent_buyers", "enter")], [("high_value", "enter")]
+        ]
+        assert cdp.profiles["ssi_1"].segments == ["high_value", "recent_buyers"]
+
+    def test_update_emits_exit_events(self, cdp):
+        profile = cdp.get_or_create_profile("ssi_1")
+        profile.metrics.trust_score = 0.0
+        cdp.update_profile("ssi_1", {"trust_score": 0.0})
+        assert "ssi_1" in cdp.segment_members["low_quality"]
+        cdp.drain_membership_events()
+
+        for _ in range(20):
+            cdp.update_profile("ssi_1", {"trust_score": 1.0})
+
+        events = [(e.segment_id, e.event_type) for e in cdp.drain_membership_events()]
+        assert events == [("low_quality", "exit")]
+        assert cdp.segment_bitsets.members("low_quality") == []
+
+    def test_only_affected_segments_are_reevaluated(self, cdp):
+        profile = cdp.get_or_create_profile("ssi_1")
+        cdp.update_profile("ssi_1", {})
+        # Changed behind the engine's back: only a full pass would notice
+        profile.metrics.total_revenue = 900.0
+        profile.metrics.total_orders = 3
+
+        cdp.update_profile("ssi_1", {"city": "Lisboa"})
+        assert "ssi_1" not in cdp.segment_members["high_value"]
+
+        cdp.compute_all_segments()
+        assert "ssi_1" in cdp.segment_members["high_value"]
+
+    def test_failing_listener_does_not_block_stream(self, cdp):
+        def broken(events):
+            raise RuntimeError("sink down")
+
+        cdp.subscribe_membership(broken)
+        cdp.get_or_create_profile("ssi_1")
+        cdp.record_purchase("ssi_1", 10.0)
+
+        events = cdp.drain_membership_events()
+        assert [(e.segment_id, e.event_type) for e in events] == [("recent_buyers", "enter")]
+
+    def test_recompute_emits_only_differences(self, cdp):
+        populate(cdp, count=30)
+        cdp.profiles["ssi_0"].metrics.trust_score = 0.9
+        cdp.compute_all_segments()
+        cdp.drain_membership_events()
+
+        cdp.compute_all_segments()
+        assert cdp.drain_membership_events() == []
+
+        cdp.profiles["ssi_0"].metrics.trust_score = 0.0
+        cdp.compute_all_segments()
+        events = cdp.drain_membership_events()
+        assert [(e.segment_id, e.profile_id, e.event_type) for e in events] == [
+            ("low_quality", "ssi_0", "enter")
+        ]
+
+
+# =============================================================================
+# LOOKALIKES
+# =============================================================================
+
+class TestLookalikes:
+
+    def test_feature_matrix_matches_profile_vectors(self, cdp):
+        populate(cdp, count=40)
+        modeler = LookalikeModeler(cdp)
+        cdp.compute_all_segments()
+
+        store = cdp.profile_store
+        expected = np.array([
+            modeler._profile_to_vector(cdp.profiles[pid]) for pid in store.profile_ids
+        ])
+        np.testing.assert_allclose(modeler.feature_matrix(), expected, rtol=1e-6, atol=1e-6)
+
+    def test_brute_force_ranks_by_similarity(self, cdp):
+        populate(cdp, count=200)
+        modeler = LookalikeModeler(cdp)
+        cdp.compute_all_segments()
+
+        found = modeler.find_lookalikes("high_value", top_n=20, similarity_threshold=0.5, use_index=False)
+        seed = set(cdp.segment_members["high_value"])
+
+        assert 0 < len(found) <= 20
+        assert not seed & set(found)
+
+        vectors = {pid: modeler._profile_to_vector(p) for pid, p in cdp.profiles.items()}
+        centroid = np.mean([vectors[pid] for pid in seed], axis=0)
+        centroid /= np.linalg.norm(centroid)
+        scores = [vectors[pid] @ centroid / np.linalg.norm(vectors[pid]) for pid in found]
+        assert scores == sorted(scores, reverse=True)
+        assert min(scores) >= 0.5 - 1e-6
+
+    def test_full_probe_index_matches_brute_force(self, cdp):
+        populate(cdp, count=300)
+        modeler = LookalikeModeler(cdp)
+        cdp.compute_all_segments()
+        modeler.build_index(n_lists=8, n_probe=8)
+
+        exact = modeler.find_lookalikes("high_value", top_n=50, similarity_threshold=0.0, use_index=False)
+        assert modeler.find_lookalikes("high_value", top_n=50, similarity_threshold=0.0, use_index=True) == exact
+
+    def test_index_rebuilt_after_rows_renumbered(self, cdp):
+        populate(cdp, count=300)
+        modeler = LookalikeModeler(cdp)
+        cdp.compute_all_segments()
+        modeler.build_index(n_lists=8, n_probe=8)
+        built = cdp.profile_store.generation
+
+        # Merge removes a row; the refresh then compacts and renumbers rows
+        cdp.merge_profiles(cdp.profiles["ssi_0"], cdp.profiles["ssi_1"])
+        cdp.compute_all_segments()
+        assert cdp.profile_store.generation > built
+
+        with_index = modeler.find_lookalikes("high_value", top_n=50, similarity_threshold=0.0, use_index=True)
+        assert modeler.index.generation == cdp.profile_store.generation
+        assert len(modeler.index.assignments) == len(cdp.profile_store)
+        assert with_index == modeler.find_lookalikes(
+            "high_value", top_n=50, similarity_threshold=0.0, use_index=False
+        )
+
+    def test_new_rows_are_assigned_without_rebuild(self, cdp):
+        populate(cdp, count=100)
+        modeler = LookalikeModeler(cdp)
+        cdp.compute_all_segments()
+        index = modeler.build_index(n_lists=4, n_probe=4)
+        centroids = index.centroids
+
+        cdp.get_or_create_profile("ssi_new")
+        cdp.record_purchase("ssi_new", 50.0)
+        modeler.find_lookalikes("high_value", use_index=True)
+
+        assert modeler.index.centroids is centroids
+        assert len(modeler.index.assignments) == len(cdp.profile_store)
+
+    def test_lookalike_segment_members(self, cdp):
+        populate(cdp, count=100)
+        modeler = LookalikeModeler(cdp)
+        cdp.compute_all_segments()
+
+        segment = modeler.create_lookalike_segment("high_value", "lal_high_value", top_n=10)
+        members = cdp.segment_members["lal_high_value"]
+
+        assert segment.profile_count == len(members) <= 10
+        assert set(cdp.segment_bitsets.members("lal_high_value")) == members
+        cdp.compute_all_segments()
+        assert cdp.segment_members["lal_high_value"] == members
@@ -0,0 +1,190 @@
+"""
+S.S.I. SHADOW - Clean Room Tests
+Tests for batched HMAC hashing, the columnar party store and sorted-array
+matching in the clean room engine.
+"""
+
+import pytest
+import random
+
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from privacy.clean_room import (
+    CleanRoomEngine,
+    CleanRoomQuery,
+    DataParty,
+    PartyColumnStore,
+    PrivacyLevel,
+    QueryType,
+    SecureHasher,
+)
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+def digests_of(keys):
+    hasher = SecureHasher('secret')
+    return np.frombuffer(hasher.digest_many(keys), dtype=f'S{SecureHasher.DIGEST_SIZE}')
+
+
+def make_query(query_type, initiator='advertiser', participants=('publisher',), metrics=(), min_size=1):
+    return CleanRoomQuery(
+        id=f'q-{query_type.value}',
+        query_type=query_type,
+        privacy_level=PrivacyLevel.LOW,
+        initiator=initiator,
+        participants=list(participants),
+        match_keys=['email_hash'],
+        metrics=list(metrics),
+        dimensions=[],
+        min_aggregation_size=min_size
+    )
+
+
+@pytest.fixture
+def engine():
+    engine = CleanRoomEngine('secret', hash_workers=1)
+    for party_id in ('advertiser', 'publisher'):
+        engine.register_party(DataParty(id=party_id, name=party_id, data_types=['emails']))
+    return engine
+
+
+# =============================================================================
+# HASHING
+# =============================================================================
+
+class TestSecureHasher:
+
+    def test_digest_many_matches_single_hashes(self):
+        hasher = SecureHasher('secret')
+        emails = ['John.Doe+promo@gmail.com', ' ana@example.com ']
+
+        raw = hasher.digest_many(emails, 'email')
+
+        assert len(raw) == 2 * SecureHasher.DIGEST_SIZE
+        assert raw[:32].hex() == hasher.hash_email(emails[0]) == hasher.hash_email('johndoe@gmail.com')
+        assert raw[32:].hex() == hasher.hash_email(emails[1])
+
+    def test_phone_normalization(self):
+        hasher = SecureHasher('secret')
+        assert hasher.digest_many(['(11) 99999-0000'], 'phone').hex() == hasher.hash_phone('5511999990000')
+
+
+# =============================================================================
+# COLUMNAR STORE
+# =============================================================================
+
+class TestPartyColumnStore:
+
+    def test_incremental_upserts_match_reference(self):
+        rng = random.Random(6)
+        store = PartyColumnStore()
+        reference = {}
+
+        for batch in range(20):
+            keys = [f'user-{rng.randrange(300)}' for _ in range(rng.randrange(0, 40))]
+            values = [float(rng.randrange(100)) for _ in keys]
+            columns = {'revenue': np.array(values)}
+            if batch % 3 == 0:
+                columns['channel'] = np.array([rng.choice(['meta', 'google']) for _ in keys], dtype=object)
+            store.upsert(digests_of(keys), columns)
+            for i, key in enumerate(keys):
+                reference[key] = {name: column[i] for name, column in columns.items()}
+
+            assert list(store.hashes) == sorted(store.hashes)
+            assert len(store) == len(reference)
+
+        for key, record in reference.items():
+            stored = store.get(digests_of([key])[0].hex())
+            stored.pop('_hash')
+            assert stored == record
+
+    def test_last_occurrence_in_batch_wins(self):
+        store = PartyColumnStore()
+        store.upsert(digests_of(['a', 'b', 'a']), {'revenue': np.array([1.0, 2.0, 3.0])})
+
+        assert len(store) == 2
+        assert store.get(digests_of(['a'])[0].hex())['revenue'] == 3.0
+
+    def test_replace_drops_fields_missing_from_new_record(self):
+        store = PartyColumnStore()
+        store.upsert(digests_of(['a', 'b']), {'revenue': np.array([1.0, 2.0])})
+        store.upsert(digests_of(['a']), {'channel': np.array(['meta'], dtype=object)})
+
+        a, b = (store.get(digest.hex()) for digest in digests_of(['a', 'b']))
+        assert a['channel'] == 'meta' and 'revenue' not in a
+        assert b['revenue'] == 2.0 and 'channel' not in b
+
+    def test_mixed_dtypes_become_object(self):
+        store = PartyColumnStore()
+        store.upsert(digests_of(['a']), {'tier': np.array([1.0])})
+        store.upsert(digests_of(['b']), {'tier': np.array(['gold'], dtype=object)})
+
+        assert store.column('tier').dtype == object
+        assert store.get(digests_of(['a'])[0].hex())['tier'] == 1.0
+        assert store.get(digests_of(['b'])[0].hex())['tier'] == 'gold'
+
+
+# =============================================================================
+# ENGINE
+# =============================================================================
+
+class TestCleanRoomEngine:
+
+    def test_ingest_drops_pii(self, engine):
+        engine.ingest_data('advertiser', [
+            {'email': 'a@example.com', 'name': 'Ana', 'revenue': 10},
+            {'email': '', 'revenue': 5},
+        ])
+
+        store = engine.data_stores['advertiser']
+        assert len(store) == 1
+        assert set(store.columns) == {'revenue'}
+        assert engine.parties['advertiser'].hashed_records == 1
+
+    def test_overlap_and_aggregates(self, engine):
+        engine.ingest_data('advertiser', [
+            {'email': f'user{i}@example.com', 'revenue': 10, 'converted': i % 2 == 0} for i in range(10)
+        ])
+        engine.ingest_data('publisher', [
+            {'email': f'USER{i}@example.com', 'revenue': 1} for i in range(5, 20)
+        ])
+
+        overlap = engine.execute_query(make_query(QueryType.OVERLAP))
+        assert overlap.total_matched == 5
+        assert overlap.match_rate == pytest.approx(0.5)
+        assert overlap.aggregates['overlap_by_party'] == {'publisher': 5}
+
+        aggregate = engine.execute_query(make_query(QueryType.AGGREGATE, metrics=['count', 'revenue', 'conversions']))
+        assert aggregate.aggregates == {'count': 5, 'revenue': 55.0, 'conversions': 2}
+
+    def test_attribution_by_channel(self, engine):
+        engine.ingest_data('advertiser', [{'email': f'u{i}@x.com', 'converted': True} for i in range(4)])
+        engine.ingest_data('publisher', [
+            {'email': 'u0@x.com', 'channel': 'meta'},
+            {'email': 'u1@x.com', 'channel': 'meta'},
+            {'email': 'u2@x.com'},
+        ])
+
+        result = engine.execute_query(make_query(QueryType.ATTRIBUTION))
+
+        assert result.aggregates['total_converters'] == 4
+        assert result.aggregates['attribution_by_channel'] == {
+            'meta': {'exposed': 2, 'converted': 2},
+            'publisher': {'exposed': 1, 'converted': 1},
+        }
+
+    def test_small_overlap_is_suppressed(self, engine):
+        engine.ingest_data('advertiser', [{'email': 'a@x.com'}])
+        engine.ingest_data('publisher', [{'email': 'a@x.com'}])
+
+        result = engine.execute_query(make_query(QueryType.OVERLAP, min_size=100))
+
+        assert result.aggregates == {'suppressed': True}
+        assert result.total_matched == 0
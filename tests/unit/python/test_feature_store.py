@@ -0,0 +1,561 @@
+"""
+S.S.I. SHADOW - Feature Store Tests
+Tests for batched online reads, the bounded local cache, binary feature
+vectors and incremental offline materialization.
+"""
+
+import pytest
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from ml.feature_store import (
+    AggregationType,
+    FeatureDefinition,
+    FeatureRegistry,
+    FeatureType,
+    FeatureView,
+    LocalFeatureCache,
+    OfflineFeatureStore,
+    OnlineFeatureStore,
+)
+
+
+# =============================================================================
+# FAKE BACKENDS
+# =============================================================================
+
+def stored(features):
+    return json.dumps({
+        'features': features,
+        'timestamp': datetime(2024, 1, 1).isoformat(),
+        'entity_id': 'x'
+    })
+
+
+async def reply(value):
+    return value
+
+
+class FakeAsyncRedis:
+    """
+    Shaped like redis.asyncio: commands are plain methods returning an
+    awaitable, so iscoroutinefunction() is False for them.
+    """
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append(('get', key))
+        return reply(self.data.get(key))
+
+    def mget(self, keys):
+        self.calls.append(('mget', list(keys)))
+        return reply([self.data.get(key) for key in keys])
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        return reply(True)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def mget(self, keys):
+        self.ops.append(('mget', list(keys)))
+
+    def setex(self, key, ttl, value):
+        self.ops.append(('setex', key, value))
+
+    def execute(self):
+        return self._execute()
+
+    async def _execute(self):
+        self.redis.calls.append(('pipeline', len(self.ops)))
+        replies = []
+        for op in self.ops:
+            if op[0] == 'mget':
+                replies.append([self.redis.data.get(key) for key in op[1]])
+            else:
+                self.redis.data[op[1]] = op[2]
+                replies.append(True)
+        return replies
+
+
+class FakeSyncRedis:
+    """Blocking client (redis-py): get_batch must run it off the event loop."""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.calls = []
+
+    def mget(self, keys):
+        self.calls.append(('mget', list(keys)))
+        return [self.data.get(key) for key in keys]
+
+
+class FakeKV:
+    """Cloudflare KV binding with bulk get."""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.bulk_calls = 0
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def get_many(self, keys):
+        self.bulk_calls += 1
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    async def put(self, key, value, expirationTtl=None):
+        self.data[key] = value
+
+
+# =============================================================================
+# BATCH READS
+# =============================================================================
+
+class TestGetBatch:
+
+    @pytest.mark.asyncio
+    async def test_misses_fetched_in_one_mget(self):
+        redis = FakeAsyncRedis({
+            'features:user:a': stored({'x': 1}),
+            'features:user:b': stored({'x': 2}),
+        })
+        store = OnlineFeatureStore(redis_client=redis)
+
+        result = await store.get_batch('user', ['b', 'missing', 'a', 'b'])
+
+        assert list(result) == ['b', 'a']
+        assert result['a'].features == {'x': 1}
+        assert redis.calls == [('mget', ['features:user:b', 'features:user:missing', 'features:user:a'])]
+
+    @pytest.mark.asyncio
+    async def test_second_batch_served_from_local_cache(self):
+        redis = FakeAsyncRedis({'features:user:a': stored({'x': 1, 'y': 2})})
+        store = OnlineFeatureStore(redis_client=redis)
+
+        await store.get_batch('user', ['a', 'missing'])
+        redis.calls.clear()
+        result = await store.get_batch('user', ['a', 'missing'], feature_names=['y'])
+
+        assert redis.calls == []
+        assert result['a'].features == {'y': 2}
+        stats = store.get_cache_stats()['views']['user']
+        assert (stats['hits'], stats['negative_hits'], stats['misses']) == (1, 1, 2)
+
+    @pytest.mark.asyncio
+    async def test_large_batches_use_one_pipeline(self, monkeypatch):
+        monkeypatch.setattr(OnlineFeatureStore, 'MGET_CHUNK_SIZE', 2)
+        redis = FakeAsyncRedis({f'features:user:{i}': stored({'i': i}) for i in range(5)})
+        store = OnlineFeatureStore(redis_client=redis)
+
+        result = await store.get_batch('user', [str(i) for i in range(5)])
+
+        assert [v.features['i'] for v in result.values()] == [0, 1, 2, 3, 4]
+        assert redis.calls == [('pipeline', 3)]
+
+    @pytest.mark.asyncio
+    async def test_kv_takes_precedence_over_redis(self):
+        kv = FakeKV({'features:user:a': stored({'source': 'kv'})})
+        redis = FakeAsyncRedis({
+            'features:user:a': stored({'source': 'redis'}),
+            'features:user:b': stored({'source': 'redis'}),
+        })
+        store = OnlineFeatureStore(kv_namespace=kv, redis_client=redis)
+
+        result = await store.get_batch('user', ['a', 'b'])
+
+        assert result['a'].features == {'source': 'kv'}
+        assert result['b'].features == {'source': 'redis'}
+        assert kv.bulk_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_get_features_awaits_async_client(self):
+        redis = FakeAsyncRedis({'features:user:a': stored({'x': 1})})
+        store = OnlineFeatureStore(redis_client=redis)
+
+        vector = await store.get_features('user', 'a')
+
+        assert vector.features == {'x': 1}
+        assert redis.calls == [('get', 'features:user:a')]
+
+    @pytest.mark.asyncio
+    async def test_sync_redis_client(self):
+        redis = FakeSyncRedis({'features:user:a': stored({'x': 1})})
+        store = OnlineFeatureStore(redis_client=redis)
+
+        result = await store.get_batch('user', ['a', 'b'])
+
+        assert list(result) == ['a']
+        assert redis.calls == [('mget', ['features:user:a', 'features:user:b'])]
+
+    @pytest.mark.asyncio
+    async def test_set_features_writes_through_async_client(self):
+        redis = FakeAsyncRedis()
+        await OnlineFeatureStore(redis_client=redis).set_features('user', 'a', {'x': 1})
+
+        vector = await OnlineFeatureStore(redis_client=redis).get_features('user', 'a')
+        assert vector.features == {'x': 1}
+
+    @pytest.mark.asyncio
+    async def test_set_features_round_trip(self):
+        redis = FakeAsyncRedis()
+        store = OnlineFeatureStore(redis_client=redis)
+        await store.set_batch('user', {'a': {'x': 1}, 'b': {'x': 2}})
+
+        fresh = OnlineFeatureStore(redis_client=redis)
+        result = await fresh.get_batch('user', ['a', 'b'])
+        assert {k: v.features for k, v in result.items()} == {'a': {'x': 1}, 'b': {'x': 2}}
+
+
+# =============================================================================
+# LOCAL CACHE
+# =============================================================================
+
+class TestLocalFeatureCache:
+
+    def test_lru_eviction_by_entries(self):
+        cache = LocalFeatureCache(max_entries=2)
+        cache.put('a', {'x': 1}, 0.0, 60)
+        cache.put('b', {'x': 2}, 0.0, 60)
+        assert cache.get('a') is not None  # 'b' becomes least recently used
+        cache.put('c', {'x': 3}, 0.0, 60)
+
+        assert 'b' not in cache
+        assert 'a' in cache and 'c' in cache
+        assert cache.evictions == 1
+
+    def test_eviction_by_bytes(self):
+        entry_size = len('k0') + len(json.dumps({'v': 'x' * 100})) + LocalFeatureCache.ENTRY_OVERHEAD
+        cache = LocalFeatureCache(max_entries=100, max_bytes=entry_size * 3)
+        for i in range(5):
+            cache.put(f'k{i}', {'v': 'x' * 100}, 0.0, 60)
+
+        assert len(cache) == 3
+        assert cache.bytes == entry_size * 3
+        assert 'k0' not in cache and 'k4' in cache
+
+    def test_ttl_expiry(self):
+        cache = LocalFeatureCache()
+        cache.put('a', {'x': 1}, 0.0, 10)
+        now = datetime.now().timestamp()
+
+        assert cache.get('a', now + 5) is not None
+        assert cache.get('a', now + 11) is None
+        assert cache.expirations == 1
+        assert cache.bytes == 0
+
+    def test_overwrite_keeps_accounting_and_heap_bounded(self):
+        cache = LocalFeatureCache()
+        for i in range(1000):
+            cache.put('a', {'x': i}, 0.0, 60)
+
+        assert len(cache) == 1
+        assert cache.get('a').features == {'x': 999}
+        assert cache.bytes == len('a') + len(json.dumps({'x': 999})) + LocalFeatureCache.ENTRY_OVERHEAD
+        assert len(cache._expiry_heap) <= 2 * len(cache) + 64 + 1
+
+    def test_purge_expired(self):
+        cache = LocalFeatureCache()
+        cache.put('short', {'x': 1}, 0.0, -1)  # already expired
+        cache.put('long', {'x': 2}, 0.0, 60)
+
+        cache.purge_expired()
+        assert len(cache) == 1 and 'long' in cache
+
+    @pytest.mark.asyncio
+    async def test_store_bounds_and_negative_cache(self):
+        redis = FakeAsyncRedis({f'features:user:{i}': stored({'i': i}) for i in range(10)})
+        store = OnlineFeatureStore(redis_client=redis, local_cache_max_entries=4, negative_cache_ttl=0)
+
+        await store.get_batch('user', [str(i) for i in range(10)] + ['missing'])
+
+        stats = store.get_cache_stats()['local_cache']
+        assert stats['entries'] == 4
+        assert stats['evictions'] == 6
+
+        redis.calls.clear()
+        await store.get_batch('user', ['missing'])
+        assert redis.calls  # negative caching disabled: asked again
+
+    @pytest.mark.asyncio
+    async def test_set_features_replaces_negative_entry(self):
+        store = OnlineFeatureStore(redis_client=FakeAsyncRedis())
+        assert await store.get_features('user', 'a') is None
+
+        await store.set_features('user', 'a', {'x': 1})
+        assert (await store.get_features('user', 'a')).features == {'x': 1}
+
+
+# =============================================================================
+# BINARY FEATURE VECTORS
+# =============================================================================
+
+@pytest.fixture
+def registry():
+    registry = FeatureRegistry()
+    registry.register_feature(FeatureDefinition(name='count', dtype=FeatureType.INT))
+    registry.register_feature(FeatureDefinition(name='score', dtype=FeatureType.FLOAT, default_value=0.5))
+    registry.register_feature(FeatureDefinition(name='flag', dtype=FeatureType.BOOL))
+    registry.register_view(FeatureView(name='risk', entity='user', features=['count', 'score', 'flag']))
+    return registry
+
+
+class TestFeatureVectorCodec:
+
+    def test_round_trip_with_defaults(self, registry):
+        codec = registry.get_codec('risk')
+        payload = codec.encode({'count': 3, 'flag': True, 'extra': 'ignored'}, datetime(2024, 1, 1))
+
+        assert len(payload) == codec.size == codec.HEADER.size + 3 * 8
+        assert codec.decode(payload) == {'count': 3, 'score': 0.5, 'flag': True}
+        values, timestamp = codec.decode_array(payload)
+        assert values.tolist() == [3.0, 0.5, 1.0]
+        assert timestamp == datetime(2024, 1, 1).timestamp()
+
+    def test_missing_without_default_is_none(self, registry):
+        codec = registry.get_codec('risk')
+        assert codec.decode(codec.encode({}))['count'] is None
+
+    def test_schema_change_rejects_old_payloads(self, registry):
+        payload = registry.get_codec('risk').encode({'count': 1})
+        registry.register_feature(FeatureDefinition(name='count', dtype=FeatureType.INT, version=2))
+
+        with pytest.raises(ValueError):
+            registry.get_codec('risk').decode(payload)
+        with pytest.raises(ValueError):
+            registry.get_codec('risk').decode(payload[:-8])
+
+    def test_unsupported_types(self, registry):
+        registry.register_feature(FeatureDefinition(name='tags', dtype=FeatureType.STRING))
+        registry.register_view(FeatureView(name='text', entity='user', features=['tags']))
+        with pytest.raises(ValueError):
+            registry.get_codec('text')
+        with pytest.raises(KeyError):
+            registry.get_codec('unknown')
+
+    @pytest.mark.asyncio
+    async def test_view_vectors_through_kv_and_redis(self, registry):
+        kv, redis = FakeKV(), FakeAsyncRedis()
+        writer = OnlineFeatureStore(kv_namespace=kv, redis_client=redis, registry=registry)
+        await writer.set_view_features('risk', 'a', {'count': 1, 'score': 0.9, 'flag': False})
+        await writer.set_batch('user', {'b': {'count': 2}}, view_name='risk')
+
+        key = 'features:user:a:view:risk'
+        assert isinstance(kv.data[key], str) and isinstance(redis.data[key], bytes)
+
+        reader = OnlineFeatureStore(redis_client=redis, registry=registry)
+        ids, matrix = await reader.get_view_vectors('risk', ['b', 'missing', 'a'])
+
+        assert ids == ['b', 'a']
+        assert matrix.shape == (2, 3)
+        assert matrix[1].tolist() == [1.0, 0.9, 0.0]
+        assert matrix[0, 0] == 2.0 and matrix[0, 1] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_invalidate_drops_view_vectors(self, registry):
+        redis = FakeAsyncRedis()
+        store = OnlineFeatureStore(redis_client=redis, registry=registry)
+        await store.set_features('user', 'a', {'count': 1})
+        await store.set_view_features('risk', 'a', {'count': 1})
+        redis.data['features:user:a:view:risk'] = registry.get_codec('risk').encode({'count': 7})
+
+        store.invalidate('user', 'a', view_name='risk')
+        assert 'features:user:a' in store._local_cache
+        ids, matrix = await store.get_view_vectors('risk', ['a'])
+        assert matrix[0, 0] == 7.0
+
+        store.invalidate('user', 'a')
+        assert 'features:user:a' not in store._local_cache
+        assert 'features:user:a:view:risk' not in store._local_cache
+
+    @pytest.mark.asyncio
+    async def test_stale_schema_counts_as_miss(self, registry):
+        redis = FakeAsyncRedis()
+        store = OnlineFeatureStore(redis_client=redis, registry=registry)
+        await store.set_batch('user', {'a': {'count': 1}}, view_name='risk')
+
+        registry.register_feature(FeatureDefinition(name='score', dtype=FeatureType.FLOAT, version=2))
+        ids, matrix = await store.get_view_vectors('risk', ['a'])
+
+        assert ids == [] and matrix.shape == (0, 3)
+
+
+# =============================================================================
+# INCREMENTAL MATERIALIZATION
+# =============================================================================
+
+class RecordingOfflineStore(OfflineFeatureStore):
+    """Captures the generated SQL instead of running it on BigQuery."""
+
+    def __init__(self, watermark=None, view_scoped=True, rows=None):
+        super().__init__(bq_client=None, project_id='proj')
+        self.watermark = watermark
+        self.view_scoped = view_scoped
+        self.rows = rows or []
+        self.queries = []
+
+    def _run(self, query, params=None):
+        self.queries.append((query, dict((name, value) for name, _, value in params or [])))
+        if 'SELECT watermark' in query:
+            row = {'watermark': self.watermark, 'view_scoped': self.view_scoped}
+            return SimpleNamespace(), [row] if self.watermark else []
+        if 'feature_timestamp = @feature_timestamp' in query:
+            return SimpleNamespace(), self.rows
+        return SimpleNamespace(total_bytes_processed=0), []
+
+
+@pytest.fixture
+def offline_registry():
+    registry = FeatureRegistry()
+    registry.register_feature(FeatureDefinition(
+        name='events_24h', dtype=FeatureType.INT,
+        aggregation=AggregationType.COUNT, window_size='24h'
+    ))
+    registry.register_feature(FeatureDefinition(
+        name='events_7d', dtype=FeatureType.INT,
+        aggregation=AggregationType.COUNT, window_size='7d'
+    ))
+    registry.register_feature(FeatureDefinition(
+        name='total_spend', dtype=FeatureType.FLOAT,
+        aggregation=AggregationType.SUM, source_column='value'
+    ))
+    registry.register_view(FeatureView(name='activity', entity='user', features=['events_24h', 'events_7d', 'total_spend']))
+    registry.register_view(FeatureView(name='lifetime', entity='user', features=['total_spend']))
+    return registry
+
+
+class TestIncrementalMaterialization:
+
+    def materialize(self, store, registry, view_name):
+        view = registry.get_view(view_name)
+        stats = store.materialize_features(view, registry, target_date=datetime(2024, 1, 10))
+        query, params = store.queries[-1]
+        return stats, query, params
+
+    def test_touched_includes_entities_leaving_each_window(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9))
+        stats, query, params = self.materialize(store, offline_registry, 'activity')
+
+        touched = query.split('touched AS (')[1].split('),')[0]
+        for seconds in (86400, 604800):
+            assert (
+                f"event_timestamp >= TIMESTAMP_SUB(@watermark, INTERVAL {seconds} SECOND)"
+                f" AND event_timestamp < TIMESTAMP_SUB(@target, INTERVAL {seconds} SECOND)"
+            ) in touched
+        assert stats['incremental'] is True
+        assert params['scan_start'] == datetime(2024, 1, 3)
+
+    def test_entities_without_scanned_events_still_get_a_row(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9))
+        _, query, _ = self.materialize(store, offline_registry, 'activity')
+
+        current = query.split('current_values AS (')[1].split('previous AS (')[0]
+        assert 'FROM touched t' in current
+        assert 'LEFT JOIN `proj.ssi_shadow.events` e' in current
+        assert 'GROUP BY t.entity_id' in current
+        # Lifetime sums keep the previous snapshot when the delta is empty
+        assert 'COALESCE(p.total_spend, 0) + COALESCE(c.total_spend, 0)' in query
+
+    def test_views_without_windows_only_touch_new_events(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9))
+        _, query, _ = self.materialize(store, offline_registry, 'lifetime')
+
+        assert 'TIMESTAMP_SUB(@watermark' not in query
+        assert 'event_timestamp >= @watermark)' in query
+
+    def test_snapshots_are_scoped_to_the_view(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9))
+        _, query, params = self.materialize(store, offline_registry, 'activity')
+
+        previous = query.split('previous AS (')[1].split('QUALIFY')[0]
+        assert 'f.view_name = @view_name' in previous
+        assert 'INSERT INTO `proj.feature_store.user_features` (entity_id, view_name,' in query
+        assert '@view_name AS view_name' in query
+        assert params['view_name'] == 'activity'
+        assert any('ADD COLUMN IF NOT EXISTS view_name' in q for q, _ in store.queries)
+
+    def test_untagged_snapshots_force_a_full_rebuild(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9), view_scoped=False)
+        stats, query, params = self.materialize(store, offline_registry, 'activity')
+
+        assert stats['incremental'] is False
+        assert params['watermark'] is None
+        assert 'previous AS (' not in query
+
+    @pytest.mark.asyncio
+    async def test_push_to_online_reads_only_the_view(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9))
+        online = OnlineFeatureStore(redis_client=FakeAsyncRedis())
+
+        await store.push_to_online(offline_registry.get_view('lifetime'), online)
+
+        query, params = store.queries[-1]
+        assert 'view_name = @view_name' in query
+        assert params == {'view_name': 'lifetime', 'feature_timestamp': datetime(2024, 1, 9)}
+
+    @pytest.mark.asyncio
+    async def test_push_to_online_writes_through_async_pipeline(self, offline_registry):
+        rows = [{'entity_id': 'a', 'total_spend': 1.5}, {'entity_id': 'b', 'total_spend': 2.0}]
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 9), rows=rows)
+        redis = FakeAsyncRedis()
+        online = OnlineFeatureStore(redis_client=redis)
+
+        pushed = await store.push_to_online(offline_registry.get_view('lifetime'), online, chunk_size=1)
+
+        assert pushed == 2
+        assert redis.calls == [('pipeline', 1), ('pipeline', 1)]
+        result = await OnlineFeatureStore(redis_client=redis).get_batch('user', ['a', 'b'])
+        assert {k: v.features for k, v in result.items()} == {'a': {'total_spend': 1.5}, 'b': {'total_spend': 2.0}}
+
+    def test_up_to_date_view_is_skipped(self, offline_registry):
+        store = RecordingOfflineStore(watermark=datetime(2024, 1, 10))
+        stats, _, _ = self.materialize(store, offline_registry, 'activity')
+        assert stats['skipped'] is True
+
+
+class TestHistoricalFeatures:
+
+    def historical_query(self, registry=None):
+        store = RecordingOfflineStore()
+        view = FeatureView(name='activity', entity='user', features=['events_24h', 'total_spend'])
+        store.get_historical_features(view, 'proj.labels.churn', registry=registry)
+        return store.queries[-1]
+
+    def test_lifetime_features_ignore_max_age(self, offline_registry):
+        query, params = self.historical_query(offline_registry)
+
+        join = query.split('LEFT JOIN')[1]
+        assert 'f.view_name = @view_name' in join
+        assert 'max_age_seconds' not in join
+        select = query.split('FROM labels l')[0]
+        assert 'f.total_spend' in select and 'AS total_spend' not in select
+        assert (
+            'IF(f.feature_timestamp > TIMESTAMP_SUB(l.label_timestamp, INTERVAL @max_age_seconds SECOND), '
+            'f.events_24h, NULL) AS events_24h'
+        ) in query
+        assert params['view_name'] == 'activity'
+        assert params['max_age_seconds'] == 30 * 86400
+
+    def test_without_registry_max_age_bounds_the_join(self):
+        query, _ = self.historical_query()
+
+        join = query.split('LEFT JOIN')[1]
+        assert 'INTERVAL @max_age_seconds SECOND' in join
+        assert 'IF(' not in query
+
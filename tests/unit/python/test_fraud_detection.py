@@ -0,0 +1,410 @@
+"""
+S.S.I. SHADOW - Fraud Detection Tests
+Tests for vectorized batch scoring, windowed network sketches, compact
+behavioral profiles and sharded scoring.
+"""
+
+import pytest
+import random
+import statistics
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+pytest.importorskip("scipy")
+
+from ml.fraud_detection import (
+    BehavioralAnalyzer,
+    FraudDetector,
+    FraudEventBatch,
+    FraudType,
+    NetworkAnalyzer,
+    ShardedFraudDetector,
+    UserBehaviorProfile,
+    WindowedCardinality,
+)
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+USER_AGENTS = ['Mozilla/5.0', 'HeadlessChrome/120', '', None]
+REFERRERS = ['https://google.com', 'https://click.ads.net/x', 'https://PROMO.shop', '', None]
+
+
+def random_events(seed, count, with_users=True):
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        event = {
+            'clicks_last_minute': rng.choice([0, 3, 11, 25, None]),
+            'is_datacenter': rng.random() < 0.2,
+            'canvas_hash': rng.choice(['c1', 'c2', '', None]),
+            'webgl_hash': rng.choice(['w1', '', None]),
+            'time_to_conversion': rng.choice([1, 4, 30, None]),
+            'scroll_depth': rng.choice([0, 20, 80]),
+            'time_on_page': rng.choice([2, 15, 120, None]),
+            'is_vpn': rng.random() < 0.3,
+            'user_agent': rng.choice(USER_AGENTS),
+            'referrer': rng.choice(REFERRERS),
+            'interactions': rng.randint(0, 40),
+            'trust_score': rng.choice([0.1, 0.5, 0.9, None]),
+            'events_per_minute': rng.uniform(0, 30),
+            'device_id': rng.choice(['d1', 'd2', 'd3', None]),
+            'ip': rng.choice(['1.1.1.1', '2.2.2.2', None]),
+            'country': rng.choice(['BR', 'US']),
+        }
+        if with_users:
+            event['user_id'] = rng.choice(['u1', 'u2', 'u3', None])
+        events.append({k: v for k, v in event.items() if v is not None})
+    return events
+
+
+def assert_same_score(batch_score, scalar_score):
+    assert batch_score.score == pytest.approx(scalar_score.score)
+    assert batch_score.risk_level == scalar_score.risk_level
+    assert batch_score.action == scalar_score.action
+    assert batch_score.confidence == pytest.approx(scalar_score.confidence)
+    assert [s.name for s in batch_score.signals] == [s.name for s in scalar_score.signals]
+    assert set(batch_score.fraud_types) == set(scalar_score.fraud_types)
+    assert batch_score.explanation == scalar_score.explanation
+
+
+# =============================================================================
+# BATCH SCORING
+# =============================================================================
+
+class TestBatchScoring:
+
+    def test_matches_analyze_per_event(self):
+        events = random_events(seed=1, count=300)
+        batch_detector, scalar_detector = FraudDetector(), FraudDetector()
+
+        result = batch_detector.analyze_batch(events)
+
+        assert len(result) == len(events)
+        for i, event in enumerate(events):
+            assert_same_score(result.fraud_score(i), scalar_detector.analyze(event, user_id=event.get('user_id')))
+
+    def test_custom_rule_without_vector_condition(self):
+        events = random_events(seed=2, count=100, with_users=False)
+        detectors = FraudDetector(), FraudDetector()
+        for detector in detectors:
+            detector.rule_engine.add_rule({
+                'name': 'brazil',
+                'category': FraudType.PAYMENT_FRAUD,
+                'condition': lambda e: e.get('country') == 'BR',
+                'score': 0.4,
+                'weight': 0.5,
+                'description': 'Brazil'
+            })
+
+        result = detectors[0].analyze_batch(events)
+
+        assert result.rule_mask[:, -1].tolist() == [e['country'] == 'BR' for e in events]
+        for i, event in enumerate(events):
+            assert_same_score(result.fraud_score(i), detectors[1].analyze(event))
+
+    def test_dataframe_and_columns_match_records(self):
+        pd = pytest.importorskip("pandas")
+        events = random_events(seed=3, count=80, with_users=False)
+
+        from_records = FraudDetector().analyze_batch(events)
+        from_frame = FraudDetector().analyze_batch(pd.DataFrame(events))
+
+        np.testing.assert_allclose(from_frame.scores, from_records.scores)
+        assert from_frame.actions.tolist() == from_records.actions.tolist()
+        assert (from_frame.rule_mask == from_records.rule_mask).all()
+
+    def test_missing_values_use_event_defaults(self):
+        batch = FraudEventBatch.from_any({'clicks_last_minute': np.array([np.nan, 12.0])})
+
+        assert batch.numeric('clicks_last_minute', 0).tolist() == [0.0, 12.0]
+        assert batch.numeric('time_to_conversion', 999).tolist() == [999.0, 999.0]
+        assert batch.flag('is_vpn').tolist() == [False, False]
+        assert batch.row(0) == {}
+        assert batch.row(1) == {'clicks_last_minute': 12.0}
+
+    def test_empty_batch(self):
+        result = FraudDetector().analyze_batch([])
+        assert len(result) == 0
+        assert result.to_fraud_scores() == []
+
+
+# =============================================================================
+# NETWORK SKETCHES
+# =============================================================================
+
+class TestWindowedCardinality:
+
+    def test_exact_while_sparse(self):
+        sketch = WindowedCardinality(bucket_seconds=60, n_buckets=10)
+        now = time.time()
+        for user in ['a', 'b', 'c', 'a']:
+            sketch.add('device', user, now)
+
+        assert sketch.count('device', now=now) == 3
+        assert sketch.count('other', now=now) == 0
+
+    def test_dense_estimate_is_close(self):
+        sketch = WindowedCardinality(bucket_seconds=60, n_buckets=10, precision=10)
+        now = time.time()
+        for i in range(5000):
+            sketch.add('ip', f'user-{i}', now)
+
+        assert sketch.memory_usage()['dense_buckets'] == 1
+        assert sketch.count('ip', now=now) == pytest.approx(5000, rel=0.1)
+
+    def test_sub_window_and_expiry(self):
+        sketch = WindowedCardinality(bucket_seconds=60, n_buckets=10)
+        now = time.time()
+        sketch.add('device', 'old', now - 5 * 60)
+        sketch.add('device', 'new', now)
+
+        assert sketch.count('device', now=now) == 2
+        assert sketch.count('device', window_seconds=60, now=now) == 1
+
+        sketch.add('device', 'older', now - 30 * 60)
+        assert sketch.count('device', now=now) == 2
+
+    def test_future_timestamp_does_not_expire_window(self):
+        sketch = WindowedCardinality(bucket_seconds=60, n_buckets=10)
+        now = time.time()
+        for user in ['a', 'b', 'c']:
+            sketch.add(user, 'device', now)
+
+        sketch.add('skewed', 'device', now + 365 * 86400)
+
+        assert len(sketch) == 4
+        assert all(sketch.count(user) == 1 for user in ['a', 'b', 'c', 'skewed'])
+
+
+class TestNetworkSnapshots:
+
+    def populated(self, **kwargs):
+        analyzer = NetworkAnalyzer(**kwargs)
+        for i in range(50):
+            analyzer.add_connection(f'user-{i}', device_id='shared-device', ip=f'10.0.0.{i % 3}')
+        return analyzer
+
+    def test_snapshot_round_trip(self, tmp_path):
+        path = str(tmp_path / 'network.npz')
+        analyzer = self.populated()
+        analyzer.snapshot(path)
+
+        restored = NetworkAnalyzer(snapshot_path=path)
+
+        assert restored.users_per_device('shared-device') == analyzer.users_per_device('shared-device')
+        assert restored.users_per_ip('10.0.0.1') == analyzer.users_per_ip('10.0.0.1')
+        assert restored.get_stats() == analyzer.get_stats()
+
+    @pytest.mark.parametrize('config', [
+        {'precision': 12},
+        {'bucket_minutes': 30},
+        {'window_hours': 48},
+    ])
+    def test_restore_rejects_other_config(self, tmp_path, config):
+        path = str(tmp_path / 'network.npz')
+        self.populated().snapshot(path)
+
+        with pytest.raises(ValueError, match='config'):
+            NetworkAnalyzer(**config).restore(path)
+        with pytest.raises(ValueError, match='config'):
+            NetworkAnalyzer(**config).merge_state(self.populated().export_state())
+
+    def test_incompatible_snapshot_is_ignored_on_construction(self, tmp_path):
+        path = str(tmp_path / 'network.npz')
+        self.populated().snapshot(path)
+
+        analyzer = NetworkAnalyzer(snapshot_path=path, precision=12)
+
+        assert analyzer.users_per_device('shared-device') == 0
+        assert len(analyzer.device_users) == 0
+
+    def test_merge_state_unions_analyzers(self):
+        left, right = NetworkAnalyzer(), NetworkAnalyzer()
+        left.add_connection('u1', device_id='d', ip='ip')
+        right.add_connection('u2', device_id='d', ip='ip')
+
+        left.merge_state(right.export_state())
+
+        assert left.users_per_device('d') == 2
+        assert left.users_per_ip('ip') == 2
+        assert left.devices_per_user('u2') == 1
+
+    def test_export_changes_is_incremental(self):
+        analyzer = NetworkAnalyzer()
+        now = time.time()
+        analyzer.add_connection('u1', device_id='d1', timestamp=now - 3 * 3600)
+        analyzer.add_connection('u2', device_id='d2', timestamp=now)
+        analyzer.export_changes()
+
+        analyzer.add_connection('u3', device_id='d1', timestamp=now)
+        arrays, new_keys = analyzer.export_changes(['device_users'])
+
+        assert arrays['device_users__keys'].tolist() == ['d1']
+        assert len(arrays['device_users__bucket_ids']) == 1
+        assert new_keys == {'device_users': set()}
+
+        arrays, _ = analyzer.export_changes(['device_users'])
+        assert arrays['device_users__keys'].tolist() == []
+
+    def test_merge_state_known_only(self):
+        left, right = NetworkAnalyzer(), NetworkAnalyzer()
+        left.add_connection('u1', device_id='d')
+        right.add_connection('u2', device_id='d')
+        right.add_connection('u2', device_id='other')
+
+        left.merge_state(right.export_state(), known_only=True)
+
+        assert left.users_per_device('d') == 2
+        assert left.users_per_device('other') == 0
+
+
+# =============================================================================
+# BEHAVIORAL PROFILES
+# =============================================================================
+
+class TestUserBehaviorProfile:
+
+    def test_ring_buffer_matches_reference(self):
+        rng = random.Random(4)
+        profile = UserBehaviorProfile('u1')
+        hours = deque(maxlen=UserBehaviorProfile.HISTORY_SIZE)
+        days = deque(maxlen=UserBehaviorProfile.HISTORY_SIZE)
+
+        for _ in range(350):
+            hour, day = rng.randrange(24), rng.randrange(7)
+            profile.record_time(hour, day)
+            hours.append(hour)
+            days.append(day)
+
+            mean, std = profile.hour_stats()
+            assert mean == pytest.approx(statistics.fmean(hours))
+            assert std == pytest.approx(statistics.pstdev(hours))
+
+        assert profile.history_size == UserBehaviorProfile.HISTORY_SIZE
+        assert profile.typical_hours == list(hours)
+        assert profile.typical_days == list(days)
+
+    def test_constructor_keeps_latest_history(self):
+        history = list(range(24)) * 5
+        profile = UserBehaviorProfile('u1', typical_hours=history, typical_days=[1, 2])
+
+        assert profile.typical_hours == history[-UserBehaviorProfile.HISTORY_SIZE:]
+        assert profile.typical_days[:2] == [1, 2]
+        assert UserBehaviorProfile('u2').hour_stats() == (0.0, 0.0)
+
+    def test_devices_and_locations_are_bounded(self):
+        profile = UserBehaviorProfile('u1')
+        for i in range(15):
+            profile.add_device(f'd{i}')
+            profile.add_device(f'd{i}')
+            profile.add_location(f'city-{i}')
+
+        assert profile.known_devices == [f'd{i}' for i in range(5, 15)]
+        assert profile.typical_locations == [f'city-{i}' for i in range(10, 15)]
+
+    def test_unusual_hour_uses_ring_stats(self):
+        analyzer = BehavioralAnalyzer()
+        for day in range(1, 6):
+            analyzer.update_profile('u1', {'timestamp': datetime(2024, 1, day, 10)})
+            analyzer.update_profile('u1', {'timestamp': datetime(2024, 1, day, 11)})
+
+        usual = analyzer.analyze_anomaly('u1', {'timestamp': datetime(2024, 1, 8, 11)})
+        unusual = analyzer.analyze_anomaly('u1', {'timestamp': datetime(2024, 1, 8, 3)})
+
+        assert 'unusual_hour' not in [s.name for s in usual]
+        assert 'unusual_hour' in [s.name for s in unusual]
+
+
+# =============================================================================
+# SHARDED SCORING
+# =============================================================================
+
+def users_on_distinct_shards(detector):
+    by_shard = {}
+    for i in range(1000):
+        by_shard.setdefault(detector.route(f'user-{i}'), f'user-{i}')
+        if len(by_shard) == detector.n_shards:
+            return [by_shard[index] for index in range(detector.n_shards)]
+    raise AssertionError("ring left a shard without users")
+
+
+@pytest.fixture(params=[False, True], ids=['local', 'processes'])
+def sharded(request):
+    with ShardedFraudDetector(n_shards=2, processes=request.param, sync_every=0) as detector:
+        yield detector
+
+
+class TestShardedFraudDetector:
+
+    def test_results_keep_batch_order(self, sharded):
+        events = random_events(seed=5, count=60, with_users=False)
+        user_ids = [None] * len(events)
+
+        expected = FraudDetector().analyze_batch(events, user_ids)
+        result = sharded.analyze_batch(events, user_ids)
+
+        np.testing.assert_allclose(result.scores, expected.scores)
+        assert result.actions.tolist() == expected.actions.tolist()
+        assert (result.rule_mask == expected.rule_mask).all()
+
+    def test_shard_error_drains_every_reply(self, sharded):
+        batch = FraudEventBatch.from_records([{'user_id': 'u'}])
+
+        # Shard 0 cannot unpack its payload; shard 1 answers normally
+        with pytest.raises((TypeError, RuntimeError)):
+            sharded._dispatch('analyze', {0: None, 1: (batch, ['u'])})
+
+        stats = sharded.get_stats()
+        assert set(stats['shards']) == set(sharded.shard_names)
+        assert all('profiles' in shard_stats for shard_stats in stats['shards'].values())
+        assert len(sharded.analyze_batch([{'user_id': 'u'}])) == 1
+
+    def test_sync_shares_counts_for_seen_keys_only(self):
+        with ShardedFraudDetector(n_shards=2, processes=False, sync_every=0) as detector:
+            first, second = users_on_distinct_shards(detector)
+            detector.analyze_batch([
+                {'user_id': first, 'device_id': 'shared', 'ip': '1.1.1.1'},
+                {'user_id': first, 'device_id': 'private'},
+                {'user_id': second, 'device_id': 'shared'},
+            ])
+
+            detector.sync_network()
+
+            networks = [shard.shard.detector.network_analyzer for shard in detector._shards]
+            assert [network.users_per_device('shared') for network in networks] == [2, 2]
+            assert networks[0].users_per_device('private') == 1
+            assert len(networks[1].device_users) == 1
+            assert len(networks[1].ip_users) == 0
+
+            exported = NetworkAnalyzer()
+            exported.merge_state(detector.export_network())
+            assert exported.users_per_device('private') == 1
+            assert exported.users_per_ip('1.1.1.1') == 1
+
+    def test_incremental_sync_brings_history_of_new_keys(self):
+        with ShardedFraudDetector(n_shards=2, processes=False, sync_every=0) as detector:
+            first, second = users_on_distinct_shards(detector)
+            networks = [shard.shard.detector.network_analyzer for shard in detector._shards]
+            detector.analyze_batch([{'user_id': first, 'device_id': 'shared'}])
+            detector.sync_network()
+            assert networks[1].users_per_device('shared') == 0
+
+            # Only the second shard touches 'shared' now; the first shard's
+            # bucket is unchanged but still has to reach it
+            detector.analyze_batch([{'user_id': second, 'device_id': 'shared'}])
+            detector.sync_network()
+            assert [network.users_per_device('shared') for network in networks] == [2, 2]
+
+            detector.sync_network()
+            assert [network.users_per_device('shared') for network in networks] == [2, 2]
+            assert all(network.export_changes()[0]['device_users__keys'].size == 0 for network in networks)
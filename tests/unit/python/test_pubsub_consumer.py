@@ -0,0 +1,343 @@
+"""
+S.S.I. SHADOW - Pub/Sub Consumer Tests
+Tests for the bounded queue, background flusher, spill and adaptive batching.
+"""
+
+import pytest
+import base64
+import json
+import time
+import threading
+from types import SimpleNamespace
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+pytest.importorskip("google.cloud.bigquery")
+pytest.importorskip("functions_framework")
+
+from functions import pubsub_consumer as consumer
+from functions.pubsub_consumer import (
+    AdaptiveBatchPolicy,
+    BigQueryBatchInserter,
+    InsertError,
+    QueueFullError,
+    SpillStore,
+    estimate_row_bytes,
+)
+
+
+# =============================================================================
+# FIXTURES
+# =============================================================================
+
+class FakeBigQueryClient:
+    """Records inserted rows; fails with an exception while `down` is True."""
+
+    def __init__(self, *args, **kwargs):
+        self.inserted = []
+        self.calls = 0
+        self.down = False
+
+    def insert_rows_json(self, table, rows, row_ids=None):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("BigQuery unavailable")
+        self.inserted.extend(rows)
+        return []
+
+
+@pytest.fixture
+def consumer_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(consumer.bigquery, "Client", FakeBigQueryClient, raising=False)
+    monkeypatch.setattr(consumer.config, "spill_dir", str(tmp_path / "spill"))
+    monkeypatch.setattr(consumer.config, "max_queue_size", 10)
+    monkeypatch.setattr(consumer.config, "batch_size", 5)
+    monkeypatch.setattr(consumer.config, "batch_timeout_ms", 20)
+    monkeypatch.setattr(consumer.config, "background_flush", False)
+    monkeypatch.setattr(consumer.config, "adaptive_batching", True)
+    monkeypatch.setattr(consumer.config, "pushgateway_url", "")
+    monkeypatch.setattr(consumer, "metrics", consumer.ConsumerMetrics())
+    return consumer.config
+
+
+@pytest.fixture
+def inserter(consumer_config, monkeypatch):
+    inserter = BigQueryBatchInserter("project", "dataset", "table")
+    monkeypatch.setattr(consumer, "_inserter", inserter)
+    yield inserter
+    inserter.stop()
+
+
+def make_cloud_event(row):
+    payload = {"row": row, "metadata": {"received_at": ""}}
+    data = base64.b64encode(json.dumps(payload).encode()).decode()
+    return SimpleNamespace(data={"message": {"data": data, "attributes": {}}})
+
+
+# =============================================================================
+# QUEUE & BACKPRESSURE
+# =============================================================================
+
+class TestBoundedQueue:
+
+    def test_rejects_when_full(self, inserter):
+        inserter.add_many_to_buffer([{"event_id": str(i)} for i in range(10)])
+        with pytest.raises(QueueFullError):
+            inserter.add_to_buffer({"event_id": "overflow"})
+        assert len(inserter.buffer) == 10
+
+    def test_batch_is_all_or_nothing(self, inserter):
+        inserter.add_many_to_buffer([{"event_id": str(i)} for i in range(8)])
+        with pytest.raises(QueueFullError):
+            inserter.add_many_to_buffer([{"event_id": "a"}, {"event_id": "b"}, {"event_id": "c"}])
+        assert len(inserter.buffer) == 8
+
+    def test_oversized_batch_accepted_on_empty_queue(self, inserter):
+        inserter.add_many_to_buffer([{"event_id": str(i)} for i in range(25)])
+        assert len(inserter.buffer) == 25
+
+
+class TestCloudEventEntryPoint:
+
+    def test_queue_full_raises_for_nack(self, inserter, consumer_config, monkeypatch):
+        monkeypatch.setattr(consumer_config, "background_flush", True)
+        inserter.add_many_to_buffer([{"event_id": str(i)} for i in range(10)])
+
+        with pytest.raises(QueueFullError):
+            consumer.handle_pubsub_message(make_cloud_event({"event_id": "x"}))
+        assert consumer.metrics.events_rejected == 1
+
+    def test_sync_mode_inserts_before_ack(self, inserter):
+        consumer.handle_pubsub_message(make_cloud_event({"event_id": "e1"}))
+
+        assert [row["event_id"] for row in inserter.client.inserted] == ["e1"]
+        assert inserter.buffer == []
+
+    def test_sync_mode_failure_nacks_without_spill(self, inserter):
+        inserter.client.down = True
+        event = make_cloud_event({"event_id": "e1"})
+
+        with pytest.raises(InsertError):
+            consumer.handle_pubsub_message(event)
+        assert inserter.spill.segments() == []
+        assert inserter.buffer == []
+
+        # Redelivery after recovery inserts the row
+        inserter.client.down = False
+        consumer.handle_pubsub_message(event)
+        assert [row["event_id"] for row in inserter.client.inserted] == ["e1"]
+
+    def test_malformed_message_is_acked(self, inserter, monkeypatch):
+        def broken(message):
+            raise KeyError("event_id")
+
+        monkeypatch.setattr(consumer, "process_message", broken)
+
+        body, status = consumer.handle_pubsub_message(make_cloud_event({"event_id": "e1"}))
+
+        assert status == 500
+        assert consumer.metrics.events_failed == 1
+        assert inserter.client.inserted == []
+
+    def test_sync_batch_request_failure_returns_503(self, inserter):
+        inserter.client.down = True
+        messages = [make_cloud_event({"event_id": str(i)}).data["message"] for i in range(7)]
+        request = SimpleNamespace(get_json=lambda force=False: {"messages": messages})
+
+        body, status = consumer.handle_batch_request(request)
+
+        assert status == 503
+        assert body["status"] == "insert_failed"
+        assert inserter.spill.segments() == []
+
+        inserter.client.down = False
+        body, status = consumer.handle_batch_request(request)
+        assert status == 200
+        assert body["inserted"] == 7
+        assert len(inserter.client.inserted) == 7
+
+    def test_background_disabled_on_cloud_functions(self, monkeypatch):
+        monkeypatch.setenv("FUNCTION_TARGET", "handle_pubsub_message")
+        monkeypatch.delenv("BACKGROUND_FLUSH", raising=False)
+        assert consumer.ConsumerConfig().background_flush is False
+
+        monkeypatch.delenv("FUNCTION_TARGET")
+        assert consumer.ConsumerConfig().background_flush is True
+
+
+# =============================================================================
+# BACKGROUND FLUSHER & SPILL
+# =============================================================================
+
+class TestBackgroundFlusher:
+
+    def test_flushes_in_background(self, inserter):
+        inserter.start()
+        inserter.add_many_to_buffer([{"event_id": str(i)} for i in range(7)])
+
+        deadline = time.time() + 5
+        while len(inserter.client.inserted) < 7 and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert len(inserter.client.inserted) == 7
+        assert consumer.metrics.events_inserted == 7
+
+    def test_stop_drains_queue(self, inserter):
+        inserter.start()
+        inserter.add_many_to_buffer([{"event_id": "a"}, {"event_id": "b"}])
+        inserter.stop()
+        assert {row["event_id"] for row in inserter.client.inserted} == {"a", "b"}
+
+    def test_stop_keeps_batches_when_inserts_outlast_the_join(self, consumer_config, monkeypatch):
+        monkeypatch.setattr(consumer_config, "flush_workers", 1)
+        inserter = BigQueryBatchInserter("project", "dataset", "table")
+        release = threading.Event()
+        insert = inserter.client.insert_rows_json
+
+        def slow_insert(table, rows, row_ids=None):
+            release.wait(5)
+            return insert(table, rows, row_ids)
+
+        inserter.client.insert_rows_json = slow_insert
+
+        class LateSemaphore:
+            """Holds the flusher's second acquire until stop() has dropped the executor."""
+
+            def __init__(self, inner):
+                self.inner = inner
+                self.acquired = 0
+
+            def acquire(self):
+                self.inner.acquire()
+                self.acquired += 1
+                deadline = time.time() + 1
+                while self.acquired > 1 and inserter._executor is not None and time.time() < deadline:
+                    time.sleep(0.005)
+
+            def release(self):
+                self.inner.release()
+
+        inserter._in_flight = LateSemaphore(inserter._in_flight)
+        flush = inserter.flush
+
+        def late_flush():
+            # Let the woken flusher reach the buffer before the final flush
+            time.sleep(0.1)
+            return flush()
+
+        inserter.flush = late_flush
+        inserter.start()
+        inserter.add_many_to_buffer([{"event_id": str(i)} for i in range(10)])
+
+        # The flusher blocks on the only worker, so the join in stop() times out
+        stopper = threading.Thread(target=inserter.stop, kwargs={"timeout": 0.05})
+        stopper.start()
+        time.sleep(0.2)
+        release.set()
+        stopper.join(5)
+
+        assert not stopper.is_alive()
+        assert sorted(row["event_id"] for row in inserter.client.inserted) == [str(i) for i in range(10)]
+        assert inserter.buffer == []
+
+
+class TestSpill:
+
+    def test_failed_batch_is_spilled_and_replayed(self, inserter):
+        inserter.client.down = True
+        inserter.add_many_to_buffer([{"event_id": "a"}, {"event_id": "b"}])
+        result = inserter.flush()
+
+        assert result["spilled"] == 2
+        assert len(inserter.spill.segments()) == 1
+
+        inserter.client.down = False
+        replay = inserter.replay_spilled()
+
+        assert replay == {"replayed": 2, "segments": 1}
+        assert inserter.spill.segments() == []
+        assert [row["event_id"] for row in inserter.client.inserted] == ["a", "b"]
+
+    def test_replay_keeps_segment_while_down(self, inserter):
+        inserter.spill.write([{"event_id": "a"}])
+        inserter.client.down = True
+
+        assert inserter.replay_spilled()["segments"] == 0
+        assert len(inserter.spill.segments()) == 1
+
+    def test_spill_respects_max_bytes(self, tmp_path):
+        store = SpillStore(str(tmp_path), max_bytes=50)
+        assert store.write([{"payload": "x" * 100}]) is None
+        assert store.segments() == []
+
+
+# =============================================================================
+# ADAPTIVE BATCHING
+# =============================================================================
+
+class TestAdaptiveBatching:
+
+    def test_batches_bounded_by_bytes(self, inserter):
+        row = {"event_id": "e", "payload": "x" * 1000}
+        inserter.policy.max_request_bytes = estimate_row_bytes(row) * 2
+        inserter.add_many_to_buffer([dict(row) for _ in range(5)])
+
+        with inserter.buffer_lock:
+            rows, batch_bytes = inserter._take_batch_locked()
+
+        assert len(rows) == 2
+        assert batch_bytes <= inserter.policy.max_request_bytes
+
+    def test_policy_grows_and_shrinks(self, consumer_config, monkeypatch):
+        monkeypatch.setattr(consumer_config, "target_insert_latency_ms", 1000)
+        policy = AdaptiveBatchPolicy()
+
+        policy.adjust(100)
+        grown = policy.batch_size
+        assert grown > 5
+
+        policy.adjust(5000)
+        assert policy.batch_size == max(consumer_config.min_batch_size, grown // 2)
+        assert policy.batch_timeout_ms == consumer_config.batch_timeout_ms
+
+    def test_lag_metric_is_per_row_average(self, inserter, monkeypatch):
+        observed = []
+        monkeypatch.setattr(
+            consumer.metrics, "record_batch_inserted",
+            lambda size, lag_ms, duration_s, batch_bytes=0: observed.append((size, lag_ms))
+        )
+        inserter.add_many_to_buffer([
+            {"event_id": "a", "pubsub_lag_ms": 100},
+            {"event_id": "b", "pubsub_lag_ms": 300},
+        ])
+        inserter.flush()
+
+        assert observed == [(2, 200.0)]
+
+    def test_flush_records_each_batch(self, inserter, monkeypatch):
+        observed = []
+        monkeypatch.setattr(
+            consumer.metrics, "record_batch_inserted",
+            lambda size, lag_ms, duration_s, batch_bytes=0: observed.append((size, batch_bytes))
+        )
+        monkeypatch.setattr(inserter.policy, "on_batch_inserted", lambda: observed.append("policy"))
+        rows = [{"event_id": str(i)} for i in range(12)]
+        inserter.add_many_to_buffer(rows)
+
+        result = inserter.flush()
+
+        sizes = [estimate_row_bytes(row) for row in rows]
+        assert result["inserted"] == 12
+        assert observed == [
+            (5, sum(sizes[:5])), "policy",
+            (5, sum(sizes[5:10])), "policy",
+            (2, sum(sizes[10:])), "policy",
+        ]
+
+    def test_avg_lag_across_batches(self, consumer_config):
+        metrics = consumer.ConsumerMetrics()
+        metrics.record_batch_inserted(2, 100.0, 0.1)
+        metrics.record_batch_inserted(2, 300.0, 0.1)
+        assert metrics.avg_lag_ms == pytest.approx(200.0)
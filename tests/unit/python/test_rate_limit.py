@@ -0,0 +1,353 @@
+"""
+S.S.I. SHADOW - Rate Limit Middleware Tests
+Tests for the sharded memory backend, the route rule matcher and the Redis
+backend's lease mode.
+"""
+
+import pytest
+import fnmatch
+import importlib.util
+import math
+import re
+
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, ROOT)
+
+
+def _load_module(name: str, relative_path: str):
+    """Load a module by path (api.middleware's __init__ pulls in the auth stack)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+rate_limit = _load_module("ssi_rate_limit_middleware", "api/middleware/rate_limit.py")
+MemoryBackend = rate_limit.MemoryBackend
+RateLimiter = rate_limit.RateLimiter
+RedisBackend = rate_limit.RedisBackend
+RateLimitAlgorithm = rate_limit.RateLimitAlgorithm
+RateLimitRule = rate_limit.RateLimitRule
+RateLimitTier = rate_limit.RateLimitTier
+RouteRuleMatcher = rate_limit.RouteRuleMatcher
+
+
+class FakeClock:
+    """Replaces time.time() inside the rate limit module."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Start on a window boundary so sliding window weights are predictable
+    clock = FakeClock(1_700_000_040.0)
+    monkeypatch.setattr(rate_limit.time, "time", clock.time)
+    return clock
+
+
+# =============================================================================
+# MEMORY BACKEND
+# =============================================================================
+
+class TestMemoryBackend:
+
+    @pytest.mark.asyncio
+    async def test_sliding_window_counts_cost(self, clock):
+        backend = MemoryBackend(num_shards=4)
+        results = [
+            await backend.increment_sliding_window("k", 60, 10, cost=3)
+            for _ in range(4)
+        ]
+
+        assert [r[0] for r in results] == [True, True, True, False]
+        assert results[2][1] == 9
+
+    @pytest.mark.asyncio
+    async def test_sliding_window_weights_previous_window(self, clock):
+        backend = MemoryBackend(num_shards=4)
+        for _ in range(10):
+            await backend.increment_sliding_window("k", 60, 10)
+        assert not (await backend.increment_sliding_window("k", 60, 10))[0]
+
+        # Halfway through the next window, half of the previous count remains
+        clock.now += 90
+        allowed, count, _ = await backend.increment_sliding_window("k", 60, 10, cost=5)
+        assert allowed and count == 10
+        assert not (await backend.increment_sliding_window("k", 60, 10))[0]
+
+    @pytest.mark.asyncio
+    async def test_token_bucket_gcra_burst_and_refill(self, clock):
+        backend = MemoryBackend(num_shards=4)
+        results = [
+            await backend.check_token_bucket("k", rate=1.0, capacity=3)
+            for _ in range(4)
+        ]
+
+        assert [r[0] for r in results] == [True, True, True, False]
+        assert results[2][1] == 0
+        assert results[3][2] >= 1
+
+        clock.now += 1
+        assert (await backend.check_token_bucket("k", rate=1.0, capacity=3))[0]
+
+    @pytest.mark.asyncio
+    async def test_reset_clears_every_algorithm(self, clock):
+        backend = MemoryBackend(num_shards=4)
+        for _ in range(3):
+            await backend.check_token_bucket("k", rate=1.0, capacity=3)
+        await backend.increment_sliding_window("k", 60, 10)
+
+        assert await backend.reset("k")
+        allowed, remaining, _ = await backend.check_token_bucket("k", rate=1.0, capacity=3)
+        assert allowed and remaining == 2
+        assert not await backend.reset("missing")
+
+    @pytest.mark.asyncio
+    async def test_keys_spread_across_shards(self, clock):
+        backend = MemoryBackend(num_shards=8)
+        for i in range(200):
+            await backend.increment(f"user:{i}", 60, 100)
+
+        assert len(backend) == 200
+        assert sum(1 for shard in backend._shards if shard.data) > 1
+
+    @pytest.mark.asyncio
+    async def test_timing_wheel_drops_expired_keys(self, clock):
+        backend = MemoryBackend(num_shards=2, wheel_size=16)
+        await backend.increment("short", 1, 10)
+        await backend.check_token_bucket("long", rate=0.01, capacity=5)
+
+        clock.now += 5
+        await backend._cleanup()
+
+        assert len(backend) == 1
+        assert await backend.get_count("short") == 0
+
+    @pytest.mark.asyncio
+    async def test_limiter_uses_memory_algorithms(self, clock):
+        limiter = RateLimiter(algorithm=RateLimitAlgorithm.TOKEN_BUCKET, enable_logging=False)
+        limiter._backend = MemoryBackend(num_shards=2)
+        limiter._initialized = True
+
+        results = [await limiter.check("user:1", limit=3) for _ in range(3)]
+        assert [r.remaining for r in results] == [2, 1, 0]
+        assert len(limiter._backend) == 1
+
+
+# =============================================================================
+# ROUTE RULE MATCHER
+# =============================================================================
+
+def linear_match(rules, path, method):
+    """Reference implementation: the original first-match regex scan."""
+    for rule in rules:
+        if method in rule.methods and re.match(rule.path_pattern, path):
+            return rule
+    return None
+
+
+class TestRouteRuleMatcher:
+
+    RULES = [
+        RateLimitRule(path_pattern=r"^/api/auth/login$", requests_per_minute=5, methods=["POST"]),
+        RateLimitRule(path_pattern=r"^/api/export", requests_per_minute=10, cost=5),
+        RateLimitRule(path_pattern=r"^/api/users/\d+/events$", requests_per_minute=30),
+        RateLimitRule(path_pattern=r"^/api/.*", requests_per_minute=100),
+        RateLimitRule(path_pattern=r"^/health\.json$", requests_per_minute=1000),
+        RateLimitRule(path_pattern=r"^/(?P<kind>a|b)/(?P=kind)$", requests_per_minute=7),
+        RateLimitRule(path_pattern=r"^/(?P<kind>x|y)/(?P=kind)$", requests_per_minute=8),
+    ]
+
+    PATHS = [
+        "/api/auth/login", "/api/auth/login/extra", "/api/export", "/api/export/csv",
+        "/api/users/42/events", "/api/users/abc/events", "/api/other", "/api",
+        "/health.json", "/healthXjson", "/a/a", "/a/b", "/y/y", "/", "",
+    ]
+
+    def test_literal_patterns_are_recognized(self):
+        assert rate_limit._parse_literal_rule(r"^/api/auth/login$") == ("/api/auth/login", True)
+        assert rate_limit._parse_literal_rule(r"^/api/.*") == ("/api/", False)
+        assert rate_limit._parse_literal_rule(r"^/health\.json$") == ("/health.json", True)
+        assert rate_limit._parse_literal_rule(r"^/api/users/\d+") is None
+
+    def test_matches_linear_scan(self):
+        matcher = RouteRuleMatcher(self.RULES)
+        for path in self.PATHS:
+            for method in ("GET", "POST", "PATCH"):
+                assert matcher.match(path, method) is linear_match(self.RULES, path, method), (path, method)
+
+    def test_first_rule_in_list_order_wins(self):
+        rules = [
+            RateLimitRule(path_pattern=r"^/api/v\d+/", requests_per_minute=1),
+            RateLimitRule(path_pattern=r"^/api/v1/items$", requests_per_minute=2),
+        ]
+        matcher = RouteRuleMatcher(rules)
+        assert matcher.match("/api/v1/items", "GET") is rules[0]
+
+    def test_invalid_pattern_is_skipped(self):
+        rules = [
+            RateLimitRule(path_pattern=r"^/api/(unclosed", requests_per_minute=1),
+            RateLimitRule(path_pattern=r"^/api/", requests_per_minute=2),
+        ]
+        matcher = RouteRuleMatcher(rules)
+        assert matcher.match("/api/x", "GET") is rules[1]
+
+    def test_decisions_are_cached(self):
+        matcher = RouteRuleMatcher(self.RULES, cache_size=8)
+        matcher.match("/api/export", "GET")
+        matcher.match("/api/export", "GET")
+        info = matcher.cache_info()
+        assert info.hits == 1 and info.misses == 1
+
+    def test_setting_rules_recompiles_matcher(self):
+        limiter = RateLimiter(enable_logging=False)
+        assert limiter._get_limit_for_path("/api/export", "GET", RateLimitTier.ANONYMOUS) == (60, 1)
+
+        limiter.custom_rules = self.RULES
+        assert limiter._get_limit_for_path("/api/export", "GET", RateLimitTier.ANONYMOUS) == (10, 5)
+
+
+# =============================================================================
+# REDIS LEASE MODE
+# =============================================================================
+
+class FakeRedis:
+    """Runs the backend's lease scripts in Python against a dict."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+        self.script_calls = 0
+
+    def register_script(self, lua):
+        if "block" not in lua:
+            return None  # Only lease mode is exercised here
+        handler = self._sliding_window_lease if "weighted_count" in lua else self._token_bucket_lease
+
+        async def script(keys, args):
+            self.script_calls += 1
+            # Redis truncates Lua numbers to integers in replies
+            return [int(value) for value in handler(keys[0], *args)]
+        return script
+
+    def _sliding_window_lease(self, key, now, window, limit, block):
+        current_window = math.floor(now / window) * window
+        current_key = f"{key}:{current_window}"
+        previous_key = f"{key}:{current_window - window}"
+        elapsed = now - current_window
+        weighted = self.data.get(current_key, 0) + self.data.get(previous_key, 0) * (window - elapsed) / window
+
+        granted = min(block, math.floor(limit - weighted))
+        if granted < 1:
+            return [0, math.ceil(weighted), window - elapsed]
+        self.data[current_key] = self.data.get(current_key, 0) + granted
+        return [granted, math.ceil(weighted + granted), window - elapsed]
+
+    def _token_bucket_lease(self, key, now, rate, capacity, block):
+        tokens, last_update = self.data.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last_update) * rate)
+
+        granted = min(block, math.floor(tokens))
+        if granted < 1:
+            return [0, math.floor(tokens), math.ceil((1 - tokens) / rate)]
+        self.data[key] = (tokens - granted, now)
+        return [granted, math.floor(tokens - granted), 0]
+
+    async def scan(self, cursor, match=None, count=None):
+        return 0, [k for k in self.data if fnmatch.fnmatchcase(k, match)]
+
+    async def delete(self, *keys):
+        return sum(1 for k in keys if self.data.pop(k, None) is not None)
+
+
+class TestRedisLeaseMode:
+
+    @pytest.mark.asyncio
+    async def test_repeat_checks_served_locally(self, clock):
+        redis = FakeRedis(clock)
+        backend = RedisBackend(redis, lease_size=10)
+
+        results = [await backend.increment_sliding_window("k", 60, 100) for _ in range(5)]
+
+        assert all(r[0] for r in results)
+        assert [r[1] for r in results] == [1, 2, 3, 4, 5]
+        assert redis.script_calls == 1
+        assert backend.lease_stats == {"local_hits": 4, "acquired": 1}
+
+    @pytest.mark.asyncio
+    async def test_lease_survives_last_second_of_window(self, clock):
+        redis = FakeRedis(clock)
+        backend = RedisBackend(redis, lease_size=10, lease_ttl=1.0)
+        clock.now += 59.5
+
+        results = [await backend.increment_sliding_window("k", 60, 100) for _ in range(5)]
+        assert all(r[0] for r in results)
+        assert redis.script_calls == 1
+
+        # The lease still ends with the window
+        clock.now += 0.5
+        await backend.increment_sliding_window("k", 60, 100)
+        assert redis.script_calls == 2
+
+    @pytest.mark.asyncio
+    async def test_lease_never_exceeds_global_limit(self, clock):
+        redis = FakeRedis(clock)
+        replicas = [RedisBackend(redis, lease_size=4) for _ in range(3)]
+
+        allowed = 0
+        for _ in range(10):
+            for backend in replicas:
+                allowed += (await backend.increment_sliding_window("k", 60, 10))[0]
+        assert allowed == 10
+
+    @pytest.mark.asyncio
+    async def test_smaller_limit_does_not_spend_larger_lease(self, clock):
+        redis = FakeRedis(clock)
+        backend = RedisBackend(redis, lease_size=100)
+
+        assert (await backend.increment_sliding_window("k", 60, 1000))[0]
+        # A stricter route rule on the same identifier sees the global count
+        allowed, count, _ = await backend.increment_sliding_window("k", 60, 10)
+        assert not allowed and count == 100
+
+        allowed, remaining, _ = await backend.check_token_bucket("tb", 1000 / 60, 1000)
+        assert allowed and remaining == 999
+        calls = redis.script_calls
+        allowed, remaining, _ = await backend.check_token_bucket("tb", 10 / 60, 10)
+        assert redis.script_calls == calls + 1
+        assert allowed and remaining == 9
+
+    @pytest.mark.asyncio
+    async def test_leases_and_locks_are_bounded(self, clock):
+        redis = FakeRedis(clock)
+        backend = RedisBackend(redis, lease_size=5)
+        backend.MAX_LEASES = 3
+
+        for i in range(10):
+            await backend.increment_sliding_window(f"user:{i}", 60, 100)
+        assert len(backend._leases) == 3
+        assert len(backend._lease_locks) <= 3
+        assert [k[0] for k in backend._leases] == [f"ratelimit:sw:user:{i}" for i in (7, 8, 9)]
+
+        # Using a lease keeps it from being evicted
+        await backend.increment_sliding_window("user:7", 60, 100)
+        await backend.increment_sliding_window("user:10", 60, 100)
+        assert [k[0] for k in backend._leases][:2] == ["ratelimit:sw:user:9", "ratelimit:sw:user:7"]
+
+    @pytest.mark.asyncio
+    async def test_reset_drops_local_leases(self, clock):
+        redis = FakeRedis(clock)
+        backend = RedisBackend(redis, lease_size=5)
+        await backend.increment_sliding_window("user:1", 60, 100)
+
+        assert await backend.reset("user:1")
+        assert backend._leases == {}
+        assert redis.data == {}